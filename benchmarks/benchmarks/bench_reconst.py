@@ -87,3 +87,39 @@ class BenchVecValSum:
     #     model = ConstrainedSphericalDeconvModel(self.gtab, None,
     #                                             sh_order=sh_order)
     #     model.fit(self.data_small, self.mask_small)
+
+
+class BenchCSDeconvBatch:
+
+    def setup(self):
+        from dipy.core.gradients import gradient_table
+        from dipy.data import get_fnames
+        from dipy.io.gradients import read_bvals_bvecs
+        from dipy.sims.voxel import multi_tensor
+
+        bvals, bvecs = read_bvals_bvecs(*get_fnames('small_64D')[1:])
+        gtab = gradient_table(bvals, bvecs)
+        evals = np.array([[0.0015, 0.0003, 0.0003]] * 2)
+        rng = np.random.default_rng(1234)
+        data = []
+        for _ in range(2000):
+            angles = [tuple(rng.uniform(0, 90, 2)) for _ in range(2)]
+            signal, _ = multi_tensor(gtab, evals, 100, angles=angles,
+                                     fractions=[50, 50], snr=20, rng=rng)
+            data.append(signal)
+        self.data = np.array(data)
+        self.model = ConstrainedSphericalDeconvModel(
+            gtab, (evals[0], 100), sh_order=8)
+
+    def time_csdeconv_voxelwise(self):
+        from dipy.reconst.csdeconv import csdeconv
+        model = self.model
+        dwi = self.data[:, model._where_dwi]
+        for signal in dwi:
+            csdeconv(signal, model._X, model.B_reg, model.tau, P=model._P)
+
+    def time_csdeconv_batch(self):
+        from dipy.reconst.csdeconv import csdeconv_batch
+        model = self.model
+        dwi = self.data[:, model._where_dwi]
+        csdeconv_batch(dwi, model._X, model.B_reg, model.tau, P=model._P)
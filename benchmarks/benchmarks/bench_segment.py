@@ -84,3 +84,26 @@ class BenchQuickbundles:
         qb = QB_New(self.basic_parameters.get('threshold', 10),
                     metric=self.custom_metric)
         _ = qb.cluster(self.streamlines)
+
+
+class BenchQuickbundlesThreads:
+
+    params = ([1, 2, 4], [2, 10])
+    param_names = ['num_threads', 'threshold']
+
+    def setup(self, num_threads, threshold):
+        rng = np.random.default_rng(42)
+        fname = get_fnames('fornix')
+        fornix = load_tractogram(fname, 'same',
+                                 bbox_valid_check=False).streamlines
+        fornix_streamlines = set_number_of_points(Streamlines(fornix), 12)
+
+        # Many randomly shifted copies of the fornix, giving thousands of
+        # clusters at small thresholds.
+        self.streamlines = Streamlines(
+            [s + shift for shift in rng.normal(0, 50, (100, 3))
+             for s in fornix_streamlines])
+
+    def time_quickbundles(self, num_threads, threshold):
+        qb = QB_New(threshold, num_threads=num_threads)
+        _ = qb.cluster(self.streamlines)
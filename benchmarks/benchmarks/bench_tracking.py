@@ -1,15 +1,23 @@
 """ Benchmarks for functions related to streamline in ``dipy.tracking``module.
 """
 
+import time
+import warnings
+
 import numpy as np
 
-from dipy.data import get_fnames
+from dipy.data import get_fnames, get_sphere
+from dipy.direction import ProbabilisticDirectionGetter
 from dipy.io.streamline import load_tractogram
 
 from dipy.tracking.streamline import set_number_of_points, length
 from dipy.tracking.streamlinespeed import compress_streamlines
 
 from dipy.tracking import Streamlines
+from dipy.tracking.local_tracking import (LocalTracking,
+                                          ParticleFilteringTracking)
+from dipy.tracking.stopping_criterion import (CmcStoppingCriterion,
+                                              ThresholdStoppingCriterion)
 
 
 class BenchStreamlines:
@@ -57,4 +65,67 @@ class BenchStreamlines:
         length(streamlines)
 
     def time_compress_streamlines(self):
-        compress_streamlines(self.fornix_streamlines)
\ No newline at end of file
+        compress_streamlines(self.fornix_streamlines)
+
+
+class BenchLocalTracking:
+
+    params = [1, 4]
+    param_names = ['num_threads']
+
+    def setup(self, num_threads):
+        rng = np.random.default_rng(42)
+        shape = (30, 30, 30)
+        shcoeff = rng.random(shape + (45,))
+        shcoeff[..., 0] += 3
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", PendingDeprecationWarning)
+            self.dg = ProbabilisticDirectionGetter.from_shcoeff(
+                shcoeff, 30, get_sphere('repulsion724'))
+        self.sc = ThresholdStoppingCriterion(np.ones(shape), .5)
+        self.seeds = rng.random((1000, 3)) * 29
+
+    def time_local_tracking(self, num_threads):
+        Streamlines(LocalTracking(self.dg, self.sc, self.seeds, np.eye(4), .5,
+                                  maxlen=200, random_seed=0,
+                                  num_threads=num_threads))
+
+    def time_local_tracking_lockstep(self, num_threads):
+        Streamlines(LocalTracking(self.dg, self.sc, self.seeds, np.eye(4), .5,
+                                  maxlen=200, random_seed=0,
+                                  num_threads=num_threads,
+                                  lockstep_size=250))
+
+
+class BenchParticleFilteringTracking:
+
+    params = [1, 2, 4]
+    param_names = ['num_threads']
+
+    def setup(self, num_threads):
+        rng = np.random.default_rng(42)
+        shape = (30, 30, 30)
+        shcoeff = rng.random(shape + (45,))
+        shcoeff[..., 0] += 3
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", PendingDeprecationWarning)
+            self.dg = ProbabilisticDirectionGetter.from_shcoeff(
+                shcoeff, 30, get_sphere('repulsion724'))
+        wm = rng.random(shape)
+        gm = (1 - wm) * rng.random(shape)
+        self.sc = CmcStoppingCriterion.from_pve(wm, gm, 1 - wm - gm,
+                                                step_size=.5,
+                                                average_voxel_size=1)
+        self.seeds = rng.random((500, 3)) * 29
+
+    def time_particle_filtering_tracking(self, num_threads):
+        Streamlines(ParticleFilteringTracking(
+            self.dg, self.sc, self.seeds, np.eye(4), .5, maxlen=200,
+            random_seed=0, num_threads=num_threads, seed_batch_size=50))
+
+    def track_streamlines_per_second(self, num_threads):
+        start = time.perf_counter()
+        self.time_particle_filtering_tracking(num_threads)
+        return len(self.seeds) / (time.perf_counter() - start)
+
+    track_streamlines_per_second.unit = "seeds/s"
@@ -1,16 +1,17 @@
-from multiprocessing import Pool
 import warnings
 
 import numpy as np
 from scipy.ndimage import affine_transform
 
 from dipy.utils.multiproc import determine_num_processes
+from dipy.utils.parallel import get_executor
 
-def _affine_transform(kwargs):
+
+def _affine_transform(i, data, kwargs):
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", message=".*scipy.*18.*",
                                 category=UserWarning)
-        return affine_transform(**kwargs)
+        return affine_transform(input=data[..., i], **kwargs)
 
 
 def reslice(data, affine, zooms, new_zooms, order=1, mode='constant', cval=0,
@@ -95,17 +96,11 @@ def reslice(data, affine, zooms, new_zooms, order=1, mode='constant', cval=0,
                     affine_transform(input=data[..., i], output=data2[..., i],
                                      **kwargs)
             else:
-                params = []
-                for i in range(data.shape[-1]):
-                    _kwargs = {'input': data[..., i]}
-                    _kwargs.update(kwargs)
-                    params.append(_kwargs)
-
-                pool = Pool(num_processes)
-
-                for i, res in enumerate(pool.imap(_affine_transform, params)):
+                executor = get_executor("process", n_jobs=num_processes)
+                for i, res in executor.map(_affine_transform,
+                                           range(data.shape[-1]),
+                                           func_args=[data, kwargs]):
                     data2[..., i] = res
-                pool.close()
         else:
             raise ValueError("dimension of data should be 3 or 4 but you"
                              " provided %d" % data.ndim)
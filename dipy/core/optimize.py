@@ -293,6 +293,160 @@ def sparse_nnls(y, X,
         iteration += 1
 
 
+def leastsq_batch(func, x0, Dfun=None, args=(), batch_args=(),
+                  ftol=1.49012e-08, xtol=1.49012e-08, max_iter=None,
+                  lambda0=1e-3, bounds=None):
+    """Minimize the sum of squares of many independent problems at once.
+
+    A vectorized Levenberg-Marquardt algorithm: the parameters of all the
+    problems are updated together at each iteration, each problem keeping
+    its own damping factor, and problems that have converged drop out of the
+    iterations. It is a batched counterpart of :func:`scipy.optimize.leastsq`
+    for the case of many small problems sharing the same model (e.g. the
+    voxels of an image).
+
+    Parameters
+    ----------
+    func : callable
+        ``func(x, *batch_args, *args)`` returns the residuals of the problems,
+        an array of shape (n, m), given their parameters `x` of shape (n, p).
+    x0 : ndarray (n, p)
+        Starting estimates of the parameters of each problem.
+    Dfun : callable, optional
+        ``Dfun(x, *batch_args, *args)`` returns the Jacobian of the residuals,
+        an array of shape (n, m, p). It is always called right after `func`
+        with the same arguments, so it can reuse values cached by `func`.
+        If None, the Jacobian is estimated with forward differences.
+    args : tuple, optional
+        Extra arguments passed as they are to `func` and `Dfun`.
+    batch_args : tuple of ndarray, optional
+        Extra arguments with one row per problem. They are indexed along
+        with `x` when only a subset of the problems is evaluated.
+    ftol : float, optional
+        Relative reduction of the sum of squares below which a problem has
+        converged.
+    xtol : float, optional
+        Relative change of the parameters below which a problem has
+        converged.
+    max_iter : int, optional
+        Maximum number of iterations. Default: ``100 * (p + 1)``.
+    lambda0 : float, optional
+        Initial damping factor, relative to the diagonal of $J^T J$.
+    bounds : tuple of array_like, optional
+        Lower and upper bounds of the parameters, broadcastable to (n, p).
+        The steps are projected onto the bounds, so `x0` should lie within
+        them.
+
+    Returns
+    -------
+    x : ndarray (n, p)
+        The solution of each problem.
+    status : ndarray (n,)
+        Integer flag for each problem: 1 and 2 when the `ftol` and `xtol`
+        criteria are met, 4 when the sum of squares cannot be reduced
+        further, 5 when `max_iter` is reached and 0 when the residuals at
+        `x0` are not finite. Values 1 to 4 indicate a solution was found.
+
+    """
+    x = np.array(x0, dtype=float)
+    n, p = x.shape
+    if bounds is not None:
+        lower = np.broadcast_to(np.asarray(bounds[0], dtype=float), (n, p))
+        upper = np.broadcast_to(np.asarray(bounds[1], dtype=float), (n, p))
+    if max_iter is None:
+        max_iter = 100 * (p + 1)
+    eps = np.finfo(float).eps
+    # Tolerances below the machine precision cannot be met
+    ftol = max(ftol, eps)
+    xtol = max(xtol, eps)
+
+    def residuals(idx, params):
+        return func(params, *[arg[idx] for arg in batch_args], *args)
+
+    def jacobian(idx, params, res):
+        if Dfun is not None:
+            return Dfun(params, *[arg[idx] for arg in batch_args], *args)
+        jac = np.empty(res.shape + (p,))
+        h = np.sqrt(eps) * np.abs(params)
+        h[h == 0] = np.sqrt(eps)
+        for j in range(p):
+            params_h = params.copy()
+            params_h[:, j] += h[:, j]
+            jac[..., j] = (residuals(idx, params_h) - res) / h[:, None, j]
+        return jac
+
+    def normal_equations(idx):
+        res = residuals(idx, x[idx])
+        if res.shape[-1] < p:
+            raise TypeError("Improper input: the number of residuals (m=%d) "
+                            "must not be smaller than the number of "
+                            "parameters (p=%d)" % (res.shape[-1], p))
+        jac = jacobian(idx, x[idx], res)
+        jac_t = np.swapaxes(jac, -1, -2)
+        JtJ[idx] = np.matmul(jac_t, jac)
+        Jtr[idx] = np.matmul(jac_t, res[..., None])[..., 0]
+        scale[idx] = np.maximum(scale[idx],
+                                np.diagonal(JtJ[idx], axis1=1, axis2=2))
+        return np.sum(res ** 2, axis=-1)
+
+    JtJ = np.empty((n, p, p))
+    Jtr = np.empty((n, p))
+    scale = np.zeros((n, p))
+    damping = np.full(n, lambda0)
+    status = np.zeros(n, dtype=int)
+
+    cost = normal_equations(np.arange(n))
+    status[cost == 0] = 1
+    active = np.flatnonzero(np.isfinite(cost) & (cost > 0))
+    diag = np.arange(p)
+    for _ in range(max_iter):
+        if not active.size:
+            break
+        A = JtJ[active]
+        A[:, diag, diag] += (damping[active, None] *
+                             np.maximum(scale[active], eps))
+        rhs = -Jtr[active]
+        if bounds is not None:
+            # Parameters at a bound that the gradient pushes further out are
+            # kept fixed for this step
+            fixed = (((x[active] <= lower[active]) & (rhs < 0)) |
+                     ((x[active] >= upper[active]) & (rhs > 0)))
+            free = ~fixed
+            A *= free[:, :, None] & free[:, None, :]
+            A[:, diag, diag] += fixed
+            rhs *= free
+        try:
+            step = np.linalg.solve(A, rhs[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.einsum('nij,nj->ni', np.linalg.pinv(A), rhs)
+        x_new = x[active] + step
+        if bounds is not None:
+            x_new = np.clip(x_new, lower[active], upper[active])
+            step = x_new - x[active]
+        with np.errstate(invalid='ignore', over='ignore'):
+            cost_new = np.sum(residuals(active, x_new) ** 2, axis=-1)
+        better = cost_new < cost[active]
+
+        small_step = (np.linalg.norm(step, axis=-1) <=
+                      xtol * np.linalg.norm(x_new, axis=-1))
+        small_reduction = (cost[active] - cost_new) <= ftol * cost[active]
+        accepted = active[better]
+        x[accepted] = x_new[better]
+        damping[accepted] *= 0.1
+        damping[active[~better]] *= 10
+
+        status[accepted[small_reduction[better]]] = 1
+        status[active[small_step & (status[active] == 0)]] = 2
+        status[active[~better & (damping[active] > 1e16)]] = 4
+
+        update = accepted[status[accepted] == 0]
+        if update.size:
+            cost[update] = normal_equations(update)
+        active = active[status[active] == 0]
+    status[active] = 5
+    return x, status
+
+
 class SKLearnLinearSolver(metaclass=abc.ABCMeta):
     """
     Provide a sklearn-like uniform interface to algorithms that solve problems
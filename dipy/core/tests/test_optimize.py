@@ -1,8 +1,9 @@
 import numpy as np
+import scipy.optimize as sopt
 import scipy.sparse as sps
 
 import numpy.testing as npt
-from dipy.core.optimize import Optimizer, sparse_nnls, spdot
+from dipy.core.optimize import Optimizer, leastsq_batch, sparse_nnls, spdot
 import dipy.core.optimize as opt
 from dipy.testing.decorators import set_random_number_generator
 
@@ -113,3 +114,44 @@ def test_sparse_nnls(rng):
     # We should be able to get back the right answer for this simple case
     npt.assert_array_almost_equal(beta, beta_hat, decimal=1)
     npt.assert_array_almost_equal(beta, beta_hat_sparse, decimal=1)
+
+
+@set_random_number_generator()
+def test_leastsq_batch(rng):
+    # Mono-exponential decays with different parameters in each problem
+    t = np.linspace(0, 3, 20)
+    n = 50
+    amp = rng.uniform(1, 3, n)
+    rate = rng.uniform(0.2, 2, n)
+    y = amp[:, None] * np.exp(-rate[:, None] * t)
+    y += rng.normal(0, 0.05, y.shape)
+
+    def residuals(x, y):
+        return y - x[:, :1] * np.exp(-x[:, 1:] * t)
+
+    def jacobian(x, y):
+        decay = np.exp(-x[:, 1:] * t)
+        return np.stack([-decay, x[:, :1] * t * decay], axis=-1)
+
+    x0 = np.ones((n, 2))
+    expected = np.array([sopt.leastsq(
+        lambda x, y: residuals(x[None], y[None])[0], [1., 1.], args=(yi,))[0]
+        for yi in y])
+    for Dfun in [jacobian, None]:
+        x, status = leastsq_batch(residuals, x0, Dfun=Dfun, batch_args=(y,))
+        npt.assert_array_almost_equal(x, expected, decimal=4)
+        npt.assert_(np.all((status > 0) & (status < 5)))
+
+    # Problems with non-finite residuals at the starting point are flagged
+    y[0] = np.nan
+    x, status = leastsq_batch(residuals, x0, Dfun=jacobian, batch_args=(y,))
+    npt.assert_equal(status[0], 0)
+    npt.assert_array_equal(x[0], x0[0])
+    npt.assert_(np.all(status[1:] > 0))
+
+    # Fewer residuals than parameters
+    def underdetermined(x, y):
+        return y - x[:, :1] - x[:, 1:]
+
+    npt.assert_raises(TypeError, leastsq_batch, underdetermined, x0,
+                      batch_args=(y[:, :1],))
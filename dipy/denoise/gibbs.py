@@ -1,11 +1,9 @@
-from functools import partial
-from multiprocessing import Pool
-
 import numpy as np
 import scipy
 
 from dipy.utils.multiproc import determine_num_processes
 from dipy.utils.deprecator import deprecated_params
+from dipy.utils.parallel import get_executor
 
 import scipy.fft
 _fft = scipy.fft
@@ -320,14 +318,11 @@ def gibbs_removal(vol, slice_axis=2, n_points=3, inplace=True,
     if nd == 2:
         vol[:, :] = _gibbs_removal_2d(vol, n_points=n_points, G0=G0, G1=G1)
     else:
-        pool = Pool(num_processes)
-
-        partial_func = partial(
-            _gibbs_removal_2d, n_points=n_points, G0=G0, G1=G1
-        )
-        vol[:, :, :] = pool.map(partial_func, vol)
-        pool.close()
-        pool.join()
+        engine = "serial" if num_processes == 1 else "process"
+        executor = get_executor(engine, n_jobs=num_processes)
+        executor.map_into(_gibbs_removal_2d, vol, vol,
+                          func_kwargs={'n_points': n_points, 'G0': G0,
+                                       'G1': G1})
 
     # Reshape data to original format
     if nd == 3:
@@ -26,6 +26,10 @@ cdef class BasePmfDirectionGetter(DirectionGetter):
         self,
         double* point) nogil
 
+    cdef void _threshold_pmf(
+        self,
+        double* pmf) nogil
+
     cpdef int get_direction(
         self,
         double[::1] point,
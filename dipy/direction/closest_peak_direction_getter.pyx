@@ -1,8 +1,11 @@
+from copy import copy
+
 import numpy as np
 cimport numpy as cnp
 
 from dipy.direction.peaks import peak_directions, default_sphere
-from dipy.direction.pmf cimport SimplePmfGen, SHCoeffPmfGen
+from dipy.direction.pmf cimport (QuantizedPmfGen, SimplePmfGen,
+                                  SHCoeffPmfGen)
 from dipy.reconst import shm
 from dipy.tracking.direction_getter cimport DirectionGetter
 from dipy.utils.fast_numpy cimport copy_point, scalar_muliplication_point
@@ -70,6 +73,18 @@ cdef class BasePmfDirectionGetter(DirectionGetter):
         self.cos_similarity = np.cos(np.deg2rad(max_angle))
         self.len_pmf = sphere.vertices.shape[0]
 
+    def __copy__(self):
+        """Copy with its own copy of the pmf generator, for one tracking
+        thread. The data are shared."""
+        cdef BasePmfDirectionGetter other = type(self).__new__(type(self))
+        other.sphere = self.sphere
+        other._pf_kwargs = self._pf_kwargs
+        other.pmf_gen = copy(self.pmf_gen)
+        other.pmf_threshold = self.pmf_threshold
+        other.cos_similarity = self.cos_similarity
+        other.len_pmf = self.len_pmf
+        return other
+
     def _get_peak_directions(self, blob):
         """Gets directions using parameters provided at init.
 
@@ -97,15 +112,20 @@ cdef class BasePmfDirectionGetter(DirectionGetter):
         return self._get_peak_directions(<double[:self.len_pmf]> pmf)
 
     cdef double* _get_pmf(self, double* point) nogil:
+        cdef double* pmf = self.pmf_gen.get_pmf_c(point)
+        self._threshold_pmf(pmf)
+        return pmf
+
+    cdef void _threshold_pmf(self, double* pmf) nogil:
+        """Set the values of `pmf` below ``pmf_threshold`` times its maximum
+        to 0."""
         cdef:
             cnp.npy_intp i
             cnp.npy_intp _len = self.len_pmf
-            double* pmf
             double pmf_threshold=self.pmf_threshold
             double absolute_pmf_threshold
             double max_pmf=0
 
-        pmf = self.pmf_gen.get_pmf_c(point)
         for i in range(_len):
             if pmf[i] > max_pmf:
                 max_pmf = pmf[i]
@@ -114,7 +134,17 @@ cdef class BasePmfDirectionGetter(DirectionGetter):
         for i in range(_len):
             if pmf[i] < absolute_pmf_threshold:
                 pmf[i] = 0.0
-        return pmf
+
+    def _get_pmf_batch(self, double[:, ::1] points):
+        """Thresholded pmfs at many points, as by ``_get_pmf``."""
+        cdef:
+            cnp.npy_intp k
+            double[:, ::1] pmfs = self.pmf_gen.get_pmf_batch(points)
+
+        with nogil:
+            for k in range(pmfs.shape[0]):
+                self._threshold_pmf(&pmfs[k, 0])
+        return np.asarray(pmfs)
 
 
 cdef class PmfGenDirectionGetter(BasePmfDirectionGetter):
@@ -196,16 +226,23 @@ cdef class PmfGenDirectionGetter(BasePmfDirectionGetter):
         legacy: bool, optional
             True to use a legacy basis definition for backward compatibility
             with previous ``tournier07`` and ``descoteaux07`` implementations.
-        sh_to_pmf: bool, optional
+        sh_to_pmf: bool or {'uint8', 'float16'}, optional
             If true, map sherical harmonics to spherical function (pmf) before
-            tracking (faster, requires more memory).
+            tracking (faster, requires more memory). If 'uint8' or 'float16',
+            the pmf of each block of voxels is mapped the first time it is
+            visited, and cached in this compact type (see
+            ``dipy.direction.pmf.QuantizedPmfGen``).
 
         See Also
         --------
         dipy.direction.peaks.peak_directions
 
         """
-        if sh_to_pmf:
+        if isinstance(sh_to_pmf, str):
+            pmf_gen = QuantizedPmfGen(np.asarray(shcoeff, dtype=float), sphere,
+                                      basis_type, legacy=legacy,
+                                      dtype=sh_to_pmf)
+        elif sh_to_pmf:
             sh_order = shm.order_from_ncoef(shcoeff.shape[3])
             pmf = shm.sh_to_sf(shcoeff, sphere, sh_order=sh_order,
                                basis_type=basis_type, legacy=legacy)
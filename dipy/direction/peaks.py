@@ -1,9 +1,4 @@
-import tempfile
-
-from multiprocessing import Pool
-from itertools import repeat
-from os import path
-
+from contextlib import ExitStack
 
 import numpy as np
 import scipy.optimize as opt
@@ -18,6 +13,7 @@ from dipy.reconst.shm import sh_to_sf_matrix
 from dipy.reconst.eudx_direction_getter import EuDXDirectionGetter
 
 from dipy.utils.multiproc import determine_num_processes
+from dipy.utils.parallel import SharedArray, get_executor
 from dipy.utils.deprecator import deprecated_params
 
 
@@ -228,146 +224,139 @@ def _peaks_from_model_parallel(model, data, sphere, relative_peak_threshold,
                                min_separation_angle, mask, return_odf,
                                return_sh, gfa_thr, normalize_peaks, sh_order,
                                sh_basis_type, npeaks, B, invB, num_processes):
-
-    shape = list(data.shape)
-    data = np.reshape(data, (-1, shape[-1]))
-    n = data.shape[0]
+    shape = data.shape[:-1]
+    n = int(np.prod(shape))
     nbr_chunks = num_processes ** 2
-    chunk_size = int(np.ceil(n / nbr_chunks))
-    indices = list(zip(np.arange(0, n, chunk_size),
-                       np.arange(0, n, chunk_size) + chunk_size))
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        data_file_name = path.join(tmpdir, 'data.npy')
-        np.save(data_file_name, data)
-        if mask is not None:
-            mask = mask.flatten()
-            mask_file_name = path.join(tmpdir, 'mask.npy')
-            np.save(mask_file_name, mask)
-        else:
-            mask_file_name = None
-
-        pool = Pool(num_processes)
-
-        pam_res = pool.map(_peaks_from_model_parallel_sub,
-                           zip(repeat((data_file_name, mask_file_name)),
-                               indices,
-                               repeat(model),
-                               repeat(sphere),
-                               repeat(relative_peak_threshold),
-                               repeat(min_separation_angle),
-                               repeat(return_odf),
-                               repeat(return_sh),
-                               repeat(gfa_thr),
-                               repeat(normalize_peaks),
-                               repeat(sh_order),
-                               repeat(sh_basis_type),
-                               repeat(npeaks),
-                               repeat(B),
-                               repeat(invB)))
-        pool.close()
-
-        pam = PeaksAndMetrics()
-        pam.sphere = sphere
-        # use memmap to reduce the memory usage
-        pam.gfa = np.memmap(path.join(tmpdir, 'gfa.npy'),
-                            dtype=pam_res[0].gfa.dtype,
-                            mode='w+',
-                            shape=(data.shape[0]))
-
-        pam.peak_dirs = np.memmap(path.join(tmpdir, 'peak_dirs.npy'),
-                                  dtype=pam_res[0].peak_dirs.dtype,
-                                  mode='w+',
-                                  shape=(data.shape[0], npeaks, 3))
-        pam.peak_values = np.memmap(path.join(tmpdir, 'peak_values.npy'),
-                                    dtype=pam_res[0].peak_values.dtype,
-                                    mode='w+',
-                                    shape=(data.shape[0], npeaks))
-        pam.peak_indices = np.memmap(path.join(tmpdir, 'peak_indices.npy'),
-                                     dtype=pam_res[0].peak_indices.dtype,
-                                     mode='w+',
-                                     shape=(data.shape[0], npeaks))
-        pam.qa = np.memmap(path.join(tmpdir, 'qa.npy'),
-                           dtype=pam_res[0].qa.dtype,
-                           mode='w+',
-                           shape=(data.shape[0], npeaks))
-        if return_sh:
-            nbr_shm_coeff = (sh_order + 2) * (sh_order + 1) // 2
-            pam.shm_coeff = np.memmap(path.join(tmpdir, 'shm.npy'),
-                                      dtype=pam_res[0].shm_coeff.dtype,
-                                      mode='w+',
-                                      shape=(data.shape[0], nbr_shm_coeff))
-            pam.B = pam_res[0].B
-        else:
-            pam.shm_coeff = None
-            pam.invB = None
-        if return_odf:
-            pam.odf = np.memmap(path.join(tmpdir, 'odf.npy'),
-                                dtype=pam_res[0].odf.dtype,
-                                mode='w+',
-                                shape=(data.shape[0], len(sphere.vertices)))
-        else:
-            pam.odf = None
-
-        # copy subprocesses pam to a single pam (memmaps)
-        for i, (start_pos, end_pos) in enumerate(indices):
-            pam.gfa[start_pos: end_pos] = pam_res[i].gfa
-            pam.peak_dirs[start_pos: end_pos] = pam_res[i].peak_dirs
-            pam.peak_values[start_pos: end_pos] = pam_res[i].peak_values
-            pam.peak_indices[start_pos: end_pos] = pam_res[i].peak_indices
-            pam.qa[start_pos: end_pos] = pam_res[i].qa
-            if return_sh:
-                pam.shm_coeff[start_pos: end_pos] = pam_res[i].shm_coeff
-            if return_odf:
-                pam.odf[start_pos: end_pos] = pam_res[i].odf
-
-        # load memmaps to arrays and reshape the metric
-        shape[-1] = -1
-        pam.gfa = np.reshape(np.array(pam.gfa), shape[:-1])
-        pam.peak_dirs = np.reshape(np.array(pam.peak_dirs), shape + [3])
-        pam.peak_values = np.reshape(np.array(pam.peak_values), shape)
-        pam.peak_indices = np.reshape(np.array(pam.peak_indices), shape)
-        pam.qa = np.reshape(np.array(pam.qa), shape)
-        if return_sh:
-            pam.shm_coeff = np.reshape(np.array(pam.shm_coeff), shape)
-        if return_odf:
-            pam.odf = np.reshape(np.array(pam.odf), shape)
-
-        # Make sure all worker processes have exited before leaving context
-        # manager in order to prevent temporary file deletion errors in windows
-        pool.join()
-
-    return pam
-
-
-def _peaks_from_model_parallel_sub(args):
-    (data_file_name, mask_file_name) = args[0]
-    (start_pos, end_pos) = args[1]
-    model = args[2]
-    sphere = args[3]
-    relative_peak_threshold = args[4]
-    min_separation_angle = args[5]
-    return_odf = args[6]
-    return_sh = args[7]
-    gfa_thr = args[8]
-    normalize_peaks = args[9]
-    sh_order = args[10]
-    sh_basis_type = args[11]
-    npeaks = args[12]
-    B = args[13]
-    invB = args[14]
-
-    data = np.load(data_file_name, mmap_mode='r')[start_pos:end_pos]
-    if mask_file_name is not None:
-        mask = np.load(mask_file_name, mmap_mode='r')[start_pos:end_pos]
-    else:
-        mask = None
+    chunk_size = max(int(np.ceil(n / nbr_chunks)), 1)
+    indices = [(start, min(start + chunk_size, n))
+               for start in range(0, n, chunk_size)]
+
+    if mask is None:
+        mask = np.ones(shape, dtype='bool')
+    elif mask.shape != shape:
+        raise ValueError("Mask is not the same shape as data.")
+
+    # The input data and all the outputs live in shared memory. The workers
+    # read their slab of voxels and write their results in place.
+    out_specs = {'gfa': ((), float),
+                 'qa': ((npeaks,), float),
+                 'peak_dirs': ((npeaks, 3), float),
+                 'peak_values': ((npeaks,), float),
+                 'peak_indices': ((npeaks,), np.int32)}
+    if return_sh:
+        n_shm_coeff = (sh_order + 2) * (sh_order + 1) // 2
+        out_specs['shm_coeff'] = ((n_shm_coeff,), float)
+    if return_odf:
+        out_specs['odf'] = ((len(sphere.vertices),), float)
+
+    with ExitStack() as stack:
+        shared_data = stack.enter_context(
+            SharedArray((n, data.shape[-1]), data.dtype))
+        shared_data.array[...] = data.reshape((n, data.shape[-1]))
+        out = {}
+        for name, (item_shape, dtype) in out_specs.items():
+            out[name] = stack.enter_context(
+                SharedArray((n,) + item_shape, dtype))
+            out[name].array[...] = 0
+        out['peak_indices'].array[...] = -1
+
+        executor = get_executor("process", n_jobs=num_processes)
+        global_max = -np.inf
+        for _, slab_max in executor.map(
+                _peaks_from_model_parallel_sub, indices, chunk_size=1,
+                func_args=[model, shared_data, mask.reshape(n), out, sphere,
+                           relative_peak_threshold, min_separation_angle,
+                           gfa_thr, normalize_peaks, invB]):
+            global_max = max(global_max, slab_max)
+
+        # Copy the results out of the shared memory blocks
+        res = {name: out[name].array.reshape(shape + item_shape).copy()
+               for name, (item_shape, _) in out_specs.items()}
+
+    res['qa'] /= global_max
+
+    return _pam_from_attrs(PeaksAndMetrics,
+                           sphere,
+                           res['peak_indices'],
+                           res['peak_values'],
+                           res['peak_dirs'],
+                           res['gfa'],
+                           res['qa'],
+                           res.get('shm_coeff'),
+                           B if return_sh else None,
+                           res.get('odf'))
+
+
+def _peaks_from_model_parallel_sub(indices, model, data, mask, out, sphere,
+                                   relative_peak_threshold,
+                                   min_separation_angle, gfa_thr,
+                                   normalize_peaks, invB):
+    start_pos, end_pos = indices
+    slab = {name: shared.array[start_pos:end_pos]
+            for name, shared in out.items()}
+    return _peaks_from_voxels(model, data[start_pos:end_pos],
+                              mask[start_pos:end_pos], sphere,
+                              relative_peak_threshold, min_separation_angle,
+                              gfa_thr, normalize_peaks, invB, slab['gfa'],
+                              slab['qa'], slab['peak_dirs'],
+                              slab['peak_values'], slab['peak_indices'],
+                              slab.get('shm_coeff'), slab.get('odf'))
+
+
+def _peaks_from_voxels(model, data, mask, sphere, relative_peak_threshold,
+                       min_separation_angle, gfa_thr, normalize_peaks, invB,
+                       gfa_array, qa_array, peak_dirs, peak_values,
+                       peak_indices, shm_coeff=None, odf_array=None):
+    """Fit the model voxel by voxel and write the peaks and metrics in place.
+
+    The output arrays must have the shape of ``data.shape[:-1]`` followed by
+    the shape of the metric in one voxel. `shm_coeff` and `odf_array` are
+    only filled if given. The quantitative anisotropy is not normalized.
+
+    Returns
+    -------
+    global_max : float
+        The largest ODF peak, used to normalize the quantitative anisotropy.
+    """
+    global_max = -np.inf
+    for idx in ndindex(data.shape[:-1]):
+        if not mask[idx]:
+            continue
+
+        odf = model.fit(data[idx]).odf(sphere)
+
+        if shm_coeff is not None:
+            shm_coeff[idx] = np.dot(odf, invB)
+
+        if odf_array is not None:
+            odf_array[idx] = odf
+
+        gfa_array[idx] = gfa(odf)
+        if gfa_array[idx] < gfa_thr:
+            global_max = max(global_max, odf.max())
+            continue
+
+        # Get peaks of odf
+        direction, pk, ind = peak_directions(odf, sphere,
+                                             relative_peak_threshold,
+                                             min_separation_angle)
+
+        # Calculate peak metrics
+        if pk.shape[0] != 0:
+            global_max = max(global_max, pk[0])
+
+            n = min(qa_array.shape[-1], pk.shape[0])
+            qa_array[idx][:n] = pk[:n] - odf.min()
 
-    return peaks_from_model(model, data, sphere, relative_peak_threshold,
-                            min_separation_angle, mask, return_odf,
-                            return_sh, gfa_thr, normalize_peaks,
-                            sh_order, sh_basis_type, npeaks, B, invB,
-                            parallel=False, num_processes=None)
+            peak_dirs[idx][:n] = direction[:n]
+            peak_indices[idx][:n] = ind[:n]
+            peak_values[idx][:n] = pk[:n]
+
+            if normalize_peaks:
+                peak_values[idx][:n] /= pk[0]
+                peak_dirs[idx] *= peak_values[idx][:, None]
+
+    return global_max
 
 
 @deprecated_params('nbr_processes', 'num_processes', since='1.4', until='1.5')
@@ -420,9 +409,9 @@ def peaks_from_model(model, data, sphere, relative_peak_threshold,
         Inverse of B.
     parallel: bool
         If True, use multiprocessing to compute peaks and metric
-        (default False). Temporary files are saved in the default temporary
-        directory of the system. It can be changed using ``import tempfile``
-        and ``tempfile.tempdir = '/path/to/tempdir'``.
+        (default False). The data and the outputs are placed in shared
+        memory, where each subprocess writes the results of its slab of
+        voxels.
     num_processes: int, optional
         If `parallel` is True, the number of subprocesses to use
         (default multiprocessing.cpu_count()). If < 0 the maximal number of
@@ -494,44 +483,13 @@ def peaks_from_model(model, data, sphere, relative_peak_threshold,
     if return_odf:
         odf_array = np.zeros((shape + (len(sphere.vertices),)))
 
-    global_max = -np.inf
-    for idx in ndindex(shape):
-        if not mask[idx]:
-            continue
-
-        odf = model.fit(data[idx]).odf(sphere)
-
-        if return_sh:
-            shm_coeff[idx] = np.dot(odf, invB)
-
-        if return_odf:
-            odf_array[idx] = odf
-
-        gfa_array[idx] = gfa(odf)
-        if gfa_array[idx] < gfa_thr:
-            global_max = max(global_max, odf.max())
-            continue
-
-        # Get peaks of odf
-        direction, pk, ind = peak_directions(odf, sphere,
-                                             relative_peak_threshold,
-                                             min_separation_angle)
-
-        # Calculate peak metrics
-        if pk.shape[0] != 0:
-            global_max = max(global_max, pk[0])
-
-            n = min(npeaks, pk.shape[0])
-            qa_array[idx][:n] = pk[:n] - odf.min()
-
-            peak_dirs[idx][:n] = direction[:n]
-            peak_indices[idx][:n] = ind[:n]
-            peak_values[idx][:n] = pk[:n]
-
-            if normalize_peaks:
-                peak_values[idx][:n] /= pk[0]
-                peak_dirs[idx] *= peak_values[idx][:, None]
-
+    global_max = _peaks_from_voxels(model, data, mask, sphere,
+                                    relative_peak_threshold,
+                                    min_separation_angle, gfa_thr,
+                                    normalize_peaks, invB, gfa_array, qa_array,
+                                    peak_dirs, peak_values, peak_indices,
+                                    shm_coeff if return_sh else None,
+                                    odf_array if return_odf else None)
     qa_array /= global_max
 
     return _pam_from_attrs(PeaksAndMetrics,
@@ -25,3 +25,18 @@ cdef class SHCoeffPmfGen(PmfGen):
         double[:, :] B
         double[:] coeff
     pass
+
+
+cdef class QuantizedPmfGen(PmfGen):
+    cdef:
+        double[:, :] B
+        bint half
+        int block_size
+        np.uint8_t[:, :, :, ::1] qdata8
+        np.uint16_t[:, :, :, ::1] qdata16
+        float[:, :, ::1] scale
+        np.uint8_t[:, :, ::1] filled
+
+    cdef int _prepare_c(self, np.npy_intp* index, double* weight,
+                        double* point) nogil
+    cdef void _fill_block(self, np.npy_intp i, np.npy_intp j, np.npy_intp k)
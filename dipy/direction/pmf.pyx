@@ -5,6 +5,8 @@
 import numpy as np
 cimport numpy as cnp
 
+from libc.math cimport floor
+
 from dipy.reconst import shm
 
 from dipy.core.interpolation cimport trilinear_interpolate4d_c
@@ -19,6 +21,19 @@ cdef class PmfGen:
         self.sphere = sphere
         self.vertices = np.asarray(sphere.vertices, dtype=float)
 
+    def __copy__(self):
+        """Copy sharing the data, with its own pmf buffer.
+
+        The pmf buffer is overwritten at each call of ``get_pmf``, a copy is
+        needed per tracking thread.
+        """
+        cdef PmfGen other = type(self).__new__(type(self))
+        other.data = self.data
+        other.sphere = self.sphere
+        other.vertices = self.vertices
+        other.pmf = np.empty(self.pmf.shape[0])
+        return other
+
     cpdef double[:] get_pmf(self, double[::1] point):
         cdef:
             cnp.npy_intp len_pmf = self.pmf.shape[0]
@@ -27,6 +42,32 @@ cdef class PmfGen:
     cdef double* get_pmf_c(self, double* point) nogil:
         pass
 
+    def get_pmf_batch(self, double[:, ::1] points):
+        """Return the pmfs at many points at once.
+
+        Parameters
+        ----------
+        points : array (K, 3)
+            The points, in voxel coordinates.
+
+        Returns
+        -------
+        pmfs : array (K, N)
+            The pmf at each point. It is zero at the points outside of the
+            data.
+        """
+        cdef:
+            cnp.npy_intp i, j
+            cnp.npy_intp len_pmf = self.pmf.shape[0]
+            double[:, ::1] pmfs = np.empty((points.shape[0], len_pmf))
+            double* pmf
+
+        for i in range(points.shape[0]):
+            pmf = self.get_pmf_c(&points[i, 0])
+            for j in range(len_pmf):
+                pmfs[i, j] = pmf[j]
+        return np.asarray(pmfs)
+
     cdef int find_closest(self, double* xyz) nogil:
         cdef:
             cnp.npy_intp idx = 0
@@ -66,6 +107,20 @@ cdef class PmfGen:
             self.pmf[i] = 0.0
 
 
+cdef cnp.ndarray _interpolate_batch(double[:, :, :, :] data,
+                                    double[:, ::1] points):
+    """Trilinear interpolation of `data` at each point, zero outside."""
+    cdef:
+        cnp.npy_intp i
+        double[:, ::1] out = np.empty((points.shape[0], data.shape[3]))
+
+    with nogil:
+        for i in range(points.shape[0]):
+            if trilinear_interpolate4d_c(data, &points[i, 0], out[i]) != 0:
+                out[i, :] = 0
+    return np.asarray(out)
+
+
 cdef class SimplePmfGen(PmfGen):
 
     def __init__(self,
@@ -84,6 +139,9 @@ cdef class SimplePmfGen(PmfGen):
             PmfGen.__clear_pmf(self)
         return &self.pmf[0]
 
+    def get_pmf_batch(self, double[:, ::1] points):
+        return _interpolate_batch(self.data, points)
+
     cdef double get_pmf_value_c(self, double* point, double* xyz) nogil:
         """
         Return the pmf value corresponding to the closest vertex to the
@@ -122,6 +180,21 @@ cdef class SHCoeffPmfGen(PmfGen):
         self.coeff = np.empty(shcoeff_array.shape[3])
         self.pmf = np.empty(self.B.shape[0])
 
+    def __copy__(self):
+        cdef SHCoeffPmfGen other = PmfGen.__copy__(self)
+        other.B = self.B
+        other.coeff = np.empty(self.coeff.shape[0])
+        return other
+
+    def get_pmf_batch(self, double[:, ::1] points):
+        """Return the pmfs at many points at once.
+
+        The SH coefficients are interpolated at all the points, and projected
+        on the sphere with a single matrix product.
+        """
+        return np.dot(_interpolate_batch(self.data, points),
+                      np.asarray(self.B).T)
+
     cdef double* get_pmf_c(self, double* point) nogil:
         cdef:
             cnp.npy_intp i, j
@@ -138,3 +211,210 @@ cdef class SHCoeffPmfGen(PmfGen):
                     _sum = _sum + (self.B[i, j] * self.coeff[j])
                 self.pmf[i] = _sum
         return &self.pmf[0]
+
+
+# Values of the half floats in [0, 1], indexed by their bits
+cdef float[::1] _HALF_TO_FLOAT = \
+    np.arange(0x3c01, dtype=np.uint16).view(np.float16).astype(np.float32)
+
+
+cdef class QuantizedPmfGen(PmfGen):
+    """Pmfs of SH coefficients, cached on the sphere in a compact type.
+
+    The SH coefficients are projected on the sphere once per voxel, the
+    first time a block of voxels is visited, and stored quantized with a
+    scale per voxel. The pmfs are then interpolated from the quantized
+    values, without evaluating the SH basis at each tracking step.
+
+    The quantized volume is allocated zero-filled, so that its memory pages
+    are only committed as blocks are visited. With 724 vertices, a fully
+    visited volume takes 8 (uint8) or 4 (float16) times less memory than
+    the float64 pmfs of ``SimplePmfGen``, in addition to the SH
+    coefficients.
+    """
+
+    def __init__(self,
+                 double[:, :, :, :] shcoeff_array,
+                 object sphere,
+                 object basis_type,
+                 legacy=True,
+                 dtype=np.uint8,
+                 block_size=8):
+        """
+        Parameters
+        ----------
+        shcoeff_array : array (X, Y, Z, C)
+            The SH coefficients of the pmf at each voxel.
+        sphere : Sphere
+            The sphere on which the pmfs are sampled.
+        basis_type : name of basis
+            The basis of ``shcoeff_array``.
+        legacy : bool, optional
+            True to use a legacy basis definition for backward compatibility
+            with previous ``tournier07`` and ``descoteaux07`` implementations.
+        dtype : {uint8, float16}, optional
+            The type of the cached pmfs. The uint8 values are a linear
+            quantization of the pmf of each voxel, from 0 to its maximum.
+            The float16 values have a relative precision of 1e-3.
+        block_size : int, optional
+            The pmfs of blocks of ``block_size**3`` voxels are computed
+            together.
+        """
+        cdef:
+            int sh_order
+            tuple shape = (shcoeff_array.shape[0], shcoeff_array.shape[1],
+                           shcoeff_array.shape[2])
+
+        PmfGen.__init__(self, shcoeff_array, sphere)
+
+        dtype = np.dtype(dtype)
+        if dtype not in (np.uint8, np.float16):
+            raise ValueError("dtype should be uint8 or float16, not %s."
+                             % dtype)
+        if block_size < 1:
+            raise ValueError("block_size must be a positive integer.")
+
+        sh_order = shm.order_from_ncoef(shcoeff_array.shape[3])
+        try:
+            basis = shm.sph_harm_lookup[basis_type]
+        except KeyError:
+            raise ValueError("%s is not a known basis type." % basis_type)
+        B, _, _ = basis(sh_order, sphere.theta, sphere.phi, legacy=legacy)
+        self.B = np.ascontiguousarray(B)
+        self.pmf = np.empty(self.B.shape[0])
+
+        self.half = dtype == np.float16
+        self.block_size = block_size
+        qshape = shape + (self.B.shape[0],)
+        empty = (1, 1, 1, 1)
+        self.qdata8 = np.zeros(empty if self.half else qshape, np.uint8)
+        self.qdata16 = np.zeros(qshape if self.half else empty, np.uint16)
+        self.scale = np.zeros(shape, np.float32)
+        nb_blocks = -(-np.array(shape) // block_size)
+        self.filled = np.zeros(nb_blocks, np.uint8)
+
+    def __copy__(self):
+        """Copy sharing the data and the cached pmfs."""
+        cdef QuantizedPmfGen other = PmfGen.__copy__(self)
+        other.B = self.B
+        other.half = self.half
+        other.block_size = self.block_size
+        other.qdata8 = self.qdata8
+        other.qdata16 = self.qdata16
+        other.scale = self.scale
+        other.filled = self.filled
+        return other
+
+    cdef void _fill_block(self, cnp.npy_intp i, cnp.npy_intp j,
+                          cnp.npy_intp k):
+        """Compute and quantize the pmfs of the block (i, j, k)."""
+        cdef int b = self.block_size
+
+        index = (slice(i * b, (i + 1) * b), slice(j * b, (j + 1) * b),
+                 slice(k * b, (k + 1) * b))
+        sf = np.dot(np.asarray(self.data)[index], np.asarray(self.B).T)
+        np.maximum(sf, 0, out=sf)
+        vmax = sf.max(axis=-1)
+        sf = np.divide(sf, vmax[..., None], out=np.zeros_like(sf),
+                       where=vmax[..., None] > 0)
+        if self.half:
+            np.asarray(self.qdata16)[index] = \
+                sf.astype(np.float16).view(np.uint16)
+            np.asarray(self.scale)[index] = vmax
+        else:
+            np.asarray(self.qdata8)[index] = np.rint(sf * 255)
+            np.asarray(self.scale)[index] = vmax / 255
+        self.filled[i, j, k] = 1
+
+    cdef int _prepare_c(self, cnp.npy_intp* index, double* weight,
+                        double* point) nogil:
+        """Interpolation indices and weights of ``point``, as in
+        ``trilinear_interpolate4d_c``, once the pmfs of the voxels are
+        cached. Return -1 if the point is outside of the data, else 0."""
+        cdef:
+            cnp.npy_intp i, j, k, flr
+            double rem
+
+        for i in range(3):
+            if point[i] < -.5 or point[i] >= (self.data.shape[i] - .5):
+                return -1
+            flr = <cnp.npy_intp> floor(point[i])
+            rem = point[i] - flr
+            index[2 * i] = flr + (flr == -1)
+            index[2 * i + 1] = flr + (flr != (self.data.shape[i] - 1))
+            weight[2 * i] = 1 - rem
+            weight[2 * i + 1] = rem
+
+        for i in range(2):
+            for j in range(2):
+                for k in range(2):
+                    if not self.filled[index[i] // self.block_size,
+                                       index[2 + j] // self.block_size,
+                                       index[4 + k] // self.block_size]:
+                        with gil:
+                            self._fill_block(
+                                index[i] // self.block_size,
+                                index[2 + j] // self.block_size,
+                                index[4 + k] // self.block_size)
+        return 0
+
+    cdef double* get_pmf_c(self, double* point) nogil:
+        cdef:
+            cnp.npy_intp i, j, k, L, x, y, z
+            cnp.npy_intp len_pmf = self.pmf.shape[0]
+            cnp.npy_intp index[6]
+            double weight[6]
+            double w
+
+        PmfGen.__clear_pmf(self)
+        if self._prepare_c(index, weight, point) != 0:
+            return &self.pmf[0]
+
+        for i in range(2):
+            for j in range(2):
+                for k in range(2):
+                    x = index[i]
+                    y = index[2 + j]
+                    z = index[4 + k]
+                    w = weight[i] * weight[2 + j] * weight[4 + k] \
+                        * self.scale[x, y, z]
+                    if w == 0:
+                        continue
+                    if self.half:
+                        for L in range(len_pmf):
+                            self.pmf[L] += w * _HALF_TO_FLOAT[
+                                self.qdata16[x, y, z, L]]
+                    else:
+                        for L in range(len_pmf):
+                            self.pmf[L] += w * self.qdata8[x, y, z, L]
+        return &self.pmf[0]
+
+    cdef double get_pmf_value_c(self, double* point, double* xyz) nogil:
+        """
+        Return the pmf value corresponding to the closest vertex to the
+        direction xyz.
+        """
+        cdef:
+            cnp.npy_intp i, j, k, x, y, z
+            cnp.npy_intp idx = self.find_closest(xyz)
+            cnp.npy_intp index[6]
+            double weight[6]
+            double w, value = 0
+
+        if self._prepare_c(index, weight, point) != 0:
+            return 0
+
+        for i in range(2):
+            for j in range(2):
+                for k in range(2):
+                    x = index[i]
+                    y = index[2 + j]
+                    z = index[4 + k]
+                    w = weight[i] * weight[2 + j] * weight[4 + k] \
+                        * self.scale[x, y, z]
+                    if self.half:
+                        value += w * _HALF_TO_FLOAT[
+                            self.qdata16[x, y, z, idx]]
+                    else:
+                        value += w * self.qdata8[x, y, z, idx]
+        return value
@@ -4,6 +4,10 @@ from dipy.direction.closest_peak_direction_getter cimport PmfGenDirectionGetter
 cdef class ProbabilisticDirectionGetter(PmfGenDirectionGetter):
     cdef:
         double[:, :] vertices
+        object _random
+
+    cdef int _direction_from_pmf(self, double* pmf, double* direction,
+                                 object random)
 
 
 cdef class DeterministicMaximumDirectionGetter(ProbabilisticDirectionGetter):
@@ -13,6 +13,7 @@ cimport numpy as cnp
 
 from dipy.direction.closest_peak_direction_getter cimport PmfGenDirectionGetter
 from dipy.utils.fast_numpy cimport (copy_point, cumsum, norm, normalize,
+                                     scalar_muliplication_point,
                                      where_to_insert)
 
 
@@ -59,7 +60,63 @@ cdef class ProbabilisticDirectionGetter(PmfGenDirectionGetter):
                                        pmf_threshold, **kwargs)
         # The vertices need to be in a contiguous array
         self.vertices = self.sphere.vertices.copy()
+        self._random = random
 
+    def __copy__(self):
+        cdef ProbabilisticDirectionGetter other = \
+            PmfGenDirectionGetter.__copy__(self)
+        other.vertices = self.vertices
+        other._random = random
+        return other
+
+    def set_random_generator(self, rng=None):
+        """Draw the directions from `rng` instead of the ``random`` module.
+
+        Parameters
+        ----------
+        rng : random.Random, optional
+            Generator of the random numbers, e.g. one per tracking thread.
+            With None, the global generator of the ``random`` module is used.
+        """
+        self._random = random if rng is None else rng.random
+
+    def get_direction_batch(self, double[:, ::1] points,
+                            double[:, ::1] directions, object rngs=None):
+        """Update the directions of many points at once.
+
+        The pmfs of all the points are computed together (see
+        ``PmfGen.get_pmf_batch``), then the direction of each point is chosen
+        from its pmf as by ``get_direction``.
+
+        Parameters
+        ----------
+        points : array (K, 3)
+            The points at which to lookup tracking directions.
+        directions : array (K, 3)
+            Previous tracking directions, updated in place.
+        rngs : array of random.Random, optional
+            Random generator of each point. By default, the random generator
+            of the direction getter is used for all the points.
+
+        Returns
+        -------
+        status : array (K,)
+            1 where no direction was found, 0 otherwise.
+        """
+        cdef:
+            cnp.npy_intp k
+            double[:, ::1] pmfs = self._get_pmf_batch(points)
+            cnp.npy_uint8[::1] status = np.ones(points.shape[0],
+                                                dtype=np.uint8)
+
+        for k in range(points.shape[0]):
+            if norm(&directions[k, 0]) == 0:
+                continue
+            normalize(&directions[k, 0])
+            status[k] = self._direction_from_pmf(
+                &pmfs[k, 0], &directions[k, 0],
+                self._random if rngs is None else rngs[k].random)
+        return np.asarray(status)
 
     cdef int get_direction_c(self, double* point, double* direction):
         """Samples a pmf to updates ``direction`` array with a new direction.
@@ -77,20 +134,30 @@ cdef class ProbabilisticDirectionGetter(PmfGenDirectionGetter):
             Returns 0 `direction` was updated with a new tracking direction, or
             1 otherwise.
 
+        """
+        cdef double* pmf
+
+        if norm(direction) == 0:
+            return 1
+        normalize(direction)
+
+        with nogil:
+            pmf = self._get_pmf(point)
+        return self._direction_from_pmf(pmf, direction, self._random)
+
+    cdef int _direction_from_pmf(self, double* pmf, double* direction,
+                                 object random):
+        """Samples the new ``direction`` from the thresholded ``pmf``.
+
+        ``direction`` is the normalized previous direction, ``pmf`` is
+        overwritten and ``random`` draws uniform numbers in [0, 1).
         """
         cdef:
             cnp.npy_intp i, idx, _len
             double[:] newdir
-            double* pmf
             double last_cdf, cos_sim
 
         _len = self.len_pmf
-        pmf = self._get_pmf(point)
-
-
-        if norm(direction) == 0:
-            return 1
-        normalize(direction)
 
         with nogil:
             for i in range(_len):
@@ -116,10 +183,9 @@ cdef class ProbabilisticDirectionGetter(PmfGenDirectionGetter):
             + direction[2] * newdir[2] > 0):
             copy_point(&newdir[0], direction)
         else:
-            newdir[0] = newdir[0] * -1
-            newdir[1] = newdir[1] * -1
-            newdir[2] = newdir[2] * -1
+            # The vertices are shared between threads, flip the copy
             copy_point(&newdir[0], direction)
+            scalar_muliplication_point(direction, -1)
         return 0
 
 
@@ -132,15 +198,20 @@ cdef class DeterministicMaximumDirectionGetter(ProbabilisticDirectionGetter):
         ProbabilisticDirectionGetter.__init__(self, pmf_gen, max_angle, sphere,
                                               pmf_threshold, **kwargs)
 
-    cdef int get_direction_c(self, double* point, double* direction):
+    cdef int _direction_from_pmf(self, double* pmf, double* direction,
+                                 object random):
         """Find direction with the highest pmf to updates ``direction`` array
         with a new direction.
+
         Parameters
         ----------
-        point : memory-view (or ndarray), shape (3,)
-            The point in an image at which to lookup tracking directions.
-        direction : memory-view (or ndarray), shape (3,)
-            Previous tracking direction.
+        pmf : double*
+            The thresholded pmf at the tracking point.
+        direction : double*
+            Normalized previous tracking direction.
+        random : callable
+            Unused, the direction is deterministic.
+
         Returns
         -------
         status : int
@@ -148,20 +219,14 @@ cdef class DeterministicMaximumDirectionGetter(ProbabilisticDirectionGetter):
             1 otherwise.
         """
         cdef:
-            cnp.npy_intp _len, max_idx
+            cnp.npy_intp i, _len, max_idx
             double[:] newdir
-            double* pmf
             double max_value, cos_sim
 
-        pmf = self._get_pmf(point)
         _len = self.len_pmf
         max_idx = 0
         max_value = 0.0
 
-        if norm(direction) == 0:
-            return 1
-        normalize(direction)
-
         with nogil:
             for i in range(_len):
                 cos_sim = self.vertices[i][0] * direction[0] \
@@ -183,8 +248,6 @@ cdef class DeterministicMaximumDirectionGetter(ProbabilisticDirectionGetter):
                 + direction[2] * newdir[2] > 0):
                 copy_point(&newdir[0], direction)
             else:
-                newdir[0] = newdir[0] * -1
-                newdir[1] = newdir[1] * -1
-                newdir[2] = newdir[2] * -1
                 copy_point(&newdir[0], direction)
+                scalar_muliplication_point(direction, -1)
         return 0
@@ -127,6 +127,20 @@ cdef class PTTDirectionGetter(ProbabilisticDirectionGetter):
         ProbabilisticDirectionGetter.__init__(self, pmf_gen, max_angle, sphere,
                                        pmf_threshold, **kwargs)
 
+    def __copy__(self):
+        raise TypeError("PTTDirectionGetter cannot be copied for "
+                        "multi-threaded tracking: it samples from the C "
+                        "library random generator, shared by all threads.")
+
+    def set_random_generator(self, rng=None):
+        if rng is not None:
+            raise TypeError("PTTDirectionGetter samples from the C library "
+                            "random generator, see dipy.utils.fast_numpy.seed")
+
+    def generate_streamlines_batch(self, *args, **kwargs):
+        raise TypeError("PTTDirectionGetter cannot track streamlines in "
+                        "lockstep: its state is the frame of a single "
+                        "streamline.")
 
     cdef void initialize_candidate(self, double[:] init_dir):
         """"Initialize the parallel transport frame.
@@ -620,6 +620,43 @@ def test_peaksFromModelParallel():
             assert_array_almost_equal(pam.odf, pam_single.odf)
 
 
+def test_peaksFromModelParallel_volume():
+    _, fbvals, fbvecs = get_fnames('small_64D')
+    bvals, bvecs = read_bvals_bvecs(fbvals, fbvecs)
+    gtab = gradient_table(bvals, bvecs)
+    mevals = np.array(([0.0015, 0.0003, 0.0003],
+                       [0.0015, 0.0003, 0.0003]))
+
+    data = np.zeros((3, 2, 2, len(bvals)))
+    for i, ijk in enumerate(np.ndindex(data.shape[:-1])):
+        data[ijk], _ = multi_tensor(gtab, mevals, 100,
+                                    angles=[(0, 0), (30 + 5 * i, 0)],
+                                    fractions=[50, 50], snr=None)
+    mask = np.ones(data.shape[:-1], dtype=bool)
+    mask[0, 0, 0] = False
+
+    model = SimpleOdfModel(gtab)
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore", message=descoteaux07_legacy_msg,
+            category=PendingDeprecationWarning)
+        pam_single = peaks_from_model(model, data, default_sphere, .5, 25,
+                                      mask=mask, return_odf=True,
+                                      return_sh=True, parallel=False)
+        pam_multi = peaks_from_model(model, data, default_sphere, .5, 25,
+                                     mask=mask, return_odf=True,
+                                     return_sh=True, parallel=True,
+                                     num_processes=2)
+
+    for attr in ['peak_dirs', 'peak_values', 'peak_indices', 'gfa', 'qa',
+                 'shm_coeff', 'B', 'odf']:
+        assert_equal(getattr(pam_multi, attr).dtype,
+                     getattr(pam_single, attr).dtype)
+        assert_array_almost_equal(getattr(pam_multi, attr),
+                                  getattr(pam_single, attr))
+    assert_array_equal(pam_multi.peak_indices[0, 0, 0], -1)
+
+
 def test_peaks_shm_coeff():
 
     SNR = 100
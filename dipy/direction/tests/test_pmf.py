@@ -6,7 +6,7 @@ from dipy.core.gradients import gradient_table
 from dipy.core.sphere import HemiSphere, unit_octahedron
 from dipy.data import default_sphere, get_sphere
 from dipy.reconst import shm
-from dipy.direction.pmf import SimplePmfGen, SHCoeffPmfGen
+from dipy.direction.pmf import QuantizedPmfGen, SimplePmfGen, SHCoeffPmfGen
 from dipy.reconst.csdeconv import ConstrainedSphericalDeconvModel
 from dipy.reconst.dti import TensorModel
 from dipy.testing.decorators import set_random_number_generator
@@ -76,3 +76,40 @@ def test_pmf_from_array():
         ValueError,
         lambda: SimplePmfGen(np.ones([2, 2, 2, len(sphere.vertices)]),
                              default_sphere))
+
+
+@set_random_number_generator()
+def test_pmf_quantized(rng):
+    sphere = get_sphere('symmetric724')
+    shcoeff = rng.random([9, 5, 4, 28])
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            'ignore', message=shm.descoteaux07_legacy_msg,
+            category=PendingDeprecationWarning)
+        pmf = shm.sh_to_sf(shcoeff, sphere, sh_order=6).clip(min=0)
+        for dtype, decimal in [(np.uint8, 2), (np.float16, 3)]:
+            pmfgen = QuantizedPmfGen(shcoeff, sphere, None, dtype=dtype,
+                                     block_size=3)
+            simple_pmfgen = SimplePmfGen(pmf, sphere)
+
+            # Test that the pmf matches the sphere-sampled pmf, up to the
+            # precision of the cached type
+            for point in rng.random([20, 3]) * [9, 5, 4] - .5:
+                npt.assert_array_almost_equal(
+                    pmfgen.get_pmf(point) / pmf.max(),
+                    simple_pmfgen.get_pmf(point) / pmf.max(), decimal)
+                xyz = sphere.vertices[5]
+                npt.assert_almost_equal(
+                    pmfgen.get_pmf_value(point, xyz) / pmf.max(),
+                    simple_pmfgen.get_pmf_value(point, xyz) / pmf.max(),
+                    decimal)
+
+            # Test that the pmf is 0 for invalid Points
+            npt.assert_array_equal(
+                pmfgen.get_pmf(np.array([-1, 0, 0], dtype='float')),
+                np.zeros(len(sphere.vertices)))
+
+    npt.assert_raises(ValueError, QuantizedPmfGen, shcoeff, sphere, None,
+                      dtype=np.float32)
+    npt.assert_raises(ValueError, QuantizedPmfGen, shcoeff, sphere, None,
+                      block_size=0)
@@ -0,0 +1,153 @@
+""" Load and save the clusters of streamlines """
+import hashlib
+
+import numpy as np
+
+from dipy.segment.clustering import ClusterCentroid, ClusterMapCentroid
+
+CLUSTERS_VERSION = '0.0.1'
+
+
+def streamlines_hash(streamlines, chunk_size=2 ** 24):
+    """ Content hash of streamlines.
+
+    Parameters
+    ----------
+    streamlines : Streamlines or sequence of ndarray
+        The streamlines to hash.
+    chunk_size : int, optional
+        Number of points hashed at once.
+
+    Returns
+    -------
+    digest : str
+        Hexadecimal BLAKE2b digest of the number of points of each streamline
+        and of their coordinates in float32.
+    """
+    h = hashlib.blake2b(digest_size=32)
+    if hasattr(streamlines, 'get_data'):
+        lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+        data = streamlines.get_data()
+        h.update(np.ascontiguousarray(lengths).tobytes())
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            h.update(np.ascontiguousarray(chunk, dtype=np.float32).tobytes())
+    else:
+        h.update(np.array([len(s) for s in streamlines],
+                          dtype=np.int64).tobytes())
+        for s in streamlines:
+            h.update(np.ascontiguousarray(s, dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+
+def save_cluster_map(fname, cluster_map, streamlines=None, thresholds=None,
+                     nb_pts=None):
+    """ Save the centroids and indices of a cluster map (NPZ file).
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the NPZ file, written as given.
+    cluster_map : ClusterMapCentroid
+        The clusters to save.
+    streamlines : Streamlines, optional
+        The clustered streamlines. Their content hash is saved so that the
+        clusters are only reloaded for the same streamlines.
+    thresholds : sequence of float, optional
+        The distance thresholds of the clustering.
+    nb_pts : int, optional
+        The number of points the streamlines were resampled to.
+
+    See Also
+    --------
+    dipy.io.clusters.load_cluster_map
+    """
+    centroids = [np.asarray(c, dtype=np.float32)
+                 for c in cluster_map.centroids]
+    indices = [np.asarray(cluster.indices, dtype=np.int64)
+               for cluster in cluster_map]
+    arrays = {
+        'version': np.array(CLUSTERS_VERSION),
+        'centroid_lengths': np.array([len(c) for c in centroids],
+                                     dtype=np.int64),
+        'centroids': (np.concatenate(centroids) if centroids
+                      else np.zeros((0, 3), dtype=np.float32)),
+        'cluster_sizes': np.array([len(i) for i in indices], dtype=np.int64),
+        'indices': (np.concatenate(indices) if indices
+                    else np.zeros(0, dtype=np.int64))}
+    if streamlines is not None:
+        arrays['streamlines_hash'] = np.array(streamlines_hash(streamlines))
+        arrays['nb_streamlines'] = np.array(len(streamlines))
+    if thresholds is not None:
+        arrays['thresholds'] = np.asarray(thresholds, dtype=float)
+    if nb_pts is not None:
+        arrays['nb_pts'] = np.array(nb_pts)
+
+    # Writing to a file object keeps numpy from appending an extension
+    with open(fname, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def load_cluster_map(fname, streamlines=None, thresholds=None, nb_pts=None):
+    """ Load a cluster map saved by `save_cluster_map`.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the NPZ file.
+    streamlines : Streamlines, optional
+        The clustered streamlines, set as the reference data of the clusters.
+        Their content hash is checked against the saved one.
+    thresholds : sequence of float, optional
+        Expected distance thresholds of the clustering.
+    nb_pts : int, optional
+        Expected number of points the streamlines were resampled to.
+
+    Returns
+    -------
+    cluster_map : ClusterMapCentroid
+        The clusters, referring to `streamlines` if given.
+
+    Raises
+    ------
+    ValueError
+        If the file was saved by another version of `save_cluster_map`, if
+        it does not match the given `streamlines`, `thresholds` or `nb_pts`,
+        or if they were not saved.
+    """
+    with np.load(fname, allow_pickle=False) as f:
+        arrays = dict(f)
+
+    version = str(arrays['version'])
+    if version != CLUSTERS_VERSION:
+        raise ValueError('Incorrect clusters file version {0}'.format(version))
+
+    if thresholds is not None and (
+            'thresholds' not in arrays or
+            not np.array_equal(arrays['thresholds'],
+                               np.asarray(thresholds, dtype=float))):
+        raise ValueError('The clusters were computed with other thresholds.')
+    if nb_pts is not None and (
+            'nb_pts' not in arrays or int(arrays['nb_pts']) != nb_pts):
+        raise ValueError('The clusters were computed with another number of '
+                         'points.')
+    if streamlines is not None:
+        # The number of streamlines is checked first as it is free
+        if ('streamlines_hash' not in arrays or
+                int(arrays['nb_streamlines']) != len(streamlines) or
+                str(arrays['streamlines_hash']) !=
+                streamlines_hash(streamlines)):
+            raise ValueError('The clusters were computed on other '
+                             'streamlines.')
+
+    centroid_splits = np.cumsum(arrays['centroid_lengths'])[:-1]
+    index_splits = np.cumsum(arrays['cluster_sizes'])[:-1]
+    cluster_map = ClusterMapCentroid()
+    if len(arrays['cluster_sizes']):
+        for i, (centroid, indices) in enumerate(zip(
+                np.split(arrays['centroids'], centroid_splits),
+                np.split(arrays['indices'], index_splits))):
+            cluster_map.add_cluster(ClusterCentroid(
+                centroid, id=i, indices=indices.tolist()))
+    cluster_map.refdata = streamlines
+    return cluster_map
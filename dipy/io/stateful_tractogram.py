@@ -19,6 +19,10 @@ from dipy.io.utils import (get_reference_info,
 logger = logging.getLogger('StatefulTractogram')
 logger.setLevel(level=logging.INFO)
 
+# Number of points transformed at once when the streamlines are not
+# transformed in place.
+CHUNK_SIZE = 2 ** 20
+
 
 def set_sft_logger_level(log_level):
     """ Change the logger of the StatefulTractogram
@@ -45,11 +49,74 @@ class Origin(enum.Enum):
     TRACKVIS = 'corner'
 
 
+def _iter_transformed_points(points, affine, chunk_size=CHUNK_SIZE):
+    """ Iterate over chunks of points transformed by an affine.
+
+    Parameters
+    ----------
+    points : ndarray (N, 3)
+        The points to transform, left untouched.
+    affine : ndarray (4, 4)
+        The affine transformation.
+    chunk_size : int, optional
+        Number of points transformed at once.
+
+    Yields
+    ------
+    start : int
+        Index of the first point of the chunk.
+    chunk : ndarray (M, 3)
+        The transformed points, in float64.
+    """
+    rzs = affine[:3, :3].T
+    trans = affine[:3, 3]
+    for start in range(0, len(points), chunk_size):
+        chunk = np.dot(points[start:start + chunk_size], rzs)
+        chunk += trans
+        yield start, chunk
+
+
+def _transform_points(points, affine, chunk_size=CHUNK_SIZE):
+    """ Transform points in place, keeping their dtype.
+
+    Parameters
+    ----------
+    points : ndarray (N, 3)
+        The points to transform.
+    affine : ndarray (4, 4)
+        The affine transformation.
+    chunk_size : int, optional
+        Number of points transformed at once.
+    """
+    for start, chunk in _iter_transformed_points(points, affine, chunk_size):
+        points[start:start + len(chunk)] = chunk
+
+
+def _points_bounds(points, affine=None, chunk_size=CHUNK_SIZE):
+    """ Minimum and maximum coordinates of points, optionally transformed
+    by an affine without modifying them """
+    if affine is None:
+        return np.min(points, axis=0), np.max(points, axis=0)
+
+    bbox_min = np.full(3, np.inf)
+    bbox_max = np.full(3, -np.inf)
+    for _, chunk in _iter_transformed_points(points, affine, chunk_size):
+        bbox_min = np.minimum(bbox_min, np.min(chunk, axis=0))
+        bbox_max = np.maximum(bbox_max, np.max(chunk, axis=0))
+    return bbox_min, bbox_max
+
+
 class StatefulTractogram:
     """ Class for stateful representation of collections of streamlines
     Object designed to be identical no matter the file format
     (trk, tck, vtk, fib, dpy). Facilitate transformation between space and
     data manipulation for each streamline / point.
+
+    Changes of space and origin are composed into a single affine, applied
+    in place once the streamlines are accessed. Once the streamlines have
+    been handed out by the `streamlines` property, the changes are applied
+    right away so that the returned object always follows the state. The
+    positions keep their dtype.
     """
 
     def __init__(self, streamlines, reference, space,
@@ -130,7 +197,6 @@ class StatefulTractogram:
 
         (self._affine, self._dimensions,
          self._voxel_sizes, self._voxel_order) = space_attributes
-        self._inv_affine = np.linalg.inv(self._affine).astype(np.float32)
 
         if space not in Space:
             raise ValueError('Space MUST be from Space enum, e.g Space.VOX.')
@@ -141,6 +207,13 @@ class StatefulTractogram:
                              'e.g Origin.NIFTI.')
         self._origin = origin
 
+        # Affine from the stored points to the current space and origin,
+        # None if the stored points are already in this space and origin.
+        self._pending_affine = None
+        # Whether the streamlines object was handed out, in which case the
+        # changes of space and origin are no longer deferred.
+        self._streamlines_shared = False
+
         logger.debug(self)
 
     @staticmethod
@@ -234,7 +307,7 @@ class StatefulTractogram:
         if isinstance(key, int):
             key = [key]
 
-        return self.from_sft(self.streamlines[key], self,
+        return self.from_sft(self._current_streamlines()[key], self,
                              data_per_point=self.data_per_point[key],
                              data_per_streamline=self.data_per_streamline[key])
 
@@ -243,9 +316,10 @@ class StatefulTractogram:
         if not self.are_compatible(self, other):
             return False
 
-        streamlines_equal = np.allclose(self.streamlines.get_data(),
-                                        other.streamlines.get_data(),
-                                        rtol=1e-3)
+        streamlines_equal = np.allclose(
+            self._current_streamlines().get_data(),
+            other._current_streamlines().get_data(),
+            rtol=1e-3)
         if not streamlines_equal:
             return False
 
@@ -283,8 +357,8 @@ class StatefulTractogram:
                              'data_per_point and data_per_streamline keys are '
                              'the same.')
 
-        streamlines = self.streamlines.copy()
-        streamlines.extend(other_sft.streamlines)
+        streamlines = self._current_streamlines().copy()
+        streamlines.extend(other_sft._current_streamlines())
 
         data_per_point = deepcopy(self.data_per_point)
         data_per_point.extend(other_sft.data_per_point)
@@ -304,8 +378,8 @@ class StatefulTractogram:
     def dtype_dict(self):
         """ Getter for dtype_dict """
 
-        dtype_dict = {'positions': self.streamlines._data.dtype,
-                      'offsets': self.streamlines._offsets.dtype}
+        dtype_dict = {'positions': self._tractogram.streamlines._data.dtype,
+                      'offsets': self._tractogram.streamlines._offsets.dtype}
         if self.data_per_point is not None:
             dtype_dict['dpp'] = {}
             for key in self.data_per_point.keys():
@@ -356,8 +430,14 @@ class StatefulTractogram:
 
     @property
     def streamlines(self):
-        """ Partially safe getter for streamlines """
-        return self._tractogram.streamlines
+        """ Partially safe getter for streamlines
+
+        The returned object is transformed in place by the following changes
+        of space and origin (e.g. `to_vox`), use `get_streamlines_copy` to
+        get streamlines independent of the state.
+        """
+        self._streamlines_shared = True
+        return self._current_streamlines()
 
     @dtype_dict.setter
     def dtype_dict(self, dtype_dict):
@@ -369,11 +449,12 @@ class StatefulTractogram:
             Dictionary containing the desired datatype for positions, offsets
             and all dpp and dps keys. (To use with TRX file format):
         """
+        streamlines = self._tractogram.streamlines
         if 'offsets' in dtype_dict:
-            self.streamlines._offsets = self.streamlines._offsets.astype(
+            streamlines._offsets = streamlines._offsets.astype(
                 dtype_dict['offsets'])
         if 'positions' in dtype_dict:
-            self.streamlines._data = self.streamlines._data.astype(
+            streamlines._data = streamlines._data.astype(
                 dtype_dict['positions'])
 
         if 'dpp' not in dtype_dict:
@@ -393,9 +474,49 @@ class StatefulTractogram:
                 self.data_per_streamline[key] = \
                     self.data_per_streamline[key].astype(dtype_to_use)
 
-    def get_streamlines_copy(self):
-        """ Safe getter for streamlines (for slicing) """
-        return self._tractogram.streamlines.copy()
+    def get_streamlines_copy(self, space=None, origin=None):
+        """ Safe getter for streamlines (for slicing)
+
+        Parameters
+        ----------
+        space : Enum (dipy.io.stateful_tractogram.Space), optional
+            Space of the copied streamlines, the current space by default.
+        origin : Enum (dipy.io.stateful_tractogram.Origin), optional
+            Origin of the copied streamlines, the current origin by default.
+
+        Returns
+        -------
+        streamlines : ArraySequence
+            Copy of the streamlines. The state of the tractogram is left
+            unchanged, the points being transformed while they are copied.
+        """
+        space = self._space if space is None else space
+        origin = self._origin if origin is None else origin
+        if space not in Space:
+            raise ValueError('Space MUST be from Space enum, e.g Space.VOX.')
+        if origin not in Origin:
+            raise ValueError('Origin MUST be from Origin enum, '
+                             'e.g Origin.NIFTI.')
+
+        affine = self._stored_to(space, origin)
+        streamlines = self._tractogram.streamlines
+        if affine is None or streamlines.is_sliced_view or \
+                streamlines._data.size == 0:
+            streamlines = streamlines.copy()
+            if affine is not None and streamlines._data.size > 0:
+                _transform_points(streamlines._data, affine)
+            return streamlines
+
+        data = np.empty_like(streamlines._data)
+        for start, chunk in _iter_transformed_points(streamlines._data,
+                                                     affine):
+            data[start:start + len(chunk)] = chunk
+
+        new_streamlines = Streamlines()
+        new_streamlines._data = data
+        new_streamlines._offsets = streamlines._offsets.copy()
+        new_streamlines._lengths = streamlines._lengths.copy()
+        return new_streamlines
 
     @streamlines.setter
     def streamlines(self, streamlines):
@@ -409,6 +530,9 @@ class StatefulTractogram:
         if isinstance(streamlines, Streamlines):
             streamlines = streamlines.copy()
         self._tractogram._streamlines = Streamlines(streamlines)
+        # The new streamlines are in the current space and origin
+        self._pending_affine = None
+        self._streamlines_shared = False
         self.data_per_point = self.data_per_point
         self.data_per_streamline = self.data_per_streamline
         logger.warning('Streamlines has been modified.')
@@ -460,24 +584,15 @@ class StatefulTractogram:
 
     def to_vox(self):
         """ Safe function to transform streamlines and update state """
-        if self._space == Space.VOXMM:
-            self._voxmm_to_vox()
-        elif self._space == Space.RASMM:
-            self._rasmm_to_vox()
+        self._move_to(Space.VOX, self._origin)
 
     def to_voxmm(self):
         """ Safe function to transform streamlines and update state """
-        if self._space == Space.VOX:
-            self._vox_to_voxmm()
-        elif self._space == Space.RASMM:
-            self._rasmm_to_voxmm()
+        self._move_to(Space.VOXMM, self._origin)
 
     def to_rasmm(self):
         """ Safe function to transform streamlines and update state """
-        if self._space == Space.VOX:
-            self._vox_to_rasmm()
-        elif self._space == Space.VOXMM:
-            self._voxmm_to_rasmm()
+        self._move_to(Space.RASMM, self._origin)
 
     def to_space(self, target_space):
         """ Safe function to transform streamlines to a particular space using
@@ -506,14 +621,12 @@ class StatefulTractogram:
     def to_center(self):
         """ Safe function to shift streamlines so the center of voxel is
         the origin """
-        if self._origin == Origin.TRACKVIS:
-            self._shift_voxel_origin()
+        self._move_to(self._space, Origin.NIFTI)
 
     def to_corner(self):
         """ Safe function to shift streamlines so the corner of voxel is
         the origin """
-        if self._origin == Origin.NIFTI:
-            self._shift_voxel_origin()
+        self._move_to(self._space, Origin.TRACKVIS)
 
     def compute_bounding_box(self):
         """ Compute the bounding box of the streamlines in their current state
@@ -523,9 +636,9 @@ class StatefulTractogram:
         output : ndarray
             8 corners of the XYZ aligned box, all zeros if no streamlines
         """
-        if self._tractogram.streamlines._data.size > 0:
-            bbox_min = np.min(self._tractogram.streamlines._data, axis=0)
-            bbox_max = np.max(self._tractogram.streamlines._data, axis=0)
+        data = self._tractogram.streamlines._data
+        if data.size > 0:
+            bbox_min, bbox_max = _points_bounds(data, self._pending_affine)
             return np.asarray(list(product(*zip(bbox_min, bbox_max))))
 
         return np.zeros((8, 3))
@@ -540,16 +653,15 @@ class StatefulTractogram:
         output : bool
             Are the streamlines within the volume of the associated reference
         """
-        if not self.streamlines:
+        if not self._tractogram.streamlines:
             return True
 
-        old_space = deepcopy(self.space)
-        old_origin = deepcopy(self.origin)
-
-        # Do to rotation, equivalent of a OBB must be done
-        self.to_vox()
-        self.to_corner()
-        bbox_corners = deepcopy(self.compute_bounding_box())
+        # Do to rotation, equivalent of a OBB must be done. The bounds are
+        # computed in voxel space without transforming the streamlines.
+        bbox_min, bbox_max = _points_bounds(
+            self._tractogram.streamlines._data,
+            self._stored_to(Space.VOX, Origin.TRACKVIS))
+        bbox_corners = np.asarray(list(product(*zip(bbox_min, bbox_max))))
 
         is_valid = True
         if np.any(bbox_corners < 0):
@@ -564,9 +676,6 @@ class StatefulTractogram:
             logger.debug(bbox_corners)
             is_valid = False
 
-        self.to_space(old_space)
-        self.to_origin(old_origin)
-
         return is_valid
 
     def remove_invalid_streamlines(self, epsilon=1e-3):
@@ -586,7 +695,7 @@ class StatefulTractogram:
         output : tuple
             Tuple of two list, indices_to_remove, indices_to_keep
         """
-        if not self.streamlines:
+        if not self._tractogram.streamlines:
             return
 
         old_space = deepcopy(self.space)
@@ -594,6 +703,7 @@ class StatefulTractogram:
 
         self.to_vox()
         self.to_corner()
+        self._apply_pending_affine()
 
         min_condition = np.min(self._tractogram.streamlines._data,
                                axis=1) < epsilon
@@ -613,7 +723,7 @@ class StatefulTractogram:
             np.setdiff1d(np.arange(len(self._tractogram)),
                          np.array(indices_to_remove)).astype(int))
 
-        tmp_streamlines = self.streamlines[indices_to_keep]
+        tmp_streamlines = self._tractogram.streamlines[indices_to_keep]
         tmp_dpp = self._tractogram.data_per_point[indices_to_keep]
         tmp_dps = self._tractogram.data_per_streamline[indices_to_keep]
 
@@ -624,6 +734,7 @@ class StatefulTractogram:
                                       data_per_point=tmp_dpp,
                                       data_per_streamline=tmp_dps,
                                       affine_to_rasmm=np.eye(4))
+        self._streamlines_shared = False
 
         self.to_space(old_space)
         self.to_origin(old_origin)
@@ -638,94 +749,74 @@ class StatefulTractogram:
         """ Safe getter for the number of streamlines """
         return self._tractogram.streamlines.total_nb_rows
 
-    def _vox_to_voxmm(self):
-        """ Unsafe function to transform streamlines """
-        if self._space == Space.VOX:
-            if self._tractogram.streamlines._data.size > 0:
-                self._tractogram.streamlines._data *= np.asarray(
-                    self._voxel_sizes)
-            self._space = Space.VOXMM
-            logger.debug('Moved streamlines from vox to voxmm.')
+    def _space_origin_to_vox(self, space, origin):
+        """ Affine from coordinates in a space and origin to voxel
+        coordinates with the origin at the center of voxel """
+        if space == Space.VOX:
+            affine = np.eye(4)
+        elif space == Space.VOXMM:
+            affine = np.diag(np.append(1. / np.asarray(self._voxel_sizes,
+                                                       dtype=float), 1.))
         else:
-            logger.warning('Wrong initial space for this function.')
-
-    def _voxmm_to_vox(self):
-        """ Unsafe function to transform streamlines """
-        if self._space == Space.VOXMM:
-            if self._tractogram.streamlines._data.size > 0:
-                self._tractogram.streamlines._data /= np.asarray(
-                    self._voxel_sizes)
-            self._space = Space.VOX
-            logger.debug('Moved streamlines from voxmm to vox.')
-        else:
-            logger.warning('Wrong initial space for this function.')
-
-    def _vox_to_rasmm(self):
-        """ Unsafe function to transform streamlines """
-        if self._space == Space.VOX:
-            if self._tractogram.streamlines._data.size > 0:
-                self._tractogram.apply_affine(self._affine)
-            self._space = Space.RASMM
-            logger.debug('Moved streamlines from vox to rasmm.')
-        else:
-            logger.warning('Wrong initial space for this function.')
-
-    def _rasmm_to_vox(self):
-        """ Unsafe function to transform streamlines """
-        if self._space == Space.RASMM:
-            if self._tractogram.streamlines._data.size > 0:
-                self._tractogram.apply_affine(self._inv_affine)
-            self._space = Space.VOX
-            logger.debug('Moved streamlines from rasmm to vox.')
-        else:
-            logger.warning('Wrong initial space for this function.')
-
-    def _voxmm_to_rasmm(self):
-        """ Unsafe function to transform streamlines """
-        if self._space == Space.VOXMM:
-            if self._tractogram.streamlines._data.size > 0:
-                self._tractogram.streamlines._data /= np.asarray(
-                    self._voxel_sizes)
-                self._tractogram.apply_affine(self._affine)
-            self._space = Space.RASMM
-            logger.debug('Moved streamlines from voxmm to rasmm.')
-        else:
-            logger.warning('Wrong initial space for this function.')
-
-    def _rasmm_to_voxmm(self):
-        """ Unsafe function to transform streamlines """
-        if self._space == Space.RASMM:
-            if self._tractogram.streamlines._data.size > 0:
-                self._tractogram.apply_affine(self._inv_affine)
-                self._tractogram.streamlines._data *= np.asarray(
-                    self._voxel_sizes)
-            self._space = Space.VOXMM
-            logger.debug('Moved streamlines from rasmm to voxmm.')
-        else:
-            logger.warning('Wrong initial space for this function.')
-
-    def _shift_voxel_origin(self):
-        """ Unsafe function to switch the origin from center to corner
-        and vice versa """
-        if self.streamlines:
-            shift = np.asarray([0.5, 0.5, 0.5])
-            if self._space == Space.VOXMM:
-                shift = shift * self._voxel_sizes
-            elif self._space == Space.RASMM:
-                tmp_affine = np.eye(4)
-                tmp_affine[0:3, 0:3] = self._affine[0:3, 0:3]
-                shift = apply_affine(tmp_affine, shift)
-            if self._origin == Origin.TRACKVIS:
-                shift *= -1
-
-            self._tractogram.streamlines._data += shift
-
-        if self._origin == Origin.NIFTI:
-            logger.debug('Origin moved to the corner of voxel.')
-            self._origin = Origin.TRACKVIS
+            affine = np.linalg.inv(np.asarray(self._affine, dtype=float))
+
+        if origin == Origin.TRACKVIS:
+            affine[:3, 3] -= 0.5
+        return affine
+
+    def _stored_to(self, space, origin):
+        """ Affine from the stored points to a space and origin, None for
+        the identity """
+        affine = self._pending_affine
+        if space != self._space or origin != self._origin:
+            transfo = np.dot(
+                np.linalg.inv(self._space_origin_to_vox(space, origin)),
+                self._space_origin_to_vox(self._space, self._origin))
+            affine = transfo if affine is None else np.dot(transfo, affine)
+
+        # Round trips (e.g. to_vox followed by to_rasmm) are not applied
+        if affine is not None and np.allclose(affine, np.eye(4),
+                                              rtol=0, atol=1e-9):
+            return None
+        return affine
+
+    def _move_to(self, space, origin):
+        """ Unsafe function to update the state, the transformation of the
+        streamlines is deferred until they are accessed """
+        if space == self._space and origin == self._origin:
+            return
+
+        self._pending_affine = self._stored_to(space, origin)
+        logger.debug('Moved streamlines from %s/%s to %s/%s.',
+                     self._space.value, self._origin.value,
+                     space.value, origin.value)
+        self._space = space
+        self._origin = origin
+        if self._streamlines_shared:
+            self._apply_pending_affine()
+
+    def _apply_pending_affine(self):
+        """ Unsafe function to transform the stored streamlines to the
+        current space and origin, keeping the dtype of the positions """
+        if self._pending_affine is None:
+            return
+
+        affine = self._pending_affine
+        self._pending_affine = None
+        streamlines = self._tractogram.streamlines
+        if streamlines._data.size == 0:
+            return
+        if streamlines.is_sliced_view:
+            # Only the selected streamlines are transformed
+            for i in range(len(streamlines)):
+                streamlines[i] = apply_affine(affine, streamlines[i])
         else:
-            logger.debug('Origin moved to the center of voxel.')
-            self._origin = Origin.NIFTI
+            _transform_points(streamlines._data, affine)
+
+    def _current_streamlines(self):
+        """ Unsafe getter for the streamlines in the current state """
+        self._apply_pending_affine()
+        return self._tractogram.streamlines
 
 
 def _is_data_per_point_valid(streamlines, data):
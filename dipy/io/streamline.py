@@ -1,18 +1,26 @@
-from copy import deepcopy
+import json
 import logging
 import os
+import shutil
+import tempfile
 import time
+import warnings
+import zipfile
 
 import nibabel as nib
+from nibabel.affines import apply_affine
 from nibabel.streamlines import detect_format
+from nibabel.streamlines.tck import TckFile
 from nibabel.streamlines.tractogram import Tractogram
+from nibabel.streamlines.trk import (TrkFile, encode_value_in_name,
+                                     get_affine_rasmm_to_trackvis)
 import numpy as np
 import trx.trx_file_memmap as tmm
 
 from dipy.io.stateful_tractogram import Origin, Space, StatefulTractogram
 from dipy.io.vtk import save_vtk_streamlines, load_vtk_streamlines
 from dipy.io.dpy import Dpy
-from dipy.io.utils import (create_tractogram_header,
+from dipy.io.utils import (create_tractogram_header, get_reference_info,
                            is_header_compatible)
 
 
@@ -46,18 +54,21 @@ def save_tractogram(sft, filename, bbox_valid_check=True):
                          'the function remove_invalid_streamlines to discard '
                          'invalid streamlines.')
 
-    old_space = deepcopy(sft.space)
-    old_origin = deepcopy(sft.origin)
-
-    sft.to_rasmm()
-    sft.to_center()
+    # The files are written in RASMM with the origin at the center of voxel.
+    # Otherwise the streamlines are transformed while being copied, so that
+    # the state of `sft` is left untouched.
+    if sft.space == Space.RASMM and sft.origin == Origin.NIFTI:
+        streamlines = sft._current_streamlines()
+    else:
+        streamlines = sft.get_streamlines_copy(space=Space.RASMM,
+                                               origin=Origin.NIFTI)
 
     timer = time.time()
     if extension in ['.trk', '.tck']:
         tractogram_type = detect_format(filename)
         header = create_tractogram_header(tractogram_type,
                                           *sft.space_attributes)
-        new_tractogram = Tractogram(sft.streamlines,
+        new_tractogram = Tractogram(streamlines,
                                     affine_to_rasmm=np.eye(4))
 
         if extension == '.trk':
@@ -69,22 +80,24 @@ def save_tractogram(sft, filename, bbox_valid_check=True):
 
     elif extension in ['.vtk', '.vtp', '.fib']:
         binary = extension in ['.vtk', '.fib']
-        save_vtk_streamlines(sft.streamlines, filename, binary=binary)
+        save_vtk_streamlines(streamlines, filename, binary=binary)
     elif extension in ['.dpy']:
         dpy_obj = Dpy(filename, mode='w')
-        dpy_obj.write_tracks(sft.streamlines)
+        dpy_obj.write_tracks(streamlines)
         dpy_obj.close()
     elif extension in ['.trx']:
-        trx = tmm.TrxFile.from_sft(sft)
+        rasmm_sft = StatefulTractogram(
+            streamlines, sft.space_attributes, Space.RASMM,
+            origin=Origin.NIFTI, data_per_point=sft.data_per_point,
+            data_per_streamline=sft.data_per_streamline)
+        rasmm_sft.dtype_dict = sft.dtype_dict
+        trx = tmm.TrxFile.from_sft(rasmm_sft)
         tmm.save(trx, filename)
         trx.close()
 
     logging.debug('Save %s with %s streamlines in %s seconds.',
                   filename, len(sft), round(time.time() - timer, 3))
 
-    sft.to_space(old_space)
-    sft.to_origin(old_origin)
-
     return True
 
 
@@ -186,6 +199,309 @@ def load_tractogram(filename, reference, to_space=Space.RASMM,
     return sft
 
 
+class _TrkStream:
+    """Append streamlines to a TRK file, patching its header on close."""
+
+    def __init__(self, filename, space_attributes):
+        header = create_tractogram_header(TrkFile, *space_attributes)
+        self.header = TrkFile._default_structarr(endianness='little')
+        for k, v in header.items():
+            if k in self.header.dtype.names:
+                self.header[k] = v
+        if self.header[nib.streamlines.Field.VOXEL_ORDER] == b'':
+            self.header[nib.streamlines.Field.VOXEL_ORDER] = b'LPS'
+        self.affine = get_affine_rasmm_to_trackvis(self.header)
+        self.file = open(filename, 'wb')
+        self.file.write(self.header.tobytes())
+
+    def set_data_per_streamline(self, shapes):
+        if len(shapes) > len(self.header['property_name']):
+            raise ValueError('Can only store {0} data_per_streamline in the '
+                             'TRK format.'
+                             .format(len(self.header['property_name'])))
+        for i, (name, size) in enumerate(shapes.items()):
+            self.header['property_name'][i] = encode_value_in_name(size,
+                                                                   name)
+        self.header[nib.streamlines.Field.NB_PROPERTIES_PER_STREAMLINE] = \
+            sum(shapes.values())
+
+    def write(self, points, lengths, data_per_streamline):
+        # Each record is the number of points, the points and the properties
+        properties = np.concatenate(
+            [np.zeros((len(lengths), 0))] + list(data_per_streamline.values()),
+            axis=1)
+        nb_properties = properties.shape[1]
+        sizes = 1 + 3 * lengths + nb_properties
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        first_points = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+        record = np.empty(sizes.sum(), dtype='<f4')
+        record.view('<i4')[starts] = lengths
+        idx = np.repeat(starts + 1 - 3 * first_points, 3 * lengths)
+        record[idx + np.arange(3 * len(points))] = \
+            apply_affine(self.affine, points).ravel()
+        if nb_properties:
+            idx = ((starts + 1 + 3 * lengths)[:, None] +
+                   np.arange(nb_properties))
+            record[idx] = properties
+        self.file.write(record.tobytes())
+
+    def close(self, nb_streamlines, nb_points):
+        self.header[nib.streamlines.Field.NB_STREAMLINES] = nb_streamlines
+        self.file.seek(0, os.SEEK_SET)
+        self.file.write(self.header.tobytes())
+        self.file.close()
+
+
+class _TckStream:
+    """Append streamlines to a TCK file, patching its header on close."""
+
+    def __init__(self, filename, space_attributes):
+        self.header = create_tractogram_header(TckFile, *space_attributes)
+        self.file = open(filename, 'wb')
+        TckFile._write_header(self.file, self.header)
+
+    def set_data_per_streamline(self, shapes):
+        if shapes:
+            warnings.warn('TCK format does not support saving additional '
+                          'data alongside streamlines. Dropping: {0}'
+                          .format(', '.join(shapes)))
+
+    def write(self, points, lengths, data_per_streamline):
+        # Streamlines are separated by a row of NaN
+        data = np.full((len(points) + len(lengths), 3), np.nan, dtype='<f4')
+        rows = np.arange(len(points)) + np.repeat(np.arange(len(lengths)),
+                                                  lengths)
+        data[rows] = points
+        self.file.write(data.tobytes())
+
+    def close(self, nb_streamlines, nb_points):
+        self.file.write(TckFile.EOF_DELIMITER.astype('<f4').tobytes())
+        # The count is zero padded, so the size of the header is unchanged
+        self.header[nib.streamlines.Field.NB_STREAMLINES] = nb_streamlines
+        self.file.seek(0, os.SEEK_SET)
+        TckFile._write_header(self.file, self.header)
+        self.file.close()
+
+
+class _TrxStream:
+    """Append streamlines to the arrays of an uncompressed TRX directory,
+    zipped into the TRX file on close."""
+
+    def __init__(self, filename, space_attributes):
+        self.filename = filename
+        self.affine, self.dimensions = space_attributes[:2]
+        self.folder = tempfile.mkdtemp(
+            prefix='.trx_', dir=os.path.dirname(os.path.abspath(filename)))
+        self.positions = open(os.path.join(self.folder,
+                                           'positions.3.float32'), 'wb')
+        self.offsets = open(os.path.join(self.folder, 'offsets.uint64'), 'wb')
+        self.dps = {}
+        self.nb_points = 0
+
+    def set_data_per_streamline(self, shapes):
+        if shapes:
+            os.mkdir(os.path.join(self.folder, 'dps'))
+        for name, size in shapes.items():
+            fname = os.path.join(self.folder, 'dps',
+                                 '{0}.{1}.float32'.format(name, size))
+            self.dps[name] = open(fname, 'wb')
+
+    def write(self, points, lengths, data_per_streamline):
+        offsets = self.nb_points + np.concatenate([[0],
+                                                   np.cumsum(lengths)[:-1]])
+        self.nb_points += len(points)
+        self.offsets.write(offsets.astype('<u8').tobytes())
+        self.positions.write(np.asarray(points, dtype='<f4').tobytes())
+        for name, values in data_per_streamline.items():
+            self.dps[name].write(np.asarray(values, dtype='<f4').tobytes())
+
+    def close(self, nb_streamlines, nb_points):
+        try:
+            self.offsets.write(np.array([nb_points], dtype='<u8').tobytes())
+            for f in [self.positions, self.offsets] + list(self.dps.values()):
+                f.close()
+            header = {'DIMENSIONS': np.asarray(self.dimensions).tolist(),
+                      'VOXEL_TO_RASMM': np.asarray(self.affine).tolist(),
+                      'NB_VERTICES': int(nb_points),
+                      'NB_STREAMLINES': int(nb_streamlines)}
+            with open(os.path.join(self.folder, 'header.json'), 'w') as f:
+                json.dump(header, f)
+            tmm.zip_from_folder(self.folder, self.filename,
+                                zipfile.ZIP_STORED)
+        finally:
+            shutil.rmtree(self.folder, ignore_errors=True)
+
+
+_STREAMS = {'.trk': _TrkStream, '.tck': _TckStream, '.trx': _TrxStream}
+
+
+class StreamingTractogramWriter:
+    """Write a tractogram to disk incrementally.
+
+    Streamlines are buffered and appended to the file by chunks, and the
+    header is patched with the number of streamlines when the writer is
+    closed, so that the memory used does not depend on the size of the
+    tractogram. This is meant to save the output of a tracking generator
+    (see `save_streamlines_generator`).
+
+    Parameters
+    ----------
+    filename : string
+        Filename with a .trk, .tck or .trx extension.
+    reference : Nifti or Trk filename, Nifti1Image or TrkFile, Nifti1Header,
+        trk.header (dict) or StatefulTractogram
+        Reference that provides the spatial attribute.
+    chunk_size : int, optional
+        Number of streamlines buffered before they are written to disk.
+
+    Notes
+    -----
+    The streamlines and their data_per_streamline must be in RASMM space,
+    with the center of the voxels as origin, as returned by `LocalTracking`
+    with the affine of the reference. The data_per_streamline (e.g. seeds)
+    are saved in TRK and TRX files and dropped from TCK files.
+
+    TRX files are written as an uncompressed directory next to `filename`,
+    which is then stored into the TRX archive on close.
+
+    Examples
+    --------
+    >>> with StreamingTractogramWriter('tractogram.trk', 'fa.nii.gz') as w:
+    ...     for streamline in tracking_result:      # doctest: +SKIP
+    ...         w.append(streamline)
+    """
+
+    def __init__(self, filename, reference, chunk_size=10000):
+        _, extension = os.path.splitext(filename)
+        if extension not in _STREAMS:
+            raise TypeError('Streaming is only supported for the trk, tck '
+                            'and trx formats.')
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+        if isinstance(reference, StatefulTractogram):
+            space_attributes = reference.space_attributes
+        else:
+            space_attributes = get_reference_info(reference)
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.nb_streamlines = 0
+        self.nb_points = 0
+        self._stream = _STREAMS[extension](filename, space_attributes)
+        self._streamlines = []
+        self._data = None
+        self._closed = False
+
+    def append(self, streamline, data_for_streamline=None):
+        """Add one streamline.
+
+        Parameters
+        ----------
+        streamline : ndarray (N, 3)
+            Points of the streamline.
+        data_for_streamline : dict, optional
+            Values of the data_per_streamline of the streamline. Every
+            streamline must have the same keys, with values of the same size.
+        """
+        data_for_streamline = data_for_streamline or {}
+        if self._data is None:
+            self._data = {k: [] for k in sorted(data_for_streamline)}
+            self._stream.set_data_per_streamline(
+                {k: np.size(v) for k, v in data_for_streamline.items()})
+        if data_for_streamline.keys() != self._data.keys():
+            raise ValueError('All the streamlines must have the same '
+                             'data_per_streamline keys.')
+        self._streamlines.append(np.asarray(streamline).reshape(-1, 3))
+        for k, values in self._data.items():
+            values.append(np.ravel(data_for_streamline[k]))
+        if len(self._streamlines) >= self.chunk_size:
+            self.flush()
+
+    def extend(self, streamlines, data_per_streamline=None):
+        """Add many streamlines.
+
+        Parameters
+        ----------
+        streamlines : iterable of ndarray (N, 3)
+            Points of the streamlines.
+        data_per_streamline : dict, optional
+            Arrays of values of each streamline, indexed along the first axis.
+        """
+        data_per_streamline = data_per_streamline or {}
+        for i, streamline in enumerate(streamlines):
+            self.append(streamline,
+                        {k: v[i] for k, v in data_per_streamline.items()})
+
+    def flush(self):
+        """Write the buffered streamlines to disk."""
+        if not self._streamlines:
+            return
+        lengths = np.array([len(s) for s in self._streamlines])
+        points = np.concatenate(self._streamlines)
+        data = {k: np.asarray(v, dtype=np.float32)
+                for k, v in self._data.items()}
+        self._stream.write(points, lengths, data)
+        self.nb_streamlines += len(lengths)
+        self.nb_points += len(points)
+        self._streamlines = []
+        for values in self._data.values():
+            values.clear()
+
+    def close(self):
+        """Write the remaining streamlines and finalize the header."""
+        if self._closed:
+            return
+        if self._data is None:
+            self._stream.set_data_per_streamline({})
+        self.flush()
+        self._stream.close(self.nb_streamlines, self.nb_points)
+        self._closed = True
+        logging.debug('Save %s with %s streamlines.', self.filename,
+                      self.nb_streamlines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_streamlines_generator(streamlines, filename, reference,
+                               save_seeds=False, chunk_size=10000):
+    """Save the streamlines of a generator without holding them in memory.
+
+    Parameters
+    ----------
+    streamlines : iterable
+        Streamlines in RASMM space, e.g. a `LocalTracking` or
+        `ParticleFilteringTracking` generator. If `save_seeds` is True, the
+        items are ``(streamline, seed)`` tuples.
+    filename : string
+        Filename with a .trk, .tck or .trx extension.
+    reference : Nifti or Trk filename, Nifti1Image or TrkFile, Nifti1Header,
+        trk.header (dict) or StatefulTractogram
+        Reference that provides the spatial attribute.
+    save_seeds : bool, optional
+        If True, save the seeds in the 'seeds' data_per_streamline.
+    chunk_size : int, optional
+        Number of streamlines buffered before they are written to disk.
+
+    Returns
+    -------
+    nb_streamlines : int
+        Number of streamlines saved.
+    """
+    with StreamingTractogramWriter(filename, reference,
+                                   chunk_size=chunk_size) as writer:
+        for item in streamlines:
+            if save_seeds:
+                streamline, seed = item
+                writer.append(streamline, {'seeds': seed})
+            else:
+                writer.append(item)
+    return writer.nb_streamlines
+
+
 def load_generator(ttype):
     """ Generate a loading function that performs a file extension
     check to restrict the user to a single file format.
@@ -0,0 +1,78 @@
+from os.path import join as pjoin
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import numpy.testing as npt
+
+from dipy.io.clusters import (load_cluster_map, save_cluster_map,
+                              streamlines_hash)
+from dipy.segment.clustering import ClusterMapCentroid, qbx_and_merge
+from dipy.testing.decorators import set_random_number_generator
+from dipy.tracking.streamline import Streamlines
+
+
+@set_random_number_generator()
+def test_io_cluster_map(rng):
+    streamlines = Streamlines([rng.random((rng.integers(5, 20), 3)) * 50
+                               for _ in range(100)])
+    cluster_map = qbx_and_merge(streamlines, [40, 20, 10], nb_pts=12,
+                                rng=rng)
+
+    with TemporaryDirectory() as tmpdir:
+        fname = pjoin(tmpdir, 'clusters.npz')
+        save_cluster_map(fname, cluster_map, streamlines,
+                         thresholds=[40, 20, 10], nb_pts=12)
+
+        loaded = load_cluster_map(fname, streamlines,
+                                  thresholds=[40, 20, 10], nb_pts=12)
+        npt.assert_equal(len(loaded), len(cluster_map))
+        npt.assert_(loaded == cluster_map)
+        npt.assert_array_equal(loaded.centroids, cluster_map.centroids)
+        npt.assert_(loaded.refdata is streamlines)
+        npt.assert_array_equal(loaded[0][0], cluster_map[0][0])
+
+        other = streamlines.copy()
+        other._data[0, 0] += 1
+        npt.assert_raises(ValueError, load_cluster_map, fname, other)
+        npt.assert_raises(ValueError, load_cluster_map, fname, streamlines[1:])
+        npt.assert_raises(ValueError, load_cluster_map, fname,
+                          thresholds=[40, 20, 5])
+        npt.assert_raises(ValueError, load_cluster_map, fname, nb_pts=20)
+
+        # Files of other versions are rejected
+        with np.load(fname) as f:
+            arrays = dict(f)
+        arrays['version'] = np.array('0.0.0')
+        with open(fname, 'wb') as f:
+            np.savez(f, **arrays)
+        npt.assert_raises(ValueError, load_cluster_map, fname)
+        save_cluster_map(fname, cluster_map, streamlines,
+                         thresholds=[40, 20, 10], nb_pts=12)
+
+        # Without the streamlines, only the indices are available
+        loaded = load_cluster_map(fname)
+        npt.assert_equal(list(loaded[0]), cluster_map[0].indices)
+
+        # Nothing can be checked when nothing was saved
+        save_cluster_map(fname, cluster_map)
+        npt.assert_raises(ValueError, load_cluster_map, fname, streamlines)
+        npt.assert_raises(ValueError, load_cluster_map, fname, nb_pts=12)
+
+        fname = pjoin(tmpdir, 'empty.npz')
+        save_cluster_map(fname, ClusterMapCentroid())
+        npt.assert_equal(len(load_cluster_map(fname)), 0)
+
+
+@set_random_number_generator()
+def test_streamlines_hash(rng):
+    streamlines = Streamlines([rng.random((rng.integers(2, 10), 3))
+                               for _ in range(20)])
+    digest = streamlines_hash(streamlines)
+    npt.assert_equal(digest, streamlines_hash(list(streamlines)))
+    npt.assert_equal(digest, streamlines_hash(streamlines, chunk_size=7))
+    npt.assert_equal(digest, streamlines_hash(streamlines.copy()))
+
+    # The split of the points into streamlines is part of the content
+    moved = Streamlines([np.concatenate(streamlines[:2])] +
+                        list(streamlines[2:]))
+    npt.assert_(streamlines_hash(moved) != digest)
@@ -1001,6 +1001,98 @@ def test_slicing_dtype_dict_attributes():
         assert_(False, msg='Slicing should not modify the dtype_dict.')
 
 
+def test_get_streamlines_copy_space():
+    sft = load_tractogram(filepath_dix['gs.trk'], filepath_dix['gs.nii'])
+    tmp_points_vox = np.loadtxt(filepath_dix['gs_vox_space.txt'])
+    tmp_points_rasmm = np.loadtxt(filepath_dix['gs_rasmm_space.txt'])
+
+    streamlines = sft.get_streamlines_copy(space=Space.VOX)
+    assert_allclose(streamlines.get_data(), tmp_points_vox,
+                    atol=1e-3, rtol=1e-6)
+    # The state and the streamlines are left untouched
+    assert_(sft.space == Space.RASMM and sft.origin == Origin.NIFTI)
+    assert_allclose(sft.streamlines.get_data(), tmp_points_rasmm,
+                    atol=1e-3, rtol=1e-6)
+
+    sft.to_vox()
+    sft.to_corner()
+    streamlines = sft.get_streamlines_copy(space=Space.RASMM,
+                                           origin=Origin.NIFTI)
+    assert_allclose(streamlines.get_data(), tmp_points_rasmm,
+                    atol=1e-3, rtol=1e-6)
+    assert_allclose(sft.streamlines.get_data(), tmp_points_vox + 0.5,
+                    atol=1e-3, rtol=1e-6)
+
+
+def test_space_round_trip():
+    sft = load_tractogram(filepath_dix['gs.trk'], filepath_dix['gs.nii'])
+    points = sft.get_streamlines_copy().get_data()
+
+    sft.to_vox()
+    sft.to_corner()
+    sft.to_voxmm()
+    assert_(sft.is_bbox_in_vox_valid())
+    sft.to_rasmm()
+    sft.to_center()
+    # Round trips are not applied to the streamlines
+    assert_array_equal(sft.streamlines.get_data(), points)
+
+
+def test_save_tractogram_keeps_state():
+    sft = load_tractogram(filepath_dix['gs.trk'], filepath_dix['gs.nii'],
+                          to_space=Space.VOX, to_origin=Origin.TRACKVIS)
+    streamlines = sft.streamlines
+    points = streamlines.get_data().copy()
+
+    with TemporaryDirectory() as tmp_dir:
+        for ext in ['.trk', '.tck', '.trx', '.dpy']:
+            filename = pjoin(tmp_dir, 'gs_vox' + ext)
+            save_tractogram(sft, filename)
+            assert_(sft.space == Space.VOX and sft.origin == Origin.TRACKVIS)
+            assert_array_equal(streamlines.get_data(), points)
+
+            reference = 'same' if ext in ['.trk', '.trx'] \
+                else filepath_dix['gs.nii']
+            loaded_sft = load_tractogram(filename, reference,
+                                         to_space=Space.VOX,
+                                         to_origin=Origin.TRACKVIS)
+            assert_allclose(loaded_sft.streamlines.get_data(), points,
+                            atol=1e-3, rtol=1e-6)
+
+
+def test_space_change_keeps_dtype():
+    sft = load_tractogram(filepath_dix['gs.trk'], filepath_dix['gs.nii'])
+    assert_(sft.streamlines._data.dtype == np.float32)
+
+    for to_space in [sft.to_vox, sft.to_corner, sft.to_voxmm, sft.to_rasmm]:
+        to_space()
+        assert_(sft.streamlines._data.dtype == np.float32)
+        assert_(sft.dtype_dict['positions'] == np.float32)
+        assert_(sft.get_streamlines_copy(space=Space.VOX)._data.dtype ==
+                np.float32)
+
+    with TemporaryDirectory() as tmp_dir:
+        filename = pjoin(tmp_dir, 'gs_corner.trx')
+        save_tractogram(sft, filename)
+        trx = tmm.load(filename)
+        assert_(trx.streamlines._data.dtype == np.float32)
+        trx.close()
+
+
+def test_streamlines_follow_space_change():
+    sft = load_tractogram(filepath_dix['gs.trk'], filepath_dix['gs.nii'])
+    tmp_points_vox = np.loadtxt(filepath_dix['gs_vox_space.txt'])
+
+    # The streamlines handed out are transformed in place
+    streamlines = sft.streamlines
+    sft.to_vox()
+    assert_allclose(streamlines.get_data(), tmp_points_vox,
+                    atol=1e-3, rtol=1e-6)
+    sft.to_corner()
+    assert_allclose(streamlines.get_data(), tmp_points_vox + 0.5,
+                    atol=1e-3, rtol=1e-6)
+
+
 def recursive_compare(d1, d2, level='root'):
     if isinstance(d1, dict) and isinstance(d2, dict):
         if d1.keys() != d2.keys():
@@ -1,10 +1,13 @@
 import json
 import os
+import warnings
 from tempfile import TemporaryDirectory
 
 from dipy.data import fetch_gold_standard_io
 from dipy.io.streamline import (load_tractogram, save_tractogram,
-                                load_trk, save_trk)
+                                load_trk, save_trk,
+                                save_streamlines_generator,
+                                StreamingTractogramWriter)
 from dipy.io.stateful_tractogram import Space, StatefulTractogram
 from dipy.io.utils import create_nifti_header
 from dipy.io.vtk import save_vtk_streamlines, load_vtk_streamlines
@@ -209,6 +212,58 @@ def test_io_dpy():
     io_tractogram('dpy')
 
 
+@pytest.mark.parametrize('extension', ['trk', 'tck', 'trx'])
+def test_streaming_writer(extension):
+    rng = np.random.default_rng(0)
+    seeds = rng.random((len(streamlines), 3))
+    with TemporaryDirectory() as tmp_dir:
+        in_affine = np.diag([2, 1.5, 1.5, 1])
+        nii_header = create_nifti_header(in_affine, [50, 50, 50],
+                                         [2, 1.5, 1.5])
+        sft = StatefulTractogram(streamlines, nii_header, space=Space.RASMM,
+                                 data_per_streamline={'seeds': seeds})
+        fpath = os.path.join(tmp_dir, 'saved.' + extension)
+        save_tractogram(sft, fpath, bbox_valid_check=False)
+
+        # The header is patched with the count of all the chunks
+        spath = os.path.join(tmp_dir, 'streamed.' + extension)
+        with warnings.catch_warnings(record=True):
+            nb_streamlines = save_streamlines_generator(
+                zip(streamlines, seeds), spath, sft, save_seeds=True,
+                chunk_size=4)
+        npt.assert_equal(nb_streamlines, len(streamlines))
+        if extension != 'trx':
+            # Same bytes as the in-memory writer
+            with open(fpath, 'rb') as f1, open(spath, 'rb') as f2:
+                npt.assert_equal(f1.read(), f2.read())
+
+        saved = load_tractogram(fpath, nii_header, bbox_valid_check=False)
+        streamed = load_tractogram(spath, nii_header, bbox_valid_check=False)
+        npt.assert_equal(len(streamed), len(streamlines))
+        for s1, s2 in zip(saved.streamlines, streamed.streamlines):
+            npt.assert_array_almost_equal(s1, s2, decimal=4)
+        if extension != 'tck':
+            npt.assert_array_almost_equal(
+                streamed.data_per_streamline['seeds'], seeds, decimal=5)
+
+        # Empty tractogram
+        epath = os.path.join(tmp_dir, 'empty.' + extension)
+        with StreamingTractogramWriter(epath, nii_header) as writer:
+            pass
+        npt.assert_equal(writer.nb_streamlines, 0)
+        empty = load_tractogram(epath, nii_header, bbox_valid_check=False)
+        npt.assert_equal(len(empty), 0)
+
+        # Consistent data_per_streamline
+        writer = StreamingTractogramWriter(epath, nii_header)
+        writer.append(streamline, {'seeds': seeds[0]})
+        npt.assert_raises(ValueError, writer.append, streamline)
+        writer.close()
+
+    npt.assert_raises(TypeError, StreamingTractogramWriter, 'test.vtk',
+                      nii_header)
+
+
 @pytest.mark.skipif(not have_fury, reason="Requires FURY")
 def test_low_io_vtk():
     with TemporaryDirectory() as tmp_dir:
@@ -1,11 +1,344 @@
+"""Caching of the expensive matrices of reconstruction models.
+
+Cached values are looked up by the *content* of their keys: two spheres with
+the same vertices, or two gradient tables with the same b-values and
+b-vectors, share their cached matrices. Each cache keeps the most recently
+used values within a memory budget.
+
+Array values can also be persisted to a directory shared by several
+processes, runs or subjects acquired with the same protocol. The directory is
+set with :func:`set_cache_directory` or the ``DIPY_CACHE_DIR`` environment
+variable.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import sys
+import tempfile
+import weakref
+
+import numpy as np
+
+from dipy.core.gradients import GradientTable
 from dipy.core.onetime import auto_attr
+from dipy.core.sphere import Sphere
+
+# Default memory budget of a cache, in bytes.
+CACHE_MAX_BYTES = 2 ** 30
+
+_cache_directory = os.environ.get('DIPY_CACHE_DIR') or None
+
+# Digests of the spheres and gradient tables used as keys, by identity.
+_key_digests = {}
+
+
+def set_cache_directory(directory):
+    """Set the directory where cached matrices are persisted.
+
+    Parameters
+    ----------
+    directory : str or None
+        Directory shared by all the caches. It is created if it does not
+        exist. None disables the persistence.
+    """
+    global _cache_directory
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    _cache_directory = directory
+
+
+def get_cache_directory():
+    """Directory where cached matrices are persisted, or None."""
+    return _cache_directory
+
+
+def content_hash(obj):
+    """Hash of the content of an object.
+
+    Parameters
+    ----------
+    obj : object
+        Numbers, strings, arrays, spheres, gradient tables, functions,
+        containers of those, or objects whose attributes are any of those.
+
+    Returns
+    -------
+    digest : str
+        Hexadecimal digest, equal for objects with equal content.
+
+    Raises
+    ------
+    TypeError
+        If the content of `obj` cannot be hashed.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    _update_hash(h, obj, set())
+    return h.hexdigest()
+
+
+def _update_hash(h, obj, seen):
+    def update(*tokens):
+        for token in tokens:
+            h.update(token if isinstance(token, bytes) else
+                     str(token).encode())
+            h.update(b'\0')
+
+    if obj is None or isinstance(obj, (bool, int, float, complex, str)):
+        update(type(obj).__name__, repr(obj))
+    elif isinstance(obj, bytes):
+        update('bytes', obj)
+    elif isinstance(obj, (np.ndarray, np.generic)):
+        arr = np.ascontiguousarray(obj)
+        if arr.dtype.hasobject:
+            raise TypeError("Cannot hash the content of object arrays")
+        update('ndarray', arr.dtype.str, arr.shape, arr.tobytes())
+    elif isinstance(obj, Sphere):
+        update('Sphere')
+        _update_hash(h, obj.vertices, seen)
+    elif isinstance(obj, GradientTable):
+        update('GradientTable')
+        for value in (obj.bvals, obj.bvecs, obj.btens, obj.big_delta,
+                      obj.small_delta, obj.b0_threshold):
+            _update_hash(h, value, seen)
+    elif isinstance(obj, (tuple, list)):
+        update(type(obj).__name__, len(obj))
+        for item in obj:
+            _update_hash(h, item, seen)
+    elif isinstance(obj, dict):
+        update('dict', len(obj))
+        for key in sorted(obj, key=repr):
+            _update_hash(h, key, seen)
+            _update_hash(h, obj[key], seen)
+    elif callable(obj) and hasattr(obj, '__qualname__'):
+        update('callable', getattr(obj, '__module__', ''), obj.__qualname__)
+    elif hasattr(obj, '__dict__'):
+        if id(obj) in seen:
+            raise TypeError("Cannot hash the content of recursive objects")
+        seen.add(id(obj))
+        cls = type(obj)
+        update('object', cls.__module__, cls.__qualname__)
+        _update_hash(h, {k: v for k, v in vars(obj).items()
+                         if k not in ('_cache', '_cache_namespace')}, seen)
+        seen.discard(id(obj))
+    else:
+        raise TypeError("Cannot hash the content of %s objects"
+                        % type(obj).__name__)
+
+
+def _memo_digest(obj):
+    # The digest is computed once per object. Spheres and gradient tables are
+    # immutable, like their attributes computed once with auto_attr, so the
+    # digest stays valid until the object is deleted, which drops the entry.
+    entry = _key_digests.get(id(obj))
+    if entry is not None and entry[0]() is obj:
+        return entry[1]
+    digest = content_hash(obj)
+    _key_digests[id(obj)] = (
+        weakref.ref(obj, lambda _, i=id(obj): _key_digests.pop(i, None)),
+        digest)
+    return digest
+
+
+def _key_token(key):
+    """Hashable token of a cache key, equal for keys with equal content.
+
+    Raises
+    ------
+    TypeError
+        If the content of `key` cannot be hashed.
+    """
+    if isinstance(key, (str, bytes)):
+        return type(key).__name__, key
+    if key is None or isinstance(key, (bool, int, float, complex)):
+        return type(key).__name__, repr(key)
+    if isinstance(key, (tuple, list)):
+        return (type(key).__name__,) + tuple(_key_token(k) for k in key)
+    if isinstance(key, (Sphere, GradientTable)):
+        return 'digest', _memo_digest(key)
+    return 'digest', content_hash(key)
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class MatrixCache:
+    """Least recently used cache of matrices keyed by content.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Memory budget. The least recently used values are evicted when the
+        cached values use more memory. Default: ``CACHE_MAX_BYTES``.
+    directory : str, optional
+        Directory where array values are persisted. Default: the directory
+        set with :func:`set_cache_directory`, looked up at each access.
+    namespace : str, optional
+        Prefix of the keys on disk, e.g. a hash of the parameters of a model
+        when the cached values depend on them. None disables the
+        persistence.
+    read_only : bool, optional
+        Make cached arrays read-only, for caches shared between objects.
+
+    Notes
+    -----
+    Keys whose content cannot be hashed (see :func:`content_hash`) are
+    compared by identity and their values are never persisted. Spheres and
+    gradient tables are immutable: the content of such a key is hashed once,
+    at its first lookup, and modifying its arrays in place afterwards does
+    not change the key. Other objects, e.g. arrays, are hashed at each
+    lookup.
+    """
+
+    def __init__(self, max_bytes=None, directory=None, namespace='',
+                 read_only=False):
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._directory = directory
+        self.namespace = namespace
+        self.read_only = read_only
+        self._values = OrderedDict()
+        self.nbytes = 0
+
+    @property
+    def directory(self):
+        if self._directory is not None:
+            return self._directory
+        return _cache_directory
+
+    @directory.setter
+    def directory(self, directory):
+        self._directory = directory
+
+    def _key(self, tag, key):
+        try:
+            return (tag, _key_token(key)), True
+        except TypeError:
+            return (tag, key), False
+
+    def _path(self, key):
+        tag, token = key
+        name = hashlib.blake2b((self.namespace + repr(token)).encode(),
+                               digest_size=20).hexdigest()
+        return os.path.join(self.directory, '%s-%s.npy' % (tag, name))
+
+    def _store(self, key, value):
+        if self.read_only and isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        old = self._values.pop(key, None)
+        if old is not None:
+            self.nbytes -= _nbytes(old)
+        self._values[key] = value
+        self.nbytes += _nbytes(value)
+        # Evict the least recently used values, always keeping the new one
+        while self.nbytes > self.max_bytes and len(self._values) > 1:
+            _, evicted = self._values.popitem(last=False)
+            self.nbytes -= _nbytes(evicted)
+
+    def get(self, tag, key, default=None):
+        """Retrieve a value, from memory or from disk.
+
+        Parameters
+        ----------
+        tag : str
+            Description of the cached value.
+        key : object
+            Key object used to look up the cached value.
+        default : object
+            Value to be returned if no cached entry is found.
+        """
+        key, persistent = self._key(tag, key)
+        if key in self._values:
+            self._values.move_to_end(key)
+            return self._values[key]
+        if (persistent and self.directory is not None and
+                self.namespace is not None):
+            try:
+                value = np.load(self._path(key), allow_pickle=False)
+            except (OSError, ValueError):
+                return default
+            self._store(key, value)
+            return value
+        return default
+
+    def set(self, tag, key, value):
+        """Store a value, and persist it if it is an array.
+
+        Parameters
+        ----------
+        tag : str
+            Description of the cached value.
+        key : object
+            Key object used to look up the cached value.
+        value : object
+            Value stored in the cache for each unique combination
+            of ``(tag, key)``.
+        """
+        key, persistent = self._key(tag, key)
+        self._store(key, value)
+        if (persistent and isinstance(value, np.ndarray) and
+                not value.dtype.hasobject and self.directory is not None and
+                self.namespace is not None):
+            path = self._path(key)
+            if not os.path.exists(path):
+                # Write to a temporary file first, so that other processes
+                # never read a partially written matrix
+                fd, tmp = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        np.save(f, value, allow_pickle=False)
+                    os.replace(tmp, path)
+                except OSError:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+
+    def get_or_compute(self, tag, key, func, *args, **kwargs):
+        """Retrieve a value, computing and storing it if it is not cached.
+
+        Parameters
+        ----------
+        tag : str
+            Description of the cached value.
+        key : object
+            Key object used to look up the cached value. It should capture
+            all the inputs of `func`.
+        func : callable
+            Called as ``func(*args, **kwargs)`` to compute the value.
+        """
+        value = self.get(tag, key)
+        if value is None:
+            value = func(*args, **kwargs)
+            self.set(tag, key, value)
+        return value
+
+    def clear(self):
+        """Clear the values held in memory."""
+        self._values.clear()
+        self.nbytes = 0
+
+
+# Cache shared by all models for matrices that only depend on their key.
+matrix_cache = MatrixCache(read_only=True)
 
 
 class Cache:
     """Cache values based on a key object (such as a sphere or gradient table).
 
+    Values are stored in a :class:`MatrixCache` of the object: keys are
+    compared by content and the least recently used values are evicted beyond
+    ``CACHE_MAX_BYTES``. When a cache directory is set (see
+    :func:`set_cache_directory`), array values are also persisted, under a
+    hash of the attributes of the object, so that objects with the same
+    parameters share them across processes and runs.
+
     Notes
     -----
+    Spheres and gradient tables used as keys must not be modified in place,
+    see :class:`MatrixCache`.
+
     This class is meant to be used as a mix-in::
 
         class MyModel(Model, Cache):
@@ -30,7 +363,20 @@ class Cache:
     # calling the super-class constructor
     @auto_attr
     def _cache(self):
-        return {}
+        return MatrixCache(namespace=None)
+
+    @auto_attr
+    def _cache_namespace(self):
+        # The attributes of the object are hashed once, when the first
+        # persisted value is needed
+        try:
+            return content_hash(self)
+        except TypeError:
+            return None
+
+    def _cache_sync_namespace(self):
+        if self._cache.namespace is None and get_cache_directory() is not None:
+            self._cache.namespace = self._cache_namespace
 
     def cache_set(self, tag, key, value):
         """Store a value in the cache.
@@ -63,7 +409,8 @@ class Cache:
         True
 
         """
-        self._cache[(tag, key)] = value
+        self._cache_sync_namespace()
+        self._cache.set(tag, key, value)
 
     def cache_get(self, tag, key, default=None):
         """Retrieve a value from the cache.
@@ -84,10 +431,11 @@ class Cache:
             `default` if no cached entry is found.
 
         """
-        return self._cache.get((tag, key), default)
+        self._cache_sync_namespace()
+        return self._cache.get(tag, key, default)
 
     def cache_clear(self):
         """Clear the cache.
 
         """
-        self._cache = {}
+        self._cache.clear()
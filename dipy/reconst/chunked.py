@@ -0,0 +1,270 @@
+"""Out-of-core reconstruction of volumes larger than the memory.
+
+The diffusion data are read one slab of slices at a time, from an array
+proxy or a memory-mapped array, each slab is fitted with the model and the
+derived maps are written into memory-mapped outputs.
+"""
+import os
+
+import nibabel as nib
+import numpy as np
+
+from dipy.core.ndindex import ndindex
+from dipy.direction.peaks import peak_directions
+from dipy.reconst.odf import gfa
+
+# Default memory budget of the diffusion data of a slab, in bytes.
+SLAB_MAX_BYTES = 2 ** 28
+
+
+def iter_slabs(shape, slab_size, axis=2):
+    """Iterate over slabs of consecutive slices of a volume.
+
+    Parameters
+    ----------
+    shape : tuple
+        Spatial shape of the volume.
+    slab_size : int
+        Number of slices of a slab. The last slab can be thinner.
+    axis : int, optional
+        Axis along which the volume is sliced.
+
+    Yields
+    ------
+    index : tuple of slices
+        Index of the slab in the volume.
+    """
+    if slab_size < 1:
+        raise ValueError("slab_size must be a positive integer")
+    for start in range(0, shape[axis], slab_size):
+        index = [slice(None)] * len(shape)
+        index[axis] = slice(start, min(start + slab_size, shape[axis]))
+        yield tuple(index)
+
+
+def peaks_metric(sphere, relative_peak_threshold=.5, min_separation_angle=25,
+                 npeaks=5, normalize_peaks=False):
+    """Metric computing the peaks of the ODFs of a fit, for `fit_chunked`.
+
+    Parameters
+    ----------
+    sphere : Sphere
+        The Sphere providing discrete directions for evaluation.
+    relative_peak_threshold : float, optional
+        Only return peaks greater than ``relative_peak_threshold * m`` where m
+        is the largest peak.
+    min_separation_angle : float in [0, 90], optional
+        The minimum distance between directions. If two peaks are too close
+        only the larger of the two is returned.
+    npeaks : int, optional
+        Maximum number of peaks found.
+    normalize_peaks : bool, optional
+        If true, all peak values are calculated relative to `max(odf)`.
+
+    Returns
+    -------
+    metric : callable
+        ``metric(fit, mask)`` returns a dictionary with the ``gfa``,
+        ``peak_dirs``, ``peak_values`` and ``peak_indices`` maps of the voxels
+        of the fit, as in `peaks_from_model`. The peak indices of the voxels
+        without peaks are -1.
+    """
+    def metric(fit, mask):
+        odf = fit.odf(sphere)
+        shape = mask.shape
+        out = {'gfa': np.zeros(shape),
+               'peak_dirs': np.zeros(shape + (npeaks, 3)),
+               'peak_values': np.zeros(shape + (npeaks,)),
+               'peak_indices': np.full(shape + (npeaks,), -1, dtype=np.int32)}
+        for idx in ndindex(shape):
+            if not mask[idx]:
+                continue
+            out['gfa'][idx] = gfa(odf[idx])
+            direction, pk, ind = peak_directions(odf[idx], sphere,
+                                                 relative_peak_threshold,
+                                                 min_separation_angle)
+            n = min(npeaks, pk.shape[0])
+            if n == 0:
+                continue
+            out['peak_dirs'][idx][:n] = direction[:n]
+            out['peak_values'][idx][:n] = pk[:n]
+            out['peak_indices'][idx][:n] = ind[:n]
+            if normalize_peaks:
+                out['peak_values'][idx][:n] /= pk[0]
+                out['peak_dirs'][idx] *= out['peak_values'][idx][:, None]
+        return out
+    # 0 is a valid vertex index
+    metric.fill_value = {'peak_indices': -1}
+    return metric
+
+
+def open_nifti_memmap(fname, shape, dtype, affine):
+    """Create a NIfTI file and map its data array into memory.
+
+    The file is zero-filled and written to in place through the returned
+    array, so that the map never needs to fit into memory.
+
+    Parameters
+    ----------
+    fname : str
+        Path of the uncompressed NIfTI file (.nii) to create.
+    shape : tuple
+        Shape of the data array.
+    dtype : dtype
+        Type of the data array.
+    affine : 4x4 array
+        The affine transform associated with the file.
+
+    Returns
+    -------
+    array : np.memmap
+        Writable array mapped onto the data of the file.
+    """
+    hdr = nib.Nifti1Header()
+    hdr.set_data_shape(shape)
+    hdr.set_data_dtype(dtype)
+    hdr.set_qform(affine, code='scanner')
+    hdr.set_sform(affine, code='scanner')
+    # Single file NIfTI data start after the header and its extensions flag
+    offset = 352
+    hdr.set_data_offset(offset)
+    dtype = hdr.get_data_dtype()
+    nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    with open(fname, 'wb') as f:
+        hdr.write_to(f)
+        f.truncate(offset + nbytes)
+    return np.memmap(fname, dtype=dtype, mode='r+', offset=offset,
+                     shape=shape, order='F')
+
+
+def fit_chunked(model, data, metrics, mask=None, out_dir=None, affine=None,
+                slab_size=None, axis=2, dtype=np.float32):
+    """Fit a model slab by slab and write the derived maps as they come.
+
+    Only one slab of the diffusion data and of the fit is held in memory at
+    a time, so that datasets larger than the memory can be reconstructed.
+
+    Parameters
+    ----------
+    model : ReconstModel
+        The model fitted to each slab, with ``model.fit(data, mask=mask)``.
+    data : str, ndarray, np.memmap or nibabel ArrayProxy
+        4D diffusion data, or the path of a NIfTI file. Slabs are read with
+        ``data[index]``, so that an array proxy (``img.dataobj``, or
+        ``load_nifti(fname, as_ndarray=False)``) or a memory-mapped array only
+        reads the slab from the disk.
+    metrics : dict
+        Maps the name of each output to a metric. A metric is either the name
+        of an attribute or method without arguments of the fit (e.g. ``'fa'``,
+        ``'md'``, ``'shm_coeff'``), or a callable ``metric(fit, mask)``
+        returning an array, or a dictionary of arrays with their own output
+        names (see `peaks_metric`). The voxels outside of the mask are zero,
+        unless a callable metric has a ``fill_value`` attribute, a dictionary
+        mapping output names to the value of these voxels.
+    mask : str, ndarray or nibabel ArrayProxy, optional
+        3D mask of the voxels to fit, or the path of a NIfTI file.
+    out_dir : str, optional
+        Directory where the maps are written, as ``<name>.nii`` NIfTI files
+        when `affine` is given or ``<name>.npy`` files otherwise. By default,
+        the maps are held in memory.
+    affine : 4x4 array, optional
+        The affine of the NIfTI outputs. When `data` is a path, the affine of
+        the input file is used by default.
+    slab_size : int, optional
+        Number of slices of a slab. By default, the slabs hold about
+        ``SLAB_MAX_BYTES`` of diffusion data.
+    axis : int, optional
+        Spatial axis along which the volume is sliced. The default, the last
+        spatial axis, reads contiguous blocks of NIfTI files.
+    dtype : dtype, optional
+        Type of the floating point maps. Integer maps keep their type and
+        boolean maps are stored as uint8.
+
+    Returns
+    -------
+    maps : dict
+        Maps the output names to their arrays, memory-mapped onto the files
+        in `out_dir` if given.
+
+    Notes
+    -----
+    Reading slabs from gzip compressed NIfTI files decompresses the file up
+    to each slab. Uncompressed files should be preferred for large datasets.
+    """
+    if isinstance(data, str):
+        img = nib.load(data)
+        if affine is None and out_dir is not None:
+            affine = img.affine
+        data = img.dataobj
+    if isinstance(mask, str):
+        mask = nib.load(mask).dataobj
+
+    shape = tuple(data.shape[:-1])
+    if mask is not None and tuple(mask.shape) != shape:
+        raise ValueError("Mask is not the same shape as data.")
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    if slab_size is None:
+        slice_bytes = (np.prod(shape, dtype=np.int64) // shape[axis] *
+                       data.shape[-1] * np.dtype(float).itemsize)
+        slab_size = int(max(SLAB_MAX_BYTES // slice_bytes, 1))
+
+    maps = {}
+    for index in iter_slabs(shape, slab_size, axis=axis):
+        if mask is not None:
+            slab_mask = np.asarray(mask[index]).astype(bool)
+            if not slab_mask.any():
+                continue
+        slab = np.asarray(data[index + (slice(None),)])
+        if mask is None:
+            slab_mask = np.ones(slab.shape[:-1], dtype=bool)
+
+        fit = model.fit(slab, mask=slab_mask)
+        for name, metric in metrics.items():
+            fill_value = getattr(metric, 'fill_value', {})
+            if callable(metric):
+                values = metric(fit, slab_mask)
+            else:
+                values = getattr(fit, metric)
+                if callable(values):
+                    values = values()
+            if not isinstance(values, dict):
+                values = {name: values}
+            for out_name, value in values.items():
+                value = np.asarray(value)
+                if out_name not in maps:
+                    maps[out_name] = _open_map(
+                        out_name, shape + value.shape[len(shape):],
+                        _map_dtype(value.dtype, dtype), out_dir, affine,
+                        fill_value.get(out_name, 0))
+                # Voxels outside of the mask keep the fill value
+                maps[out_name][index][slab_mask] = value[slab_mask]
+
+    if not maps:
+        raise ValueError("The mask is empty, no voxel was fitted.")
+    for out in maps.values():
+        if isinstance(out, np.memmap):
+            out.flush()
+    return maps
+
+
+def _map_dtype(value_dtype, dtype):
+    if value_dtype == bool:
+        return np.dtype(np.uint8)
+    if np.issubdtype(value_dtype, np.integer):
+        return value_dtype
+    return np.dtype(dtype)
+
+
+def _open_map(name, shape, dtype, out_dir, affine, fill_value=0):
+    if out_dir is None:
+        out = np.zeros(shape, dtype=dtype)
+    elif affine is not None:
+        out = open_nifti_memmap(os.path.join(out_dir, name + '.nii'),
+                                shape, dtype, affine)
+    else:
+        out = np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy'),
+                                        mode='w+', dtype=dtype, shape=shape)
+    if fill_value != 0:
+        out.fill(fill_value)
+    return out
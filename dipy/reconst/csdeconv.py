@@ -5,6 +5,7 @@ import numbers
 from scipy.integrate import quad
 from scipy.special import lpn, gamma
 import scipy.linalg as la
+import scipy.sparse as sps
 import scipy.linalg.lapack as ll
 
 from dipy.data import small_sphere, get_sphere, default_sphere
@@ -13,12 +14,13 @@ from dipy.core.geometry import cart2sphere
 from dipy.core.ndindex import ndindex
 from dipy.sims.voxel import single_tensor
 
+from dipy.reconst.cache import matrix_cache
 from dipy.reconst.multi_voxel import multi_voxel_fit
 from dipy.reconst.dti import TensorModel, fractional_anisotropy
 from dipy.reconst.shm import (sph_harm_ind_list, real_sh_descoteaux_from_index,
                               sph_harm_lookup, lazy_index, SphHarmFit,
                               real_sh_descoteaux, sh_to_rh, forward_sdeconv_mat,
-                              SphHarmModel)
+                              SphHarmModel, descoteaux07_legacy_msg)
 from dipy.reconst.utils import _roi_in_volume, _mask_from_roi
 
 from dipy.direction.peaks import peaks_from_model
@@ -166,6 +168,28 @@ class AxSymShResponse:
         return np.dot(self.dwi_response, B.T)
 
 
+def _sh_basis_on_points(tag, m, n, key, points):
+    """Legacy descoteaux07 SH basis sampled on the directions of `points`.
+
+    The matrix is shared through ``matrix_cache``, under `tag` and `key`
+    (which must determine `points`).
+    """
+    # Warn on every call, whether or not the matrix is already cached
+    warnings.warn(descoteaux07_legacy_msg, category=PendingDeprecationWarning)
+
+    def compute():
+        x, y, z = np.asarray(points).T
+        r, theta, phi = cart2sphere(x, y, z)
+        with warnings.catch_warnings():
+            warnings.filterwarnings(
+                "ignore", message=descoteaux07_legacy_msg,
+                category=PendingDeprecationWarning)
+            return real_sh_descoteaux_from_index(
+                m, n, theta[:, None], phi[:, None])
+
+    return matrix_cache.get_or_compute(tag, (m, n, key), compute)
+
+
 class ConstrainedSphericalDeconvModel(SphHarmModel):
 
     def __init__(self, gtab, response, reg_sphere=None, sh_order=8,
@@ -239,22 +263,14 @@ class ConstrainedSphericalDeconvModel(SphHarmModel):
             msg += "than the actual data points"
             warnings.warn(msg, UserWarning)
 
-        x, y, z = gtab.gradients[self._where_dwi].T
-        r, theta, phi = cart2sphere(x, y, z)
         # for the gradient sphere
-        self.B_dwi = real_sh_descoteaux_from_index(
-            m, n, theta[:, None], phi[:, None])
+        self.B_dwi = _sh_basis_on_points(
+            'csd_B_dwi', m, n, gtab, gtab.gradients[self._where_dwi])
 
         # for the sphere used in the regularization positivity constraint
         self.sphere = reg_sphere or small_sphere
-
-        r, theta, phi = cart2sphere(
-            self.sphere.x,
-            self.sphere.y,
-            self.sphere.z
-        )
-        self.B_reg = real_sh_descoteaux_from_index(
-            m, n, theta[:, None], phi[:, None])
+        self.B_reg = _sh_basis_on_points(
+            'csd_B_reg', m, n, self.sphere, self.sphere.vertices)
 
         self.response = response
         if isinstance(response, AxSymShResponse):
@@ -271,14 +287,15 @@ class ConstrainedSphericalDeconvModel(SphHarmModel):
             m_response = m
             self.response_scaling = response[1]
         r_rh = sh_to_rh(r_sh, m_response, n_response)
-        self.R = forward_sdeconv_mat(r_rh, n)
+        self.R = matrix_cache.get_or_compute(
+            'forward_sdeconv_mat', (r_rh, n), forward_sdeconv_mat, r_rh, n)
 
         # scale lambda_ to account for differences in the number of
         # SH coefficients and number of mapped directions
         # This is exactly what is done in [4]_
         lambda_ = (lambda_ * self.R.shape[0] * r_rh[0] /
                    (np.sqrt(self.B_reg.shape[0]) * np.sqrt(362.)))
-        self.B_reg *= lambda_
+        self.B_reg = self.B_reg * lambda_
         self.sh_order = sh_order
         self.tau = tau
         self.convergence = convergence
@@ -292,6 +309,25 @@ class ConstrainedSphericalDeconvModel(SphHarmModel):
                                 convergence=self.convergence, P=self._P)
         return SphHarmFit(self, shm_coeff, None)
 
+    def fit_batch(self, data):
+        """Fit a block of voxels.
+
+        Parameters
+        ----------
+        data : ndarray (N, g)
+            Signal of N voxels.
+
+        Returns
+        -------
+        shm_coeff : ndarray (N, M)
+            FOD spherical harmonic coefficients of each voxel.
+        """
+        dwi_data = data[:, self._where_dwi]
+        shm_coeff, _ = csdeconv_batch(dwi_data, self._X, self.B_reg,
+                                      self.tau, convergence=self.convergence,
+                                      P=self._P)
+        return shm_coeff
+
     def predict(self, sh_coeff, gtab=None, S0=1.):
         """Compute a signal prediction given spherical harmonic coefficients
         for the provided GradientTable class instance.
@@ -392,25 +428,17 @@ class ConstrainedSDTModel(SphHarmModel):
             msg += "than the actual data points"
             warnings.warn(msg, UserWarning)
 
-        x, y, z = gtab.gradients[self._where_dwi].T
-        r, theta, phi = cart2sphere(x, y, z)
         # for the gradient sphere
-        self.B_dwi = real_sh_descoteaux_from_index(
-            m, n, theta[:, None], phi[:, None])
+        self.B_dwi = _sh_basis_on_points(
+            'csd_B_dwi', m, n, gtab, gtab.gradients[self._where_dwi])
 
         # for the odf sphere
         if reg_sphere is None:
             self.sphere = get_sphere('symmetric362')
         else:
             self.sphere = reg_sphere
-
-        r, theta, phi = cart2sphere(
-            self.sphere.x,
-            self.sphere.y,
-            self.sphere.z
-        )
-        self.B_reg = real_sh_descoteaux_from_index(
-            m, n, theta[:, None], phi[:, None])
+        self.B_reg = _sh_basis_on_points(
+            'csd_B_reg', m, n, self.sphere, self.sphere.vertices)
 
         self.R, self.P = forward_sdt_deconv_mat(ratio, n)
 
@@ -440,6 +468,31 @@ class ConstrainedSDTModel(SphHarmModel):
 
         return SphHarmFit(self, shm_coeff, None)
 
+    def fit_batch(self, data):
+        """Fit a block of voxels.
+
+        Parameters
+        ----------
+        data : ndarray (N, g)
+            Signal of N voxels.
+
+        Returns
+        -------
+        shm_coeff : ndarray (N, M)
+            FOD spherical harmonic coefficients of each voxel.
+        """
+        s_sh = np.linalg.lstsq(self.B_dwi, data[:, self._where_dwi].T,
+                               rcond=-1)[0]
+        # initial ODF estimation
+        odf_sh = np.dot(self.P, s_sh).T
+        Z = np.linalg.norm(np.dot(odf_sh, self.B_reg.T), axis=-1)
+
+        shm_coeff = np.zeros_like(odf_sh)
+        for i in np.flatnonzero(Z):
+            shm_coeff[i], _ = odf_deconv(odf_sh[i] / Z[i], self.R, self.B_reg,
+                                         self.lambda_, self.tau)
+        return shm_coeff
+
 
 def estimate_response(gtab, evals, S0):
     """ Estimate single fiber response function
@@ -702,6 +755,130 @@ def csdeconv(dwsignal, X, B_reg, tau=0.1, convergence=50, P=None):
     return fodf_sh, num_it
 
 
+def csdeconv_batch(dwsignal, X, B_reg, tau=0.1, convergence=50, P=None,
+                   block_size=1000):
+    r""" Constrained-regularized spherical deconvolution of many voxels
+
+    Vectorized version of :func:`csdeconv`. All the voxels of a block are
+    iterated together: at each iteration the matrices $Q$ of the voxels that
+    have not converged yet are formed with a single matrix product and solved
+    with a batched linear solver. Converged voxels drop out of the
+    iterations.
+
+    Parameters
+    ----------
+    dwsignal : array (N, g)
+        Diffusion weighted signals of N voxels to be deconvolved.
+    X : array
+        Prediction matrix which estimates diffusion weighted signals from FOD
+        coefficients.
+    B_reg : array (V, B)
+        SH basis matrix which maps FOD coefficients to FOD values on the
+        surface of the sphere. B_reg should be scaled to account for lambda.
+    tau : float
+        Threshold controlling the amplitude below which the corresponding fODF
+        is assumed to be zero. See :func:`csdeconv`.
+    convergence : int
+        Maximum number of iterations to allow the deconvolution to converge.
+    P : ndarray
+        This is an optimization to avoid computing ``dot(X.T, X)`` many times.
+    block_size : int
+        Number of voxels iterated together. Memory use grows with
+        ``block_size * B ** 2``.
+
+    Returns
+    -------
+    fodf_sh : ndarray (N, ``(sh_order + 1)*(sh_order + 2)/2``)
+         Spherical harmonics coefficients of the constrained-regularized fiber
+         ODF of each voxel.
+    num_it : ndarray (N,)
+         Number of iterations in the constrained-regularization used for
+         convergence of each voxel.
+
+    See Also
+    --------
+    csdeconv
+    """
+    mu = 1e-5
+    if P is None:
+        P = np.dot(X.T, X)
+    dwsignal = np.atleast_2d(dwsignal)
+    z = np.dot(dwsignal, X)
+
+    try:
+        fodf_sh = la.cho_solve(la.cho_factor(P), z.T).T
+    except la.LinAlgError:
+        P = P + mu * np.eye(P.shape[0])
+        fodf_sh = la.cho_solve(la.cho_factor(P), z.T).T
+    # For the first iteration we use a smooth FOD that only uses SH orders up
+    # to 4 (the first 15 coefficients).
+    fodf = np.dot(fodf_sh[:, :15], B_reg[:, :15].T)
+    # The mean of an fodf can be computed by taking $Y_{0,0} * coeff_{0,0}$
+    threshold = (B_reg[0, 0] * fodf_sh[:, 0] * tau)[:, None]
+    fodf_small = fodf < threshold
+
+    # If the low-order fodf does not have any values less than threshold, the
+    # full-order fodf is used.
+    smooth = ~fodf_small.any(axis=-1)
+    if smooth.any():
+        fodf_small[smooth] = (np.dot(fodf_sh[smooth], B_reg.T) <
+                              threshold[smooth])
+
+    # Outer products of the rows of B_reg, so that H^T H can be formed for
+    # many voxels with one (sparse) matrix product
+    n_coef = B_reg.shape[1]
+    BB = (B_reg[:, :, None] * B_reg[:, None, :]).reshape((len(B_reg), -1))
+
+    def rows_outer(weights, sparse=True):
+        """Sum of the outer products of the rows of B_reg selected (+1) or
+        removed (-1) by `weights`, for each voxel"""
+        if sparse:
+            HtH = sps.csr_matrix(weights, dtype=float) @ BB
+        else:
+            HtH = np.dot(weights.astype(float), BB)
+        return HtH.reshape((-1, n_coef, n_coef))
+
+    num_it = np.zeros(len(dwsignal), dtype=int)
+    # If the fodf still has no values less than threshold, it is final.
+    where_small = np.flatnonzero(fodf_small.any(axis=-1))
+    failed = False
+    for start in range(0, len(where_small), block_size):
+        block = where_small[start:start + block_size]
+        small = fodf_small[block]
+        z_block = z[block]
+        threshold_block = threshold[block]
+        # This is the super-resolved trick, see csdeconv. Between iterations
+        # only a few directions enter or leave the negative set, so Q is
+        # updated with the outer products of those rows only.
+        Q = rows_outer(small, sparse=False)
+        Q += P
+        active = np.arange(len(block))
+        for it in range(1, convergence + 1):
+            new_sh = np.linalg.solve(Q[active], z_block[active, :, None])
+            new_sh = new_sh[..., 0]
+
+            # Sample the FOD using the regularization sphere.
+            new_small = np.dot(new_sh, B_reg.T) < threshold_block[active]
+            delta = new_small.astype(np.int8) - small[active]
+            changed = delta.any(axis=-1)
+
+            fodf_sh[block[active]] = new_sh
+            num_it[block[active]] = it
+            small[active] = new_small
+            active = active[changed]
+            if not len(active):
+                break
+            Q[active] += rows_outer(delta[changed])
+        else:
+            failed = True
+
+    if failed:
+        msg = 'maximum number of iterations exceeded - failed to converge'
+        warnings.warn(msg)
+
+    return fodf_sh, num_it
+
+
 def odf_deconv(odf_sh, R, B_reg, lambda_=1., tau=0.1, r2_term=False):
     r""" ODF constrained-regularized spherical deconvolution using
     the Sharpening Deconvolution Transform (SDT) [1]_, [2]_.
@@ -7,8 +7,7 @@ import functools
 
 import numpy as np
 
-import scipy.optimize as opt
-
+from dipy.core.optimize import leastsq_batch
 from dipy.utils.arrfuncs import pinv
 from dipy.data import get_sphere
 from dipy.core.gradients import gradient_table
@@ -1559,13 +1558,13 @@ class _NllsHelper():
 
         Parameters
         ----------
-        tensor : array (3,3)
-            The 3-by-3 tensor matrix
+        tensor : array (Npar,) or (N, Npar)
+            The parameters of the fit, for one voxel or for N voxels at once.
 
         design_matrix : array
             The design matrix
 
-        data : array
+        data : array (g,) or (N, g)
             The voxel signal in all gradient directions
 
         weighting : str (optional).
@@ -1604,7 +1603,7 @@ class _NllsHelper():
         estimation of tensors by outlier rejection. MRM, 53: 1088-95.
         """
         # This is the predicted signal given the params:
-        y = np.exp(np.dot(design_matrix, tensor))
+        y = np.exp(np.dot(tensor, design_matrix.T))
         self.y = y  # cache the results
 
         # Compute the residuals
@@ -1641,7 +1640,7 @@ class _NllsHelper():
             ans = self.sqrt_w * residuals
             if np.iterable(w):
                 # cache the weights for the *non-squared* residuals
-                self.sqrt_w = np.sqrt(w)[:, None]
+                self.sqrt_w = np.sqrt(w)[..., None]
             return ans
 
     def jacobian_func(self, tensor, design_matrix, data, weighting=None, sigma=None):
@@ -1662,9 +1661,9 @@ class _NllsHelper():
         # sqrt(w) because w corresponds to the squared residuals
 
         if weighting is None:
-            return -self.y[:, None] * design_matrix
+            return -self.y[..., None] * design_matrix
         else:
-            return -self.y[:, None] * design_matrix * self.sqrt_w
+            return -self.y[..., None] * design_matrix * self.sqrt_w
 
 
 def _decompose_tensor_nan(tensor, tensor_alternative, min_diffusivity=0):
@@ -1712,6 +1711,95 @@ def _decompose_tensor_nan(tensor, tensor_alternative, min_diffusivity=0):
     return evals, evecs
 
 
+def _nlls_batch(design_matrix, data, start_params, weighting=None,
+                sigma=None, jac=True, step=10000):
+    """Non-linear least-squares fit of many voxels at once.
+
+    Parameters
+    ----------
+    design_matrix : array (g, Npar)
+        Design matrix of the cumulant expansion.
+    data : array (N, g)
+        The signal of N voxels.
+    start_params : array (N, Npar)
+        Starting estimates of the parameters (e.g. OLS solution).
+    weighting : str, optional
+        Weighting scheme of the residuals, see :func:`nlls_fit_tensor`.
+    sigma : float or array, optional
+        Noise estimate or weights, used according to `weighting`. Arrays are
+        broadcast against `data`, so they can vary across images and voxels.
+    jac : bool, optional
+        Use the analytic Jacobian. Default: True.
+    step : int, optional
+        Number of voxels optimized together. Memory use grows with
+        ``step * g * Npar``.
+
+    Returns
+    -------
+    params : array (N, Npar)
+        The fitted parameters.
+    success : array (N,)
+        Whether the fitted parameters of each voxel are finite. Voxels that
+        did not converge keep their last estimate, as with
+        :func:`scipy.optimize.leastsq`.
+    """
+    nlls = _NllsHelper()
+    batch_args = (data,)
+    if sigma is not None:
+        batch_args += (np.broadcast_to(sigma, data.shape),)
+
+    def err_func(params, data, sigma=None):
+        return nlls.err_func(params, design_matrix, data, weighting, sigma)
+
+    def jacobian_func(params, data, sigma=None):
+        return nlls.jacobian_func(params, design_matrix, data, weighting,
+                                  sigma)
+
+    params = np.empty(start_params.shape)
+    success = np.empty(len(data), dtype=bool)
+    for start in range(0, len(data), step):
+        block = slice(start, start + step)
+        params[block], _ = leastsq_batch(
+            err_func, start_params[block],
+            Dfun=jacobian_func if jac else None,
+            batch_args=tuple(arg[block] for arg in batch_args))
+        success[block] = np.all(np.isfinite(params[block]), axis=-1)
+    return params, success
+
+
+def _nlls_to_params(tensor_params, start_params, success, npa,
+                    fail_is_nan=False):
+    """Converts the cumulant expansion parameters of non-linear fits to
+    eigenvalues, eigenvectors (and kurtosis terms), resorting to the starting
+    estimates where the fit failed.
+
+    Returns the model parameters (N, npa) and the S0 estimates (N, 1).
+    """
+    resort_to_OLS = not np.all(success)
+    if resort_to_OLS:
+        tensor_params = tensor_params.copy()
+        if fail_is_nan:
+            tensor_params[~success] = np.nan
+        else:
+            tensor_params[~success] = start_params[~success]
+    valid = np.all(np.isfinite(tensor_params), axis=-1)
+
+    params = np.full((len(tensor_params), npa), np.nan)
+    evals, evecs = decompose_tensor(
+        from_lower_triangular(tensor_params[valid, :6]))
+    params[valid, :3] = evals
+    params[valid, 3:12] = evecs.reshape((-1, 9))
+    if npa > 12:
+        # Kurtosis tensor elements are normalized by the squared MD
+        md2 = evals.mean(-1) ** 2
+        params[valid, 12:] = tensor_params[valid, 6:-1] / md2[:, None]
+    model_S0 = np.exp(-tensor_params[:, -1:])
+
+    if resort_to_OLS:
+        warnings.warn(ols_resort_msg, UserWarning)
+    return params, model_S0
+
+
 def nlls_fit_tensor(design_matrix, data, weighting=None,
                     sigma=None, jac=True, return_S0_hat=False,
                     fail_is_nan=False):
@@ -1754,88 +1842,39 @@ def nlls_fit_tensor(design_matrix, data, weighting=None,
     -------
     nlls_params: the eigen-values and eigen-vectors of the tensor in each
         voxel.
+
+    Notes
+    -----
+    All the voxels are optimized together with a vectorized
+    Levenberg-Marquardt algorithm (see
+    :func:`dipy.core.optimize.leastsq_batch`).
     """
     # Detect number of parameters to estimate from design_matrix length plus
     # 5 due to diffusion tensor conversion to eigenvalue and eigenvectors
     npa = design_matrix.shape[-1] + 5
 
-    # Detect if number of parameters corresponds to dti
-    dti = (npa == 12)
-
-    # Flatten for the iteration over voxels:
+    # Flatten for the vectorized fit over voxels:
     flat_data = data.reshape((-1, data.shape[-1]))
+    if np.any(np.all(flat_data == 0, axis=-1)):
+        raise ValueError("The data in this voxel contains only zeros")
+    if isinstance(sigma, np.ndarray) and sigma.ndim > 1:  # spatially varying
+        sigma = np.reshape(sigma, (-1, 1))
 
     # Use the OLS method parameters as the starting point for the optimization:
     D, _ = ols_fit_tensor(design_matrix, flat_data, return_lower_triangular=True)
-
-    # Flatten for the iteration over voxels:
     ols_params = np.reshape(D, (-1, D.shape[-1]))
 
-    # Initialize parameter matrix
-    params = np.empty((flat_data.shape[0], npa))
-
-    # For warnings
-    resort_to_OLS = False
-
-    # Instance of _NllsHelper, need for nlls error func and jacobian
-    nlls = _NllsHelper()
-
-    if return_S0_hat:
-        model_S0 = np.empty((flat_data.shape[0], 1))
-    for vox in range(flat_data.shape[0]):
-        if np.all(flat_data[vox] == 0):
-            raise ValueError("The data in this voxel contains only zeros")
-
-        start_params = ols_params[vox]
-
-        try:
-
-            # Do the optimization in this voxel:
-            if jac:
-                this_param, status = opt.leastsq(nlls.err_func, start_params,
-                                                 args=(design_matrix,
-                                                       flat_data[vox],
-                                                       weighting,
-                                                       sigma),
-                                                 Dfun=nlls.jacobian_func)
-            else:
-                this_param, status = opt.leastsq(nlls.err_func, start_params,
-                                                 args=(design_matrix,
-                                                       flat_data[vox],
-                                                       weighting,
-                                                       sigma))
-
-            # Convert diffusion tensor parameters to the evals and the evecs:
-            evals, evecs = decompose_tensor(
-                from_lower_triangular(this_param[:6]))
-            params[vox, :3] = evals
-            params[vox, 3:12] = evecs.ravel()
-
-        # If leastsq failed to converge and produced nans, we'll resort to the
-        # OLS solution in this voxel:
-        except (np.linalg.LinAlgError, TypeError) as e:
-            resort_to_OLS = True
-            this_param = start_params
-
-            if not fail_is_nan:
-                # Convert diffusion tensor parameters to evals and evecs
-                evals, evecs = decompose_tensor(
-                    from_lower_triangular(this_param[:6]))
-                params[vox, :3] = evals
-                params[vox, 3:12] = evecs.ravel()
-            else:
-                # Set NaN values
-                this_param[:] = np.nan  # so that S0_hat is NaN
-                params[vox, :] = np.nan
-
-        if return_S0_hat:
-            model_S0[vox] = np.exp(-this_param[-1])
-        if not dti:
-            md2 = evals.mean(0) ** 2
-            params[vox, 12:] = this_param[6:-1] / md2
+    try:
+        this_params, success = _nlls_batch(design_matrix, flat_data,
+                                           ols_params, weighting, sigma, jac)
+    # If the problem is ill-posed (e.g. too few data points), we'll resort to
+    # the OLS solution:
+    except (np.linalg.LinAlgError, TypeError):
+        this_params = ols_params
+        success = np.zeros(len(flat_data), dtype=bool)
 
-    if resort_to_OLS:
-        warnings.warn(ols_resort_msg, UserWarning)
+    params, model_S0 = _nlls_to_params(this_params, ols_params, success, npa,
+                                       fail_is_nan=fail_is_nan)
 
     params.shape = data.shape[:-1] + (npa,)
     if return_S0_hat:
@@ -1885,6 +1924,12 @@ def restore_fit_tensor(design_matrix, data, sigma=None, jac=True,
     -------
     restore_params : an estimate of the tensor parameters in each voxel.
 
+    Notes
+    -----
+    Each step of the algorithm is applied to all the voxels that need it at
+    once, using a vectorized Levenberg-Marquardt algorithm (see
+    :func:`dipy.core.optimize.leastsq_batch`).
+
     References
     ----------
     .. [1] Chang, L-C, Jones, DK and Pierpaoli, C (2005). RESTORE: robust
@@ -1895,166 +1940,112 @@ def restore_fit_tensor(design_matrix, data, sigma=None, jac=True,
     # 5 due to diffusion tensor conversion to eigenvalue and eigenvectors
     npa = design_matrix.shape[-1] + 5
 
-    # Detect if number of parameters corresponds to dti
-    dti = (npa == 12)
-
-    # Flatten for the iteration over voxels:
+    # Flatten for the vectorized fit over voxels:
     flat_data = data.reshape((-1, data.shape[-1]))
+    if np.any(np.all(flat_data == 0, axis=-1)):
+        raise ValueError("The data in this voxel contains only zeros")
     if isinstance(sigma, np.ndarray):
         if sigma.ndim > 1:  # spatially varying
             sigma = np.reshape(sigma, (-1, 1))
+    # Noise level of each data point
+    if sigma is not None:
+        flat_sigma = np.broadcast_to(sigma, flat_data.shape)
+    else:
+        flat_sigma = None
 
     # calculate OLS solution
     D, _ = ols_fit_tensor(design_matrix, flat_data, return_lower_triangular=True)
-
-    # Flatten for the iteration over voxels:
     ols_params = np.reshape(D, (-1, D.shape[-1]))
-
-    # Initialize parameter matrix
-    params = np.empty((flat_data.shape[0], npa))
+    start_params = ols_params.copy()
 
     # For storing whether image is used in final fit for each voxel
     robust = np.ones(flat_data.shape, dtype=int)
 
-    # For warnings
-    resort_to_OLS = False
-
-    # Instance of _NllsHelper, need for nlls error func and jacobian
-    nlls = _NllsHelper()
-
-    if return_S0_hat:
-        model_S0 = np.empty((flat_data.shape[0], 1))
-    for vox in range(flat_data.shape[0]):
-        if np.all(flat_data[vox] == 0):
-            raise ValueError("The data in this voxel contains only zeros")
-
-        start_params = ols_params[vox]
-
-        # set sigma value
-        if np.iterable(sigma):
-            sigma_vox = sigma[vox, 0] if sigma.ndim > 1 else sigma
-        else:
-            sigma_vox = sigma
-
-        try:
-
-            # Do nlls using sigma weighting in this voxel:
-            if jac:
-                this_param, status = opt.leastsq(nlls.err_func, start_params,
-                                                 args=(design_matrix,
-                                                       flat_data[vox],
-                                                       'sigma',
-                                                       sigma_vox),
-                                                 Dfun=nlls.jacobian_func)
-            else:
-                this_param, status = opt.leastsq(nlls.err_func, start_params,
-                                                 args=(design_matrix,
-                                                       flat_data[vox],
-                                                       'sigma',
-                                                       sigma_vox))
-
-            # Get the residuals:
-            pred_sig = np.exp(np.dot(design_matrix, this_param))
-            residuals = flat_data[vox] - pred_sig
-
-            # If any of the residuals are outliers (using 3 sigma as a
-            # criterion following Chang et al., e.g page 1089):
-            if np.any(np.abs(residuals) > 3 * sigma_vox):
-
-                rdx = 1
-                while rdx <= 10:  # NOTE: capped at 10 iterations
-                    C = 1.4826 * np.median(np.abs(residuals - np.median(residuals)))
-                    denominator = (C**2 + residuals**2)**2
-                    gmm = np.divide(C**2, denominator,
-                                    out=np.zeros_like(denominator),
-                                    where=denominator != 0)
-
-                    # Do nlls with GMM-weighting:
-                    if jac:
-                        this_param, status = opt.leastsq(
-                            nlls.err_func, start_params,
-                            args=(design_matrix, flat_data[vox], 'gmm', gmm),
-                            Dfun=nlls.jacobian_func)
-                    else:
-                        this_param, status = opt.leastsq(nlls.err_func,
-                                                         start_params,
-                                                         args=(design_matrix,
-                                                               flat_data[vox],
-                                                               'gmm',
-                                                               gmm))
-
-                    # Recalculate residuals given gmm fit
-                    pred_sig = np.exp(np.dot(design_matrix, this_param))
-                    residuals = flat_data[vox] - pred_sig
-                    perc = 100 * np.linalg.norm(this_param - start_params) / np.linalg.norm(this_param)
-                    start_params = this_param
-                    if perc < 0.1: break
-                    rdx = rdx + 1
-
-                cond = np.abs(residuals) > 3 * sigma_vox
-                if np.any(cond):
-                    # If you still have outliers, refit without those outliers:
-                    non_outlier_idx = np.where(cond == False)
-                    clean_design = design_matrix[non_outlier_idx]
-                    clean_data = flat_data[vox][non_outlier_idx]
-                    robust[vox] = (cond == False)
-
-                    # recalculate OLS solution with clean data
-                    new_start, _ = ols_fit_tensor(clean_design, clean_data,
-                                               return_lower_triangular=True)
-
-                    if np.iterable(sigma_vox):
-                        this_sigma = sigma_vox[non_outlier_idx]
-                    else:
-                        this_sigma = sigma_vox
-
-                    if jac:
-                        this_param, status = opt.leastsq(nlls.err_func,
-                                                         new_start,
-                                                         args=(clean_design,
-                                                               clean_data,
-                                                               'sigma',
-                                                               this_sigma),
-                                                         Dfun=nlls.jacobian_func)
-                    else:
-                        this_param, status = opt.leastsq(nlls.err_func,
-                                                         new_start,
-                                                         args=(clean_design,
-                                                               clean_data,
-                                                               'sigma',
-                                                               this_sigma))
-
-            # Convert diffusion tensor parameters to the evals and the evecs:
-            evals, evecs = decompose_tensor(
-                from_lower_triangular(this_param[:6]))
-            params[vox, :3] = evals
-            params[vox, 3:12] = evecs.ravel()
-
-        # If leastsq failed to converge and produced nans, we'll resort to the
-        # OLS solution in this voxel:
-        except (np.linalg.LinAlgError, TypeError) as e:
-            resort_to_OLS = True
-            this_param = start_params
-
-            if not fail_is_nan:
-                # Convert diffusion tensor parameters to evals and evecs:
-                evals, evecs = decompose_tensor(
-                    from_lower_triangular(this_param[:6]))
-                params[vox, :3] = evals
-                params[vox, 3:12] = evecs.ravel()
-            else:
-                # Set NaN values
-                this_param[:] = np.nan  # so that S0_hat is NaN
-                params[vox, :] = np.nan
-
-        if return_S0_hat:
-            model_S0[vox] = np.exp(-this_param[-1])
-        if not dti:
-            md2 = evals.mean(0) ** 2
-            params[vox, 12:] = this_param[6:-1] / md2
+    try:
+        # Do nlls using sigma weighting in all voxels:
+        this_params, success = _nlls_batch(design_matrix, flat_data,
+                                           start_params, 'sigma', flat_sigma,
+                                           jac)
+
+        # Get the residuals:
+        pred_sig = np.exp(np.dot(this_params, design_matrix.T))
+        residuals = flat_data - pred_sig
+
+        # If any of the residuals are outliers (using 3 sigma as a
+        # criterion following Chang et al., e.g page 1089):
+        outlier_vox = np.flatnonzero(
+            np.any(np.abs(residuals) > 3 * flat_sigma, axis=-1) & success)
+        # NOTE: the GMM-weighted fits are capped at 10 iterations
+        active = outlier_vox
+        for rdx in range(10):
+            if not active.size:
+                break
+            res = residuals[active]
+            C = 1.4826 * np.median(
+                np.abs(res - np.median(res, axis=-1, keepdims=True)), axis=-1)
+            C2 = (C ** 2)[:, None]
+            denominator = (C2 + res ** 2) ** 2
+            gmm = np.divide(C2, denominator, out=np.zeros_like(denominator),
+                            where=denominator != 0)
+
+            # Do nlls with GMM-weighting:
+            new_params, new_success = _nlls_batch(
+                design_matrix, flat_data[active], start_params[active],
+                'gmm', gmm, jac)
+            this_params[active] = new_params
+            success[active] = new_success
+
+            # Recalculate residuals given gmm fit
+            pred_sig = np.exp(np.dot(new_params, design_matrix.T))
+            residuals[active] = flat_data[active] - pred_sig
+            perc = (100 * np.linalg.norm(new_params - start_params[active],
+                                         axis=-1) /
+                    np.linalg.norm(new_params, axis=-1))
+            start_params[active[new_success]] = new_params[new_success]
+            active = active[~(perc < 0.1) & new_success]
+
+        cond = (np.abs(residuals[outlier_vox]) >
+                3 * flat_sigma[outlier_vox])
+        refit = np.any(cond, axis=-1) & success[outlier_vox]
+        refit_vox = outlier_vox[refit]
+        if refit_vox.size:
+            # If you still have outliers, refit without those outliers:
+            keep = ~cond[refit]
+            robust[refit_vox] = keep
+
+            # Too few data points are left in these voxels for the fit
+            ill_posed = keep.sum(-1) < design_matrix.shape[-1]
+            success[refit_vox[ill_posed]] = False
+            refit_vox = refit_vox[~ill_posed]
+            keep = keep[~ill_posed]
+
+            # Removing the outliers is equivalent to setting their weights to
+            # zero, which keeps the problems of all voxels the same size.
+            # Recalculate the OLS solution with clean data:
+            clean_design = keep[..., None] * design_matrix
+            clean_log = keep * np.log(flat_data[refit_vox])
+            new_start = np.einsum('nij,nj->ni', np.linalg.pinv(clean_design),
+                                  clean_log)
 
-    if resort_to_OLS:
-        warnings.warn(ols_resort_msg, UserWarning)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                weights = keep / flat_sigma[refit_vox] ** 2
+            new_params, new_success = _nlls_batch(
+                design_matrix, flat_data[refit_vox], new_start, 'gmm',
+                weights, jac)
+            this_params[refit_vox] = new_params
+            success[refit_vox] = new_success
+
+    # If the problem is ill-posed (e.g. too few data points), we'll resort to
+    # the OLS solution:
+    except (np.linalg.LinAlgError, TypeError):
+        this_params = start_params
+        success = np.zeros(len(flat_data), dtype=bool)
+
+    # If leastsq produced non-finite values, we'll resort to the last starting
+    # point of the optimization in these voxels:
+    params, model_S0 = _nlls_to_params(this_params, start_params, success,
+                                       npa, fail_is_nan=fail_is_nan)
 
     params.shape = data.shape[:-1] + (npa,)
     extra = {"robust": robust}
@@ -3,7 +3,7 @@ import numpy as np
 from dipy.reconst.odf import OdfModel, OdfFit
 from dipy.reconst.cache import Cache
 import warnings
-from dipy.reconst.multi_voxel import multi_voxel_fit
+from dipy.reconst.multi_voxel import multi_voxel_fit, DenseMultiVoxelFit
 
 
 class GeneralizedQSamplingModel(OdfModel, Cache):
@@ -81,6 +81,14 @@ class GeneralizedQSamplingModel(OdfModel, Cache):
     def fit(self, data):
         return GeneralizedQSamplingFit(self, data)
 
+    def fit_batch(self, data):
+        """The GQI fit holds the signal itself, so there is nothing to fit."""
+        return data
+
+    def fit_from_params(self, params, mask):
+        return DenseMultiVoxelFit(self, params, mask, GeneralizedQSamplingFit,
+                                  vectorized=True)
+
 
 class GeneralizedQSamplingFit(OdfFit):
 
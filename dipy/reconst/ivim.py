@@ -4,6 +4,7 @@ import warnings
 import numpy as np
 from scipy.optimize import least_squares, differential_evolution
 
+from dipy.core.optimize import leastsq_batch
 from dipy.reconst.base import ReconstModel
 from dipy.reconst.multi_voxel import multi_voxel_fit
 from dipy.utils.optpkg import optional_package
@@ -19,8 +20,9 @@ def ivim_prediction(params, gtab):
 
     Parameters
     ----------
-    params : array
-        An array of IVIM parameters - [S0, f, D_star, D].
+    params : array (..., 4)
+        An array of IVIM parameters - [S0, f, D_star, D] - in the last
+        dimension.
 
     gtab : GradientTable class instance
         Gradient directions and bvalues.
@@ -32,12 +34,12 @@ def ivim_prediction(params, gtab):
 
     Returns
     -------
-    S : array
+    S : array (..., len(bvals))
         An array containing the IVIM signal estimated using given parameters.
 
     """
     b = gtab.bvals
-    S0, f, D_star, D = params
+    S0, f, D_star, D = np.moveaxis(np.asarray(params)[..., None], -2, 0)
 
     S = S0 * (f * np.exp(-b * D_star) + (1 - f) * np.exp(-b * D))
 
@@ -128,6 +130,70 @@ def f_D_star_error(params, gtab, signal, S0, D):
     return signal - f_D_star_prediction([f, D_star], gtab, S0, D)
 
 
+def _ivim_residuals_batch(params, signal, bvals):
+    """Residuals of the IVIM model for many voxels at once.
+
+    Parameters
+    ----------
+    params : array (N, 4)
+        The IVIM parameters [S0, f, D_star, D] of N voxels.
+    signal : array (N, len(bvals))
+        The measured signal.
+    bvals : array
+        The b-values.
+
+    Returns
+    -------
+    residual : array (N, len(bvals))
+    """
+    S0, f, D_star, D = params.T[..., None]
+    return signal - S0 * (f * np.exp(-bvals * D_star) +
+                          (1 - f) * np.exp(-bvals * D))
+
+
+def _ivim_jacobian_batch(params, signal, bvals):
+    """Jacobian of :func:`_ivim_residuals_batch` (N, len(bvals), 4)."""
+    S0, f, D_star, D = params.T[..., None]
+    E_star = np.exp(-bvals * D_star)
+    E = np.exp(-bvals * D)
+    return -np.stack([f * E_star + (1 - f) * E,
+                      S0 * (E_star - E),
+                      -S0 * f * bvals * E_star,
+                      -S0 * (1 - f) * bvals * E], axis=-1)
+
+
+def _f_D_star_residuals_batch(params, signal, S0, D, bvals):
+    """Residuals of the IVIM model with S0 and D fixed, for many voxels.
+
+    Parameters
+    ----------
+    params : array (N, 2)
+        The values of f and D_star of N voxels.
+    signal : array (N, len(bvals))
+        The measured signal.
+    S0, D : array (N,)
+        The parameters S0 and D obtained from a linear fit.
+    bvals : array
+        The b-values.
+
+    Returns
+    -------
+    residual : array (N, len(bvals))
+    """
+    f, D_star = params.T[..., None]
+    return signal - S0[:, None] * (f * np.exp(-bvals * D_star) +
+                                   (1 - f) * np.exp(-bvals * D[:, None]))
+
+
+def _f_D_star_jacobian_batch(params, signal, S0, D, bvals):
+    """Jacobian of :func:`_f_D_star_residuals_batch` (N, len(bvals), 2)."""
+    f, D_star = params.T[..., None]
+    E_star = np.exp(-bvals * D_star)
+    E = np.exp(-bvals * D[:, None])
+    return -S0[:, None, None] * np.stack([E_star - E,
+                                          -f * bvals * E_star], axis=-1)
+
+
 def ivim_model_selector(gtab, fit_method='trr', **kwargs):
     """
     Selector function to switch between the 2-stage Trust-Region Reflective
@@ -173,7 +239,8 @@ class IvimModelTRR(ReconstModel):
     def __init__(self, gtab, split_b_D=400.0, split_b_S0=200., bounds=None,
                  two_stage=True, tol=1e-15,
                  x_scale=(1000., 0.1, 0.001, 0.0001),
-                 gtol=1e-15, ftol=1e-15, eps=1e-15, maxiter=1000):
+                 gtol=1e-15, ftol=1e-15, eps=1e-15, maxiter=1000,
+                 warm_start=False):
 
         r"""
         Initialize an IVIM model.
@@ -251,6 +318,22 @@ class IvimModelTRR(ReconstModel):
             Maximum number of iterations to perform.
             default : 1000
 
+        warm_start : bool, optional
+            When fitting many voxels at once, voxels whose linear fit is not
+            a feasible initial guess for the non-linear fits start from the
+            solution of the nearest voxel (in fitting order, i.e. along the
+            last axis of the volume) that has one, instead of keeping the
+            linear fit.
+            default : False
+
+        Notes
+        -----
+        When the model is fitted to more than one voxel, all the voxels are
+        fitted at once: the linear fits are done with a single least-squares
+        solve and the non-linear refinements with a vectorized
+        Levenberg-Marquardt algorithm (see
+        :func:`dipy.core.optimize.leastsq_batch`).
+
         References
         ----------
         .. [1] Le Bihan, Denis, et al. "Separation of diffusion and perfusion
@@ -284,6 +367,7 @@ class IvimModelTRR(ReconstModel):
         self.options = {'gtol': gtol, 'ftol': ftol,
                         'eps': eps, 'maxiter': maxiter}
         self.x_scale = x_scale
+        self.warm_start = warm_start
 
         self.bounds = bounds or BOUNDS
 
@@ -348,13 +432,117 @@ class IvimModelTRR(ReconstModel):
         else:
             return IvimFit(self, params_linear)
 
+    def fit_batch(self, data):
+        """Fit the IVIM model to many voxels at once.
+
+        The steps are the same as in :meth:`fit`, applied to all the voxels
+        together.
+
+        Parameters
+        ----------
+        data : array (N, len(bvals))
+            The measured signal of N voxels.
+
+        Returns
+        -------
+        params : array (N, 4)
+            The IVIM parameters [S0, f, D_star, D] of each voxel.
+        """
+        S0_prime, D = self.estimate_linear_fit(
+            data, self.split_b_D, less_than=False)
+        S0, D_star_prime = self.estimate_linear_fit(data, self.split_b_S0,
+                                                    less_than=True)
+        f_guess = 1 - S0_prime / S0
+
+        # Fit f and D_star with S0 and D fixed.
+        warningMsg = "x0 obtained from linear fitting is not feasible"
+        warningMsg += " as initial guess for leastsq while estimating "
+        warningMsg += "f and D_star. Using parameters from the "
+        warningMsg += "linear fit."
+        f_D_star = self._leastsq_batch(
+            _f_D_star_residuals_batch, _f_D_star_jacobian_batch,
+            np.column_stack([f_guess, D_star_prime]),
+            ((0., 0.), (self.bounds[1][1], self.bounds[1][2])),
+            (data, S0, D), warningMsg)
+        params_linear = np.column_stack([S0, f_D_star, D])
+        if not self.two_stage:
+            return params_linear
+
+        warningMsg = "x0 is unfeasible for leastsq fitting."
+        warningMsg += " Returning x0 values from the linear fit."
+        params_two_stage = self._leastsq_batch(
+            _ivim_residuals_batch, _ivim_jacobian_batch, params_linear,
+            self.bounds, (data,), warningMsg)
+        bounds_violated = ~(np.all(params_two_stage >= self.bounds[0], -1) &
+                            np.all(params_two_stage <= self.bounds[1], -1))
+        if np.any(bounds_violated):
+            warningMsg = "Bounds are violated for leastsq fitting. "
+            warningMsg += "Returning parameters from linear fit"
+            warnings.warn(warningMsg, UserWarning)
+            params_two_stage[bounds_violated] = params_linear[bounds_violated]
+        return params_two_stage
+
+    def fit_from_params(self, params, mask=None):
+        """Build the fit object of a volume from its IVIM parameters.
+
+        Parameters
+        ----------
+        params : array (..., 4)
+            The IVIM parameters of each voxel.
+        mask : array, optional
+            Not used, voxels outside the mask have all parameters set to zero.
+
+        Returns
+        -------
+        IvimFit object
+        """
+        return IvimFit(self, params)
+
+    def _leastsq_batch(self, residuals, jacobian, x0, bounds, batch_args,
+                       warning_msg):
+        """Bounded non-linear least-squares fit of many voxels.
+
+        Voxels whose initial guess `x0` lies outside the bounds keep it and a
+        warning is raised, unless `warm_start` is set, in which case they
+        start from the solution of the nearest feasible voxel.
+        """
+        lower, upper = (np.broadcast_to(bound, x0.shape) for bound in bounds)
+        feasible = np.all((x0 >= lower) & (x0 <= upper), axis=-1)
+
+        def solve(idx, start):
+            x, _ = leastsq_batch(residuals, start, Dfun=jacobian,
+                                 args=(self.gtab.bvals,),
+                                 batch_args=tuple(arg[idx]
+                                                  for arg in batch_args),
+                                 ftol=self.options["ftol"], xtol=self.tol,
+                                 max_iter=self.options["maxiter"],
+                                 bounds=(lower[idx], upper[idx]))
+            return x
+
+        x = x0.copy()
+        x[feasible] = solve(feasible, x0[feasible])
+        infeasible = np.flatnonzero(~feasible)
+        if infeasible.size:
+            if self.warm_start and np.any(feasible):
+                candidates = np.flatnonzero(feasible)
+                pos = np.searchsorted(candidates, infeasible)
+                before = candidates[np.maximum(pos - 1, 0)]
+                after = candidates[np.minimum(pos, len(candidates) - 1)]
+                nearest = np.where(infeasible - before <= after - infeasible,
+                                   before, after)
+                x[infeasible] = solve(infeasible, x[nearest])
+            else:
+                warnings.warn(warning_msg, UserWarning)
+        return x
+
     def estimate_linear_fit(self, data, split_b, less_than=True):
         """Estimate a linear fit by taking log of data.
 
         Parameters
         ----------
         data : array
-            An array containing the data to be fit
+            An array containing the data to be fit. Multiple voxels can be
+            fit at once with a (..., len(bvals)) array.
 
         split_b : float
             The b value to split the data
@@ -364,24 +552,23 @@ class IvimModelTRR(ReconstModel):
 
         Returns
         -------
-        S0 : float
+        S0 : float or array
             The estimated S0 value. (intercept)
 
-        D : float
+        D : float or array
             The estimated value of D.
         """
         if less_than:
-            bvals_split = self.gtab.bvals[self.gtab.bvals <= split_b]
-            D, neg_log_S0 = np.polyfit(bvals_split,
-                                       -np.log(data[self.gtab.bvals <=
-                                                    split_b]), 1)
+            split = self.gtab.bvals <= split_b
         else:
-            bvals_split = self.gtab.bvals[self.gtab.bvals >= split_b]
-            D, neg_log_S0 = np.polyfit(bvals_split,
-                                       -np.log(data[self.gtab.bvals >=
-                                                    split_b]), 1)
-
-        S0 = np.exp(-neg_log_S0)
+            split = self.gtab.bvals >= split_b
+        neg_log_data = -np.log(data[..., split])
+        D, neg_log_S0 = np.polyfit(self.gtab.bvals[split],
+                                   neg_log_data.reshape((-1, split.sum())).T,
+                                   1)
+
+        S0 = np.exp(-neg_log_S0).reshape(data.shape[:-1])[()]
+        D = D.reshape(data.shape[:-1])[()]
         return S0, D
 
     def estimate_f_D_star(self, params_f_D_star, data, S0, D):
@@ -510,7 +697,8 @@ class IvimModelTRR(ReconstModel):
 
 class IvimModelVP(ReconstModel):
 
-    def __init__(self, gtab, bounds=None, maxiter=10, xtol=1e-8):
+    def __init__(self, gtab, bounds=None, maxiter=10, xtol=1e-8,
+                 grid_search=False):
         r""" Initialize an IvimModelVP class.
 
         The IVIM model assumes that biological tissue includes a volume
@@ -539,6 +727,14 @@ class IvimModelVP(ReconstModel):
             Tolerance for convergence of minimization.
             default : 1e-8
 
+        grid_search : bool, optional
+            When fitting many voxels at once, replace the differential
+            evolution by a search on a regular grid and the convex
+            optimization by its closed form solution, both applied to all the
+            voxels together (see :meth:`fit_batch`). This is much faster, but
+            the results differ slightly from those of the voxel by voxel fit.
+            default : False
+
         References
         ----------
         .. [1] Le Bihan, Denis, et al. "Separation of diffusion and perfusion
@@ -560,6 +756,7 @@ class IvimModelVP(ReconstModel):
         self.yhat_diffusion = np.zeros(self.bvals.shape[0])
         self.exp_phi1 = np.zeros((self.bvals.shape[0], 2))
         self.bounds = bounds or (BOUNDS[0][1:], BOUNDS[1][1:])
+        self.grid_search = grid_search
 
     @multi_voxel_fit
     def fit(self, data, bounds_de=None):
@@ -589,6 +786,10 @@ class IvimModelVP(ReconstModel):
                (2016).
 
         """
+        return IvimFit(self, self._fit_params(data))
+
+    def _fit_params(self, data):
+        """The IVIM parameters [S0, f, D_star, D] of a single voxel."""
         data_max = data.max()
         data = data / data_max
         b = self.bvals
@@ -623,8 +824,122 @@ class IvimModelVP(ReconstModel):
         S0_est = S0 * data_max
 
         # final result containing the four fit parameters: S0, f, D* and D
-        result = np.insert(result, 0, np.mean(S0_est), axis=0)
-        return IvimFit(self, result)
+        return np.insert(result, 0, np.mean(S0_est), axis=0)
+
+    def fit_batch(self, data):
+        """Fit the IVIM model to many voxels at once.
+
+        By default, the voxels are fitted one by one as in :meth:`fit`.
+
+        With `grid_search`, the three steps of :meth:`fit` are applied to all
+        the voxels together. The differential evolution is replaced by an
+        exhaustive search of the variable projection cost on a regular grid
+        spanning the same search space, and the volume fractions, a one
+        dimensional constrained linear least-squares problem, are computed in
+        closed form instead of with cvxpy. The final non-linear least-squares
+        fit uses :func:`dipy.core.optimize.leastsq_batch`.
+
+        Parameters
+        ----------
+        data : array (N, len(bvals))
+            The measured signal of N voxels.
+
+        Returns
+        -------
+        params : array (N, 4)
+            The IVIM parameters [S0, f, D_star, D] of each voxel.
+        """
+        if not self.grid_search:
+            params = np.zeros((len(data), 4))
+            for i, voxel in enumerate(data):
+                params[i] = self._fit_params(voxel)
+            return params
+
+        data_max = data.max(axis=-1, keepdims=True)
+        signal = data / data_max
+        b = self.bvals
+
+        # Optimizer #1: Grid search over the bounds of the differential
+        # evolution of `fit`
+        x = self._grid_search_batch(signal, [(0.005, 0.01), (10**-4, 0.001)])
+
+        # Optimizer #2: Constrained linear fit of the volume fractions, with
+        # the constraints of `cvx_fit` (f + (1 - f) == 1 holds by design)
+        E_star = np.exp(-b * x[:, :1])
+        E = np.exp(-b * x[:, 1:])
+        dE = E_star - E
+        with np.errstate(invalid='ignore', divide='ignore'):
+            f = np.sum(dE * (signal - E), -1) / np.sum(dE ** 2, -1)
+        f = np.clip(np.nan_to_num(f), max(0.011, 1 - 0.89),
+                    min(self.bounds[1][0], 1 - 0.011))
+        x_f = np.column_stack([f, x])
+
+        # Optimizer #3: Nonlinear-Least Squares
+        x_f = np.clip(x_f, self.bounds[0], self.bounds[1])
+        x_f, _ = leastsq_batch(self._nlls_residuals_batch, x_f,
+                               Dfun=self._nlls_jacobian_batch,
+                               batch_args=(signal,), xtol=self.xtol,
+                               bounds=self.bounds)
+        f_est, D_star_est, D_est = x_f.T[..., None]
+
+        S0 = data / (f_est * np.exp(-b * D_star_est) + (1 - f_est) *
+                     np.exp(-b * D_est))
+
+        # final result containing the four fit parameters: S0, f, D* and D
+        return np.column_stack([np.mean(S0, axis=-1), x_f])
+
+    def fit_from_params(self, params, mask=None):
+        """Build the fit object of a volume from its IVIM parameters.
+
+        Parameters
+        ----------
+        params : array (..., 4)
+            The IVIM parameters of each voxel.
+        mask : array, optional
+            Not used, voxels outside the mask have all parameters set to zero.
+
+        Returns
+        -------
+        IvimFit object
+        """
+        return IvimFit(self, params)
+
+    def _grid_search_batch(self, signal, bounds, grid_size=32):
+        """Minimize the variable projection cost (see `ivim_mix_cost_one`) of
+        many voxels over a regular grid of the non-linear parameters.
+
+        Returns the (N, 2) best values of D_star and D.
+        """
+        grid = [np.linspace(low, high, grid_size) for low, high in bounds]
+        D = grid[1]
+        best_cost = np.full(len(signal), np.inf)
+        best = np.zeros((len(signal), 2))
+        for D_star in grid[0]:
+            # Orthonormal bases of the columns of phi for all values of D
+            phi = np.stack([np.exp(-np.outer(np.full(grid_size, D_star),
+                                             self.bvals)),
+                            np.exp(-np.outer(D, self.bvals))], axis=-1)
+            Q = np.linalg.qr(phi)[0]
+            projection = np.dot(signal, np.concatenate(Q, axis=-1))
+            projection = projection.reshape((len(signal), grid_size, 2))
+            cost = -np.sum(projection ** 2, axis=-1)
+            idx = np.argmin(cost, axis=-1)
+            cost = cost[np.arange(len(signal)), idx]
+            better = cost < best_cost
+            best_cost[better] = cost[better]
+            best[better] = np.column_stack([np.full(better.sum(), D_star),
+                                            D[idx[better]]])
+        return best
+
+    def _nlls_residuals_batch(self, x_f, signal):
+        """Residuals of the last step of :meth:`fit_batch`."""
+        params = np.column_stack([np.ones(len(x_f)), x_f])
+        return _ivim_residuals_batch(params, signal, self.bvals)
+
+    def _nlls_jacobian_batch(self, x_f, signal):
+        """Jacobian of :meth:`_nlls_residuals_batch`."""
+        params = np.column_stack([np.ones(len(x_f)), x_f])
+        return _ivim_jacobian_batch(params, signal, self.bvals)[..., 1:]
 
     def stoc_search_cost(self, x, signal):
         """
@@ -6,14 +6,58 @@ from tqdm import tqdm
 from dipy.core.ndindex import ndindex
 from dipy.reconst.quick_squash import quick_squash as _squash
 from dipy.reconst.base import ReconstFit
+from dipy.utils.parallel import SharedArray, get_executor
+
+# Default number of masked voxels handed to ``fit_batch`` at a time.
+BATCH_CHUNK_SIZE = 10000
 
 
 def multi_voxel_fit(single_voxel_fit):
     """Method decorator to turn a single voxel model fit
     definition into a multi voxel model fit definition
+
+    Models can opt in to batched fitting by defining two methods:
+
+    ``fit_batch(data)``
+        Takes an (N, g) array holding N masked voxels and returns an (N, ...)
+        array of model parameters.
+    ``fit_from_params(params, mask)``
+        Takes the dense parameter array, with the shape of the data volume
+        (unmasked voxels are zero), and returns the multi voxel fit object.
+
+    When both are available, the masked voxels are fitted in chunks of
+    ``BATCH_CHUNK_SIZE`` voxels and no per-voxel fit objects are created.
+
+    The decorated method accepts ``engine``, ``n_jobs`` and ``chunk_size``
+    keyword arguments. With an engine other than "serial", the masked voxels
+    are split in chunks that are fitted in parallel by the executor of
+    :func:`dipy.utils.parallel.get_executor`. Worker processes read the data
+    from shared memory.
     """
-    def new_fit(self, data, mask=None):
-        """Fit method for every voxel in data"""
+    def new_fit(self, data, mask=None, engine="serial", n_jobs=None,
+                chunk_size=None):
+        """Fit method for every voxel in data
+
+        Parameters
+        ----------
+        data : ndarray
+            The signal, diffusion-weighted measurements in the last axis.
+        mask : ndarray, optional
+            Boolean mask of the voxels to fit. Default: all voxels.
+        engine : str, optional
+            {"serial", "thread", "process", "joblib", "dask", "ray"}
+            "serial" fits the voxels in the calling process, the others fit
+            chunks of voxels in parallel. With process based engines, single
+            voxel fit objects are pickled back from the workers, so their
+            ``model`` attribute is a copy of the model. Default: "serial".
+        n_jobs : int, optional
+            Number of parallel workers. See
+            :func:`dipy.utils.multiproc.determine_num_processes`. Default:
+            all cores.
+        chunk_size : int, optional
+            Maximum number of voxels fitted at once by ``fit_batch`` or sent
+            to a worker.
+        """
         # If only one voxel just return a normal fit
         if data.ndim == 1:
             return single_voxel_fit(self, data)
@@ -27,6 +71,20 @@ def multi_voxel_fit(single_voxel_fit):
         elif mask.shape != data.shape[:-1]:
             raise ValueError("mask and data shape do not match")
 
+        batched = hasattr(self, 'fit_batch') and hasattr(self,
+                                                         'fit_from_params')
+        if engine != "serial":
+            result = _fit_parallel(self, single_voxel_fit.__name__, data,
+                                   mask, batched, engine, n_jobs, chunk_size)
+            if batched:
+                return self.fit_from_params(result, mask)
+            return MultiVoxelFit(self, result, mask)
+
+        if batched:
+            params = _fit_batches(self, data, mask,
+                                  chunk_size or BATCH_CHUNK_SIZE)
+            return self.fit_from_params(params, mask)
+
         # Fit data where mask is True
         fit_array = np.empty(data.shape[:-1], dtype=object)
         bar = tqdm(total=np.sum(mask), position=0)
@@ -39,6 +97,154 @@ def multi_voxel_fit(single_voxel_fit):
     return new_fit
 
 
+def _fit_batches(model, data, mask, chunk_size):
+    """Fit the masked voxels of `data` with ``model.fit_batch`` in chunks.
+
+    Parameters
+    ----------
+    model : object
+        Model defining ``fit_batch``.
+    data : ndarray (..., g)
+        Signal volume.
+    mask : ndarray (...)
+        Boolean mask of the voxels to fit.
+    chunk_size : int
+        Maximum number of voxels passed to ``fit_batch`` at once.
+
+    Returns
+    -------
+    params : ndarray
+        Dense array of parameters with shape ``data.shape[:-1] + p`` where
+        ``p`` is the shape of the parameters of a single voxel. Voxels outside
+        the mask are set to zero.
+    """
+    coords = np.nonzero(mask)
+    n_voxels = len(coords[0])
+    idx = coords
+    params = None
+    bar = tqdm(total=n_voxels, position=0)
+    for start in range(0, n_voxels, chunk_size):
+        idx = tuple(c[start:start + chunk_size] for c in coords)
+        chunk_params = np.asarray(model.fit_batch(data[idx]))
+        if params is None:
+            params = np.zeros(data.shape[:-1] + chunk_params.shape[1:],
+                              dtype=chunk_params.dtype)
+        params[idx] = chunk_params
+        bar.update(len(idx[0]))
+    bar.close()
+    if params is None:
+        # Nothing to fit, ask the model for the shape of its parameters
+        empty = np.asarray(model.fit_batch(data[idx]))
+        params = np.zeros(data.shape[:-1] + empty.shape[1:],
+                          dtype=empty.dtype)
+    return params
+
+
+def _fit_chunk(bounds, model, fit_name, data, params):
+    """Fit the masked voxels ``start:stop`` in a worker"""
+    start, stop = bounds
+    if params is not None:
+        params[start:stop] = model.fit_batch(data[start:stop])
+        return None
+    fit = getattr(model, fit_name)
+    return [fit(voxel) for voxel in data[start:stop]]
+
+
+def _fit_parallel(model, fit_name, data, mask, batched, engine, n_jobs,
+                  chunk_size):
+    """Fit the masked voxels of `data` with a parallel executor.
+
+    With process based engines, the masked voxels are copied to a shared
+    memory block which the workers read without copying, and the parameters
+    of batched models are written by the workers directly into a shared
+    output array.
+
+    Parameters
+    ----------
+    model : object
+        The model to fit.
+    fit_name : str
+        Name of the decorated fit method of `model`.
+    data : ndarray (..., g)
+        Signal volume.
+    mask : ndarray (...)
+        Boolean mask of the voxels to fit.
+    batched : bool
+        Whether the model defines ``fit_batch`` and ``fit_from_params``.
+    engine : str
+        Engine of :func:`dipy.utils.parallel.get_executor`.
+    n_jobs : int or None
+        Number of workers.
+    chunk_size : int or None
+        Number of voxels per task. By default, the voxels are split in about
+        four chunks per worker, of at most ``BATCH_CHUNK_SIZE`` voxels.
+
+    Returns
+    -------
+    result : ndarray
+        Dense parameter array if `batched`, else object array of single voxel
+        fits.
+    """
+    executor = get_executor(engine, n_jobs=n_jobs)
+    coords = np.nonzero(mask)
+    n_voxels = len(coords[0])
+    if chunk_size is None:
+        chunk_size = int(np.ceil(n_voxels / (4 * executor.n_jobs)))
+        chunk_size = min(max(chunk_size, 1), BATCH_CHUNK_SIZE)
+    bounds = [(start, min(start + chunk_size, n_voxels))
+              for start in range(0, n_voxels, chunk_size)]
+
+    if batched:
+        # Fit the first voxel to learn the shape of the parameters
+        first = np.asarray(model.fit_batch(data[tuple(c[:1] for c in coords)]))
+        result = np.zeros(data.shape[:-1] + first.shape[1:],
+                          dtype=first.dtype)
+    else:
+        result = np.empty(data.shape[:-1], dtype=object)
+    if n_voxels == 0:
+        return result
+
+    def allocate(shape, dtype):
+        if executor.uses_processes:
+            shared = SharedArray(shape, dtype)
+            blocks.append(shared)
+            return shared, shared.array
+        arr = np.empty(shape, dtype=dtype)
+        return arr, arr
+
+    blocks = []
+    try:
+        masked_data, masked_view = allocate((n_voxels, data.shape[-1]),
+                                            data.dtype)
+        for start, stop in bounds:
+            idx = tuple(c[start:stop] for c in coords)
+            masked_view[start:stop] = data[idx]
+        params, params_view = None, None
+        if batched:
+            params, params_view = allocate(
+                (n_voxels,) + result.shape[mask.ndim:], result.dtype)
+
+        bar = tqdm(total=n_voxels, position=0)
+        for i, fits in executor.map(_fit_chunk, bounds, chunk_size=1,
+                                    func_args=[model, fit_name, masked_data,
+                                               params]):
+            start, stop = bounds[i]
+            if fits is not None:
+                idx = tuple(c[start:stop] for c in coords)
+                for n, ijk in enumerate(zip(*idx)):
+                    result[ijk] = fits[n]
+            bar.update(stop - start)
+        bar.close()
+        if batched:
+            result[coords] = params_view
+    finally:
+        # Release the views before closing the shared memory blocks
+        del masked_view, params_view
+        for shared in blocks:
+            shared.close()
+    return result
+
+
 class MultiVoxelFit(ReconstFit):
     """Holds an array of fits and allows access to their attributes and
     methods"""
@@ -112,3 +318,110 @@ class CallableArray(np.ndarray):
             if item is not None:
                 result[ijk] = item(*args, **kwargs)
         return _squash(result)
+
+
+class DenseMultiVoxelFit(MultiVoxelFit):
+    """Multi voxel fit backed by a dense array of model parameters
+
+    Parameters
+    ----------
+    model : object
+        The model that was fit.
+    params : ndarray (..., p)
+        Model parameters of every voxel. Voxels outside `mask` are zero.
+    mask : ndarray (...)
+        Boolean mask of the voxels that were fit.
+    fit_class : callable
+        Single voxel fit class, called as ``fit_class(model, params)``.
+    vectorized : bool, optional
+        If True, ``fit_class`` also accepts an (N, p) array of parameters
+        and its attributes and methods return arrays with one row per voxel.
+        Derived quantities are then computed for all the voxels at once.
+        Otherwise they are computed by building a fit object for each voxel.
+
+    Notes
+    -----
+    Attributes that are not callable are computed once and cached.
+    """
+
+    def __init__(self, model, params, mask, fit_class, vectorized=False):
+        self.model = model
+        self.params = params
+        self.mask = mask
+        self.fit_class = fit_class
+        self.vectorized = vectorized
+        self._cache = {}
+        self._fit_array = None
+        self._batch_fit = None
+
+    @property
+    def shape(self):
+        return self.mask.shape
+
+    @property
+    def fit_array(self):
+        """Object array of single voxel fits, built on first access"""
+        if self._fit_array is None:
+            fit_array = np.empty(self.mask.shape, dtype=object)
+            for ijk in zip(*np.nonzero(self.mask)):
+                fit_array[ijk] = self.fit_class(self.model, self.params[ijk])
+            self._fit_array = fit_array
+        return self._fit_array
+
+    @property
+    def batch_fit(self):
+        """Fit object holding the parameters of all the masked voxels"""
+        if self._batch_fit is None:
+            self._batch_fit = self.fit_class(self.model,
+                                             self.params[self.mask])
+        return self._batch_fit
+
+    def _scatter(self, values):
+        """Place per masked voxel `values` in an array shaped like the fit"""
+        values = np.asarray(values)
+        shape = self.mask.shape
+        if values.ndim:
+            shape += values.shape[1:]
+        result = np.zeros(shape, dtype=values.dtype)
+        result[self.mask] = values
+        return result
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if attr in self._cache:
+            return self._cache[attr]
+        if not self.vectorized:
+            result = MultiVoxelFit.__getattr__(self, attr)
+            if not callable(result):
+                self._cache[attr] = result
+            return result
+
+        value = getattr(self.batch_fit, attr)
+        if callable(value):
+            def vectorized_method(*args, **kwargs):
+                return self._scatter(value(*args, **kwargs))
+            return vectorized_method
+        result = self._scatter(value)
+        self._cache[attr] = result
+        return result
+
+    def __getitem__(self, index):
+        mask = self.mask[index]
+        if isinstance(mask, np.ndarray) and mask.ndim:
+            return DenseMultiVoxelFit(self.model, self.params[index], mask,
+                                      self.fit_class, self.vectorized)
+        if not mask:
+            return None
+        return self.fit_class(self.model, self.params[index])
+
+    def predict(self, *args, **kwargs):
+        if not self.vectorized:
+            return MultiVoxelFit.predict(self, *args, **kwargs)
+        if not hasattr(self.batch_fit, 'predict'):
+            msg = "This model does not have prediction implemented yet"
+            raise NotImplementedError(msg)
+        S0 = kwargs.get('S0')
+        if isinstance(S0, np.ndarray) and S0.shape == self.mask.shape:
+            kwargs['S0'] = S0[self.mask]
+        return self._scatter(self.batch_fit.predict(*args, **kwargs))
@@ -754,6 +754,24 @@ class SphHarmModel(OdfModel, Cache):
             self.cache_set("sampling_matrix", sphere, sampling_matrix)
         return sampling_matrix
 
+    def fit_from_params(self, shm_coeff, mask=None):
+        """Build a fit object from spherical harmonic coefficients.
+
+        Used by ``multi_voxel_fit`` for models defining ``fit_batch``.
+
+        Parameters
+        ----------
+        shm_coeff : ndarray (..., M)
+            Spherical harmonic coefficients of every voxel.
+        mask : ndarray (...), optional
+            Voxels for which the coefficients were fitted.
+
+        Returns
+        -------
+        fit : SphHarmFit
+        """
+        return SphHarmFit(self, shm_coeff, mask)
+
 
 class QballBaseModel(SphHarmModel):
     """To be subclassed by Qball type models."""
@@ -6,7 +6,7 @@ import numpy as np
 from scipy.special import genlaguerre, gamma, hyp2f1
 
 from dipy.reconst.cache import Cache
-from dipy.reconst.multi_voxel import multi_voxel_fit
+from dipy.reconst.multi_voxel import multi_voxel_fit, DenseMultiVoxelFit
 from dipy.reconst.shm import real_sh_descoteaux_from_index
 from dipy.core.geometry import cart2sphere
 
@@ -210,8 +210,8 @@ class ShoreModel(Cache):
         self.pos_grid = pos_grid
         self.pos_radius = pos_radius
 
-    @multi_voxel_fit
-    def fit(self, data):
+    def _shore_matrices(self):
+        """The SHORE basis and its regularized pseudo-inverse"""
         Lshore = l_shore(self.radial_order)
         Nshore = n_shore(self.radial_order)
         # Generate the SHORE basis
@@ -227,22 +227,58 @@ class ShoreModel(Cache):
                 np.linalg.inv(np.dot(M.T, M) + self.lambdaN * Nshore +
                               self.lambdaL * Lshore), M.T)
             self.cache_set('shore_matrix_reg_pinv', self.gtab, MpseudoInv)
+        return M, MpseudoInv
 
-        # Compute the signal coefficients in SHORE basis
+    def _unconstrained_coef(self, data, MpseudoInv):
+        """SHORE coefficients of the signal in the last axis of `data`,
+        normalized so that the signal at the origin is one"""
+        coef = np.dot(data, MpseudoInv.T)
+
+        signal_0 = 0
+
+        for n in range(int(self.radial_order / 2) + 1):
+            signal_0 += (
+                coef[..., n] * (genlaguerre(n, 0.5)(0) * (
+                    (factorial(n)) /
+                    (2 * np.pi * (self.zeta ** 1.5) * gamma(n + 1.5))
+                ) ** 0.5)
+            )
+
+        return coef / signal_0[..., None]
+
+    def fit_batch(self, data):
+        """Fit a block of voxels.
+
+        Parameters
+        ----------
+        data : ndarray (N, g)
+            Signal of N voxels.
+
+        Returns
+        -------
+        coef : ndarray (N, c)
+            SHORE coefficients of each voxel.
+        """
+        M, MpseudoInv = self._shore_matrices()
         if not self.constrain_e0:
-            coef = np.dot(MpseudoInv, data)
+            return self._unconstrained_coef(data, MpseudoInv)
+        coef = np.zeros((data.shape[0], M.shape[1]))
+        for i in range(data.shape[0]):
+            coef[i] = self.fit(data[i]).shore_coeff
+        return coef
 
-            signal_0 = 0
+    def fit_from_params(self, params, mask):
+        return DenseMultiVoxelFit(self, params, mask, ShoreFit)
 
-            for n in range(int(self.radial_order / 2) + 1):
-                signal_0 += (
-                    coef[n] * (genlaguerre(n, 0.5)(0) * (
-                        (factorial(n)) /
-                        (2 * np.pi * (self.zeta ** 1.5) * gamma(n + 1.5))
-                    ) ** 0.5)
-                )
+    @multi_voxel_fit
+    def fit(self, data):
+        Lshore = l_shore(self.radial_order)
+        Nshore = n_shore(self.radial_order)
+        M, MpseudoInv = self._shore_matrices()
 
-            coef = coef / signal_0
+        # Compute the signal coefficients in SHORE basis
+        if not self.constrain_e0:
+            coef = self._unconstrained_coef(data, MpseudoInv)
         else:
             data_norm = data / data[self.gtab.b0s_mask].mean()
             M0 = M[self.gtab.b0s_mask, :]
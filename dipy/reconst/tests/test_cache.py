@@ -1,7 +1,14 @@
-from dipy.reconst.cache import Cache
-from dipy.core.sphere import Sphere
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from numpy.testing import assert_, assert_equal, assert_array_equal
 
-from numpy.testing import assert_, assert_equal
+from dipy.core.gradients import gradient_table
+from dipy.core.sphere import Sphere
+from dipy.reconst.cache import (Cache, MatrixCache, content_hash,
+                                matrix_cache, set_cache_directory,
+                                get_cache_directory)
 
 
 class DummyModel(Cache):
@@ -9,6 +16,11 @@ class DummyModel(Cache):
         pass
 
 
+class ParamModel(Cache):
+    def __init__(self, order):
+        self.order = order
+
+
 def test_basic_cache():
     t = DummyModel()
     s = Sphere(theta=[0], phi=[0])
@@ -22,3 +34,109 @@ def test_basic_cache():
 
     t.cache_clear()
     assert_(t.cache_get("design_matrix", s) is None)
+
+
+def test_content_keys():
+    s1 = Sphere(theta=[0, 1], phi=[0, 1])
+    s2 = Sphere(theta=[0, 1], phi=[0, 1])
+    s3 = Sphere(theta=[0, 1], phi=[0, 2])
+    assert_equal(content_hash(s1), content_hash(s2))
+    assert_(content_hash(s1) != content_hash(s3))
+
+    bvals = np.array([0, 1000, 1000, 1000])
+    bvecs = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    gtab1 = gradient_table(bvals, bvecs)
+    gtab2 = gradient_table(bvals.copy(), bvecs.copy())
+    gtab3 = gradient_table(2 * bvals, bvecs)
+    assert_equal(content_hash(gtab1), content_hash(gtab2))
+    assert_(content_hash(gtab1) != content_hash(gtab3))
+    gtab_lte = gradient_table(bvals, bvecs, btens='LTE')
+    gtab_ste = gradient_table(bvals, bvecs, btens='STE')
+    assert_(content_hash(gtab_lte) != content_hash(gtab_ste))
+    assert_(content_hash(gtab_lte) != content_hash(gtab1))
+
+    # Values are shared between keys of equal content
+    t = DummyModel()
+    m = np.eye(2)
+    t.cache_set("design_matrix", s1, m)
+    assert_(t.cache_get("design_matrix", s2) is m)
+    assert_(t.cache_get("design_matrix", s3) is None)
+
+    # Keys that cannot be hashed by content are compared by identity
+    key = object()
+    t.cache_set("design_matrix", key, m)
+    assert_(t.cache_get("design_matrix", key) is m)
+    assert_(t.cache_get("design_matrix", object()) is None)
+
+    # Tuple keys are compared item by item
+    t.cache_set("response", (s1, 0.5), m)
+    assert_(t.cache_get("response", (s2, 0.5)) is m)
+    assert_(t.cache_get("response", (s2, 1)) is None)
+    assert_(t.cache_get("response", (s3, 0.5)) is None)
+
+
+def test_key_digest_memo():
+    from dipy.reconst.cache import _key_digests
+    s = Sphere(theta=[0, 1], phi=[0, 1])
+    t = DummyModel()
+    t.cache_set("design_matrix", s, 1)
+    assert_(id(s) in _key_digests)
+    assert_equal(t.cache_get("design_matrix", s), 1)
+    key = id(s)
+    del s
+    assert_(key not in _key_digests)
+
+
+def test_lru_eviction():
+    cache = MatrixCache(max_bytes=2 * 8 * 100)
+    for i in range(3):
+        cache.set("m", i, np.zeros(100))
+    assert_(cache.get("m", 0) is None)
+    assert_(cache.get("m", 1) is not None)
+    assert_(cache.get("m", 2) is not None)
+    assert_equal(cache.nbytes, 2 * 8 * 100)
+
+    # Accessing a value makes it the most recently used one
+    cache.get("m", 1)
+    cache.set("m", 3, np.zeros(100))
+    assert_(cache.get("m", 2) is None)
+    assert_(cache.get("m", 1) is not None)
+
+    # A value larger than the budget is still kept
+    cache.set("m", 4, np.zeros(1000))
+    assert_(cache.get("m", 4) is not None)
+    assert_equal(cache.nbytes, 8 * 1000)
+
+
+def test_persistence():
+    previous = get_cache_directory()
+    with TemporaryDirectory() as tmpdir:
+        try:
+            set_cache_directory(tmpdir)
+            s = Sphere(theta=[0, 1], phi=[0, 1])
+            m = np.arange(6.).reshape(2, 3)
+
+            MatrixCache().set("m", s, m)
+            assert_equal(len(os.listdir(tmpdir)), 1)
+            loaded = MatrixCache().get("m", Sphere(theta=[0, 1], phi=[0, 1]))
+            assert_array_equal(loaded, m)
+            # Different namespaces do not share values
+            assert_(MatrixCache(namespace="other").get("m", s) is None)
+
+            # Models with equal parameters share their persisted values
+            ParamModel(8).cache_set("m", s, m)
+            assert_array_equal(ParamModel(8).cache_get("m", s), m)
+            assert_(ParamModel(6).cache_get("m", s) is None)
+        finally:
+            set_cache_directory(previous)
+
+    # Without a directory, values only live in memory
+    assert_(ParamModel(8).cache_get("m", s) is None)
+
+
+def test_matrix_cache_read_only():
+    s = Sphere(theta=[0, 1], phi=[0, 1])
+    m = matrix_cache.get_or_compute("test_read_only", s, np.ones, (2, 3))
+    assert_(not m.flags.writeable)
+    assert_(matrix_cache.get_or_compute("test_read_only", s, np.zeros,
+                                        (2, 3)) is m)
@@ -0,0 +1,126 @@
+import os
+from tempfile import TemporaryDirectory
+import warnings
+
+import nibabel as nib
+import numpy as np
+import numpy.testing as npt
+
+from dipy.core.gradients import gradient_table
+from dipy.data import get_fnames, default_sphere
+from dipy.direction.peaks import peaks_from_model
+from dipy.io.gradients import read_bvals_bvecs
+from dipy.io.image import save_nifti
+from dipy.reconst.chunked import fit_chunked, iter_slabs, peaks_metric
+from dipy.reconst.csdeconv import ConstrainedSphericalDeconvModel
+from dipy.reconst.dti import TensorModel
+from dipy.reconst.shm import descoteaux07_legacy_msg
+from dipy.sims.voxel import multi_tensor
+from dipy.testing.decorators import set_random_number_generator
+
+
+def _simulated_volume(rng, shape=(4, 3, 5)):
+    fimg, fbvals, fbvecs = get_fnames('small_64D')
+    bvals, bvecs = read_bvals_bvecs(fbvals, fbvecs)
+    gtab = gradient_table(bvals, bvecs)
+    mevals = np.array([[0.0015, 0.0003, 0.0003], [0.0015, 0.0003, 0.0003]])
+    data = np.empty(shape + (len(bvals),))
+    for idx in np.ndindex(shape):
+        angles = [(0, 0), (rng.uniform(30, 90), rng.uniform(0, 90))]
+        data[idx], _ = multi_tensor(gtab, mevals, S0=100, angles=angles,
+                                    fractions=[50, 50], snr=30, rng=rng)
+    mask = np.ones(shape, dtype=bool)
+    mask[0, 0] = False
+    mask[..., 3] = False
+    return gtab, data, mask
+
+
+def test_iter_slabs():
+    slabs = list(iter_slabs((4, 3, 5), 2))
+    npt.assert_equal(len(slabs), 3)
+    npt.assert_equal(slabs[-1], (slice(None), slice(None), slice(4, 5)))
+    slabs = list(iter_slabs((4, 3, 5), 3, axis=0))
+    npt.assert_equal(slabs[0], (slice(0, 3), slice(None), slice(None)))
+    npt.assert_raises(ValueError, list, iter_slabs((4, 3, 5), 0))
+
+
+@set_random_number_generator()
+def test_fit_chunked(rng):
+    gtab, data, mask = _simulated_volume(rng)
+    model = TensorModel(gtab)
+    tenfit = model.fit(data, mask=mask)
+
+    maps = fit_chunked(model, data, {'fa': 'fa', 'md': 'md', 'evecs': 'evecs',
+                                     'mask': lambda fit, mask: mask},
+                       mask=mask, slab_size=2, dtype=np.float64)
+    npt.assert_array_almost_equal(maps['fa'], tenfit.fa)
+    npt.assert_array_almost_equal(maps['md'], tenfit.md)
+    npt.assert_array_almost_equal(np.abs(maps['evecs']),
+                                  np.abs(tenfit.evecs))
+    npt.assert_array_equal(maps['mask'], mask)
+    npt.assert_equal(maps['mask'].dtype, np.uint8)
+
+    # Read the slabs from a NIfTI file and write memory-mapped NIfTI maps
+    with TemporaryDirectory() as tmpdir:
+        affine = np.diag([2., 2., 2., 1.])
+        fdata = os.path.join(tmpdir, 'dwi.nii')
+        save_nifti(fdata, data, affine)
+        out_dir = os.path.join(tmpdir, 'maps')
+        maps = fit_chunked(model, fdata, {'fa': 'fa', 'md': 'md'}, mask=mask,
+                           out_dir=out_dir, axis=0, slab_size=3)
+        npt.assert_equal(maps['fa'].dtype, np.float32)
+        fa_img = nib.load(os.path.join(out_dir, 'fa.nii'))
+        npt.assert_array_equal(fa_img.affine, affine)
+        npt.assert_array_almost_equal(fa_img.get_fdata(), tenfit.fa, 5)
+        del maps, fa_img
+
+        # Without an affine, the maps are written as .npy files
+        maps = fit_chunked(model, nib.load(fdata).dataobj, {'md': 'md'},
+                           out_dir=out_dir, slab_size=4)
+        md = np.load(os.path.join(out_dir, 'md.npy'))
+        npt.assert_array_almost_equal(md, model.fit(data).md, 5)
+        del maps
+
+    npt.assert_raises(ValueError, fit_chunked, model, data, {'fa': 'fa'},
+                      mask=np.zeros(data.shape[:-1], dtype=bool))
+    npt.assert_raises(ValueError, fit_chunked, model, data, {'fa': 'fa'},
+                      mask=mask[:-1])
+
+
+@set_random_number_generator()
+def test_fit_chunked_peaks(rng):
+    gtab, data, mask = _simulated_volume(rng)
+    response = (np.array([0.0015, 0.0003, 0.0003]), 100)
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore", message=descoteaux07_legacy_msg,
+            category=PendingDeprecationWarning)
+        model = ConstrainedSphericalDeconvModel(gtab, response, sh_order=6)
+        pam = peaks_from_model(model, data, default_sphere, .5, 25,
+                               mask=mask, sh_order=6)
+        maps = fit_chunked(model, data,
+                           {'shm_coeff': 'shm_coeff',
+                            'peaks': peaks_metric(default_sphere, .5, 25)},
+                           mask=mask, slab_size=2, dtype=np.float64)
+
+    npt.assert_equal(sorted(maps), ['gfa', 'peak_dirs', 'peak_indices',
+                                    'peak_values', 'shm_coeff'])
+    npt.assert_array_almost_equal(maps['gfa'], pam.gfa)
+    npt.assert_array_equal(maps['peak_indices'], pam.peak_indices)
+    npt.assert_array_almost_equal(maps['peak_values'], pam.peak_values)
+    npt.assert_array_almost_equal(maps['peak_dirs'], pam.peak_dirs)
+    npt.assert_equal(maps['shm_coeff'].shape, mask.shape + (28,))
+    npt.assert_array_equal(maps['shm_coeff'][~mask], 0)
+
+    # Voxels outside of the mask, in fitted or skipped slabs, have no peaks
+    with TemporaryDirectory() as tmpdir:
+        with warnings.catch_warnings():
+            warnings.filterwarnings(
+                "ignore", message=descoteaux07_legacy_msg,
+                category=PendingDeprecationWarning)
+            maps = fit_chunked(model, data,
+                               {'peaks': peaks_metric(default_sphere, .5, 25)},
+                               mask=mask, out_dir=tmpdir, slab_size=1)
+        npt.assert_array_equal(maps['peak_indices'][~mask], -1)
+        npt.assert_array_equal(maps['peak_indices'], pam.peak_indices)
+        del maps
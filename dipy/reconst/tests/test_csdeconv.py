@@ -14,6 +14,8 @@ from dipy.core.sphere import Sphere, HemiSphere
 from dipy.core.sphere_stats import angular_similarity
 from dipy.reconst.csdeconv import (ConstrainedSphericalDeconvModel,
                                    ConstrainedSDTModel,
+                                   csdeconv,
+                                   csdeconv_batch,
                                    forward_sdeconv_mat,
                                    odf_deconv,
                                    odf_sh_to_sharp,
@@ -31,6 +33,7 @@ from dipy.reconst.shm import (
     sf_to_sh,
     sh_to_sf,
     real_sh_descoteaux,
+    SphHarmFit,
     sph_harm_ind_list
 )
 from dipy.reconst.shm import lazy_index
@@ -772,3 +775,73 @@ def test_csd_convergence():
                                                         sh_order=8)
 
     assert_equal(model_w_conv.fit(S).shm_coeff, model_wo_conv.fit(S).shm_coeff)
+
+
+@set_random_number_generator()
+def test_csd_fit_batch(rng):
+    _, fbvals, fbvecs = get_fnames('small_64D')
+    bvals, bvecs = read_bvals_bvecs(fbvals, fbvecs)
+    gtab = gradient_table(bvals, bvecs)
+    mevals = np.array(([0.0015, 0.0003, 0.0003],
+                       [0.0015, 0.0003, 0.0003]))
+    data = np.empty((2, 3, 2, len(bvals)))
+    for ijk in np.ndindex(data.shape[:-1]):
+        angles = [(0, 0), (rng.uniform(30, 90), rng.uniform(0, 90))]
+        data[ijk], _ = multi_tensor(gtab, mevals, 100, angles=angles,
+                                    fractions=[50, 50], snr=30, rng=rng)
+    mask = np.ones(data.shape[:-1], dtype=bool)
+    mask[0, 0, 0] = False
+
+    response = (np.array([0.0015, 0.0003, 0.0003]), 100)
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore", message=descoteaux07_legacy_msg,
+            category=PendingDeprecationWarning)
+        models = [ConstrainedSphericalDeconvModel(gtab, response),
+                  ConstrainedSDTModel(gtab, 0.2)]
+
+    for model in models:
+        fit = model.fit(data, mask=mask)
+        npt.assert_(isinstance(fit, SphHarmFit))
+        npt.assert_array_equal(fit.shm_coeff[0, 0, 0], 0)
+        for ijk in zip(*np.nonzero(mask)):
+            npt.assert_array_almost_equal(fit.shm_coeff[ijk],
+                                          model.fit(data[ijk]).shm_coeff)
+        npt.assert_equal(fit[1, 1, 1].shm_coeff.shape,
+                         fit.shm_coeff.shape[-1:])
+        parallel_fit = model.fit(data, mask=mask, engine="process", n_jobs=2)
+        npt.assert_array_almost_equal(parallel_fit.shm_coeff, fit.shm_coeff)
+
+
+@set_random_number_generator()
+def test_csdeconv_batch(rng):
+    _, fbvals, fbvecs = get_fnames('small_64D')
+    bvals, bvecs = read_bvals_bvecs(fbvals, fbvecs)
+    gtab = gradient_table(bvals, bvecs)
+    mevals = np.array(([0.0015, 0.0003, 0.0003],
+                       [0.0015, 0.0003, 0.0003]))
+    data = np.empty((40, len(bvals)))
+    for i in range(len(data)):
+        angles = [(0, 0), (rng.uniform(20, 90), rng.uniform(0, 90))]
+        data[i], _ = multi_tensor(gtab, mevals, 100, angles=angles,
+                                  fractions=[50, 50], snr=20, rng=rng)
+    data[0] = 0
+
+    response = (np.array([0.0015, 0.0003, 0.0003]), 100)
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore", message=descoteaux07_legacy_msg,
+            category=PendingDeprecationWarning)
+        csd = ConstrainedSphericalDeconvModel(gtab, response)
+    dwi = data[:, csd._where_dwi]
+
+    for block_size in [1000, 7]:
+        fodf_sh, num_it = csdeconv_batch(dwi, csd._X, csd.B_reg, csd.tau,
+                                         P=csd._P, block_size=block_size)
+        npt.assert_equal(fodf_sh.shape, (len(data), csd._X.shape[1]))
+        for i in range(len(data)):
+            expected_sh, expected_it = csdeconv(dwi[i], csd._X, csd.B_reg,
+                                                csd.tau, P=csd._P)
+            npt.assert_array_almost_equal(fodf_sh[i], expected_sh)
+            npt.assert_equal(num_it[i], expected_it)
+        npt.assert_array_equal(fodf_sh[0], 0)
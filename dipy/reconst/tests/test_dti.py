@@ -1,5 +1,7 @@
 """Testing DTI."""
 
+from functools import partial
+from unittest import mock
 import warnings
 
 import numpy as np
@@ -665,6 +667,55 @@ def test_nlls_fit_tensor():
     tmf = npt.assert_raises(ValueError, tensor_model.fit, Y_less)
 
 
+@set_random_number_generator()
+def test_nlls_fit_tensor_voxelwise(rng):
+    # The vectorized fit should match a voxel by voxel fit with leastsq
+    bvals, bvecs = read_bvals_bvecs(*get_fnames('55dir_grad'))
+    gtab = grad.gradient_table(bvals, bvecs)
+    X = dti.design_matrix(gtab)
+    n_vox = 20
+    evals = np.array([0.0015, 0.0004, 0.0003])
+    data = np.empty((n_vox, len(bvals)))
+    for i in range(n_vox):
+        evecs = np.linalg.qr(rng.standard_normal((3, 3)))[0]
+        data[i] = single_tensor(gtab, 100, evals, evecs, snr=30, rng=rng)
+    data = np.maximum(data, 1)
+    sigma = rng.uniform(1, 5, (n_vox, 1))
+
+    params, _ = dti.nlls_fit_tensor(X, data, weighting='sigma', sigma=sigma)
+
+    nlls = dti._NllsHelper()
+    ols, _ = dti.ols_fit_tensor(X, data, return_lower_triangular=True)
+    for i in range(n_vox):
+        this_param, _ = opt.leastsq(nlls.err_func, ols[i],
+                                    args=(X, data[i], 'sigma', sigma[i, 0]),
+                                    Dfun=nlls.jacobian_func)
+        evals_i, _ = decompose_tensor(from_lower_triangular(this_param[:6]))
+        npt.assert_array_almost_equal(params[i, :3] * 1e3, evals_i * 1e3,
+                                      decimal=4)
+
+
+@set_random_number_generator()
+def test_nlls_fit_tensor_not_converged(rng):
+    # Voxels stopped by the iteration limit keep their last estimate
+    bvals, bvecs = read_bvals_bvecs(*get_fnames('55dir_grad'))
+    gtab = grad.gradient_table(bvals, bvecs)
+    X = dti.design_matrix(gtab)
+    evals = np.array([0.0015, 0.0004, 0.0003])
+    data = np.stack([single_tensor(gtab, 100, evals, np.eye(3), snr=20,
+                                   rng=rng) for _ in range(5)])
+    data = np.maximum(data, 1)
+
+    ols, _ = dti.ols_fit_tensor(X, data)
+    with mock.patch.object(dti, 'leastsq_batch',
+                           partial(dti.leastsq_batch, max_iter=1)):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", UserWarning)
+            params, _ = dti.nlls_fit_tensor(X, data)
+    npt.assert_(np.all(np.isfinite(params)))
+    npt.assert_(np.any(np.abs(params[:, :3] - ols[:, :3]) > 1e-9))
+
+
 def test_restore():
     """
     Test the implementation of the RESTORE algorithm
@@ -10,7 +10,8 @@ from dipy.sims.voxel import sticks_and_ball
 from dipy.reconst.odf import gfa
 from dipy.direction.peaks import peak_directions
 
-from numpy.testing import assert_equal, assert_almost_equal
+from numpy.testing import (assert_equal, assert_almost_equal,
+                           assert_array_equal, assert_array_almost_equal)
 
 
 
@@ -71,3 +72,11 @@ def test_mvoxel_gqi():
     odf = all_odfs[-1, -1, -1]
     directions, values, indices = peak_directions(odf, sphere, .35, 25)
     assert_equal(directions.shape[0], 2)
+
+    # The volume fit matches the single voxel fits
+    mask = np.ones(data.shape[:-1], dtype=bool)
+    mask[0, 0, 0] = False
+    odfs = gq.fit(data, mask=mask).odf(sphere)
+    assert_array_equal(odfs[0, 0, 0], 0)
+    assert_array_almost_equal(odfs[-1, -1, -1],
+                              gq.fit(data[-1, -1, -1]).odf(sphere))
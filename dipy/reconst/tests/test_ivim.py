@@ -523,3 +523,76 @@ def test_D_vp():
     """
     ivim_fit_VP = ivim_model_VP.fit(data_single)
     assert_array_almost_equal(ivim_fit_VP.D, D_VP, decimal=4)
+
+
+def test_fit_batch():
+    """
+    Test that fitting many voxels at once gives the same results as fitting
+    them one by one.
+    """
+    noisy_multi = np.zeros((2, 2, 1, len(gtab.bvals)))
+    noisy_multi[0, 1, 0] = noisy_multi[1, 1, 0] = noisy_single
+    noisy_multi[0, 0, 0] = noisy_multi[1, 0, 0] = data_single
+
+    msg = "Bounds for this fit have been set from experiments .*"
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message=msg, category=UserWarning)
+        model = IvimModel(gtab, fit_method='trr')
+        model_warm = IvimModel(gtab, fit_method='trr', warm_start=True)
+
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always", category=UserWarning)
+        fit = model.fit(noisy_multi)
+        message = ["x0 obtained from linear fitting is not feasible",
+                   "x0 is unfeasible",
+                   "Bounds are violated for leastsq fitting"]
+        for m in message:
+            assert_(any(m in str(lw.message) for lw in w))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=UserWarning)
+        expected = model.fit(noisy_single).model_params
+    assert_equal(fit.shape, (2, 2, 1))
+    assert_array_almost_equal(fit.model_params[0, 0, 0], params_trr)
+    assert_array_almost_equal(fit.model_params[0, 1, 0], expected)
+    assert_array_almost_equal(fit.predict(gtab)[1, 0, 0], data_single)
+
+    # Noisy voxels start from the solution of their neighbours
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always", category=UserWarning)
+        fit_warm = model_warm.fit(noisy_multi)
+        assert_equal(len(w), 0)
+    assert_array_almost_equal(fit_warm.model_params[1, 0, 0], params_trr)
+    params_warm = fit_warm.model_params[1, 1, 0]
+    assert_(np.all(params_warm >= model_warm.bounds[0]))
+    assert_(np.all(params_warm <= model_warm.bounds[1]))
+    assert_greater_equal(
+        np.sum((noisy_single - ivim_prediction(expected, gtab)) ** 2),
+        np.sum((noisy_single - ivim_prediction(params_warm, gtab)) ** 2))
+
+
+def test_fit_batch_vp():
+    """
+    Test the IvimModelVP fit of many voxels at once, with a grid search.
+    """
+    model_grid = IvimModel(gtab, fit_method='VarPro', grid_search=True)
+    ivim_fit = model_grid.fit(data_multi)
+    assert_equal(ivim_fit.shape, (2, 2, 1))
+    assert_array_almost_equal(ivim_fit.perfusion_fraction, f_VP, decimal=2)
+    assert_array_almost_equal(ivim_fit.D_star, D_star_VP, decimal=4)
+    assert_array_almost_equal(ivim_fit.D, D_VP, decimal=4)
+    assert_array_almost_equal(ivim_fit.predict(gtab), data_multi, decimal=2)
+
+
+@needs_cvxpy
+def test_fit_batch_vp_default():
+    """
+    Test that the IvimModelVP fit of many voxels gives the results of the
+    voxel by voxel fit by default.
+    """
+    np.random.seed(1234)
+    ivim_fit = ivim_model_VP.fit(data_multi)
+    assert_equal(ivim_fit.shape, (2, 2, 1))
+    np.random.seed(1234)
+    expected = ivim_model_VP.fit(data_multi[0, 0, 0]).model_params
+    assert_array_almost_equal(ivim_fit.model_params[0, 0, 0], expected)
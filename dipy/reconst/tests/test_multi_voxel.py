@@ -3,7 +3,9 @@ from functools import reduce
 import numpy as np
 import numpy.testing as npt
 
-from dipy.reconst.multi_voxel import _squash, multi_voxel_fit, CallableArray
+from dipy.reconst import multi_voxel
+from dipy.reconst.multi_voxel import (_squash, multi_voxel_fit, CallableArray,
+                                      DenseMultiVoxelFit)
 from dipy.core.sphere import unit_icosahedron
 from dipy.testing.decorators import set_random_number_generator
 
@@ -179,3 +181,167 @@ def test_multi_voxel_fit(rng):
     # Test indexing into a fit
     npt.assert_equal(type(fit[0, 0, 0]), SillyFit)
     npt.assert_equal(fit[:2, :2, :2].shape, (2, 2, 2))
+
+
+def test_multi_voxel_fit_batch():
+
+    class BatchModel:
+
+        def __init__(self):
+            self.batch_sizes = []
+
+        @multi_voxel_fit
+        def fit(self, data, mask=None):
+            raise AssertionError("single voxel fit should not be called")
+
+        def fit_batch(self, data):
+            self.batch_sizes.append(data.shape[0])
+            return data[:, :2] * 2
+
+        def fit_from_params(self, params, mask):
+            return params, mask
+
+    model = BatchModel()
+    data = np.arange(3 * 4 * 5 * 6, dtype=float).reshape((3, 4, 5, 6))
+    params, mask = model.fit(data)
+    npt.assert_array_equal(params, data[..., :2] * 2)
+    npt.assert_equal(mask.shape, data.shape[:-1])
+    npt.assert_equal(model.batch_sizes, [60])
+
+    # Masked voxels are zero and the data is fit in chunks
+    mask = np.zeros(data.shape[:-1], dtype=bool)
+    mask[1:, ::2] = True
+    model = BatchModel()
+    chunk_size = multi_voxel.BATCH_CHUNK_SIZE
+    multi_voxel.BATCH_CHUNK_SIZE = 7
+    try:
+        params, _ = model.fit(data, mask=mask)
+    finally:
+        multi_voxel.BATCH_CHUNK_SIZE = chunk_size
+    npt.assert_array_equal(params[mask], data[mask][:, :2] * 2)
+    npt.assert_array_equal(params[~mask], 0)
+    npt.assert_equal(model.batch_sizes, [7, 7, 6])
+
+    # Empty mask
+    params, _ = BatchModel().fit(data, mask=np.zeros_like(mask))
+    npt.assert_equal(params.shape, (3, 4, 5, 2))
+    npt.assert_array_equal(params, 0)
+
+
+def test_dense_multi_voxel_fit():
+
+    class SillyFit:
+
+        n_calls = 0
+
+        def __init__(self, model, params):
+            self.model = model
+            self.params = params
+
+        @property
+        def total(self):
+            SillyFit.n_calls += 1
+            return self.params.sum(-1)
+
+        def odf(self, sphere):
+            return np.dot(self.params[..., :1], np.ones((1, len(sphere.phi))))
+
+        def predict(self, S0=1.):
+            return self.params * np.asarray(S0)[..., None]
+
+    mask = np.zeros((3, 3, 3), dtype=bool)
+    mask[0, 0] = 1
+    mask[1, 1] = 1
+    params = np.zeros((3, 3, 3, 2))
+    params[mask] = [1., 2.]
+
+    for vectorized in [True, False]:
+        SillyFit.n_calls = 0
+        fit = DenseMultiVoxelFit(None, params, mask, SillyFit,
+                                 vectorized=vectorized)
+        npt.assert_equal(fit.shape, (3, 3, 3))
+        expected = np.zeros((3, 3, 3))
+        expected[mask] = 3
+        npt.assert_array_equal(fit.total, expected)
+        # Derived attributes are cached
+        n_calls = SillyFit.n_calls
+        npt.assert_array_equal(fit.total, expected)
+        npt.assert_equal(SillyFit.n_calls, n_calls)
+
+        odf = fit.odf(unit_icosahedron)
+        npt.assert_equal(odf.shape, (3, 3, 3, 12))
+        npt.assert_array_equal(odf[mask], 1)
+        npt.assert_array_equal(odf[~mask], 0)
+
+        S0 = np.arange(27.).reshape((3, 3, 3))
+        predicted = np.zeros((3, 3, 3, 2))
+        predicted[mask] = params[mask] * S0[mask][:, None]
+        npt.assert_array_equal(fit.predict(S0=S0), predicted)
+
+        # Indexing into the fit
+        npt.assert_equal(type(fit[0, 0, 0]), SillyFit)
+        npt.assert_(fit[2, 2, 2] is None)
+        sub_fit = fit[:2, :2]
+        npt.assert_equal(sub_fit.shape, (2, 2, 3))
+        npt.assert_array_equal(sub_fit.total, expected[:2, :2])
+
+
+class _ParallelModel:
+    """Model defined at module level so that its fits can be pickled"""
+
+    @multi_voxel_fit
+    def fit(self, data):
+        return _ParallelFit(self, data)
+
+
+class _ParallelFit:
+
+    def __init__(self, model, data):
+        self.model = model
+        self.data = data
+
+    @property
+    def total(self):
+        return self.data.sum()
+
+
+class _ParallelBatchModel(_ParallelModel):
+
+    def fit_batch(self, data):
+        return data * 2
+
+    def fit_from_params(self, params, mask):
+        return params
+
+
+def test_multi_voxel_fit_parallel():
+    data = np.arange(3 * 4 * 5 * 6, dtype=float).reshape((3, 4, 5, 6))
+    mask = np.zeros(data.shape[:-1], dtype=bool)
+    mask[1:, ::2] = True
+
+    model = _ParallelModel()
+    serial_fit = model.fit(data, mask=mask)
+    for engine in ["thread", "process"]:
+        for chunk_size in [None, 1, 7]:
+            fit = model.fit(data, mask=mask, engine=engine, n_jobs=2,
+                            chunk_size=chunk_size)
+            npt.assert_array_equal(fit.total, serial_fit.total)
+            npt.assert_(fit[0, 0, 0] is None)
+
+    params = _ParallelBatchModel().fit(data, mask=mask, engine="thread",
+                                       n_jobs=2)
+    npt.assert_array_equal(params[mask], data[mask] * 2)
+
+    params = _ParallelBatchModel().fit(data, mask=mask, engine="process",
+                                       n_jobs=2, chunk_size=5)
+    npt.assert_array_equal(params[mask], data[mask] * 2)
+    npt.assert_array_equal(params[~mask], 0)
+
+    params = _ParallelBatchModel().fit(data, engine="process", n_jobs=2)
+    npt.assert_array_equal(params, data * 2)
+
+    params = _ParallelBatchModel().fit(data, mask=np.zeros_like(mask),
+                                       engine="process", n_jobs=2)
+    npt.assert_array_equal(params, np.zeros(data.shape))
+
+    npt.assert_raises(ValueError, model.fit, data, engine="gpu")
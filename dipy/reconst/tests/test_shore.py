@@ -102,3 +102,29 @@ def compute_e0(shorefit):
                       gamma(n + 1.5))) ** 0.5))
 
     return signal_0
+
+
+def test_shore_fitting_volume():
+    gtab = get_gtab_taiwan_dsi()
+    mevals = np.array(([0.0015, 0.0003, 0.0003],
+                       [0.0015, 0.0003, 0.0003]))
+    S = np.zeros((2, 2, 1, len(gtab.bvals)))
+    for i, angle in enumerate([30, 45, 60, 90]):
+        S[i // 2, i % 2, 0], _ = multi_tensor(gtab, mevals, S0=100.0,
+                                              angles=[(0, 0), (angle, 0)],
+                                              fractions=[50, 50], snr=None)
+    mask = np.ones(S.shape[:-1], dtype=bool)
+    mask[0, 0, 0] = False
+
+    asm = ShoreModel(gtab, radial_order=6, zeta=700, lambdaN=1e-12,
+                     lambdaL=1e-12)
+    asmfit = asm.fit(S, mask=mask)
+    npt.assert_array_equal(asmfit.shore_coeff[0, 0, 0], 0)
+    for ijk in zip(*np.nonzero(mask)):
+        voxel_fit = asm.fit(S[ijk])
+        npt.assert_array_almost_equal(asmfit.shore_coeff[ijk],
+                                      voxel_fit.shore_coeff)
+        npt.assert_array_almost_equal(asmfit[ijk].rtop_signal(),
+                                      voxel_fit.rtop_signal())
+    npt.assert_array_almost_equal(asmfit.rtop_signal()[1, 1, 0],
+                                  asm.fit(S[1, 1, 0]).rtop_signal())
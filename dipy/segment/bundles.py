@@ -1,13 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
 from time import time
 from itertools import chain
 import logging
+import os
+from zipfile import BadZipFile
 
 import numpy as np
 from dipy.tracking.streamline import (set_number_of_points, nbytes,
                                       select_random_set_of_streamlines)
 from dipy.segment.clustering import qbx_and_merge
-from dipy.tracking.distances import (bundles_distances_mdf,
-                                     bundles_distances_mam)
+from dipy.segment.fss import FastStreamlineSearch
+from dipy.io.clusters import load_cluster_map, save_cluster_map
+from dipy.tracking.distances import bundles_distances_sparse
 from dipy.align.streamlinear import (StreamlineLinearRegistration,
                                      BundleMinDistanceMetric,
                                      BundleSumDistanceMatrixMetric,
@@ -16,6 +21,7 @@ from dipy.align.streamlinear import (StreamlineLinearRegistration,
 from dipy.tracking.streamline import Streamlines, length
 
 from dipy.utils.deprecator import deprecated_params
+from dipy.utils.omp import determine_num_threads
 
 from nibabel.affines import apply_affine
 
@@ -31,7 +37,28 @@ def check_range(streamline, gt, lt):
 logger = logging.getLogger(__name__)
 
 
-def bundle_adjacency(dtracks0, dtracks1, threshold):
+def _fss_close_pairs(ref_streamlines, streamlines, radius, fss=None):
+    """ Pairs of streamlines closer than `radius` (MDF) with FSS
+
+    Returns the indices in `streamlines` and in `ref_streamlines` of each
+    pair, searched in `fss` if given or in a new search tree of
+    `ref_streamlines`. The streamlines are resampled to 20 points.
+    """
+    if len(ref_streamlines) == 0 or len(streamlines) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    if fss is None:
+        fss = FastStreamlineSearch(ref_streamlines, radius, resampling=20)
+    res = fss.radius_search(streamlines, radius)
+    return res.row, res.col
+
+
+def _check_fss_distance(distance):
+    if distance.lower() != 'mdf':
+        raise ValueError('FastStreamlineSearch only supports the mdf '
+                         'distance')
+
+
+def bundle_adjacency(dtracks0, dtracks1, threshold, use_fss=False):
     """ Find bundle adjacency between two given tracks/bundles
 
     Parameters
@@ -45,6 +72,10 @@ def bundle_adjacency(dtracks0, dtracks1, threshold):
         how much strictness user wants while calculating bundle adjacency
         between two bundles. Smaller threshold means bundles should be strictly
         adjacent to get higher BA score.
+    use_fss : bool, optional
+        If True, the streamlines closer than `threshold` are found with the
+        radius search of FastStreamlineSearch on streamlines resampled to 20
+        points, instead of a dense MDF matrix.
 
     Returns
     -------
@@ -57,32 +88,23 @@ def bundle_adjacency(dtracks0, dtracks1, threshold):
                         tractography simplification, Frontiers in Neuroscience,
                         vol 6, no 175, 2012.
     """
-    d01 = bundles_distances_mdf(dtracks0, dtracks1)
-
-    pair12 = []
-
-    for i in range(len(dtracks0)):
-        if np.min(d01[i, :]) < threshold:
-            j = np.argmin(d01[i, :])
-            pair12.append((i, j))
-
-    pair12 = np.array(pair12)
-    pair21 = []
-
-    # solo2 = []
-    for i in range(len(dtracks1)):
-        if np.min(d01[:, i]) < threshold:
-            j = np.argmin(d01[:, i])
-            pair21.append((i, j))
-
-    pair21 = np.array(pair21)
-    A = len(pair12) / float(len(dtracks0))
-    B = len(pair21) / float(len(dtracks1))
+    if use_fss:
+        rows, cols = _fss_close_pairs(dtracks1, dtracks0, threshold)
+    else:
+        # Only the pairs closer than the threshold are computed
+        d01 = bundles_distances_sparse(dtracks0, dtracks1, threshold)
+        rows = np.repeat(np.arange(len(dtracks0)), np.diff(d01.indptr))
+        close = d01.data < threshold
+        rows, cols = rows[close], d01.indices[close]
+
+    A = len(np.unique(rows)) / float(len(dtracks0))
+    B = len(np.unique(cols)) / float(len(dtracks1))
     res = 0.5 * (A + B)
     return res
 
 
-def ba_analysis(recognized_bundle, expert_bundle, nb_pts=20, threshold=6.):
+def ba_analysis(recognized_bundle, expert_bundle, nb_pts=20, threshold=6.,
+                use_fss=False):
     """ Calculates bundle adjacency score between two given bundles
 
     Parameters
@@ -99,6 +121,8 @@ def ba_analysis(recognized_bundle, expert_bundle, nb_pts=20, threshold=6.):
         how much strictness user wants while calculating bundle adjacency
         between two bundles. Smaller threshold means bundles should be strictly
         adjacent to get higher BA score.
+    use_fss : bool, optional
+        If True, use the FastStreamlineSearch mode of `bundle_adjacency`.
 
     Returns
     -------
@@ -115,7 +139,8 @@ def ba_analysis(recognized_bundle, expert_bundle, nb_pts=20, threshold=6.):
 
     expert_bundle = set_number_of_points(expert_bundle, nb_pts)
 
-    return bundle_adjacency(recognized_bundle, expert_bundle, threshold)
+    return bundle_adjacency(recognized_bundle, expert_bundle, threshold,
+                            use_fss=use_fss)
 
 
 def cluster_bundle(bundle, clust_thr, rng, nb_pts=20, select_randomly=500000):
@@ -214,7 +239,7 @@ class RecoBundles:
 
     def __init__(self, streamlines,  greater_than=50, less_than=1000000,
                  cluster_map=None, clust_thr=15, nb_pts=20,
-                 rng=None, verbose=False):
+                 rng=None, verbose=False, cluster_cache=None):
         """ Recognition of bundles
 
         Extract bundles from a participants' tractograms using model bundles
@@ -242,6 +267,12 @@ class RecoBundles:
             Default: None
         verbose: bool, optional.
             If True, log information.
+        cluster_cache : str, optional
+            Path of a NPZ file caching the clustering of `streamlines`. The
+            clusters are loaded from it when it matches the content of the
+            streamlines kept by `greater_than` and `less_than`, `clust_thr`
+            and `nb_pts`. Otherwise the streamlines are clustered and the
+            clusters are saved to it (default None).
 
         Notes
         -----
@@ -272,13 +303,15 @@ class RecoBundles:
                         f" length = {len(self.streamlines)}")
 
         self.start_thr = [40, 25, 20]
+        self._fss = None
         if rng is None:
             self.rng = np.random.default_rng()
         else:
             self.rng = rng
 
         if cluster_map is None:
-            self._cluster_streamlines(clust_thr=clust_thr, nb_pts=nb_pts)
+            self._cluster_streamlines(clust_thr=clust_thr, nb_pts=nb_pts,
+                                      cluster_cache=cluster_cache)
         else:
             if self.verbose:
                 t = time()
@@ -293,7 +326,7 @@ class RecoBundles:
                 logger.info(f' Streamlines have {self.nb_centroids} centroids')
                 logger.info(f' Total loading duration {time() - t:0.3f} s\n')
 
-    def _cluster_streamlines(self, clust_thr, nb_pts):
+    def _cluster_streamlines(self, clust_thr, nb_pts, cluster_cache=None):
 
         if self.verbose:
             t = time()
@@ -305,9 +338,28 @@ class RecoBundles:
         # TODO this needs to become a default parameter
         thresholds = self.start_thr + [clust_thr]
 
-        merged_cluster_map = qbx_and_merge(self.streamlines, thresholds,
-                                           nb_pts, None, self.rng,
-                                           self.verbose)
+        merged_cluster_map = None
+        if cluster_cache is not None and os.path.exists(cluster_cache):
+            try:
+                merged_cluster_map = load_cluster_map(
+                    cluster_cache, self.streamlines, thresholds=thresholds,
+                    nb_pts=nb_pts)
+                if self.verbose:
+                    logger.info(f' Clusters loaded from {cluster_cache}')
+            # Stale or unreadable caches are clustered again and overwritten
+            except (ValueError, KeyError, EOFError, OSError,
+                    BadZipFile) as e:
+                if self.verbose:
+                    logger.info(f' Ignoring {cluster_cache}: {e}')
+
+        if merged_cluster_map is None:
+            merged_cluster_map = qbx_and_merge(self.streamlines, thresholds,
+                                               nb_pts, None, self.rng,
+                                               self.verbose)
+            if cluster_cache is not None:
+                save_cluster_map(cluster_cache, merged_cluster_map,
+                                 self.streamlines, thresholds=thresholds,
+                                 nb_pts=nb_pts)
 
         self.cluster_map = merged_cluster_map
         self.centroids = merged_cluster_map.centroids
@@ -331,7 +383,8 @@ class RecoBundles:
                   slr_select=(400, 600),
                   slr_method='L-BFGS-B',
                   pruning_thr=5,
-                  pruning_distance='mdf'):
+                  pruning_distance='mdf',
+                  use_fss=False):
         """ Recognize the model_bundle in self.streamlines
 
         Parameters
@@ -400,6 +453,12 @@ class RecoBundles:
             Pruning after reducing the search space (default 5).
         pruning_distance : string, optional
             Pruning distance type can be mdf or mam (default mdf)
+        use_fss : bool, optional
+            If True, the close centroids of the search space reduction and of
+            the pruning are found with the radius search of
+            FastStreamlineSearch instead of dense distance matrices. The
+            search tree of the centroids of `streamlines` is built once and
+            reused. Only the mdf distances are supported (default False).
 
         Returns
         -------
@@ -408,6 +467,12 @@ class RecoBundles:
         recognized_labels : array
             Indices of recognized bundle in the original tractogram
 
+        Notes
+        -----
+        With `use_fss`, the centroids are resampled to 20 points and the
+        distances equal to the thresholds are excluded, so that the recognized
+        streamlines can slightly differ.
+
         References
         ----------
         .. [Garyfallidis17] Garyfallidis et al. Recognition of white matter
@@ -425,8 +490,165 @@ class RecoBundles:
         neighb_streamlines, neighb_indices = self._reduce_search_space(
             model_centroids,
             reduction_thr=reduction_thr,
-            reduction_distance=reduction_distance)
+            reduction_distance=reduction_distance,
+            use_fss=use_fss,
+            num_threads=num_threads)
+
+        pruned_streamlines, labels = self._register_and_prune(
+            model_bundle, model_centroids, neighb_streamlines, neighb_indices,
+            slr=slr, num_threads=num_threads, slr_metric=slr_metric,
+            slr_x0=slr_x0, slr_bounds=slr_bounds, slr_select=slr_select,
+            slr_method=slr_method, pruning_thr=pruning_thr,
+            pruning_distance=pruning_distance, use_fss=use_fss)
+        if self.verbose:
+            logger.info(f'Total duration of recognition time'
+                        f' is {time()-t:0.3f} s\n')
+
+        return pruned_streamlines, labels
+
+    def recognize_bundles(self, model_bundles, model_clust_thr,
+                          reduction_thr=10,
+                          reduction_distance='mdf',
+                          slr=True,
+                          num_threads=None,
+                          slr_metric=None,
+                          slr_x0=None,
+                          slr_bounds=None,
+                          slr_select=(400, 600),
+                          slr_method='L-BFGS-B',
+                          pruning_thr=5,
+                          pruning_distance='mdf',
+                          num_workers=None,
+                          use_fss=False):
+        """ Recognize all the bundles of an atlas in self.streamlines
+
+        Equivalent to calling `recognize` for each model bundle, but the
+        distances between the centroids of all the model bundles and the
+        centroids of the tractogram are computed as one matrix, and the model
+        bundles are clustered, registered and pruned in parallel workers.
 
+        Parameters
+        ----------
+        model_bundles : sequence of Streamlines
+            The model bundles of the atlas.
+        model_clust_thr : float or sequence of float
+            MDF distance threshold for the model bundles, or one threshold
+            per model bundle.
+        reduction_thr : float, optional
+            Reduce search space in the target tractogram by (mm) (default 10)
+        reduction_distance : string, optional
+            Reduction distance type can be mdf or mam (default mdf)
+        slr : bool, optional
+            Use Streamline-based Linear Registration (SLR) locally
+            (default True)
+        num_threads : int, optional
+            Number of threads to be used for the OpenMP parallelization of
+            the recognition of each bundle (distances and SLR). If None
+            (default), a single thread is used when the bundles are
+            recognized by several workers, otherwise the behavior is the one
+            of `recognize`.
+        slr_metric : BundleMinDistanceMetric
+        slr_x0 : array or int or str, optional
+            Initial parametrization of the SLR, see `recognize`.
+        slr_bounds : array, optional
+            (default None)
+        slr_select : tuple, optional
+            Select the number of streamlines from model to neirborhood of
+            model to perform the local SLR.
+        slr_method : string, optional
+            Optimization method 'L_BFGS_B' or 'Powell' optimizers can be used.
+            (default 'L-BFGS-B')
+        pruning_thr : float, optional
+            Pruning after reducing the search space (default 5).
+        pruning_distance : string, optional
+            Pruning distance type can be mdf or mam (default mdf)
+        num_workers : int, optional
+            Number of bundles recognized in parallel. If None (default) the
+            value of OMP_NUM_THREADS environment variable is used if it is
+            set, otherwise all available threads are used. If < 0 the maximal
+            number of threads minus |num_workers + 1| is used.
+        use_fss : bool, optional
+            If True, the close centroids of the search space reductions and of
+            the pruning are found with the radius search of
+            FastStreamlineSearch instead of dense distance matrices. The
+            search tree of the centroids of `streamlines` is built once and
+            reused. Only the mdf distances are supported (default False).
+
+        Returns
+        -------
+        recognized : list of tuple
+            The ``(recognized_transf, recognized_labels)`` of each model
+            bundle, as returned by `recognize`.
+
+        Notes
+        -----
+        Each model bundle is recognized with its own random generator spawned
+        from ``self.rng``, so that the results do not depend on the number of
+        workers.
+        """
+        if self.verbose:
+            t = time()
+            logger.info(f'## Recognize {len(model_bundles)} bundles ## \n')
+
+        nb_bundles = len(model_bundles)
+        model_clust_thr = np.broadcast_to(model_clust_thr, (nb_bundles,))
+        seeds = np.random.SeedSequence(
+            self.rng.integers(np.iinfo(np.int64).max)).spawn(nb_bundles)
+        rngs = [np.random.default_rng(seed) for seed in seeds]
+        num_workers = min(determine_num_threads(num_workers),
+                          max(nb_bundles, 1))
+        # Workers times OpenMP threads should not oversubscribe the machine
+        worker_threads = num_threads
+        if num_threads is None and num_workers > 1:
+            worker_threads = 1
+
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            model_centroids = list(pool.map(
+                lambda i: self._cluster_model_bundle(
+                    model_bundles[i], model_clust_thr=model_clust_thr[i],
+                    rng=rngs[i]),
+                range(nb_bundles)))
+
+            # One search for the search space reduction of all the model
+            # bundles, split back into the centroids of each bundle
+            close_clusters_indices = self._close_clusters_indices(
+                Streamlines(chain(*model_centroids)), reduction_thr,
+                reduction_distance, use_fss=use_fss,
+                nb_centroids=[len(centroids) for centroids in model_centroids],
+                num_threads=num_threads)
+
+            def recognize_one(i):
+                neighb_streamlines, neighb_indices = self._reduce_search_space(
+                    model_centroids[i],
+                    reduction_thr=reduction_thr,
+                    reduction_distance=reduction_distance,
+                    close_clusters_indices=close_clusters_indices[i])
+                return self._register_and_prune(
+                    model_bundles[i], model_centroids[i], neighb_streamlines,
+                    neighb_indices, slr=slr, num_threads=worker_threads,
+                    # Metrics hold the streamlines being registered
+                    slr_metric=(slr_metric if isinstance(slr_metric, str)
+                                else copy(slr_metric)),
+                    slr_x0=slr_x0,
+                    slr_bounds=slr_bounds, slr_select=slr_select,
+                    slr_method=slr_method, pruning_thr=pruning_thr,
+                    pruning_distance=pruning_distance, use_fss=use_fss,
+                    rng=rngs[i])
+
+            recognized = list(pool.map(recognize_one, range(nb_bundles)))
+
+        if self.verbose:
+            logger.info(f'Total duration of recognition time'
+                        f' is {time()-t:0.3f} s\n')
+
+        return recognized
+
+    def _register_and_prune(self, model_bundle, model_centroids,
+                            neighb_streamlines, neighb_indices, slr=True,
+                            num_threads=None, slr_metric=None, slr_x0=None,
+                            slr_bounds=None, slr_select=(400, 600),
+                            slr_method='L-BFGS-B', pruning_thr=5,
+                            pruning_distance='mdf', use_fss=False, rng=None):
         if len(neighb_streamlines) == 0:
             return Streamlines([]), []
 
@@ -440,7 +662,8 @@ class RecoBundles:
                 select_model=slr_select[0],
                 select_target=slr_select[1],
                 method=slr_method,
-                num_threads=num_threads)
+                num_threads=num_threads,
+                rng=rng)
         else:
             transf_streamlines = neighb_streamlines
 
@@ -449,10 +672,10 @@ class RecoBundles:
             transf_streamlines,
             neighb_indices,
             pruning_thr=pruning_thr,
-            pruning_distance=pruning_distance)
-        if self.verbose:
-            logger.info(f'Total duration of recognition time'
-                        f' is {time()-t:0.3f} s\n')
+            pruning_distance=pruning_distance,
+            use_fss=use_fss,
+            num_threads=num_threads,
+            rng=rng)
 
         return pruned_streamlines, self.filtered_indices[labels]
 
@@ -466,7 +689,8 @@ class RecoBundles:
                slr_select=(400, 600),
                slr_method='L-BFGS-B',
                pruning_thr=6,
-               pruning_distance='mdf'):
+               pruning_distance='mdf',
+               use_fss=False):
         """ Refine and recognize the model_bundle in self.streamlines
         This method expects once pruned streamlines as input. It refines the
         first output of recobundle by applying second local slr (optional),
@@ -572,7 +796,8 @@ class RecoBundles:
         neighb_streamlines, neighb_indices = self._reduce_search_space(
             pruned_model_centroids,
             reduction_thr=reduction_thr,
-            reduction_distance=reduction_distance)
+            reduction_distance=reduction_distance,
+            use_fss=use_fss)
 
         if len(neighb_streamlines) == 0:  # if no streamlines recognized
             return Streamlines([]), []
@@ -598,7 +823,8 @@ class RecoBundles:
             transf_streamlines,
             neighb_indices,
             pruning_thr=pruning_thr,
-            pruning_distance=pruning_distance)
+            pruning_distance=pruning_distance,
+            use_fss=use_fss)
 
         if self.verbose:
             logger.info(f'Total duration of recognition time'
@@ -656,7 +882,7 @@ class RecoBundles:
         return ba_value, bmd_value
 
     def _cluster_model_bundle(self, model_bundle, model_clust_thr, nb_pts=20,
-                              select_randomly=500000):
+                              select_randomly=500000, rng=None):
 
         if self.verbose:
             t = time()
@@ -668,7 +894,7 @@ class RecoBundles:
         model_cluster_map = qbx_and_merge(model_bundle, thresholds,
                                           nb_pts=nb_pts,
                                           select_randomly=select_randomly,
-                                          rng=self.rng)
+                                          rng=self.rng if rng is None else rng)
         model_centroids = model_cluster_map.centroids
         nb_model_centroids = len(model_centroids)
         if self.verbose:
@@ -677,32 +903,21 @@ class RecoBundles:
         return model_centroids
 
     def _reduce_search_space(self, model_centroids,
-                             reduction_thr=20, reduction_distance='mdf'):
+                             reduction_thr=20, reduction_distance='mdf',
+                             close_clusters_indices=None, use_fss=False,
+                             num_threads=None):
         if self.verbose:
             t = time()
             logger.info('# Reduce search space')
             logger.info(f' Reduction threshold {reduction_thr:0.3f}')
             logger.info(f' Reduction distance {reduction_distance}')
 
-        if reduction_distance.lower() == 'mdf':
-            if self.verbose:
-                logger.info(' Using MDF')
-            centroid_matrix = bundles_distances_mdf(model_centroids,
-                                                    self.centroids)
-        elif reduction_distance.lower() == 'mam':
-            if self.verbose:
-                logger.info(' Using MAM')
-            centroid_matrix = bundles_distances_mam(model_centroids,
-                                                    self.centroids)
-        else:
-            raise ValueError('Given reduction distance not known')
-
-        centroid_matrix[centroid_matrix > reduction_thr] = np.inf
+        if close_clusters_indices is None:
+            close_clusters_indices, = self._close_clusters_indices(
+                model_centroids, reduction_thr, reduction_distance,
+                use_fss=use_fss, num_threads=num_threads)
 
-        mins = np.min(centroid_matrix, axis=0)
-        close_clusters_indices = list(np.where(mins != np.inf)[0])
-
-        close_clusters = self.cluster_map[close_clusters_indices]
+        close_clusters = self.cluster_map[list(close_clusters_indices)]
 
         neighb_indices = [cluster.indices for cluster in close_clusters]
 
@@ -722,15 +937,48 @@ class RecoBundles:
 
         return neighb_streamlines, neighb_indices
 
+    def _close_clusters_indices(self, model_centroids, reduction_thr,
+                                reduction_distance='mdf', use_fss=False,
+                                nb_centroids=None, num_threads=None):
+        # Indices of the clusters close to each group of `nb_centroids`
+        # consecutive model centroids
+        if nb_centroids is None:
+            nb_centroids = [len(model_centroids)]
+        bounds = np.cumsum([0] + list(nb_centroids))
+
+        if use_fss:
+            _check_fss_distance(reduction_distance)
+            if self._fss is None or self._fss.max_radius < reduction_thr:
+                self._fss = FastStreamlineSearch(self.centroids,
+                                                 reduction_thr, resampling=20)
+            rows, cols = _fss_close_pairs(self.centroids, model_centroids,
+                                          reduction_thr, fss=self._fss)
+            return [np.unique(cols[(rows >= start) & (rows < end)])
+                    for start, end in zip(bounds[:-1], bounds[1:])]
+
+        if reduction_distance.lower() not in ('mdf', 'mam'):
+            raise ValueError('Given reduction distance not known')
+        if self.verbose:
+            logger.info(f' Using {reduction_distance.upper()}')
+        centroid_matrix = bundles_distances_sparse(
+            model_centroids, self.centroids, reduction_thr,
+            distance=reduction_distance, num_threads=num_threads)
+        indptr = centroid_matrix.indptr
+        return [np.unique(centroid_matrix.indices[indptr[start]:indptr[end]])
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
     def _register_neighb_to_model(self, model_bundle, neighb_streamlines,
                                   metric=None, x0=None, bounds=None,
                                   select_model=400, select_target=600,
                                   method='L-BFGS-B',
-                                  nb_pts=20, num_threads=None):
+                                  nb_pts=20, num_threads=None, rng=None):
         if self.verbose:
             logger.info('# Local SLR of neighb_streamlines to model')
             t = time()
 
+        if rng is None:
+            rng = self.rng
+
         if metric is None or metric == 'symmetric':
             metric = BundleMinDistanceMetric(num_threads=num_threads)
         if metric == 'asymmetric':
@@ -747,9 +995,9 @@ class RecoBundles:
 
         # TODO this can be speeded up by using directly the centroids
         static = select_random_set_of_streamlines(model_bundle,
-                                                  select_model, rng=self.rng)
+                                                  select_model, rng=rng)
         moving = select_random_set_of_streamlines(neighb_streamlines,
-                                                  select_target, rng=self.rng)
+                                                  select_target, rng=rng)
 
         static = set_number_of_points(static, nb_pts)
         moving = set_number_of_points(moving, nb_pts)
@@ -787,7 +1035,10 @@ class RecoBundles:
                                  neighb_indices,
                                  mdf_thr=5,
                                  pruning_thr=10,
-                                 pruning_distance='mdf'):
+                                 pruning_distance='mdf',
+                                 use_fss=False,
+                                 num_threads=None,
+                                 rng=None):
         if self.verbose:
             if pruning_thr < 0:
                 logger.info('Pruning_thr has to be greater or equal to 0')
@@ -801,35 +1052,37 @@ class RecoBundles:
         rtransf_cluster_map = qbx_and_merge(transf_streamlines,
                                             thresholds, nb_pts=20,
                                             select_randomly=500000,
-                                            rng=self.rng)
+                                            rng=self.rng if rng is None
+                                            else rng)
         if self.verbose:
             logger.info(f' QB Duration {time() - t:0.3f} s\n')
 
         rtransf_centroids = rtransf_cluster_map.centroids
 
-        if pruning_distance.lower() == 'mdf':
-            if self.verbose:
-                logger.info(' Using MDF')
-            dist_matrix = bundles_distances_mdf(model_centroids,
-                                                rtransf_centroids)
-        elif pruning_distance.lower() == 'mam':
+        if use_fss:
+            _check_fss_distance(pruning_distance)
             if self.verbose:
-                logger.info(' Using MAM')
-            dist_matrix = bundles_distances_mam(model_centroids,
-                                                rtransf_centroids)
+                logger.info(' Using FSS')
+            # Search the few model centroids for each transformed centroid
+            transf_rows, _ = _fss_close_pairs(model_centroids,
+                                              rtransf_centroids, pruning_thr)
+            close_clusters_indices = np.unique(transf_rows)
         else:
-            raise ValueError('Given pruning distance is not available')
-        dist_matrix[np.isnan(dist_matrix)] = np.inf
-        dist_matrix[dist_matrix > pruning_thr] = np.inf
+            if pruning_distance.lower() not in ('mdf', 'mam'):
+                raise ValueError('Given pruning distance is not available')
+            if self.verbose:
+                logger.info(f' Using {pruning_distance.upper()}')
+            pruning_matrix = bundles_distances_sparse(
+                model_centroids, rtransf_centroids, pruning_thr,
+                distance=pruning_distance, num_threads=num_threads)
+            if self.verbose:
+                logger.info(' Pruning matrix size is (%d, %d)'
+                            % pruning_matrix.shape)
 
-        pruning_matrix = dist_matrix.copy()
-        if self.verbose:
-            logger.info(' Pruning matrix size is (%d, %d)'
-                        % pruning_matrix.shape)
+            close_clusters_indices = np.unique(pruning_matrix.indices)
 
-        mins = np.min(pruning_matrix, axis=0)
         pruned_indices = [rtransf_cluster_map[i].indices
-                          for i in np.where(mins != np.inf)[0]]
+                          for i in close_clusters_indices]
         pruned_indices = list(chain(*pruned_indices))
         idx = np.array(pruned_indices)
         if len(idx) == 0:
@@ -439,6 +439,14 @@ class QuickBundles(Clustering):
         12 points.
     max_nb_clusters : int
         Limits the creation of bundles.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None,
+        the value of OMP_NUM_THREADS environment variable is used if it is
+        set, otherwise all available threads are used. If < 0 the maximal
+        number of threads minus $|num_threads + 1|$ is used (enter -1 to use
+        as many threads as possible). 0 raises an error. With more than one
+        thread, the nearest bundles of batches of streamlines are searched in
+        parallel, giving the same bundles. Default: 1.
 
     Examples
     --------
@@ -480,9 +488,10 @@ class QuickBundles(Clustering):
     """
 
     def __init__(self, threshold, metric="MDF_12points",
-                 max_nb_clusters=np.iinfo('i4').max):
+                 max_nb_clusters=np.iinfo('i4').max, num_threads=1):
         self.threshold = threshold
         self.max_nb_clusters = max_nb_clusters
+        self.num_threads = num_threads
 
         if isinstance(metric, MinimumAverageDirectFlipMetric):
             raise ValueError("Use AveragePointwiseEuclideanMetric instead")
@@ -516,7 +525,8 @@ class QuickBundles(Clustering):
         cluster_map = quickbundles(streamlines, self.metric,
                                    threshold=self.threshold,
                                    max_nb_clusters=self.max_nb_clusters,
-                                   ordering=ordering)
+                                   ordering=ordering,
+                                   num_threads=self.num_threads)
 
         cluster_map.refdata = streamlines
         return cluster_map
@@ -2,11 +2,21 @@
 
 import itertools
 import numpy as np
+cimport numpy as cnp
+
+from cython.parallel import prange
+from libc.math cimport sqrt
 
 from dipy.segment.cythonutils cimport Data2D, shape2tuple
 from dipy.segment.metricspeed cimport Metric
-from dipy.segment.clusteringspeed cimport ClustersCentroid, QuickBundles, QuickBundlesX
+from dipy.segment.clusteringspeed cimport (ClustersCentroid, Centroid,
+                                           NearestCluster, QuickBundles,
+                                           QuickBundlesX)
 from dipy.segment.clustering import ClusterMapCentroid, ClusterCentroid
+from dipy.segment.metricspeed import (AveragePointwiseEuclideanMetric,
+                                      SumPointwiseEuclideanMetric)
+from dipy.utils.omp import determine_num_threads
+from dipy.utils.omp cimport set_num_threads, restore_default_num_threads
 
 cdef extern from "stdlib.h" nogil:
     ctypedef unsigned long size_t
@@ -20,6 +30,8 @@ DTYPE = np.float32
 DEF BIGGEST_DOUBLE = 1.7976931348623157e+308  # np.finfo('f8').max
 DEF BIGGEST_FLOAT = 3.4028235e+38  # np.finfo('f4').max
 DEF BIGGEST_INT = 2147483647  # np.iinfo('i4').max
+# Relative slack making the barycenter bound robust to rounding errors
+DEF BOUND_SLACK = 1e-7
 
 
 def clusters_centroid2clustermap_centroid(ClustersCentroid clusters_list):
@@ -63,7 +75,8 @@ def peek(iterable):
 
 
 def quickbundles(streamlines, Metric metric, double threshold,
-                 long max_nb_clusters=BIGGEST_INT, ordering=None):
+                 long max_nb_clusters=BIGGEST_INT, ordering=None,
+                 num_threads=1, int batch_size=256):
     """ Clusters streamlines using QuickBundles.
 
     Parameters
@@ -79,12 +92,35 @@ def quickbundles(streamlines, Metric metric, double threshold,
         Limits the creation of bundles. (Default: inf)
     ordering : iterable of indices, optional
         Iterate through `data` using the given ordering.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) the value of OMP_NUM_THREADS environment variable is used
+        if it is set, otherwise all available threads are used. If < 0 the
+        maximal number of threads minus $|num_threads + 1|$ is used (enter -1
+        to use as many threads as possible). 0 raises an error. If 1, the
+        streamlines are assigned one by one (default).
+    batch_size : int, optional
+        Number of streamlines whose nearest clusters are searched in parallel
+        at once, when `num_threads` is not 1.
 
     Returns
     -------
     `ClusterMapCentroid` object
         Result of the clustering.
 
+    Notes
+    -----
+    When `num_threads` is not 1, the streamlines are assigned by batches: the
+    nearest clusters of the streamlines of a batch are searched in parallel
+    among the clusters existing at the beginning of the batch, then the
+    streamlines are assigned in order, only comparing them again with the
+    clusters created or updated earlier in the batch. The clusters are the
+    same as the ones obtained with one thread. With the
+    `AveragePointwiseEuclideanMetric` and `SumPointwiseEuclideanMetric`
+    metrics, the distance between the barycenters of two streamlines is a
+    lower bound of their distance, which prunes most of the clusters from the
+    nearest cluster search.
+
     References
     ----------
     .. [Garyfallidis12] Garyfallidis E. et al., QuickBundles a method for
@@ -95,6 +131,8 @@ def quickbundles(streamlines, Metric metric, double threshold,
     threshold = min(threshold, BIGGEST_DOUBLE)
     # Threshold of -np.inf is not supported, set it to 0
     threshold = max(threshold, 0)
+    if batch_size < 1:
+        raise ValueError("batch_size must be a positive integer.")
     if ordering is None:
         ordering = range(len(streamlines))
 
@@ -106,18 +144,249 @@ def quickbundles(streamlines, Metric metric, double threshold,
     features_shape = shape2tuple(metric.feature.c_infer_shape(streamlines[first_idx].astype(DTYPE)))
     cdef QuickBundles qb = QuickBundles(features_shape, metric, threshold, max_nb_clusters)
     cdef int idx
-    for idx in ordering:
-        streamline = streamlines[idx]
-        if not streamline.flags.writeable or streamline.dtype != DTYPE:
-            streamline = streamline.astype(DTYPE)
-        cluster_id = qb.assignment_step(streamline, idx)
-        # The update step is performed right after the assignment step instead
-        # of after all streamlines have been assigned like k-means algorithm.
-        qb.update_step(cluster_id)
+
+    if num_threads is not None and num_threads == 1:
+        for idx in ordering:
+            streamline = streamlines[idx]
+            if not streamline.flags.writeable or streamline.dtype != DTYPE:
+                streamline = streamline.astype(DTYPE)
+            cluster_id = qb.assignment_step(streamline, idx)
+            # The update step is performed right after the assignment step instead
+            # of after all streamlines have been assigned like k-means algorithm.
+            qb.update_step(cluster_id)
+    else:
+        _quickbundles_batches(qb, streamlines, ordering, batch_size,
+                              num_threads)
 
     return clusters_centroid2clustermap_centroid(qb.clusters)
 
 
+cdef inline void barycenter(Data2D features, double* out) nogil:
+    cdef:
+        cnp.npy_intp N = features.shape[0], D = features.shape[1]
+        cnp.npy_intp n, d
+
+    for d in range(D):
+        out[d] = 0
+        for n in range(N):
+            out[d] += features[n, d]
+        out[d] /= N
+
+
+cdef inline double barycenters_dist(double* bary1, double* bary2,
+                                    cnp.npy_intp D) nogil:
+    cdef:
+        cnp.npy_intp d
+        double dd, dist = 0
+
+    for d in range(D):
+        dd = bary1[d] - bary2[d]
+        dist += dd * dd
+
+    return sqrt(dist)
+
+
+cdef inline void keep_nearest(NearestCluster* nearest, int k,
+                              double dist) nogil:
+    # Ties go to the first cluster, as when scanning them in order
+    if dist < nearest.dist or (dist == nearest.dist and k < nearest.id):
+        nearest.id = k
+        nearest.dist = dist
+
+
+cdef NearestCluster find_nearest_cluster_bounded(
+        Metric metric, Centroid* centroids, cnp.npy_intp nb_clusters,
+        Data2D features, double* features_bary, double[:, ::1] centroids_bary,
+        double bound_scale, int* nb_dists) nogil except *:
+    """ Finds the nearest cluster among the first `nb_clusters` clusters.
+
+    Clusters whose barycenter lower bound, scaled by `bound_scale`, is
+    greater than the nearest distance found so far are skipped. A
+    `bound_scale` of 0 disables the bound.
+    """
+    cdef:
+        cnp.npy_intp k, first = -1
+        cnp.npy_intp D = centroids_bary.shape[1]
+        double bound, smallest_bound = BIGGEST_DOUBLE
+        NearestCluster nearest
+
+    nearest.id = -1
+    nearest.dist = BIGGEST_DOUBLE
+    nearest.flip = 0
+
+    if bound_scale > 0 and nb_clusters > 0:
+        # Start with the cluster having the smallest bound so that the next
+        # ones are pruned early.
+        for k in range(nb_clusters):
+            bound = barycenters_dist(&centroids_bary[k, 0], features_bary, D)
+            if bound < smallest_bound:
+                smallest_bound = bound
+                first = k
+
+        nb_dists[0] += 1
+        keep_nearest(&nearest, first,
+                     metric.c_dist(centroids[first].features[0], features))
+
+    for k in range(nb_clusters):
+        if bound_scale > 0:
+            if k == first:
+                continue
+
+            bound = bound_scale * barycenters_dist(&centroids_bary[k, 0],
+                                                   features_bary, D)
+            if bound > nearest.dist or (bound == nearest.dist and
+                                        k > nearest.id):
+                continue
+
+        nb_dists[0] += 1
+        keep_nearest(&nearest, k,
+                     metric.c_dist(centroids[k].features[0], features))
+
+    return nearest
+
+
+cdef void _quickbundles_batches(QuickBundles qb, streamlines, ordering,
+                                int batch_size, num_threads) except *:
+    """ Assigns the streamlines to the clusters of `qb` by batches.
+
+    The nearest clusters of a batch are searched in parallel among the
+    clusters existing before the batch. The streamlines are then assigned in
+    order: a streamline is only compared again with the clusters created or
+    updated earlier in the batch, unless its nearest cluster is one of them
+    in which case all clusters are searched again. This gives the same
+    clusters as assigning the streamlines one by one.
+    """
+    cdef:
+        Metric metric = qb.metric
+        int flip = not metric.feature.is_order_invariant
+        cnp.npy_intp N = qb.features_shape.dims[0]
+        cnp.npy_intp D = qb.features_shape.dims[1]
+        cnp.npy_intp i, j, b, k, nb, nb_clusters, nb_dirty
+        int cluster_id, threads_to_use
+        double bound_scale = 0
+        long nb_mdf_calls = 0
+        float[:, :, ::1] features
+        float[:, :, ::1] features_flip
+        double[:, ::1] features_bary
+        double[:, ::1] centroids_bary = np.zeros((batch_size, D))
+        cnp.uint8_t[::1] dirty = np.zeros(batch_size, dtype=np.uint8)
+        int[::1] dirty_ids = np.zeros(batch_size, dtype=np.int32)
+        int[::1] nb_dists = np.zeros(batch_size, dtype=np.int32)
+        NearestCluster* nearest = NULL
+        NearestCluster* nearest_flip = NULL
+
+    # The barycenter of the features is a lower bound of the average (or sum)
+    # of pointwise distances by the triangle inequality.
+    if type(metric) is AveragePointwiseEuclideanMetric:
+        bound_scale = 1 - BOUND_SLACK
+    elif type(metric) is SumPointwiseEuclideanMetric:
+        bound_scale = N * (1 - BOUND_SLACK)
+
+    features = np.empty((batch_size, N, D), dtype=DTYPE)
+    features_flip = np.empty((batch_size, N, D), dtype=DTYPE)
+    features_bary = np.zeros((batch_size, D))
+
+    threads_to_use = determine_num_threads(num_threads)
+    set_num_threads(threads_to_use)
+    try:
+        nearest = <NearestCluster*> calloc(batch_size, sizeof(NearestCluster))
+        nearest_flip = <NearestCluster*> calloc(batch_size,
+                                                sizeof(NearestCluster))
+        if nearest == NULL or nearest_flip == NULL:
+            raise MemoryError()
+
+        ordering = iter(ordering)
+        while True:
+            indices = list(itertools.islice(ordering, batch_size))
+            nb = len(indices)
+            if nb == 0:
+                break
+
+            for b in range(nb):
+                streamline = streamlines[indices[b]]
+                if not streamline.flags.writeable or streamline.dtype != DTYPE:
+                    streamline = streamline.astype(DTYPE)
+                qb.extract_features(streamline, features[b], features_flip[b])
+                barycenter(features[b], &features_bary[b, 0])
+
+            # Nearest clusters among the clusters existing before the batch,
+            # the barycenter of the flipped features being the same.
+            nb_clusters = qb.clusters.c_size()
+            with nogil:
+                for b in prange(nb, schedule='guided'):
+                    nb_dists[b] = 0
+                    nearest[b] = find_nearest_cluster_bounded(
+                        metric, qb.clusters.centroids, nb_clusters,
+                        features[b], &features_bary[b, 0], centroids_bary,
+                        bound_scale, &nb_dists[b])
+                    if flip:
+                        nearest_flip[b] = find_nearest_cluster_bounded(
+                            metric, qb.clusters.centroids, nb_clusters,
+                            features_flip[b], &features_bary[b, 0],
+                            centroids_bary, bound_scale, &nb_dists[b])
+
+            for b in range(nb):
+                nb_mdf_calls += nb_dists[b]
+
+            # Assign the streamlines in order
+            nb_dirty = 0
+            for b in range(nb):
+                if ((nearest[b].id >= 0 and dirty[nearest[b].id]) or
+                        (flip and nearest_flip[b].id >= 0 and
+                         dirty[nearest_flip[b].id])):
+                    # The nearest cluster has moved, search all the clusters
+                    nb_dists[b] = 0
+                    nearest[b] = find_nearest_cluster_bounded(
+                        metric, qb.clusters.centroids, qb.clusters.c_size(),
+                        features[b], &features_bary[b, 0], centroids_bary,
+                        bound_scale, &nb_dists[b])
+                    if flip:
+                        nearest_flip[b] = find_nearest_cluster_bounded(
+                            metric, qb.clusters.centroids,
+                            qb.clusters.c_size(), features_flip[b],
+                            &features_bary[b, 0], centroids_bary,
+                            bound_scale, &nb_dists[b])
+                    nb_mdf_calls += nb_dists[b]
+                else:
+                    for j in range(nb_dirty):
+                        k = dirty_ids[j]
+                        keep_nearest(&nearest[b], k, metric.c_dist(
+                            qb.clusters.centroids[k].features[0],
+                            features[b]))
+                        if flip:
+                            keep_nearest(&nearest_flip[b], k, metric.c_dist(
+                                qb.clusters.centroids[k].features[0],
+                                features_flip[b]))
+                    nb_mdf_calls += nb_dirty * (1 + flip)
+
+                cluster_id = qb.assign_to_nearest(
+                    nearest[b], nearest_flip[b], features[b],
+                    features_flip[b], indices[b])
+                qb.update_step(cluster_id)
+
+                if cluster_id >= centroids_bary.shape[0]:
+                    centroids_bary = np.concatenate(
+                        [centroids_bary, np.zeros_like(centroids_bary)])
+                    dirty = np.concatenate([dirty, np.zeros_like(dirty)])
+                if bound_scale > 0:
+                    barycenter(qb.clusters.centroids[cluster_id].features[0],
+                               &centroids_bary[cluster_id, 0])
+                if not dirty[cluster_id]:
+                    dirty[cluster_id] = 1
+                    dirty_ids[nb_dirty] = cluster_id
+                    nb_dirty += 1
+
+            for j in range(nb_dirty):
+                dirty[dirty_ids[j]] = 0
+    finally:
+        free(nearest)
+        free(nearest_flip)
+        if num_threads is not None:
+            restore_default_num_threads()
+
+    qb.stats.nb_mdf_calls += nb_mdf_calls
+
+
 def quickbundlesx(streamlines, Metric metric, thresholds, ordering=None):
     """ Clusters streamlines using QuickBundlesX.
 
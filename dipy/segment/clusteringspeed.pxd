@@ -87,6 +87,8 @@ cdef class QuickBundles:
     cdef QuickBundlesStats stats
 
     cdef NearestCluster find_nearest_cluster(QuickBundles self, Data2D features) nogil except *
+    cdef int extract_features(QuickBundles self, Data2D datum, Data2D features, Data2D features_flip) nogil except -1
+    cdef int assign_to_nearest(QuickBundles self, NearestCluster nearest_cluster, NearestCluster nearest_cluster_flip, Data2D features, Data2D features_flip, int datum_id) nogil except -1
     cdef int assignment_step(QuickBundles self, Data2D datum, int datum_id) nogil except -1
     cdef void update_step(QuickBundles self, int cluster_id) nogil except *
     cdef object _build_clustermap(self)
@@ -540,30 +540,22 @@ cdef class QuickBundles:
 
         return nearest_cluster
 
-    cdef int assignment_step(QuickBundles self, Data2D datum, int datum_id) nogil except -1:
-        """ Compute the assignment step of the QuickBundles algorithm.
+    cdef int extract_features(QuickBundles self, Data2D datum, Data2D features, Data2D features_flip) nogil except -1:
+        """ Extracts the features of a datum and of its flipped version.
 
-        It will assign a datum to its closest cluster according to a given
-        metric. If the distance between the datum and its closest cluster is
-        greater than the specified threshold, a new cluster is created and the
-        datum is assigned to it.
+        The flipped features are only extracted if the metric is not order
+        invariant.
 
         Parameters
         ----------
         datum : 2D array
-            The datum to assign.
-        datum_id : int
-            ID of the datum, usually its index.
-
-        Returns
-        -------
-        int
-            Index of the cluster the datum has been assigned to.
+            The datum from which features are extracted.
+        features : 2D array
+            Receives the features of the datum.
+        features_flip : 2D array
+            Receives the features of the flipped datum.
         """
-        cdef:
-            Data2D features_to_add = self.features
-            NearestCluster nearest_cluster, nearest_cluster_flip
-            Shape features_shape = self.metric.feature.c_infer_shape(datum)
+        cdef Shape features_shape = self.metric.feature.c_infer_shape(datum)
 
         # Check if datum is compatible with the metric
         if not same_shape(features_shape, self.features_shape):
@@ -575,21 +567,46 @@ cdef class QuickBundles:
             with gil:
                 raise ValueError("Data features' shapes must be compatible according to the metric used!")
 
-        # Find nearest cluster to datum
-        self.metric.feature.c_extract(datum, self.features)
-        nearest_cluster = self.find_nearest_cluster(self.features)
-
-        # Find nearest cluster to s_i_flip if metric is not order invariant
+        self.metric.feature.c_extract(datum, features)
         if not self.metric.feature.is_order_invariant:
-            self.metric.feature.c_extract(datum[::-1], self.features_flip)
-            nearest_cluster_flip = self.find_nearest_cluster(self.features_flip)
+            self.metric.feature.c_extract(datum[::-1], features_flip)
+
+        return 0
+
+    cdef int assign_to_nearest(QuickBundles self, NearestCluster nearest_cluster,
+                               NearestCluster nearest_cluster_flip,
+                               Data2D features, Data2D features_flip,
+                               int datum_id) nogil except -1:
+        """ Assigns a datum to its nearest cluster or to a new cluster.
+
+        Parameters
+        ----------
+        nearest_cluster : `NearestCluster` object
+            Nearest cluster to the features of the datum.
+        nearest_cluster_flip : `NearestCluster` object
+            Nearest cluster to the features of the flipped datum. Ignored if
+            the metric is order invariant.
+        features : 2D array
+            Features of the datum.
+        features_flip : 2D array
+            Features of the flipped datum.
+        datum_id : int
+            ID of the datum, usually its index.
+
+        Returns
+        -------
+        int
+            Index of the cluster the datum has been assigned to.
+        """
+        cdef Data2D features_to_add = features
 
-            # If we found a lower distance using a flipped datum,
-            #  add the flipped version instead
+        # If we found a lower distance using a flipped datum,
+        #  add the flipped version instead
+        if not self.metric.feature.is_order_invariant:
             if nearest_cluster_flip.dist < nearest_cluster.dist:
                 nearest_cluster.id = nearest_cluster_flip.id
                 nearest_cluster.dist = nearest_cluster_flip.dist
-                features_to_add = self.features_flip
+                features_to_add = features_flip
 
         # Check if distance with the nearest cluster is below some threshold
         # or if we already have the maximum number of clusters.
@@ -601,6 +618,44 @@ cdef class QuickBundles:
         self.clusters.c_assign(nearest_cluster.id, datum_id, features_to_add)
         return nearest_cluster.id
 
+    cdef int assignment_step(QuickBundles self, Data2D datum, int datum_id) nogil except -1:
+        """ Compute the assignment step of the QuickBundles algorithm.
+
+        It will assign a datum to its closest cluster according to a given
+        metric. If the distance between the datum and its closest cluster is
+        greater than the specified threshold, a new cluster is created and the
+        datum is assigned to it.
+
+        Parameters
+        ----------
+        datum : 2D array
+            The datum to assign.
+        datum_id : int
+            ID of the datum, usually its index.
+
+        Returns
+        -------
+        int
+            Index of the cluster the datum has been assigned to.
+        """
+        cdef NearestCluster nearest_cluster, nearest_cluster_flip
+        nearest_cluster_flip.id = -1
+        nearest_cluster_flip.dist = BIGGEST_DOUBLE
+        nearest_cluster_flip.flip = 1
+
+        self.extract_features(datum, self.features, self.features_flip)
+
+        # Find nearest cluster to datum
+        nearest_cluster = self.find_nearest_cluster(self.features)
+
+        # Find nearest cluster to s_i_flip if metric is not order invariant
+        if not self.metric.feature.is_order_invariant:
+            nearest_cluster_flip = self.find_nearest_cluster(self.features_flip)
+
+        return self.assign_to_nearest(nearest_cluster, nearest_cluster_flip,
+                                      self.features, self.features_flip,
+                                      datum_id)
+
     cdef void update_step(QuickBundles self, int cluster_id) nogil except *:
         """ Compute the update step of the QuickBundles algorithm.
 
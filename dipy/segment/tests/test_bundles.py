@@ -1,15 +1,21 @@
 import sys
+from os.path import join as pjoin
+from tempfile import TemporaryDirectory
+from unittest import mock
 import pytest
 import warnings
 
 import numpy as np
+import numpy.testing as npt
 from numpy.testing import assert_equal, assert_almost_equal
 
 from dipy.data import get_fnames
 from dipy.io.streamline import load_tractogram
-from dipy.segment.bundles import RecoBundles
-from dipy.tracking.distances import bundles_distances_mam
-from dipy.tracking.streamline import Streamlines
+from dipy.segment import bundles
+from dipy.segment.bundles import RecoBundles, ba_analysis, bundle_adjacency
+from dipy.tracking.distances import (bundles_distances_mam,
+                                     bundles_distances_sparse)
+from dipy.tracking.streamline import Streamlines, set_number_of_points
 from dipy.segment.clustering import qbx_and_merge
 from dipy.testing.decorators import set_random_number_generator
 
@@ -282,3 +288,181 @@ def test_rb_reduction_mam():
     # check if the bundle is recognized correctly
     for row in D:
         assert_equal(row.min(), 0)
+
+
+@pytest.mark.skipif(is_big_endian,
+                    reason="Little Endian architecture required")
+@set_random_number_generator(42)
+def test_rb_recognize_bundles(rng):
+
+    far = f2.copy()
+    far._data += np.array([300, 0, 0])
+    model_bundles = [f2, f3, far]
+
+    recognized = []
+    for num_workers in [1, 2]:
+        rb = RecoBundles(f, greater_than=0, clust_thr=10,
+                         rng=np.random.default_rng(42))
+        with mock.patch.object(bundles, 'bundles_distances_sparse',
+                               wraps=bundles_distances_sparse) as bds:
+            recognized.append(rb.recognize_bundles(model_bundles,
+                                                   model_clust_thr=5.,
+                                                   reduction_thr=10,
+                                                   num_workers=num_workers))
+        # Several workers compute the distances of a bundle in one thread
+        threads = {call.kwargs['num_threads']
+                   for call in bds.call_args_list[1:]}
+        assert_equal(threads, {None if num_workers == 1 else 1})
+
+    # Each bundle has its own generator, the workers do not change the result
+    for (rec_trans1, rec_labels1), (rec_trans2, rec_labels2) in \
+            zip(*recognized):
+        assert_equal(rec_labels1, rec_labels2)
+        assert_almost_equal(rec_trans1.get_data(), rec_trans2.get_data())
+
+    msg = "Streamlines do not have the same number of points. *"
+    for model_bundle, (rec_trans, rec_labels) in zip(model_bundles[:2],
+                                                     recognized[0]):
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message=msg,
+                                    category=UserWarning)
+            D = bundles_distances_mam(model_bundle, f[rec_labels])
+
+        # check if the bundle is recognized correctly
+        for row in D:
+            assert_equal(row.min(), 0)
+
+    rec_trans, rec_labels = recognized[0][2]
+    assert_equal(len(rec_trans), 0)
+    assert_equal(len(rec_labels), 0)
+
+    rb = RecoBundles(f, greater_than=0, clust_thr=10, rng=rng)
+    (rec_trans, rec_labels), = rb.recognize_bundles(
+        [f2], model_clust_thr=[5.], reduction_thr=10,
+        reduction_distance='mam', slr=False, pruning_distance='mam')
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message=msg, category=UserWarning)
+        D = bundles_distances_mam(f2, f[rec_labels])
+    for row in D:
+        assert_equal(row.min(), 0)
+
+
+@set_random_number_generator(42)
+def test_rb_cluster_cache(rng):
+
+    with TemporaryDirectory() as tmpdir:
+        fname = pjoin(tmpdir, 'clusters.npz')
+        rb = RecoBundles(f, greater_than=0, clust_thr=10, rng=rng,
+                         cluster_cache=fname)
+
+        # The cached clusters of the same streamlines are reused as they are
+        with mock.patch.object(bundles, 'qbx_and_merge') as qbx:
+            rb_cached = RecoBundles(f, greater_than=0, clust_thr=10, rng=rng,
+                                    cluster_cache=fname)
+            qbx.assert_not_called()
+        assert_equal(rb_cached.nb_centroids, rb.nb_centroids)
+        assert_equal(rb_cached.indices, rb.indices)
+        assert_almost_equal(rb_cached.centroids, rb.centroids)
+
+        rec_trans, rec_labels = rb_cached.recognize(model_bundle=f2,
+                                                    model_clust_thr=5.,
+                                                    reduction_thr=10)
+        msg = "Streamlines do not have the same number of points. *"
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message=msg,
+                                    category=UserWarning)
+            D = bundles_distances_mam(f2, f[rec_labels])
+        for row in D:
+            assert_equal(row.min(), 0)
+
+        # Other streamlines or thresholds cluster again and update the cache
+        for kwargs in [{'clust_thr': 8}, {'greater_than': 40}]:
+            params = {'greater_than': 0, 'clust_thr': 10}
+            params.update(kwargs)
+            with mock.patch.object(bundles, 'qbx_and_merge',
+                                   wraps=qbx_and_merge) as qbx:
+                rb_other = RecoBundles(f, cluster_cache=fname, **params)
+                qbx.assert_called_once()
+            with mock.patch.object(bundles, 'qbx_and_merge') as qbx:
+                RecoBundles(f, cluster_cache=fname, **params)
+                qbx.assert_not_called()
+            assert_equal(rb_other.nb_streamlines,
+                         len(rb_other.cluster_map.refdata))
+
+        # Unreadable caches are clustered again and overwritten
+        for content in [b'', b'not a clusters file']:
+            with open(fname, 'wb') as cache:
+                cache.write(content)
+            with mock.patch.object(bundles, 'qbx_and_merge',
+                                   wraps=qbx_and_merge) as qbx:
+                RecoBundles(f, greater_than=0, clust_thr=10,
+                            cluster_cache=fname)
+                qbx.assert_called_once()
+            with mock.patch.object(bundles, 'qbx_and_merge') as qbx:
+                RecoBundles(f, greater_than=0, clust_thr=10,
+                            cluster_cache=fname)
+                qbx.assert_not_called()
+
+
+@pytest.mark.skipif(is_big_endian,
+                    reason="Little Endian architecture required")
+def test_rb_fss():
+
+    rb = RecoBundles(f, greater_than=0, clust_thr=10,
+                     rng=np.random.default_rng(42))
+    rb_fss = RecoBundles(f, greater_than=0, clust_thr=10,
+                         rng=np.random.default_rng(42))
+
+    for model_bundle in [f2, f3]:
+        rec_trans, rec_labels = rb.recognize(model_bundle=model_bundle,
+                                             model_clust_thr=5.,
+                                             reduction_thr=10,
+                                             slr=False)
+        fss_trans, fss_labels = rb_fss.recognize(model_bundle=model_bundle,
+                                                 model_clust_thr=5.,
+                                                 reduction_thr=10,
+                                                 slr=False,
+                                                 use_fss=True)
+        assert_equal(np.sort(fss_labels), np.sort(rec_labels))
+
+    # The search tree of the centroids is reused, or grown for larger radii
+    fss = rb_fss._fss
+    rb_fss.recognize(model_bundle=f2, model_clust_thr=5., reduction_thr=8,
+                     use_fss=True)
+    assert rb_fss._fss is fss
+    refine_trans, refine_labels = rb_fss.refine(model_bundle=f2,
+                                                pruned_streamlines=fss_trans,
+                                                model_clust_thr=5.,
+                                                reduction_thr=12,
+                                                use_fss=True)
+    assert rb_fss._fss.max_radius == 12
+    assert len(refine_labels) > 0
+
+    recognized = rb_fss.recognize_bundles([f2, f3], model_clust_thr=5.,
+                                          reduction_thr=10, slr=False,
+                                          num_workers=1, use_fss=True)
+    msg = "Streamlines do not have the same number of points. *"
+    for (_, labels), model_bundle in zip(recognized, [f2, f3]):
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message=msg,
+                                    category=UserWarning)
+            D = bundles_distances_mam(model_bundle, f[labels])
+        for row in D:
+            assert_equal(row.min(), 0)
+
+    npt.assert_raises(ValueError, rb_fss.recognize, model_bundle=f2,
+                      model_clust_thr=5., reduction_distance='mam',
+                      use_fss=True)
+
+
+def test_bundle_adjacency_fss():
+
+    for bundle, other, threshold in [(f2, f1, 6.), (f1, f3, 4.),
+                                     (f2, f3, 6.)]:
+        bundle = set_number_of_points(bundle, 20)
+        other = set_number_of_points(other, 20)
+        assert_almost_equal(
+            bundle_adjacency(bundle, other, threshold, use_fss=True),
+            bundle_adjacency(bundle, other, threshold))
+    assert_almost_equal(ba_analysis(f1, f1[:100], use_fss=True),
+                        ba_analysis(f1, f1[:100]))
@@ -200,6 +200,54 @@ def test_quickbundles_with_not_order_invariant_metric():
     assert_array_equal(clusters[0].centroid, streamline)
 
 
+@set_random_number_generator(42)
+def test_quickbundles_num_threads(rng):
+    # Bundles spread around the space, close enough to make many clusters.
+    streamlines = []
+    for _ in range(30):
+        offset = rng.normal(0, 30, 3)
+        streamline = np.cumsum(rng.normal(0, 1, (20, 3)), axis=0)
+        streamlines += [(streamline + offset +
+                         rng.normal(0, 1, (20, 3))).astype(dtype)
+                        for _ in range(rng.integers(1, 20))]
+    # Flipped duplicates to exercise the ties and the flipped assignment.
+    streamlines += [s[::-1].copy() for s in streamlines[::5]]
+    ordering = rng.permutation(len(streamlines))
+
+    def check_same_clusters(clusters1, clusters2):
+        assert_equal(len(clusters1), len(clusters2))
+        for cluster1, cluster2 in zip(clusters1, clusters2):
+            assert_array_equal(cluster1.indices, cluster2.indices)
+            assert_array_equal(cluster1.centroid, cluster2.centroid)
+
+    feature = dipysfeature.ResampleFeature(nb_points=12)
+    metrics = [dipysmetric.AveragePointwiseEuclideanMetric(feature),
+               dipysmetric.SumPointwiseEuclideanMetric(feature),
+               dipysmetric.SumPointwiseEuclideanMetric(
+                   dipysfeature.CenterOfMassFeature()),
+               dipysmetric.CosineMetric(
+                   dipysfeature.VectorOfEndpointsFeature())]
+    for metric, thr in zip(metrics, [3., 36., 3., 0.1]):
+        for max_nb_clusters in [np.iinfo('i4').max, 20]:
+            clusters = quickbundles(streamlines, metric, thr,
+                                    max_nb_clusters=max_nb_clusters,
+                                    ordering=ordering)
+            for num_threads, batch_size in [(None, 256), (2, 1), (2, 7)]:
+                clusters_parallel = quickbundles(
+                    streamlines, metric, thr, max_nb_clusters=max_nb_clusters,
+                    ordering=ordering, num_threads=num_threads,
+                    batch_size=batch_size)
+                check_same_clusters(clusters, clusters_parallel)
+
+    qb = QuickBundles(threshold=3., num_threads=2)
+    check_same_clusters(QuickBundles(threshold=3.).cluster(streamlines),
+                        qb.cluster(streamlines))
+    assert_equal(len(qb.cluster([])), 0)
+
+    assert_raises(ValueError, quickbundles, streamlines, metrics[0], 3.,
+                  num_threads=2, batch_size=0)
+
+
 def test_quickbundles_memory_leaks():
     qb = QuickBundles(threshold=2*threshold)
 
@@ -1,5 +1,7 @@
 cimport cython
 
+import numpy as np
+
 from dipy.tracking.stopping_criterion cimport (StreamlineStatus,
                                                StoppingCriterion,
                                                TRACKPOINT,
@@ -135,6 +137,141 @@ cdef class DirectionGetter:
            i = streamline.shape[0]
        return i, stream_status
 
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def generate_streamlines_batch(self,
+                                   double[:, ::1] seeds,
+                                   double[:, ::1] directions,
+                                   double[::1] voxel_size,
+                                   double step_size,
+                                   StoppingCriterion stopping_criterion,
+                                   cnp.float_t[:, :, ::1] streamlines,
+                                   int fixedstep,
+                                   object rngs=None):
+        """Track many streamlines in lockstep.
+
+        All the streamlines still being tracked advance by one step at a
+        time, so that their directions are computed together with
+        ``get_direction_batch``. Each streamline is tracked as by
+        ``generate_streamline``.
+
+        Parameters
+        ----------
+        seeds : array (K, 3)
+            First point of each streamline.
+        directions : array (K, 3)
+            Initial direction of each streamline, updated in place.
+        voxel_size : array (3,)
+            Size of voxels in the data set.
+        step_size : float
+            Size of tracking steps in mm if ``fixedstep``.
+        stopping_criterion : StoppingCriterion
+            Used to check the streamline status along path.
+        streamlines : array (K, N, 3)
+            Output of tracking, ``N`` is the maximum length of a streamline.
+        fixedstep : int
+            If greater than 0, a fixed step_size is used, otherwise a variable
+            step size is used.
+        rngs : array of random.Random, optional
+            Random generator of each streamline, passed to
+            ``get_direction_batch``.
+
+        Returns
+        -------
+        lengths : array (K,)
+            Length of each streamline.
+        statuses : array (K,)
+            Ending state of each streamline.
+        """
+        cdef:
+            cnp.npy_intp i, j, k, m, n
+            cnp.npy_intp len_streamlines = streamlines.shape[1]
+            double voxdir[3]
+            double[:, ::1] points, active_points, active_dirs
+            cnp.npy_intp[::1] active_view
+            cnp.npy_uint8[::1] failed
+            cnp.npy_intp[::1] lengths
+            int[::1] statuses
+            StreamlineStatus stream_status
+            void (*step)(double*, double*, double) nogil
+
+        if fixedstep > 0:
+            step = _fixed_step
+        else:
+            step = _step_to_boundary
+
+        n = seeds.shape[0]
+        points = np.array(seeds)
+        streamlines[:, 0, :] = seeds
+        lengths_arr = np.full(n, len_streamlines, dtype=np.intp)
+        statuses_arr = np.full(n, TRACKPOINT, dtype=np.intc)
+        lengths = lengths_arr
+        statuses = statuses_arr
+        active = np.arange(n, dtype=np.intp)
+        directions_arr = np.asarray(directions)
+        points_arr = np.asarray(points)
+
+        for i in range(1, len_streamlines):
+            if active.shape[0] == 0:
+                break
+            active_points = points_arr[active]
+            active_dirs = directions_arr[active]
+            failed = np.asarray(self.get_direction_batch(
+                active_points, active_dirs,
+                None if rngs is None else rngs[active]), dtype=np.uint8)
+            active_view = active
+            keep = np.ones(active.shape[0], dtype=bool)
+            for j in range(active.shape[0]):
+                k = active_view[j]
+                if failed[j]:
+                    lengths[k] = i
+                    keep[j] = False
+                    continue
+                for m in range(3):
+                    directions[k, m] = active_dirs[j, m]
+                    voxdir[m] = active_dirs[j, m] / voxel_size[m]
+                step(&points[k, 0], voxdir, step_size)
+                copy_point(&points[k, 0], &streamlines[k, i, 0])
+                stream_status = stopping_criterion.check_point_c(
+                    &points[k, 0])
+                statuses[k] = stream_status
+                if (stream_status == ENDPOINT or
+                        stream_status == INVALIDPOINT or
+                        stream_status == OUTSIDEIMAGE):
+                    lengths[k] = i
+                    keep[j] = False
+            active = active[keep]
+        return lengths_arr, statuses_arr
+
+    def get_direction_batch(self, double[:, ::1] points,
+                            double[:, ::1] directions, object rngs=None):
+        """Update the directions of many points at once.
+
+        This default implementation calls ``get_direction`` for each point.
+
+        Parameters
+        ----------
+        points : array (K, 3)
+            The points at which to lookup tracking directions.
+        directions : array (K, 3)
+            Previous tracking directions, updated in place.
+        rngs : array of random.Random, optional
+            Random generator of each point, used by the probabilistic
+            direction getters.
+
+        Returns
+        -------
+        status : array (K,)
+            1 where no direction was found, 0 otherwise.
+        """
+        cdef:
+            cnp.npy_intp i
+            cnp.npy_uint8[::1] status = np.zeros(points.shape[0],
+                                                 dtype=np.uint8)
+        for i in range(points.shape[0]):
+            status[i] = self.get_direction_c(&points[i, 0], &directions[i, 0])
+        return np.asarray(status)
+
     cpdef int get_direction(self,
                             double[::1] point,
                             double[::1] direction) except -1:
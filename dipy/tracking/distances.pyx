@@ -7,12 +7,18 @@
 
 cimport cython
 
-from libc.stdlib cimport calloc, realloc, free
+from libc.math cimport INFINITY
+from libc.stdlib cimport calloc, malloc, realloc, free
+from cython.parallel import parallel, prange
 
 import numpy as np
+from scipy.sparse import csr_matrix
 from warnings import warn
 cimport numpy as cnp
 
+from dipy.utils.omp import determine_num_threads
+from dipy.utils.omp cimport set_num_threads, restore_default_num_threads
+
 
 cdef extern from "dpy_math.h" nogil:
     double floor(double x)
@@ -470,9 +476,320 @@ def most_similar_track_mam(tracks,metric='avg'):
         track2others[j] = czhang(t1_len, t1_ptr, t2_len, t2_ptr, min_buffer, metric_type)
     return si, track2others
 
+# Memory budget of the distances of a block of rows, in bytes
+DEF BLOCK_BYTES = 67108864
+
+
+def _pack_tracks(tracks, cnp.npy_intp pad=0):
+    """ Concatenate tracks as contiguous float32 points
+
+    Returns the points, padded with `pad` zero points, and the offset and
+    number of points of each track.
+    """
+    if hasattr(tracks, 'get_data'):
+        lengths = np.asarray(tracks._lengths, dtype=np.intp)
+        points = np.asarray(tracks.get_data(), dtype=f32_dt).reshape(-1, 3)
+    else:
+        tracks = [np.asarray(t, dtype=f32_dt).reshape(-1, 3) for t in tracks]
+        lengths = np.array([len(t) for t in tracks], dtype=np.intp)
+        points = (np.concatenate(tracks) if len(tracks)
+                  else np.zeros((0, 3), dtype=f32_dt))
+    offsets = np.zeros(len(lengths), dtype=np.intp)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    if pad:
+        points = np.concatenate([points, np.zeros((pad, 3), dtype=f32_dt)])
+    return np.ascontiguousarray(points), offsets, lengths
+
+
+def _check_same_nb_points(tracksA, tracksB):
+    # for performance issue, we just check the first streamline
+    if len(tracksA) and len(tracksB) and len(tracksA[0]) != len(tracksB[0]):
+        w_s = "Streamlines do not have the same number of points. "
+        w_s += "All streamlines need to have the same number of points. "
+        w_s += "Use dipy.tracking.streamline.set_number_of_points to adjust "
+        w_s += "your streamlines"
+        warn(w_s)
+
+
+def _metric_type(metric):
+    if metric == 'avg':
+        return 0
+    elif metric == 'min':
+        return 1
+    elif metric == 'max':
+        return 2
+    raise ValueError('Metric should be one of avg, min, max')
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def bundles_distances_mam(tracksA, tracksB, metric='avg'):
+cdef void _mam_block(float[:, ::1] pointsA, cnp.npy_intp[::1] offsetsA,
+                     cnp.npy_intp[::1] lengthsA, float[:, ::1] pointsB,
+                     cnp.npy_intp[::1] offsetsB, cnp.npy_intp[::1] lengthsB,
+                     cnp.npy_intp longest_track_len, int metric_type,
+                     double[:, ::1] DM) nogil:
+    """ MAM distances of tracks A and B, in parallel over the tracks A """
+    cdef:
+        cnp.npy_intp i, j
+        cnp.float32_t *min_buffer
+
+    with parallel():
+        # Each thread has its own buffer of minimum distances
+        min_buffer = <cnp.float32_t *> malloc(2 * longest_track_len *
+                                              sizeof(cnp.float32_t))
+        for i in prange(DM.shape[0], schedule='guided'):
+            for j in range(DM.shape[1]):
+                DM[i, j] = czhang(lengthsA[i], &pointsA[offsetsA[i], 0],
+                                  lengthsB[j], &pointsB[offsetsB[j], 0],
+                                  min_buffer, metric_type)
+        free(min_buffer)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _mdf_block(float[:, ::1] pointsA, cnp.npy_intp[::1] offsetsA,
+                     float[:, ::1] pointsB, cnp.npy_intp[::1] offsetsB,
+                     cnp.npy_intp t_len, double[:, ::1] DM) nogil:
+    """ MDF distances of tracks A and B, in parallel over the tracks A """
+    cdef cnp.npy_intp i, j
+
+    for i in prange(DM.shape[0], schedule='guided'):
+        for j in range(DM.shape[1]):
+            DM[i, j] = min_track_direct_flip_dist(&pointsA[offsetsA[i], 0],
+                                                  &pointsB[offsetsB[j], 0],
+                                                  t_len)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _mam_block_bounded(float[:, ::1] pointsA, cnp.npy_intp[::1] offsetsA,
+                             cnp.npy_intp[::1] lengthsA, double[:, ::1] boxesA,
+                             float[:, ::1] pointsB, cnp.npy_intp[::1] offsetsB,
+                             cnp.npy_intp[::1] lengthsB, double[:, ::1] boxesB,
+                             cnp.npy_intp longest_track_len, int metric_type,
+                             double bound, double[:, ::1] DM) nogil:
+    """ MAM distances of tracks A and B, infinite above `bound`
+
+    The distance between the bounding boxes of two tracks is lower than the
+    distance of any of their points, and thus than their MAM distances.
+    """
+    cdef:
+        cnp.npy_intp i, j, k
+        double gap, gap2
+        cnp.float32_t *min_buffer
+
+    with parallel():
+        min_buffer = <cnp.float32_t *> malloc(2 * longest_track_len *
+                                              sizeof(cnp.float32_t))
+        for i in prange(DM.shape[0], schedule='guided'):
+            for j in range(DM.shape[1]):
+                gap2 = 0
+                for k in range(3):
+                    gap = boxesA[i, k] - boxesB[j, k + 3]
+                    if boxesB[j, k] - boxesA[i, k + 3] > gap:
+                        gap = boxesB[j, k] - boxesA[i, k + 3]
+                    if gap > 0:
+                        gap2 = gap2 + gap * gap
+                if gap2 > bound * bound:
+                    DM[i, j] = INFINITY
+                else:
+                    DM[i, j] = czhang(lengthsA[i], &pointsA[offsetsA[i], 0],
+                                      lengthsB[j], &pointsB[offsetsB[j], 0],
+                                      min_buffer, metric_type)
+        free(min_buffer)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _mdf_block_bounded(float[:, ::1] pointsA, cnp.npy_intp[::1] offsetsA,
+                             double[:, ::1] baryA, float[:, ::1] pointsB,
+                             cnp.npy_intp[::1] offsetsB, double[:, ::1] baryB,
+                             cnp.npy_intp t_len, double bound,
+                             double[:, ::1] DM) nogil:
+    """ MDF distances of tracks A and B, infinite above `bound`
+
+    The distance between the barycenters of two tracks is lower than their
+    direct and flipped average distances, and thus than their MDF distance.
+    """
+    cdef:
+        cnp.npy_intp i, j, k
+        double d, d2
+
+    for i in prange(DM.shape[0], schedule='guided'):
+        for j in range(DM.shape[1]):
+            d2 = 0
+            for k in range(3):
+                d = baryA[i, k] - baryB[j, k]
+                d2 = d2 + d * d
+            if d2 > bound * bound:
+                DM[i, j] = INFINITY
+            else:
+                DM[i, j] = bounded_min_track_direct_flip_dist(
+                    &pointsA[offsetsA[i], 0], &pointsB[offsetsB[j], 0],
+                    t_len, bound)
+
+
+def _track_barycenters(points, offsets, cnp.npy_intp t_len):
+    # Barycenters of the t_len points read from each offset
+    points = np.asarray(points)
+    offsets = np.asarray(offsets)
+    cumsum = np.zeros((len(points) + 1, 3))
+    np.cumsum(points, axis=0, out=cumsum[1:])
+    return (cumsum[offsets + t_len] - cumsum[offsets]) / max(t_len, 1)
+
+
+def _track_boxes(points, offsets, lengths):
+    # Bounding boxes (min and max corners) of the tracks
+    points = np.asarray(points)
+    offsets = np.asarray(offsets)
+    lengths = np.asarray(lengths)
+    boxes = np.zeros((len(offsets), 6))
+    nonempty = lengths > 0
+    if np.any(nonempty):
+        points = points[:np.sum(lengths)]
+        starts = offsets[nonempty]
+        boxes[nonempty, :3] = np.minimum.reduceat(points, starts)
+        boxes[nonempty, 3:] = np.maximum.reduceat(points, starts)
+    return boxes
+
+
+def _iter_distances_blocks(tracksA, tracksB, distance, metric, block_size,
+                           num_threads, threshold=None):
+    cdef:
+        cnp.npy_intp start, stop, lentA, lentB, t_len = 0
+        cnp.npy_intp longest_track_len
+        int metric_type = 0, threads_to_use
+        double bound = 0
+        float[:, ::1] pointsA, pointsB
+        cnp.npy_intp[::1] offsetsA, lengthsA, offsetsB, lengthsB
+        double[:, ::1] DM, boundsA, boundsB
+
+    if distance.lower() == 'mdf':
+        is_mdf = True
+    elif distance.lower() == 'mam':
+        is_mdf = False
+        metric_type = _metric_type(metric)
+    else:
+        raise ValueError('Distance should be one of mdf, mam')
+    if block_size is not None and block_size < 1:
+        raise ValueError('block_size must be a positive integer')
+    _check_same_nb_points(tracksA, tracksB)
+
+    lentA = len(tracksA)
+    lentB = len(tracksB)
+    if block_size is None:
+        block_size = max(BLOCK_BYTES // (8 * max(lentB, 1)), 1)
+    if is_mdf and lentA:
+        t_len = len(tracksA[0])
+    # The MDF reads t_len points of every track, padding keeps the reads of
+    # shorter tracks in the buffer
+    pointsB, offsetsB, lengthsB = _pack_tracks(tracksB, pad=t_len)
+    threads_to_use = determine_num_threads(num_threads)
+    if threshold is not None:
+        # Pairs are skipped when their lower bound is above the threshold,
+        # with a margin for the float32 rounding of the distances
+        bound = threshold * (1 + 1e-5) + 1e-5
+        if is_mdf:
+            boundsB = _track_barycenters(pointsB, offsetsB, t_len)
+        else:
+            boundsB = _track_boxes(pointsB, offsetsB, lengthsB)
+
+    for start in range(0, lentA, block_size):
+        stop = min(start + block_size, lentA)
+        pointsA, offsetsA, lengthsA = _pack_tracks(tracksA[start:stop],
+                                                   pad=t_len)
+        DM = np.zeros((stop - start, lentB), dtype=np.double)
+        set_num_threads(threads_to_use)
+        if is_mdf and threshold is not None:
+            boundsA = _track_barycenters(pointsA, offsetsA, t_len)
+            with nogil:
+                _mdf_block_bounded(pointsA, offsetsA, boundsA, pointsB,
+                                   offsetsB, boundsB, t_len, bound, DM)
+        elif is_mdf:
+            with nogil:
+                _mdf_block(pointsA, offsetsA, pointsB, offsetsB, t_len, DM)
+        else:
+            longest_track_len = max(np.max(lengthsA, initial=1),
+                                    np.max(lengthsB, initial=1))
+            if threshold is not None:
+                boundsA = _track_boxes(pointsA, offsetsA, lengthsA)
+                with nogil:
+                    _mam_block_bounded(pointsA, offsetsA, lengthsA, boundsA,
+                                       pointsB, offsetsB, lengthsB, boundsB,
+                                       longest_track_len, metric_type, bound,
+                                       DM)
+            else:
+                with nogil:
+                    _mam_block(pointsA, offsetsA, lengthsA, pointsB,
+                               offsetsB, lengthsB, longest_track_len,
+                               metric_type, DM)
+        if num_threads is not None:
+            restore_default_num_threads()
+        yield start, np.asarray(DM)
+
+
+def iter_bundles_distances(tracksA, tracksB, distance='mdf', metric='avg',
+                           block_size=None, num_threads=1):
+    """ Iterate over blocks of rows of the distances between two bundles
+
+    Only the distances of one block of tracks of A to all the tracks of B are
+    held in memory at a time.
+
+    Parameters
+    ----------
+    tracksA : sequence
+       of tracks as arrays, shape (N1,3) .. (Nm,3)
+    tracksB : sequence
+       of tracks as arrays, shape (N1,3) .. (Nm,3)
+    distance : str, optional
+       'mdf' (see `bundles_distances_mdf`) or 'mam' (see
+       `bundles_distances_mam`).
+    metric : str, optional
+       'avg', 'min', 'max', the metric of the 'mam' distance.
+    block_size : int, optional
+       Number of rows of the blocks. By default, the blocks use about 64 MB.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None,
+        the value of OMP_NUM_THREADS environment variable is used if it is
+        set, otherwise all available threads are used. If < 0 the maximal
+        number of threads minus |num_threads + 1| is used (enter -1 to use as
+        many threads as possible). 0 raises an error. Default: 1.
+
+    Yields
+    ------
+    start : int
+        Index of the first track of A of the block.
+    DM : array, shape (block_size, len(tracksB))
+        distances between the tracks ``tracksA[start:start + block_size]``
+        and tracksB. The last block can have less rows.
+
+    See Also
+    --------
+    dipy.tracking.distances.bundles_distances_mdf
+    dipy.tracking.distances.bundles_distances_mam
+    """
+    return _iter_distances_blocks(tracksA, tracksB, distance, metric,
+                                  block_size, num_threads)
+
+
+def _bundles_distances(tracksA, tracksB, distance, metric, num_threads, out):
+    if out is None:
+        return next(iter_bundles_distances(
+            tracksA, tracksB, distance=distance, metric=metric,
+            block_size=max(len(tracksA), 1), num_threads=num_threads),
+            (0, np.zeros((0, len(tracksB)))))[1]
+    if out.shape != (len(tracksA), len(tracksB)):
+        raise ValueError('out should have the shape (len(tracksA), '
+                         'len(tracksB))')
+    for start, DM in iter_bundles_distances(tracksA, tracksB,
+                                            distance=distance, metric=metric,
+                                            num_threads=num_threads):
+        out[start:start + DM.shape[0]] = DM
+    return out
+
+
+def bundles_distances_mam(tracksA, tracksB, metric='avg', num_threads=1,
+                          out=None):
     """ Calculate distances between list of tracks A and list of tracks B
 
     Parameters
@@ -483,88 +800,34 @@ def bundles_distances_mam(tracksA, tracksB, metric='avg'):
        of tracks as arrays, shape (N1,3) .. (Nm,3)
     metric : str
        'avg', 'min', 'max'
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None,
+        the value of OMP_NUM_THREADS environment variable is used if it is
+        set, otherwise all available threads are used. If < 0 the maximal
+        number of threads minus |num_threads + 1| is used (enter -1 to use as
+        many threads as possible). 0 raises an error. Default: 1.
+    out : array, shape (len(tracksA), len(tracksB)), optional
+        Array, e.g. a ``np.memmap``, where the distances are written by
+        blocks of rows, so that only a block is held in memory.
 
     Returns
     -------
     DM : array, shape (len(tracksA), len(tracksB))
-        distances between tracksA and tracksB according to metric
+        distances between tracksA and tracksB according to metric, `out` if
+        given.
 
     See Also
     --------
     dipy.tracking.streamline.set_number_of_points
+    dipy.tracking.distances.iter_bundles_distances
 
     """
-    cdef:
-        cnp.npy_intp i, j, lentA, lentB
-        int metric_type
-    if metric=='avg':
-        metric_type = 0
-    elif metric == 'min':
-        metric_type = 1
-    elif metric == 'max':
-        metric_type = 2
-    else:
-        raise ValueError('Metric should be one of avg, min, max')
-    # preprocess tracks
-    cdef:
-        cnp.npy_intp longest_track_len = 0, track_len
-        cnp.npy_intp longest_track_lenA = 0, longest_track_lenB = 0
-        cnp.ndarray[object, ndim=1] tracksA32
-        cnp.ndarray[object, ndim=1] tracksB32
-        cnp.ndarray[cnp.double_t, ndim=2] DM
-    lentA = len(tracksA)
-    lentB = len(tracksB)
-    # for performance issue, we just check the first streamline
-    if len(tracksA[0]) != len(tracksB[0]):
-        w_s = "Streamlines do not have the same number of points. "
-        w_s += "All streamlines need to have the same number of points. "
-        w_s += "Use dipy.tracking.streamline.set_number_of_points to adjust "
-        w_s += "your streamlines"
-        warn(w_s)
-    tracksA32 = np.zeros((lentA,), dtype=object)
-    tracksB32 = np.zeros((lentB,), dtype=object)
-    DM = np.zeros((lentA,lentB), dtype=np.double)
-    # process tracks to predictable memory layout, find longest track
-    for i in range(lentA):
-        tracksA32[i] = np.ascontiguousarray(tracksA[i], dtype=f32_dt)
-        track_len = tracksA32[i].shape[0]
-        if track_len > longest_track_lenA:
-            longest_track_lenA = track_len
-    for i in range(lentB):
-        tracksB32[i] = np.ascontiguousarray(tracksB[i], dtype=f32_dt)
-        track_len = tracksB32[i].shape[0]
-        if track_len > longest_track_lenB:
-            longest_track_lenB = track_len
-    if longest_track_lenB > longest_track_lenA:
-        longest_track_lenA = longest_track_lenB
-    # preallocate buffer array for track distance calculations
-    cdef:
-        cnp.ndarray [cnp.float32_t, ndim=1] distances_buffer
-        cnp.float32_t *t1_ptr
-        cnp.float32_t *t2_ptr
-        cnp.float32_t *min_buffer
-    distances_buffer = np.zeros((longest_track_lenA*2,), dtype=np.float32)
-    min_buffer = <cnp.float32_t *> cnp.PyArray_DATA(distances_buffer)
-    # cycle over tracks
-    cdef:
-        cnp.ndarray [cnp.float32_t, ndim=2] t1, t2
-        cnp.npy_intp t1_len, t2_len
-    for i from 0 <= i < lentA:
-        t1 = tracksA32[i]
-        t1_len = cnp.PyArray_DIM(t1, 0)
-        t1_ptr = <cnp.float32_t *> cnp.PyArray_DATA(t1)
-        for j from 0 <= j < lentB:
-            t2 = tracksB32[j]
-            t2_len = cnp.PyArray_DIM(t2, 0)
-            t2_ptr = <cnp.float32_t *> cnp.PyArray_DATA(t2)
-            DM[i,j] = czhang(t1_len, t1_ptr, t2_len, t2_ptr, min_buffer, metric_type)
+    _metric_type(metric)
+    return _bundles_distances(tracksA, tracksB, 'mam', metric, num_threads,
+                              out)
 
-    return DM
 
-
-@cython.boundscheck(False)
-@cython.wraparound(False)
-def bundles_distances_mdf(tracksA, tracksB):
+def bundles_distances_mdf(tracksA, tracksB, num_threads=1, out=None):
     """ Calculate distances between list of tracks A and list of tracks B
 
     All tracks need to have the same number of points
@@ -575,70 +838,94 @@ def bundles_distances_mdf(tracksA, tracksB):
        of tracks as arrays, [(N,3) .. (N,3)]
     tracksB : sequence
        of tracks as arrays, [(N,3) .. (N,3)]
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None,
+        the value of OMP_NUM_THREADS environment variable is used if it is
+        set, otherwise all available threads are used. If < 0 the maximal
+        number of threads minus |num_threads + 1| is used (enter -1 to use as
+        many threads as possible). 0 raises an error. Default: 1.
+    out : array, shape (len(tracksA), len(tracksB)), optional
+        Array, e.g. a ``np.memmap``, where the distances are written by
+        blocks of rows, so that only a block is held in memory.
 
     Returns
     -------
     DM : array, shape (len(tracksA), len(tracksB))
-        distances between tracksA and tracksB according to metric
+        distances between tracksA and tracksB according to metric, `out` if
+        given.
 
     See Also
     --------
     dipy.tracking.streamline.set_number_of_points
+    dipy.tracking.distances.iter_bundles_distances
 
     """
-    cdef:
-        cnp.npy_intp i, j, lentA, lentB
-    # preprocess tracks
-    cdef:
-        cnp.npy_intp longest_track_len = 0, track_len
-        longest_track_lenA, longest_track_lenB
-        cnp.ndarray[object, ndim=1] tracksA32
-        cnp.ndarray[object, ndim=1] tracksB32
-        cnp.ndarray[cnp.double_t, ndim=2] DM
-    lentA = len(tracksA)
-    lentB = len(tracksB)
-    # for performance issue, we just check the first streamline
-    if len(tracksA[0]) != len(tracksB[0]):
-        w_s = "Streamlines do not have the same number of points. "
-        w_s += "All streamlines need to have the same number of points. "
-        w_s += "Use dipy.tracking.streamline.set_number_of_points to adjust "
-        w_s += "your streamlines"
-        warn(w_s)
-    tracksA32 = np.zeros((lentA,), dtype=object)
-    tracksB32 = np.zeros((lentB,), dtype=object)
-    DM = np.zeros((lentA,lentB), dtype=np.double)
-    # process tracks to predictable memory layout
-    for i in range(lentA):
-        tracksA32[i] = np.ascontiguousarray(tracksA[i], dtype=f32_dt)
-    for i in range(lentB):
-        tracksB32[i] = np.ascontiguousarray(tracksB[i], dtype=f32_dt)
-    # preallocate buffer array for track distance calculations
-    cdef:
-        cnp.float32_t *t1_ptr
-        cnp.float32_t *t2_ptr
-        cnp.float32_t *min_buffer
-    # cycle over tracks
-    cdef:
-        cnp.ndarray [cnp.float32_t, ndim=2] t1, t2
-        cnp.npy_intp t1_len, t2_len
-        float d[2]
-    t_len = tracksA32[0].shape[0]
+    return _bundles_distances(tracksA, tracksB, 'mdf', 'avg', num_threads,
+                              out)
 
-    for i from 0 <= i < lentA:
-        t1 = tracksA32[i]
-        #t1_len = t1.shape[0]
-        t1_ptr = <cnp.float32_t *> cnp.PyArray_DATA(t1)
-        for j from 0 <= j < lentB:
-            t2 = tracksB32[j]
-            #t2_len = t2.shape[0]
-            t2_ptr = <cnp.float32_t *> cnp.PyArray_DATA(t2)
-            #DM[i,j] = czhang(t1_len, t1_ptr, t2_len, t2_ptr, min_buffer, metric_type)
-            track_direct_flip_dist(t1_ptr, t2_ptr,t_len,<float *>d)
-            if d[0]<d[1]:
-                DM[i,j]=d[0]
-            else:
-                DM[i,j]=d[1]
-    return DM
+
+def bundles_distances_sparse(tracksA, tracksB, threshold, distance='mdf',
+                             metric='avg', block_size=None, num_threads=1):
+    """ Distances between tracks A and tracks B up to a threshold
+
+    Only the pairs of tracks closer than `threshold` are kept, in a sparse
+    matrix. The distance of a pair is not computed when a lower bound shows
+    that it is above the threshold: the distance between the barycenters of
+    the tracks for the MDF, between their bounding boxes for the MAM.
+
+    Parameters
+    ----------
+    tracksA : sequence
+       of tracks as arrays, shape (N1,3) .. (Nm,3)
+    tracksB : sequence
+       of tracks as arrays, shape (N1,3) .. (Nm,3)
+    threshold : float
+       Pairs with a distance lower or equal to `threshold` are kept.
+    distance : str, optional
+       'mdf' (see `bundles_distances_mdf`) or 'mam' (see
+       `bundles_distances_mam`).
+    metric : str, optional
+       'avg', 'min', 'max', the metric of the 'mam' distance.
+    block_size : int, optional
+       Number of tracks of A processed at once. By default, about 64 MB of
+       distances are held in memory at a time.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None,
+        the value of OMP_NUM_THREADS environment variable is used if it is
+        set, otherwise all available threads are used. If < 0 the maximal
+        number of threads minus |num_threads + 1| is used (enter -1 to use as
+        many threads as possible). 0 raises an error. Default: 1.
+
+    Returns
+    -------
+    DM : scipy.sparse.csr_matrix, shape (len(tracksA), len(tracksB))
+        distances of the kept pairs. Null distances are stored explicitly,
+        so that the kept pairs are the stored entries, e.g. the neighbors of
+        ``tracksA[i]`` are ``DM.indices[DM.indptr[i]:DM.indptr[i + 1]]``.
+
+    See Also
+    --------
+    dipy.tracking.distances.bundles_distances_mdf
+    dipy.tracking.distances.bundles_distances_mam
+
+    """
+    indptr = [np.zeros(1, dtype=np.intp)]
+    indices = []
+    data = []
+    nb_pairs = 0
+    for _, DM in _iter_distances_blocks(tracksA, tracksB, distance, metric,
+                                        block_size, num_threads,
+                                        threshold=threshold):
+        kept = DM <= threshold
+        rows, cols = np.nonzero(kept)
+        indptr.append(nb_pairs + np.cumsum(np.count_nonzero(kept, axis=1)))
+        indices.append(cols)
+        data.append(DM[rows, cols])
+        nb_pairs += len(cols)
+    return csr_matrix((np.concatenate(data or [np.zeros(0)]),
+                       np.concatenate(indices or [np.zeros(0, np.intp)]),
+                       np.concatenate(indptr)),
+                      shape=(len(tracksA), len(tracksB)))
 
 
 
@@ -1500,6 +1787,51 @@ cdef void track_direct_flip_dist(float *a,float *b,long rows,float *out) nogil:
     out[1]=<cnp.float32_t>distf/<cnp.float32_t>rows
 
 
+cdef inline float min_track_direct_flip_dist(float *a, float *b,
+                                             long rows) nogil:
+    """ Minimum of the direct and flip average distances of two tracks """
+    cdef float d[2]
+    track_direct_flip_dist(a, b, rows, d)
+    if d[0] < d[1]:
+        return d[0]
+    return d[1]
+
+
+cdef inline float bounded_min_track_direct_flip_dist(float *a, float *b,
+                                                     long rows,
+                                                     double bound) nogil:
+    """ Minimum of the direct and flip average distances of two tracks
+
+    Same as `min_track_direct_flip_dist`, but returns infinity as soon as
+    both partial sums of distances exceed ``rows * bound``.
+    """
+    cdef:
+        cnp.npy_intp i=0
+        cnp.npy_intp j=0
+        cnp.float32_t sub=0,subf=0, tmprow=0, tmprowf=0
+        double distf=0,dist=0, sum_bound = rows * bound
+        float d, df
+
+    for i from 0<=i<rows:
+        tmprow=0
+        tmprowf=0
+        for j from 0<=j<3:
+            sub=a[i*3+j]-b[i*3+j]
+            subf=a[i*3+j]-b[(rows-1-i)*3+j]
+            tmprow+=sub*sub
+            tmprowf+=subf*subf
+        dist+=sqrt(tmprow)
+        distf+=sqrt(tmprowf)
+        if dist > sum_bound and distf > sum_bound:
+            return INFINITY
+
+    d = <cnp.float32_t>dist/<cnp.float32_t>rows
+    df = <cnp.float32_t>distf/<cnp.float32_t>rows
+    if d < df:
+        return d
+    return df
+
+
 @cython.cdivision(True)
 cdef inline void track_direct_flip_3dist(float *a1, float *b1,float  *c1,float *a2, float *b2, float *c2, float *out) nogil:
     """ Calculate the euclidean distance between two 3pt tracks
@@ -1,13 +1,152 @@
-import random
+from collections import Counter, deque
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from itertools import islice
+import random
+import threading
+from time import perf_counter
 from warnings import warn
 import numpy as np
 
-from dipy.tracking.localtrack import local_tracker, pft_tracker
+from dipy.tracking.localtrack import (local_tracker, local_tracker_batch,
+                                     pft_tracker)
 from dipy.tracking.stopping_criterion import (AnatomicalStoppingCriterion,
-                                              StreamlineStatus)
+                                              StreamlineStatus,
+                                              TimedStoppingCriterion)
 from dipy.tracking import utils
 from dipy.utils import fast_numpy
+from dipy.utils.omp import determine_num_threads
+
+
+class TrackingStats:
+    """Counters and timings of a tracking run.
+
+    An instance given as the ``stats`` of ``LocalTracking`` or
+    ``ParticleFilteringTracking`` is updated as the seeds are tracked, so
+    that it can be inspected during the run as well as after it. With
+    several threads, the times are summed over the threads.
+
+    Parameters
+    ----------
+    callback : callable, optional
+        Called with the stats after each seed (each batch of seeds tracked
+        in lockstep) is recorded, e.g. to report the progress of the run.
+        With several threads, it is called from the tracking threads.
+
+    Attributes
+    ----------
+    nb_seeds : int
+        Number of seeds tracked.
+    nb_streamlines : int
+        Number of streamlines returned.
+    status_counts : Counter
+        Number of tracked segments, forward or backward from a seed, per
+        ``StreamlineStatus`` ending the segment.
+    step_counts : Counter
+        Number of streamlines per number of steps, before the streamlines
+        are discarded for their status or length.
+    discarded_by_status : int
+        Number of streamlines discarded because a segment did not end in an
+        ENDPOINT or OUTSIDEIMAGE status, without ``return_all``.
+    discarded_by_length : int
+        Number of streamlines discarded because they are shorter than
+        ``minlen`` or longer than ``maxlen``, without ``return_all``.
+    tracking_time : float
+        Time spent tracking the segments, in seconds.
+    stopping_criterion_time : float
+        Part of ``tracking_time`` spent checking the points with the
+        stopping criterion, in seconds.
+    elapsed : float
+        Wall time from the start of the run to the last recorded seed, in
+        seconds.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._start = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.nb_seeds = 0
+        self.nb_streamlines = 0
+        self.status_counts = Counter()
+        self.step_counts = Counter()
+        self.discarded_by_status = 0
+        self.discarded_by_length = 0
+        self.tracking_time = 0.
+        self.stopping_criterion_time = 0.
+        self.elapsed = 0.
+
+    @property
+    def direction_getter_time(self):
+        """Time spent tracking outside of the stopping criterion, mostly in
+        the direction getter, in seconds."""
+        return self.tracking_time - self.stopping_criterion_time
+
+    @property
+    def seeds_per_second(self):
+        """Number of seeds tracked per second of wall time."""
+        return self.nb_seeds / self.elapsed if self.elapsed > 0 else 0.
+
+    def steps_histogram(self, bins=10):
+        """Histogram of the number of steps of the streamlines.
+
+        Parameters
+        ----------
+        bins : int or sequence of scalars, optional
+            The bins of ``numpy.histogram``.
+
+        Returns
+        -------
+        hist : array
+            Number of streamlines in each bin.
+        bin_edges : array
+            The edges of the bins.
+        """
+        steps = np.fromiter(self.step_counts.keys(), dtype=float,
+                            count=len(self.step_counts))
+        counts = np.fromiter(self.step_counts.values(), dtype=float,
+                             count=len(self.step_counts))
+        hist, bin_edges = np.histogram(steps, bins=bins, weights=counts)
+        return hist.astype(int), bin_edges
+
+    def summary(self):
+        """A text report of the stats."""
+        statuses = ", ".join("%s: %d" % (StreamlineStatus(status).name, count)
+                             for status, count in
+                             sorted(self.status_counts.items()))
+        return ("%d seeds in %.2f s (%.1f seeds/s), %d streamlines\n"
+                "segment statuses: %s\n"
+                "discarded streamlines: %d by status, %d by length\n"
+                "tracking time: %.3f s, %.3f s in the direction getter, "
+                "%.3f s in the stopping criterion"
+                % (self.nb_seeds, self.elapsed, self.seeds_per_second,
+                   self.nb_streamlines, statuses, self.discarded_by_status,
+                   self.discarded_by_length, self.tracking_time,
+                   self.direction_getter_time, self.stopping_criterion_time))
+
+    def _start_clock(self):
+        if self._start is None:
+            self._start = perf_counter()
+
+    def _merge(self, other):
+        """Add the counts and times of `other`, then reset them."""
+        with self._lock:
+            self.nb_seeds += other.nb_seeds
+            self.nb_streamlines += other.nb_streamlines
+            self.status_counts.update(other.status_counts)
+            self.step_counts.update(other.step_counts)
+            self.discarded_by_status += other.discarded_by_status
+            self.discarded_by_length += other.discarded_by_length
+            self.tracking_time += other.tracking_time
+            self.stopping_criterion_time += other.stopping_criterion_time
+            if self._start is not None:
+                self.elapsed = perf_counter() - self._start
+        other._reset()
+        if self.callback is not None:
+            self.callback(self)
 
 
 class LocalTracking:
@@ -34,7 +173,9 @@ class LocalTracking:
                  step_size, max_cross=None, maxlen=500, minlen=2,
                  fixedstep=True, return_all=True, random_seed=None,
                  save_seeds=False, unidirectional=False,
-                 randomize_forward_direction=False, initial_directions=None):
+                 randomize_forward_direction=False, initial_directions=None,
+                 num_threads=1, seed_batch_size=1000, lockstep_size=None,
+                 stats=None):
         """Creates streamlines by using local fiber-tracking.
 
         Parameters
@@ -85,6 +226,37 @@ class LocalTracking:
             Initial direction to follow from the ``seed`` position. If
             ``max_cross`` is None, one streamline will be generated per peak
             per voxel. If None, `direction_getter.initial_direction` is used.
+        num_threads : int or None, optional
+            Number of threads tracking batches of seeds in parallel. If None,
+            all available cores are used (or ``OMP_NUM_THREADS`` if set). If
+            < 0, the maximal number of cores minus ``|num_threads + 1|`` is
+            used (enter -1 to use as many cores as possible). Each thread uses
+            a copy of `direction_getter` and its own random generator, so the
+            streamlines are the same as with one thread for a given
+            `random_seed`. Multiple threads require a direction getter
+            supporting ``copy.copy``, e.g. the probabilistic, deterministic
+            maximum and closest peak direction getters. Default: 1.
+        seed_batch_size : int, optional
+            Number of seeds tracked at once by a thread.
+        lockstep_size : int or None, optional
+            If not None, the streamlines of this many seeds are tracked in
+            lockstep: they advance together one step at a time, and the
+            direction getter computes their directions at once (e.g. the
+            pmfs of all the points with a single matrix product, see
+            ``PmfGen.get_pmf_batch``). This amortizes the cost of each step
+            for the probabilistic and deterministic maximum direction
+            getters. With a `random_seed`, each seed draws from its own
+            random generator, in the order of the serial tracking (the k-th
+            initial directions of all the seeds are tracked together), so
+            the streamlines do not depend on `lockstep_size`, up to the
+            rounding of the pmfs computed by the matrix product, which can
+            break ties differently than the serial tracking. Not supported
+            by ``PTTDirectionGetter``.
+            Default: None, the streamlines are tracked one at a time.
+        stats : TrackingStats, optional
+            Updated with the counters and timings of the tracking as the
+            seeds are tracked. The stopping criterion is then timed at each
+            step, which slows down the tracking slightly.
         """
 
         self.direction_getter = direction_getter
@@ -129,10 +301,71 @@ class LocalTracking:
         self.return_all = return_all
         self.random_seed = random_seed
         self.save_seeds = save_seeds
+        if seed_batch_size < 1:
+            raise ValueError("seed_batch_size must be greater than 0.")
+        self.num_threads = determine_num_threads(num_threads)
+        self.seed_batch_size = seed_batch_size
+        if lockstep_size is not None:
+            if lockstep_size < 1:
+                raise ValueError("lockstep_size must be greater than 0.")
+            # Fail early if the direction getter cannot track in lockstep
+            try:
+                local_tracker_batch(
+                    direction_getter, stopping_criterion,
+                    np.empty((0, 3)), np.empty((0, 3)), self._voxel_size,
+                    np.empty((0, maxlen + 1, 3)), step_size, int(fixedstep))
+            except TypeError as e:
+                raise ValueError("Lockstep tracking is not supported by this "
+                                 "direction getter: %s" % e)
+        self.lockstep_size = lockstep_size
+        # Random generators of the tracking, None for the global generators
+        # of random, numpy and fast_numpy
+        self._rng = None
+        self._np_rng = None
+        self.stats = stats
+        # Stats of the seeds being tracked, and the stopping criterion used
+        # by the trackers, timed when recording stats
+        self._record = None if stats is None else TrackingStats()
+        self._stopping_criterion = self._checked_criterion()
+        if self.num_threads > 1:
+            # Fail early if the direction getter cannot be used by threads
+            self._thread_copy()
+
+    def _thread_copy(self):
+        """Copy of the tracker for one thread, with its own copy of the
+        direction getter and its own random generators.
+
+        Stopping criteria drawing random numbers (e.g. CMC) are copied too.
+        """
+        try:
+            direction_getter = copy(self.direction_getter)
+        except TypeError as e:
+            raise ValueError("Multi-threaded tracking is not supported by "
+                             "this direction getter: %s" % e)
+        tracker = copy(self)
+        tracker.direction_getter = direction_getter
+        tracker._rng = random.Random()
+        tracker._np_rng = np.random.RandomState()
+        if hasattr(direction_getter, 'set_random_generator'):
+            direction_getter.set_random_generator(tracker._rng)
+        if hasattr(self.stopping_criterion, 'set_random_generator'):
+            tracker.stopping_criterion = copy(self.stopping_criterion)
+            tracker.stopping_criterion.set_random_generator(tracker._np_rng)
+        if self.stats is not None:
+            tracker._record = TrackingStats()
+        tracker._stopping_criterion = tracker._checked_criterion()
+        return tracker
+
+    def _checked_criterion(self):
+        """The stopping criterion of the trackers, timed when recording
+        stats."""
+        if self.stats is None:
+            return self.stopping_criterion
+        return TimedStoppingCriterion.wrap(self.stopping_criterion)
 
     def _tracker(self, seed, first_step, streamline):
         return local_tracker(self.direction_getter,
-                             self.stopping_criterion,
+                             self._stopping_criterion,
                              seed,
                              first_step,
                              self._voxel_size,
@@ -154,78 +387,314 @@ class LocalTracking:
         inv_A = np.linalg.inv(self.affine)
         lin = inv_A[:3, :3]
         offset = inv_A[:3, 3]
+        seeds = ((i, np.dot(lin, s) + offset)
+                 for i, s in enumerate(self.seeds))
+        if self.stats is not None:
+            self.stats._start_clock()
+
+        if self.num_threads > 1:
+            yield from self._generate_tractogram_threads(seeds)
+            return
 
         F = np.empty((self.max_length + 1, 3), dtype=float)
         B = F.copy()
-        for i, s in enumerate(self.seeds):
-            s = np.dot(lin, s) + offset
-            # Set the random seed in numpy, random and fast_numpy (lic.stdlib)
-            if self.random_seed is not None:
-                s_random_seed = hash(np.abs((np.sum(s)) + self.random_seed)) \
-                    % (np.iinfo(np.uint32).max - 1)
+        yield from self._track_seeds(seeds, F, B)
+
+    def _track_seeds(self, seeds, F, B):
+        """Track the (index, voxel seed) pairs, yielding the streamlines in
+        the order of the seeds.
+
+        `F` and `B` are the buffers of the forward and backward tracking of
+        one seed.
+        """
+        seeds = iter(seeds)
+        if self.lockstep_size is None:
+            batches = ([seed] for seed in seeds)
+        else:
+            batches = iter(lambda: list(islice(seeds, self.lockstep_size)),
+                           [])
+        for batch in batches:
+            if self.lockstep_size is None:
+                streamlines = self._seed_streamlines(*batch[0], F, B)
+            else:
+                streamlines = self._lockstep_streamlines(batch)
+            if self.stats is None:
+                yield from streamlines
+                continue
+            streamlines = list(streamlines)
+            self._record.nb_seeds += len(batch)
+            self._record.nb_streamlines += len(streamlines)
+            self.stats._merge(self._record)
+            yield from streamlines
+
+    def _track(self, seed, first_step, streamline):
+        """Track one segment with ``_tracker``, recording its status and
+        timings in the stats."""
+        if self.stats is None:
+            return self._tracker(seed, first_step, streamline)
+        start = perf_counter()
+        start_checks = self._stopping_criterion.elapsed
+        steps, stream_status = self._tracker(seed, first_step, streamline)
+        self._record.tracking_time += perf_counter() - start
+        self._record.stopping_criterion_time += \
+            self._stopping_criterion.elapsed - start_checks
+        self._record.status_counts[int(stream_status)] += 1
+        return steps, stream_status
+
+    def _track_batch(self, seeds, first_steps, streamlines, rngs):
+        """Track segments in lockstep with ``local_tracker_batch``,
+        recording their statuses and timings in the stats."""
+        if self.stats is not None:
+            start = perf_counter()
+            start_checks = self._stopping_criterion.elapsed
+        steps, stream_status = local_tracker_batch(
+            self.direction_getter, self._stopping_criterion, seeds,
+            first_steps, self._voxel_size, streamlines, self.step_size,
+            self.fixed_stepsize, rngs)
+        if self.stats is not None:
+            self._record.tracking_time += perf_counter() - start
+            self._record.stopping_criterion_time += \
+                self._stopping_criterion.elapsed - start_checks
+            self._record.status_counts.update(stream_status.tolist())
+        return steps, stream_status
+
+    def _generate_tractogram_threads(self, seeds):
+        """Track batches of seeds in a pool of threads.
+
+        Batches are submitted a few at a time and their streamlines are
+        yielded in the order of the seeds.
+        """
+        local = threading.local()
+
+        def track_batch(batch):
+            if not hasattr(local, 'tracker'):
+                local.tracker = self._thread_copy()
+                local.F = np.empty((self.max_length + 1, 3), dtype=float)
+                local.B = local.F.copy()
+            return list(local.tracker._track_seeds(batch, local.F, local.B))
+
+        batches = iter(lambda: list(islice(seeds, self.seed_batch_size)), [])
+        pool = ThreadPoolExecutor(max_workers=self.num_threads)
+        try:
+            pending = deque(pool.submit(track_batch, batch) for batch in
+                            islice(batches, 2 * self.num_threads))
+            while pending:
+                streamlines = pending.popleft().result()
+                for batch in islice(batches, 1):
+                    pending.append(pool.submit(track_batch, batch))
+                yield from streamlines
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _seed_random_seed(self, s):
+        """Seed of the random generators for the seed `s`."""
+        return hash(np.abs((np.sum(s)) + self.random_seed)) \
+            % (np.iinfo(np.uint32).max - 1)
+
+    def _initial_directions(self, i, s):
+        """Initial tracking directions of the i-th seed."""
+        if self.initial_directions is None:
+            return self.direction_getter.initial_direction(s)
+        # normalize the initial directions.
+        # initial directions with norm 0 are removed.
+        d_ns = np.linalg.norm(self.initial_directions[i, :, :], axis=1)
+        return self.initial_directions[i, d_ns > 0, :] \
+            / d_ns[d_ns > 0, np.newaxis]
+
+    def _seed_streamlines(self, i, s, F, B):
+        """Track the streamlines of the i-th seed, `s` in voxel coordinates.
+
+        `F` and `B` are the buffers of the forward and backward tracking.
+        """
+        # Set the random seed in numpy, random and fast_numpy (lic.stdlib),
+        # or in the random generators of the tracker
+        if self.random_seed is not None:
+            s_random_seed = self._seed_random_seed(s)
+            if self._rng is None:
                 random.seed(s_random_seed)
                 np.random.seed(s_random_seed)
                 fast_numpy.seed(s_random_seed)
+            else:
+                self._rng.seed(s_random_seed)
+                self._np_rng.seed(s_random_seed)
+        choice = random.choice if self._rng is None else self._rng.choice
+
+        directions = self._initial_directions(i, s)
 
-            if self.initial_directions is None:
-                directions = self.direction_getter.initial_direction(s)
+        if len(directions) == 0 and self.return_all:
+            # only the seed position
+            if self.save_seeds:
+                yield [s], s
             else:
-                # normalize the initial directions.
-                # initial directions with norm 0 are removed.
-                d_ns = np.linalg.norm(self.initial_directions[i, :, :], axis=1)
-                directions = self.initial_directions[i, d_ns > 0, :] \
-                    / d_ns[d_ns > 0, np.newaxis]
+                yield [s]
+
+        if self.randomize_forward_direction:
+            directions = [d * choice([1, -1]) for d in directions]
+
+        directions = directions[:self.max_cross]
+
+        for first_step in directions:
+            stepsF = stepsB = 1
+            stepsF, stream_status = self._track(s, first_step, F)
+            if not (self.return_all
+                    or stream_status in (StreamlineStatus.ENDPOINT,
+                                         StreamlineStatus.OUTSIDEIMAGE)):
+                if self.stats is not None:
+                    self._record.step_counts[stepsF - 1] += 1
+                    self._record.discarded_by_status += 1
+                continue
+
+            if not self.unidirectional:
+                first_step = -first_step
+                if stepsF > 1:
+                    # Use the opposite of the first selected orientation for
+                    # the backward tracking segment
+                    opposite_step = F[0] - F[1]
+                    opposite_step_norm = np.linalg.norm(opposite_step)
+                    if opposite_step_norm > 0:
+                        first_step = opposite_step / opposite_step_norm
+                stepsB, stream_status = self._track(s, first_step, B)
+                if not (self.return_all or
+                        stream_status in (StreamlineStatus.ENDPOINT,
+                                          StreamlineStatus.OUTSIDEIMAGE)):
+                    if self.stats is not None:
+                        self._record.step_counts[stepsF + stepsB - 2] += 1
+                        self._record.discarded_by_status += 1
+                    continue
 
-            if len(directions) == 0 and self.return_all:
-                # only the seed position
+            if stepsB == 1:
+                streamline = F[:stepsF].copy()
+            else:
+                parts = (B[stepsB - 1:0:-1], F[:stepsF])
+                streamline = np.concatenate(parts, axis=0)
+
+            # move to the next streamline if only the seed position
+            # and not return all
+            len_sl = len(streamline)
+            if self.stats is not None:
+                self._record.step_counts[len_sl - 1] += 1
+            if len_sl >= self.min_length and len_sl <= self.max_length \
+                    or self.return_all:
                 if self.save_seeds:
-                    yield [s], s
+                    yield streamline, s
                 else:
-                    yield [s]
+                    yield streamline
+            elif self.stats is not None:
+                self._record.discarded_by_length += 1
 
-            if self.randomize_forward_direction:
-                directions = [d * random.choice([1, -1]) for d in directions]
+    def _lockstep_streamlines(self, batch):
+        """Track the streamlines of a batch of (index, voxel seed) pairs in
+        lockstep, see ``local_tracker_batch``.
 
-            directions = directions[:self.max_cross]
-
-            for first_step in directions:
-                stepsF = stepsB = 1
-                stepsF, stream_status = self._tracker(s, first_step, F)
-                if not (self.return_all
-                        or stream_status in (StreamlineStatus.ENDPOINT,
-                                             StreamlineStatus.OUTSIDEIMAGE)):
-                    continue
+        The streamlines are the same as with ``_seed_streamlines`` and are
+        yielded in the same order. With a `random_seed`, each seed has its
+        own random generator, seeded as in ``_seed_streamlines``.
+        """
+        outputs = [[] for _ in batch]
+        seeds, first_steps, owners, ranks, rngs = [], [], [], [], []
+        for b, (i, s) in enumerate(batch):
+            rng = None
+            if self.random_seed is not None:
+                rng = random.Random(self._seed_random_seed(s))
+            choice = (rng or self._rng or random).choice
 
-                if not self.unidirectional:
-                    first_step = -first_step
-                    if stepsF > 1:
-                        # Use the opposite of the first selected orientation for
-                        # the backward tracking segment
-                        opposite_step = F[0] - F[1]
-                        opposite_step_norm = np.linalg.norm(opposite_step)
-                        if opposite_step_norm > 0:
-                            first_step = opposite_step / opposite_step_norm
-                    stepsB, stream_status = self._tracker(s, first_step, B)
-                    if not (self.return_all or
-                            stream_status in (StreamlineStatus.ENDPOINT,
-                                              StreamlineStatus.OUTSIDEIMAGE)):
-                        continue
-
-                if stepsB == 1:
-                    streamline = F[:stepsF].copy()
+            directions = self._initial_directions(i, s)
+            if len(directions) == 0 and self.return_all:
+                # only the seed position
+                outputs[b].append(([s], s))
+            if self.randomize_forward_direction:
+                directions = [d * choice([1, -1]) for d in directions]
+
+            for k, first_step in enumerate(directions[:self.max_cross]):
+                seeds.append(s)
+                first_steps.append(first_step)
+                owners.append(b)
+                ranks.append(k)
+                rngs.append(rng)
+
+        if seeds:
+            seeds = np.array(seeds, dtype=float)
+            first_steps = np.array(first_steps, dtype=float)
+            ranks = np.array(ranks)
+            if self.random_seed is not None:
+                rngs = np.array(rngs + [None], dtype=object)[:-1]
+
+            # The k-th initial directions of all the seeds are tracked in the
+            # k-th pass, so that the generator of each seed is drawn in the
+            # same order as in the serial tracking
+            for k in range(ranks.max() + 1):
+                tracks = np.flatnonzero(ranks == k)
+                streamlines = self._track_lockstep(
+                    seeds[tracks], first_steps[tracks],
+                    None if self.random_seed is None else rngs[tracks])
+                for t, streamline in zip(tracks, streamlines):
+                    if streamline is not None:
+                        b = owners[t]
+                        outputs[b].append((streamline, batch[b][1]))
+
+        for out in outputs:
+            for streamline, s in out:
+                if self.save_seeds:
+                    yield streamline, s
                 else:
-                    parts = (B[stepsB - 1:0:-1], F[:stepsF])
-                    streamline = np.concatenate(parts, axis=0)
+                    yield streamline
 
-                # move to the next streamline if only the seed position
-                # and not return all
-                len_sl = len(streamline)
-                if len_sl >= self.min_length and len_sl <= self.max_length \
+    def _track_lockstep(self, seeds, first_steps, rngs):
+        """Track the forward and backward segments of streamlines in
+        lockstep.
+
+        Returns the list of the streamlines, None for the discarded ones.
+        """
+        stop_states = (int(StreamlineStatus.ENDPOINT),
+                       int(StreamlineStatus.OUTSIDEIMAGE))
+        F = np.empty((len(seeds), self.max_length + 1, 3), dtype=float)
+        stepsF, stream_status = self._track_batch(seeds, first_steps, F, rngs)
+        keep = np.isin(stream_status, stop_states) | self.return_all
+        stepsB = np.ones(len(seeds), dtype=np.intp)
+
+        back = np.flatnonzero(keep)
+        if not self.unidirectional and len(back):
+            back_steps = -first_steps[back]
+            for j, t in enumerate(back):
+                if stepsF[t] > 1:
+                    # Use the opposite of the first selected orientation for
+                    # the backward tracking segment
+                    opposite_step = F[t, 0] - F[t, 1]
+                    opposite_step_norm = np.linalg.norm(opposite_step)
+                    if opposite_step_norm > 0:
+                        back_steps[j] = opposite_step / opposite_step_norm
+            B = np.empty((len(back), self.max_length + 1, 3), dtype=float)
+            stepsB[back], stream_status = self._track_batch(
+                seeds[back], back_steps, B,
+                None if rngs is None else rngs[back])
+            keep[back] &= (np.isin(stream_status, stop_states)
+                           | self.return_all)
+            backward = dict(zip(back, B))
+
+        if self.stats is not None:
+            self._record.step_counts.update(
+                (stepsF[~keep] + stepsB[~keep] - 2).tolist())
+            self._record.discarded_by_status += int(np.sum(~keep))
+
+        streamlines = [None] * len(seeds)
+        for t in np.flatnonzero(keep):
+            if stepsB[t] == 1:
+                streamline = F[t, :stepsF[t]].copy()
+            else:
+                parts = (backward[t][stepsB[t] - 1:0:-1], F[t, :stepsF[t]])
+                streamline = np.concatenate(parts, axis=0)
+
+            # move to the next streamline if only the seed position
+            # and not return all
+            len_sl = len(streamline)
+            if self.stats is not None:
+                self._record.step_counts[len_sl - 1] += 1
+            if self.min_length <= len_sl <= self.max_length \
                     or self.return_all:
-                        if self.save_seeds:
-                            yield streamline, s
-                        else:
-                            yield streamline
+                streamlines[t] = streamline
+            elif self.stats is not None:
+                self._record.discarded_by_length += 1
+        return streamlines
 
 
 class ParticleFilteringTracking(LocalTracking):
@@ -236,7 +705,8 @@ class ParticleFilteringTracking(LocalTracking):
                  pft_max_trial=20, particle_count=15, return_all=True,
                  random_seed=None, save_seeds=False,
                  min_wm_pve_before_stopping=0, unidirectional=False,
-                 randomize_forward_direction=False, initial_directions=None):
+                 randomize_forward_direction=False, initial_directions=None,
+                 num_threads=1, seed_batch_size=1000, stats=None):
         r"""A streamline generator using the particle filtering tractography
         method [1]_.
 
@@ -304,7 +774,21 @@ class ParticleFilteringTracking(LocalTracking):
             Initial direction to follow from the ``seed`` position. If
             ``max_cross`` is None, one streamline will be generated per peak
             per voxel. If None, `direction_getter.initial_direction` is used.
-
+        num_threads : int or None, optional
+            Number of threads tracking batches of seeds in parallel. If None,
+            all available cores are used (or ``OMP_NUM_THREADS`` if set). If
+            < 0, the maximal number of cores minus ``|num_threads + 1|`` is
+            used (enter -1 to use as many cores as possible). Each thread has
+            its own particles, its own copy of `direction_getter` and of a
+            CMC `stopping_criterion`, and its own random generators, so the
+            streamlines are the same as with one thread for a given
+            `random_seed`. Default: 1.
+        seed_batch_size : int, optional
+            Number of seeds tracked at once by a thread.
+        stats : TrackingStats, optional
+            Updated with the counters and timings of the tracking as the
+            seeds are tracked. The stopping criterion is then timed at each
+            step, which slows down the tracking slightly.
 
         References
         ----------
@@ -336,18 +820,9 @@ class ParticleFilteringTracking(LocalTracking):
                              "between 0 and 1.")
 
         self.min_wm_pve_before_stopping = min_wm_pve_before_stopping
-        self.directions = np.empty((maxlen + 1, 3), dtype=float)
         self.pft_max_trial = pft_max_trial
         self.particle_count = particle_count
-        self.particle_paths = np.empty((2, self.particle_count,
-                                        pft_max_steps + 1, 3),
-                                       dtype=float)
-        self.particle_weights = np.empty(self.particle_count, dtype=float)
-        self.particle_dirs = np.empty((2, self.particle_count,
-                                       pft_max_steps + 1, 3), dtype=float)
-        self.particle_steps = np.empty((2, self.particle_count), dtype=np.intp)
-        self.particle_stream_statuses = np.empty((2, self.particle_count),
-                                                 dtype=np.intp)
+        self._allocate_particles(maxlen)
         super(ParticleFilteringTracking, self).__init__(
             direction_getter=direction_getter,
             stopping_criterion=stopping_criterion,
@@ -363,11 +838,35 @@ class ParticleFilteringTracking(LocalTracking):
             save_seeds=save_seeds,
             unidirectional=unidirectional,
             randomize_forward_direction=randomize_forward_direction,
-            initial_directions=initial_directions)
+            initial_directions=initial_directions,
+            num_threads=num_threads,
+            seed_batch_size=seed_batch_size,
+            stats=stats)
+
+    def _allocate_particles(self, maxlen):
+        """Allocate the directions and particles buffers of the tracking."""
+        pft_max_steps = (self.pft_max_nbr_back_steps +
+                         self.pft_max_nbr_front_steps)
+        self.directions = np.empty((maxlen + 1, 3), dtype=float)
+        self.particle_paths = np.empty((2, self.particle_count,
+                                        pft_max_steps + 1, 3),
+                                       dtype=float)
+        self.particle_weights = np.empty(self.particle_count, dtype=float)
+        self.particle_dirs = np.empty((2, self.particle_count,
+                                       pft_max_steps + 1, 3), dtype=float)
+        self.particle_steps = np.empty((2, self.particle_count), dtype=np.intp)
+        self.particle_stream_statuses = np.empty((2, self.particle_count),
+                                                 dtype=np.intp)
+
+    def _thread_copy(self):
+        """Copy of the tracker for one thread, with its own particles."""
+        tracker = super(ParticleFilteringTracking, self)._thread_copy()
+        tracker._allocate_particles(self.max_length)
+        return tracker
 
     def _tracker(self, seed, first_step, streamline):
         return pft_tracker(self.direction_getter,
-                           self.stopping_criterion,
+                           self._stopping_criterion,
                            seed,
                            first_step,
                            self._voxel_size,
@@ -383,4 +882,5 @@ class ParticleFilteringTracking(LocalTracking):
                            self.particle_weights,
                            self.particle_steps,
                            self.particle_stream_statuses,
-                           self.min_wm_pve_before_stopping)
+                           self.min_wm_pve_before_stopping,
+                           self._rng)
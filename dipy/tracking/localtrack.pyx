@@ -1,6 +1,8 @@
 
 from random import random
 
+import numpy as np
+
 cimport cython
 cimport numpy as cnp
 from dipy.tracking.direction_getter cimport DirectionGetter
@@ -76,6 +78,67 @@ def local_tracker(
     return i, stream_status
 
 
+def local_tracker_batch(
+        DirectionGetter dg,
+        StoppingCriterion sc,
+        double[:, ::1] seed_pos,
+        double[:, ::1] first_step,
+        double[::1] voxel_size,
+        cnp.float_t[:, :, ::1] streamlines,
+        double step_size,
+        int fixedstep,
+        object rngs=None):
+    """Tracks one direction from many seeds, in lockstep.
+
+    The streamlines advance together one step at a time, so that the
+    direction getter computes the directions of all of them at once. Each
+    streamline is the same as tracked by ``local_tracker``, up to the order
+    in which random numbers are drawn.
+
+    Parameters
+    ----------
+    dg : DirectionGetter
+        Used to choosing tracking directions.
+    sc : StoppingCriterion
+        Used to check the streamline status (e.g. endpoint) along path.
+    seed_pos : array, float, 2d, (K, 3)
+        First point of each (partial) streamline.
+    first_step : array, float, 2d, (K, 3)
+        Initial seeding direction of each streamline.
+    voxel_size : array, float, 1d, (3,)
+        Size of voxels in the data set.
+    streamlines : array, float, 3d, (K, N, 3)
+        Output of tracking will be put into this array. ``N`` sets the
+        maximum allowable length of the streamlines.
+    step_size : float
+        Size of tracking steps in mm if ``fixed_step``.
+    fixedstep : int
+        If greater than 0, a fixed step_size is used, otherwise a variable
+        step size is used.
+    rngs : array of random.Random, optional
+        Random generator of each streamline. By default, the random generator
+        of the direction getter is used.
+
+    Returns
+    -------
+    end : array, int, (K,)
+        Length of each tracked streamline
+    stream_status : array, int, (K,)
+        Ending state of each streamline as determined by the
+        StoppingCriterion.
+    """
+    if (seed_pos.shape[1] != 3 or first_step.shape[1] != 3 or
+            voxel_size.shape[0] != 3 or streamlines.shape[2] != 3 or
+            seed_pos.shape[0] != first_step.shape[0] or
+            seed_pos.shape[0] != streamlines.shape[0]):
+        raise ValueError('Invalid input parameter dimensions.')
+
+    directions = np.array(first_step)
+    return dg.generate_streamlines_batch(seed_pos, directions, voxel_size,
+                                         step_size, sc, streamlines,
+                                         fixedstep, rngs)
+
+
 def pft_tracker(
         DirectionGetter dg,
         AnatomicalStoppingCriterion sc,
@@ -94,7 +157,8 @@ def pft_tracker(
         cnp.float_t[:] particle_weights,
         cnp.npy_intp[:, :]  particle_steps,
         cnp.npy_intp[:, :]  particle_stream_statuses,
-        int min_wm_pve_before_stopping):
+        int min_wm_pve_before_stopping,
+        object rng=None):
     """Tracks one direction from a seed using the particle filtering algorithm.
 
     This function is the main workhorse of the ``ParticleFilteringTracking``
@@ -145,6 +209,9 @@ def pft_tracker(
     min_wm_pve_before_stopping : int, optional
         Minimum white matter pve (1 - sc.include_map - sc.exclude_map) to
         reach before allowing the tractography to stop.
+    rng : random.Random, optional
+        Random generator of the resampling of the particles. By default, the
+        global generator of the ``random`` module is used.
 
     Returns
     -------
@@ -174,7 +241,8 @@ def pft_tracker(
                      pft_max_nbr_back_steps, pft_max_nbr_front_steps,
                      pft_max_trials, particle_count, particle_paths,
                      particle_dirs, particle_weights, particle_steps,
-                     particle_stream_statuses, min_wm_pve_before_stopping)
+                     particle_stream_statuses, min_wm_pve_before_stopping,
+                     random if rng is None else rng.random)
     return i, stream_status
 
 
@@ -199,7 +267,8 @@ cdef _pft_tracker(DirectionGetter dg,
                   cnp.float_t[:] particle_weights,
                   cnp.npy_intp[:, :] particle_steps,
                   cnp.npy_intp[:, :] particle_stream_statuses,
-                  double min_wm_pve_before_stopping):
+                  double min_wm_pve_before_stopping,
+                  object random):
     cdef:
         cnp.npy_intp i, j
         int pft_trial, back_steps, front_steps
@@ -253,7 +322,7 @@ cdef _pft_tracker(DirectionGetter dg,
                          voxel_size, step_size, stream_status,
                          back_steps + front_steps, particle_count,
                          particle_paths, particle_dirs, particle_weights,
-                         particle_steps, particle_stream_statuses)
+                         particle_steps, particle_stream_statuses, random)
                 pft_trial += 1
                 # update the current point with the PFT results
                 copy_point(&streamline[i-1, 0], point)
@@ -303,7 +372,8 @@ cdef _pft(cnp.float_t[:, :] streamline,
           cnp.float_t[:, :, :, :] particle_dirs,
           cnp.float_t[:] particle_weights,
           cnp.npy_intp[:, :] particle_steps,
-          cnp.npy_intp[:, :] particle_stream_statuses):
+          cnp.npy_intp[:, :] particle_stream_statuses,
+          object random):
     cdef:
         double sum_weights, sum_squared, N_effective, rdm_sample
         double point[3]
@@ -47,4 +47,13 @@ cdef class CmcStoppingCriterion(AnatomicalStoppingCriterion):
         double step_size
         double average_voxel_size
         double correction_factor
+        object _random
+    pass
+
+
+cdef class TimedStoppingCriterion(AnatomicalStoppingCriterion):
+    cdef:
+        readonly StoppingCriterion criterion
+        object timer
+        public double elapsed
     pass
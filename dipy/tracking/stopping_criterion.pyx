@@ -8,6 +8,8 @@ cdef extern from "dpy_math.h" nogil:
 
 from dipy.core.interpolation cimport trilinear_interpolate4d_c
 
+from time import perf_counter
+
 import numpy as np
 
 cdef class StoppingCriterion:
@@ -250,6 +252,26 @@ cdef class CmcStoppingCriterion(AnatomicalStoppingCriterion):
         self.step_size = step_size
         self.average_voxel_size = average_voxel_size
         self.correction_factor = step_size / average_voxel_size
+        self._random = np.random.random
+
+    def __copy__(self):
+        """Copy sharing the maps, with its own interpolation buffer, for
+        one tracking thread."""
+        return type(self)(np.asarray(self.include_map),
+                          np.asarray(self.exclude_map), self.step_size,
+                          self.average_voxel_size)
+
+    def set_random_generator(self, rng=None):
+        """Draw the stopping decisions from `rng` instead of the global
+        generator of ``numpy.random``.
+
+        Parameters
+        ----------
+        rng : numpy.random.RandomState, optional
+            Generator of the random numbers, e.g. one per tracking thread.
+            With None, the global generator of ``numpy.random`` is used.
+        """
+        self._random = np.random.random if rng is None else rng.random
 
     cdef StreamlineStatus check_point_c(self, double* point):
         cdef:
@@ -277,20 +299,74 @@ cdef class CmcStoppingCriterion(AnatomicalStoppingCriterion):
             raise RuntimeError("Unexpected interpolation error " +
                                "(exclude_map - code:%i)" % exclude_err)
 
-        rng = np.random.default_rng()
         # test if the tracking continues
         if include_result + exclude_result <= 0:
             return TRACKPOINT
         num = max(0, (1 - include_result - exclude_result))
         den = num + include_result + exclude_result
         p = (num / den) ** self.correction_factor
-        if rng.random() < p:
+        if self._random() < p:
             return TRACKPOINT
 
         # test if the tracking stopped in the include tissue map
         p = (include_result / (include_result + exclude_result))
-        if rng.random() < p:
+        if self._random() < p:
             return ENDPOINT
 
         # the tracking stopped in the exclude tissue map
         return INVALIDPOINT
+
+
+cdef class TimedStoppingCriterion(AnatomicalStoppingCriterion):
+    r"""
+    Stopping criterion measuring the time spent checking the points with
+    another criterion.
+
+    It is an anatomical criterion sharing the include and exclude maps of
+    the timed criterion (empty maps for the other criteria), so that the
+    particle filtering tracking can use it too.
+
+    cdef:
+        StoppingCriterion criterion
+        object timer
+        double elapsed
+    """
+
+    def __cinit__(self, include_map, exclude_map, criterion, timer):
+        self.criterion = criterion
+        self.timer = timer
+        self.elapsed = 0
+
+    @classmethod
+    def wrap(cls, criterion, timer=perf_counter):
+        """Time the checks of `criterion`.
+
+        Parameters
+        ----------
+        criterion : StoppingCriterion
+            The criterion checking the points.
+        timer : callable, optional
+            Clock returning the current time in seconds.
+
+        Returns
+        -------
+        timed : TimedStoppingCriterion
+            The criterion accumulating the time of the checks, in seconds,
+            in ``elapsed``.
+        """
+        cdef AnatomicalStoppingCriterion anatomical
+        if isinstance(criterion, AnatomicalStoppingCriterion):
+            anatomical = criterion
+            include_map = np.asarray(anatomical.include_map)
+            exclude_map = np.asarray(anatomical.exclude_map)
+        else:
+            include_map = exclude_map = np.zeros((1, 1, 1))
+        return cls(include_map, exclude_map, criterion, timer)
+
+    cdef StreamlineStatus check_point_c(self, double* point):
+        cdef:
+            double start = self.timer()
+            StreamlineStatus status = self.criterion.check_point_c(point)
+
+        self.elapsed += self.timer() - start
+        return status
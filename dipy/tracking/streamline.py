@@ -8,7 +8,7 @@ import numpy as np
 from nibabel.affines import apply_affine
 from nibabel.streamlines import ArraySequence as Streamlines
 from dipy.tracking.streamlinespeed import length, set_number_of_points
-from dipy.tracking.distances import bundles_distances_mdf
+from dipy.tracking.distances import bundles_distances_sparse
 import dipy.tracking.utils as ut
 from dipy.core.geometry import dist_to_corner
 from dipy.core.interpolation import (interpolate_vector_3d,
@@ -391,16 +391,18 @@ def cluster_confidence(streamlines, max_mdf=5, subsample=12, power=1,
     # calculate the pairwise MDF distance between all streamlines in dataset
     subsamp_sls = set_number_of_points(streamlines, subsample)
 
-    cci_score_mtrx = np.zeros([len(subsamp_sls)])
-
-    for i, sl in enumerate(subsamp_sls):
-        mdf_mx = bundles_distances_mdf([subsamp_sls[i]], subsamp_sls)
-        if (mdf_mx == 0).sum() > 1:
-            raise ValueError('Identical streamlines. CCI calculation invalid')
-        mdf_mx_oi = (mdf_mx > 0) & (mdf_mx < max_mdf) & ~ np.isnan(mdf_mx)
-        mdf_mx_oi_only = mdf_mx[mdf_mx_oi]
-        cci_score = np.sum(np.divide(1, np.power(mdf_mx_oi_only, power)))
-        cci_score_mtrx[i] = cci_score
+    # Only the pairs closer than max_mdf are computed and stored
+    mdf_mx = bundles_distances_sparse(subsamp_sls, subsamp_sls, max_mdf)
+    nb_streamlines = len(subsamp_sls)
+    rows = np.repeat(np.arange(nb_streamlines), np.diff(mdf_mx.indptr))
+    if np.any(np.bincount(rows[mdf_mx.data == 0],
+                          minlength=nb_streamlines) > 1):
+        raise ValueError('Identical streamlines. CCI calculation invalid')
+    mdf_mx_oi = (mdf_mx.data > 0) & (mdf_mx.data < max_mdf)
+    cci_score_mtrx = np.bincount(
+        rows[mdf_mx_oi],
+        weights=np.divide(1, np.power(mdf_mx.data[mdf_mx_oi], power)),
+        minlength=nb_streamlines)
 
     return cci_score_mtrx
 
@@ -1,14 +1,16 @@
+from os.path import join as pjoin
+from tempfile import TemporaryDirectory
 import warnings
 
 import numpy as np
 from numpy.testing import (assert_array_almost_equal,
                            assert_equal, assert_almost_equal,
-                           assert_array_equal)
+                           assert_array_equal, assert_raises)
 
 from dipy.testing import assert_true
 from dipy.testing.decorators import set_random_number_generator
 from dipy.tracking import distances as pf
-from dipy.tracking.streamline import set_number_of_points
+from dipy.tracking.streamline import Streamlines, set_number_of_points
 from dipy.data import get_fnames
 from dipy.io.streamline import load_tractogram
 
@@ -196,6 +198,105 @@ def test_bundles_distances_mdf(verbose=False):
         assert_true("not have the same number of points" in str(w[0].message))
 
 
+@set_random_number_generator()
+def test_bundles_distances_blocks(rng):
+    tracksA = [rng.random((rng.integers(2, 12), 3)) for _ in range(23)]
+    tracksB = Streamlines([rng.random((rng.integers(2, 12), 3))
+                           for _ in range(17)])
+    resampledA = set_number_of_points(tracksA, 8)
+    resampledB = set_number_of_points(tracksB, 8)
+
+    msg = "Streamlines do not have the same number of points. *"
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message=msg, category=UserWarning)
+        for distance, A, B, kwargs in [
+                ('mdf', resampledA, resampledB, {}),
+                ('mam', tracksA, tracksB, {'metric': 'avg'}),
+                ('mam', tracksA, tracksB, {'metric': 'max'})]:
+            func = getattr(pf, 'bundles_distances_' + distance)
+            DM = func(A, B, num_threads=1, **kwargs)
+            assert_equal(DM.shape, (23, 17))
+            assert_array_equal(func(A, B, num_threads=2, **kwargs), DM)
+            assert_array_equal(func(list(A), list(B), **kwargs), DM)
+
+            starts = []
+            blocks = []
+            for start, block in pf.iter_bundles_distances(
+                    A, B, distance=distance, block_size=5, **kwargs):
+                starts.append(start)
+                blocks.append(block)
+            assert_equal(starts, [0, 5, 10, 15, 20])
+            assert_equal(blocks[-1].shape, (3, 17))
+            assert_array_equal(np.concatenate(blocks), DM)
+
+            with TemporaryDirectory() as tmpdir:
+                out = np.lib.format.open_memmap(
+                    pjoin(tmpdir, 'dm.npy'), mode='w+', dtype=np.float32,
+                    shape=DM.shape)
+                assert_true(func(A, B, out=out, **kwargs) is out)
+                assert_array_almost_equal(out, DM, 5)
+                del out
+
+            assert_equal(func(A[:0], B, **kwargs).shape, (0, 17))
+            assert_equal(func(A, B[:0], **kwargs).shape, (23, 0))
+            assert_raises(ValueError, func, A, B, out=np.zeros((17, 23)),
+                          **kwargs)
+
+        # The MDF of the first points of longer tracks
+        DM = pf.bundles_distances_mdf(resampledA, tracksB)
+        assert_equal(DM.shape, (23, 17))
+
+    assert_raises(ValueError, next,
+                  pf.iter_bundles_distances(tracksA, tracksB, 'mad'))
+    assert_raises(ValueError, next,
+                  pf.iter_bundles_distances(tracksA, tracksB, block_size=0))
+    assert_raises(ValueError, pf.bundles_distances_mam, tracksA, tracksB,
+                  metric='mean')
+
+
+@set_random_number_generator()
+def test_bundles_distances_sparse(rng):
+    def walk(nb_points):
+        return (np.cumsum(rng.normal(size=(nb_points, 3)), axis=0) +
+                rng.random(3) * 30)
+
+    tracksA = [walk(rng.integers(2, 12)) for _ in range(40)]
+    tracksB = Streamlines([walk(rng.integers(2, 12)) for _ in range(30)])
+    tracksB.append(tracksA[0])
+    resampledA = set_number_of_points(tracksA, 8)
+    resampledB = set_number_of_points(tracksB, 8)
+
+    msg = "Streamlines do not have the same number of points. *"
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message=msg, category=UserWarning)
+        for distance, A, B, metric in [('mdf', resampledA, resampledB, 'avg'),
+                                       ('mam', tracksA, tracksB, 'avg'),
+                                       ('mam', tracksA, tracksB, 'min'),
+                                       ('mam', tracksA, tracksB, 'max')]:
+            DM = getattr(pf, 'bundles_distances_' + distance)(A, B)
+            for threshold in [0, 3, 8, 100]:
+                for block_size in [None, 7]:
+                    sparse = pf.bundles_distances_sparse(
+                        A, B, threshold, distance=distance, metric=metric,
+                        block_size=block_size)
+                    if distance == 'mam':
+                        DM = pf.bundles_distances_mam(A, B, metric=metric)
+                    assert_equal(sparse.shape, DM.shape)
+                    assert_equal(sparse.nnz, np.sum(DM <= threshold))
+                    assert_array_equal(sparse.toarray(),
+                                       np.where(DM <= threshold, DM, 0))
+
+            # Null distances are kept
+            sparse = pf.bundles_distances_sparse(A, B, 0, distance=distance)
+            assert_equal(sparse.nnz, 1)
+            assert_equal(sparse.indices, [30])
+
+    sparse = pf.bundles_distances_sparse(resampledA[:0], resampledB, 1)
+    assert_equal(sparse.shape, (0, 31))
+    assert_raises(ValueError, pf.bundles_distances_sparse, tracksA, tracksB,
+                  1, distance='mad')
+
+
 def test_mam_distances():
     xyz1 = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0], [3, 0, 0]])
     xyz2 = np.array([[0, 1, 1], [1, 0, 1], [2, 3, -2]])
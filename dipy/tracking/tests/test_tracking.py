@@ -15,12 +15,15 @@ from dipy.direction import (BootDirectionGetter,
                             ProbabilisticDirectionGetter,
                             PTTDirectionGetter)
 from dipy.reconst.csdeconv import ConstrainedSphericalDeconvModel
-from dipy.reconst.shm import descoteaux07_legacy_msg
+from dipy.direction.pmf import SHCoeffPmfGen
+from dipy.reconst.shm import descoteaux07_legacy_msg, sh_to_sf
 from dipy.tracking.local_tracking import (LocalTracking,
-                                          ParticleFilteringTracking)
+                                          ParticleFilteringTracking,
+                                          TrackingStats)
 from dipy.tracking.streamline import Streamlines
 from dipy.tracking.stopping_criterion import (ActStoppingCriterion,
                                               BinaryStoppingCriterion,
+                                              CmcStoppingCriterion,
                                               ThresholdStoppingCriterion,
                                               StreamlineStatus)
 from dipy.tracking.utils import random_seeds_from_mask, seeds_from_mask
@@ -1145,3 +1148,197 @@ def test_tracking_with_initial_directions():
     for sl in streamlines:
         npt.assert_(np.allclose(sl, expected[1][2:])
                     or np.allclose(sl, expected[1][:3][::-1]))
+
+
+@set_random_number_generator(0)
+def test_multithreaded_tracking(rng):
+    """Test that tracking with several threads gives the streamlines of the
+    serial tracking for a given random seed."""
+    sphere = get_sphere('repulsion100')
+    mask = np.ones((8, 8, 8))
+    mask[0] = 0
+    sc = ThresholdStoppingCriterion(mask, .5)
+    shcoeff = rng.random((8, 8, 8, 15))
+    shcoeff[..., 0] += 2
+    seeds = rng.random((200, 3)) * 7
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore", message=descoteaux07_legacy_msg,
+            category=PendingDeprecationWarning)
+        dgs = [ProbabilisticDirectionGetter.from_shcoeff(shcoeff, 60, sphere),
+               ProbabilisticDirectionGetter.from_shcoeff(shcoeff, 60, sphere,
+                                                         sh_to_pmf=True),
+               DeterministicMaximumDirectionGetter.from_shcoeff(
+                   shcoeff, 60, sphere),
+               ClosestPeakDirectionGetter.from_shcoeff(shcoeff, 60, sphere)]
+        for dg in dgs:
+            for kwargs in [{}, {'unidirectional': True,
+                                'randomize_forward_direction': True,
+                                'save_seeds': True}]:
+                serial = list(LocalTracking(dg, sc, seeds, np.eye(4), .5,
+                                            random_seed=1, **kwargs))
+                threaded = list(LocalTracking(dg, sc, seeds, np.eye(4), .5,
+                                              random_seed=1, num_threads=3,
+                                              seed_batch_size=7, **kwargs))
+                npt.assert_equal(len(threaded), len(serial))
+                for out_threaded, out_serial in zip(threaded, serial):
+                    for a, b in zip(out_threaded, out_serial):
+                        npt.assert_array_equal(a, b)
+
+        # Direction getters drawing from a global C generator and direction
+        # getters without a copy for threads are rejected
+        dg = PTTDirectionGetter.from_shcoeff(shcoeff, 60, sphere)
+        npt.assert_raises(ValueError, LocalTracking, dg, sc, seeds,
+                          np.eye(4), .5, num_threads=2)
+    npt.assert_raises(ValueError, LocalTracking, dgs[0], sc, seeds,
+                      np.eye(4), .5, num_threads=2, seed_batch_size=0)
+
+
+@set_random_number_generator(0)
+def test_multithreaded_particle_filtering_tracking(rng):
+    """Test that particle filtering tracking with several threads gives the
+    streamlines of the serial tracking for a given random seed."""
+    sphere = get_sphere('repulsion100')
+    shape = (8, 8, 8)
+    shcoeff = rng.random(shape + (15,))
+    shcoeff[..., 0] += 2
+    wm = rng.random(shape)
+    gm = (1 - wm) * rng.random(shape)
+    csf = 1 - wm - gm
+    seeds = rng.random((100, 3)) * 7
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore", message=descoteaux07_legacy_msg,
+            category=PendingDeprecationWarning)
+        dg = ProbabilisticDirectionGetter.from_shcoeff(shcoeff, 60, sphere)
+    scs = [ActStoppingCriterion.from_pve(wm, gm, csf),
+           CmcStoppingCriterion.from_pve(wm, gm, csf, step_size=.2,
+                                         average_voxel_size=1)]
+    for sc in scs:
+        for kwargs in [{}, {'unidirectional': True,
+                            'randomize_forward_direction': True,
+                            'save_seeds': True}]:
+            serial = list(ParticleFilteringTracking(
+                dg, sc, seeds, np.eye(4), .2, random_seed=1, **kwargs))
+            threaded = list(ParticleFilteringTracking(
+                dg, sc, seeds, np.eye(4), .2, random_seed=1, num_threads=3,
+                seed_batch_size=7, **kwargs))
+            npt.assert_equal(len(threaded), len(serial))
+            for out_threaded, out_serial in zip(threaded, serial):
+                for a, b in zip(out_threaded, out_serial):
+                    npt.assert_array_equal(a, b)
+
+
+@set_random_number_generator(0)
+def test_lockstep_tracking(rng):
+    """Test that tracking seeds in lockstep gives the streamlines of the
+    serial tracking for a given random seed."""
+    sphere = get_sphere('repulsion100')
+    mask = np.ones((8, 8, 8))
+    mask[0] = 0
+    sc = ThresholdStoppingCriterion(mask, .5)
+    shcoeff = rng.random((8, 8, 8, 15))
+    shcoeff[..., 0] += 2
+    seeds = rng.random((100, 3)) * 7
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore", message=descoteaux07_legacy_msg,
+            category=PendingDeprecationWarning)
+        pmf = sh_to_sf(shcoeff, sphere, sh_order=4).clip(min=0)
+        dgs = [ProbabilisticDirectionGetter.from_pmf(pmf, 60, sphere),
+               DeterministicMaximumDirectionGetter.from_pmf(pmf, 60, sphere),
+               ClosestPeakDirectionGetter.from_shcoeff(shcoeff, 60, sphere)]
+        for dg in dgs:
+            # Seeds can have several initial directions without max_cross
+            for kwargs in [{'max_cross': 1}, {'max_cross': None},
+                           {'max_cross': 1, 'unidirectional': True,
+                            'randomize_forward_direction': True,
+                            'save_seeds': True},
+                           {'max_cross': None, 'unidirectional': True,
+                            'randomize_forward_direction': True,
+                            'save_seeds': True}]:
+                serial = list(LocalTracking(dg, sc, seeds, np.eye(4), .5,
+                                            random_seed=1, **kwargs))
+                for lockstep_size in [1, 7]:
+                    lockstep = list(LocalTracking(
+                        dg, sc, seeds, np.eye(4), .5, random_seed=1,
+                        lockstep_size=lockstep_size, **kwargs))
+                    npt.assert_equal(len(lockstep), len(serial))
+                    for out_lockstep, out_serial in zip(lockstep, serial):
+                        for a, b in zip(out_lockstep, out_serial):
+                            npt.assert_array_equal(a, b)
+
+        # The pmfs of the SH coefficients are computed by a matrix product
+        pmf_gen = SHCoeffPmfGen(shcoeff, sphere, None)
+        points = rng.random((50, 3)) * 7
+        npt.assert_array_almost_equal(
+            pmf_gen.get_pmf_batch(points),
+            [np.copy(pmf_gen.get_pmf(p)) for p in points])
+
+        dg = PTTDirectionGetter.from_shcoeff(shcoeff, 60, sphere)
+        npt.assert_raises(ValueError, LocalTracking, dg, sc, seeds,
+                          np.eye(4), .5, lockstep_size=8)
+    npt.assert_raises(ValueError, LocalTracking, dgs[0], sc, seeds,
+                      np.eye(4), .5, lockstep_size=0)
+
+
+@set_random_number_generator(0)
+def test_tracking_stats(rng):
+    """Test that the stats of a tracking run account for all the seeds and
+    streamlines, without changing the streamlines."""
+    sphere = get_sphere('repulsion100')
+    shape = (8, 8, 8)
+    mask = np.ones(shape)
+    mask[0] = 0
+    shcoeff = rng.random(shape + (15,))
+    shcoeff[..., 0] += 2
+    wm = rng.random(shape)
+    gm = (1 - wm) * rng.random(shape)
+    csf = 1 - wm - gm
+    seeds = rng.random((50, 3)) * 7
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore", message=descoteaux07_legacy_msg,
+            category=PendingDeprecationWarning)
+        dg = ProbabilisticDirectionGetter.from_shcoeff(shcoeff, 60, sphere)
+    sc = ThresholdStoppingCriterion(mask, .5)
+    act = ActStoppingCriterion.from_pve(wm, gm, csf)
+    runs = [(LocalTracking, sc, {}),
+            (LocalTracking, sc, {'return_all': False, 'minlen': 10,
+                                 'maxlen': 30}),
+            (LocalTracking, sc, {'return_all': False, 'minlen': 10,
+                                 'maxlen': 30, 'lockstep_size': 7}),
+            (LocalTracking, sc, {'num_threads': 2, 'seed_batch_size': 7}),
+            (ParticleFilteringTracking, act, {'return_all': False})]
+    for tracking, criterion, kwargs in runs:
+        stats = TrackingStats(callback=lambda stats: calls.append(stats))
+        calls = []
+        streamlines = list(tracking(dg, criterion, seeds, np.eye(4), .5,
+                                    random_seed=1, **kwargs))
+        recorded = list(tracking(dg, criterion, seeds, np.eye(4), .5,
+                                 random_seed=1, stats=stats, **kwargs))
+        npt.assert_equal(len(recorded), len(streamlines))
+        for a, b in zip(recorded, streamlines):
+            npt.assert_array_equal(a, b)
+
+        npt.assert_equal(stats.nb_seeds, len(seeds))
+        npt.assert_equal(stats.nb_streamlines, len(streamlines))
+        npt.assert_(len(calls) > 0)
+        nb_tracked = sum(stats.step_counts.values())
+        npt.assert_equal(stats.nb_streamlines + stats.discarded_by_status +
+                         stats.discarded_by_length, nb_tracked)
+        npt.assert_equal(stats.steps_histogram(bins=4)[0].sum(), nb_tracked)
+        for streamline in streamlines:
+            npt.assert_(stats.step_counts[len(streamline) - 1] > 0)
+        # Each streamline has a forward and a backward segment, unless its
+        # forward segment is discarded
+        npt.assert_(nb_tracked <= sum(stats.status_counts.values())
+                    <= 2 * nb_tracked)
+        npt.assert_(0 < stats.stopping_criterion_time < stats.tracking_time)
+        npt.assert_(stats.direction_getter_time > 0)
+        npt.assert_(stats.seeds_per_second > 0)
+        npt.assert_(str(stats.nb_seeds) in stats.summary())
@@ -7,7 +7,8 @@ from dipy.tracking import metrics
 from dipy.tracking.streamline import transform_streamlines
 from dipy.tracking.utils import (connectivity_matrix, density_map, length,
                                  ndbincount, reduce_labels, seeds_from_mask,
-                                 random_seeds_from_mask, target,
+                                 random_seeds_from_mask, iter_seeds_from_mask,
+                                 iter_random_seeds_from_mask, target,
                                  target_line_based, unique_rows, near_roi,
                                  reduce_rois, path_length, _min_at,
                                  max_angle_from_curvature,
@@ -567,6 +568,64 @@ def test_random_seeds_from_mask(rng):
     assert_true(np.all(seeds_nt_150 == seeds_nt_500))
 
 
+@set_random_number_generator()
+def test_iter_seeds_from_mask(rng):
+    mask = rng.random((6, 7, 8)) > .5
+    affine = np.diag([2., 3., 1., 1.])
+    affine[:3, 3] = [1, 2, 3]
+    seeds = seeds_from_mask(mask, affine, density=[2, 1, 3])
+    chunks = list(iter_seeds_from_mask(mask, affine, density=[2, 1, 3],
+                                       chunk_size=100))
+    npt.assert_array_equal([len(c) for c in chunks[:-1]], 100)
+    npt.assert_array_equal(np.concatenate(chunks), seeds)
+
+    chunks = list(iter_seeds_from_mask(mask, affine, density=2,
+                                       dtype=np.float32))
+    npt.assert_equal(chunks[0].dtype, np.float32)
+    npt.assert_array_almost_equal(np.concatenate(chunks),
+                                  seeds_from_mask(mask, affine, density=2),
+                                  decimal=5)
+    npt.assert_equal(list(iter_seeds_from_mask(np.zeros((2, 2, 2)),
+                                               affine)), [])
+    npt.assert_raises(ValueError, next,
+                      iter_seeds_from_mask(mask, affine, chunk_size=0))
+
+
+@set_random_number_generator()
+def test_iter_random_seeds_from_mask(rng):
+    mask = rng.random((6, 7, 8)) > .5
+    affine = np.diag([2., 3., 1., 1.])
+    affine[:3, 3] = [1, 2, 3]
+
+    chunks = list(iter_random_seeds_from_mask(mask, affine, seeds_count=3,
+                                              random_seed=0, chunk_size=100,
+                                              dtype=np.float32))
+    seeds = np.concatenate(chunks)
+    npt.assert_equal(chunks[0].dtype, np.float32)
+    npt.assert_equal(len(seeds), 3 * mask.sum())
+    # Each voxel of the mask has 3 seeds
+    voxels = np.round((seeds - affine[:3, 3]) / [2, 3, 1]).astype(int)
+    counts = np.zeros(mask.shape, dtype=int)
+    np.add.at(counts, tuple(voxels.T), 1)
+    npt.assert_array_equal(counts, 3 * mask)
+
+    # The chunks do not depend on the number of seeds and are reproducible
+    for seeds_count, per_voxel in [(2, True), (150, False), (5000, False)]:
+        other = list(iter_random_seeds_from_mask(
+            mask, affine, seeds_count=seeds_count,
+            seed_count_per_voxel=per_voxel, random_seed=0, chunk_size=100,
+            dtype=np.float32))
+        nb_seeds = seeds_count * mask.sum() if per_voxel else seeds_count
+        npt.assert_equal(sum(len(c) for c in other), nb_seeds)
+        npt.assert_array_equal(other[0], chunks[0])
+
+    other = list(iter_random_seeds_from_mask(mask, affine, seeds_count=3,
+                                             random_seed=1, chunk_size=100))
+    assert_true(not np.allclose(other[0], chunks[0]))
+    npt.assert_equal(list(iter_random_seeds_from_mask(np.zeros((2, 2, 2)),
+                                                      affine, 10, False)), [])
+
+
 def test_connectivity_matrix_shape():
     # Labels: z-planes have labels 0,1,2
     labels = np.zeros((3, 3, 3), dtype=int)
@@ -522,6 +522,143 @@ def random_seeds_from_mask(mask, affine, seeds_count=1,
     return seeds
 
 
+def _seed_mask(mask):
+    mask = np.array(mask, dtype=bool, copy=False, ndmin=3)
+    if mask.ndim != 3:
+        raise ValueError('mask cannot be more than 3d')
+    return mask
+
+
+def _seeds_to_space(voxels, offsets, affine, dtype):
+    """Seeds at `offsets` from the centers of `voxels`, in point space."""
+    seeds = voxels + offsets
+    seeds = np.dot(seeds, affine[:3, :3].T)
+    seeds += affine[:3, 3]
+    return seeds.astype(dtype, copy=False)
+
+
+def iter_seeds_from_mask(mask, affine, density=(1, 1, 1), chunk_size=100000,
+                         dtype=float):
+    """Generate the seeds of ``seeds_from_mask`` in chunks.
+
+    Only one chunk of seeds is held in memory at a time, so that tracking
+    can start before all the seeds are placed, e.g. with
+    ``LocalTracking(dg, sc, itertools.chain.from_iterable(chunks), ...)``.
+
+    Parameters
+    ----------
+    mask : binary 3d array_like
+        A binary array specifying where to place the seeds for fiber tracking.
+    affine : array, (4, 4)
+        The mapping between voxel indices and the point space for seeds.
+    density : int or array_like (3,)
+        Specifies the number of seeds to place along each dimension. A
+        ``density`` of `2` is the same as ``[2, 2, 2]`` and will result in a
+        total of 8 seeds per voxel.
+    chunk_size : int, optional
+        Number of seeds of each chunk. The last chunk can be smaller.
+    dtype : dtype, optional
+        Type of the seeds, e.g. ``np.float32`` to halve their memory.
+
+    Yields
+    ------
+    seeds : array (chunk_size, 3)
+        Consecutive chunks of the seeds of ``seeds_from_mask``.
+
+    See Also
+    --------
+    seeds_from_mask, iter_random_seeds_from_mask
+
+    """
+    mask = _seed_mask(mask)
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+
+    density = np.asarray(density, int)
+    if density.size == 1:
+        density = np.full(3, density.item(), dtype=int)
+    elif density.shape != (3,):
+        raise ValueError("density should be in integer array of shape (3,)")
+
+    # Grid of points between -.5 and .5, centered at 0, with given density
+    grid = np.mgrid[0:density[0], 0:density[1], 0:density[2]]
+    grid = grid.T.reshape((-1, 3))
+    grid = grid / density
+    grid += (.5 / density - .5)
+
+    voxels = np.flatnonzero(mask)
+    nb_seeds = len(voxels) * len(grid)
+    for start in range(0, nb_seeds, chunk_size):
+        index = np.arange(start, min(start + chunk_size, nb_seeds))
+        where = np.column_stack(np.unravel_index(
+            voxels[index // len(grid)], mask.shape))
+        yield _seeds_to_space(where, grid[index % len(grid)], affine, dtype)
+
+
+def iter_random_seeds_from_mask(mask, affine, seeds_count=1,
+                                seed_count_per_voxel=True, random_seed=None,
+                                chunk_size=100000, dtype=float):
+    """Generate randomly placed seeds in chunks.
+
+    As ``random_seeds_from_mask``, the voxels of the mask are visited in a
+    random order, ``seeds_count`` times if ``seed_count_per_voxel``, and a
+    seed is placed randomly in each visited voxel. The positions in each
+    chunk are drawn from their own random stream, derived from
+    `random_seed` and the index of the chunk, so that a chunk is the same
+    whether or not the previous chunks were drawn. The seeds differ from
+    those of ``random_seeds_from_mask``.
+
+    Parameters
+    ----------
+    mask : binary 3d array_like
+        A binary array specifying where to place the seeds for fiber tracking.
+    affine : array, (4, 4)
+        The mapping between voxel indices and the point space for seeds.
+    seeds_count : int
+        The number of seeds to generate. If ``seed_count_per_voxel`` is True,
+        specifies the number of seeds to place in each voxel. Otherwise,
+        specifies the total number of seeds to place in the mask.
+    seed_count_per_voxel: bool
+        If True, seeds_count is per voxel, else seeds_count is the total number
+        of seeds.
+    random_seed : int, optional
+        The seed of the random streams (numpy.random.SeedSequence).
+    chunk_size : int, optional
+        Number of seeds of each chunk. The last chunk can be smaller.
+    dtype : dtype, optional
+        Type of the seeds, e.g. ``np.float32`` to halve their memory.
+
+    Yields
+    ------
+    seeds : array (chunk_size, 3)
+        Consecutive chunks of the seeds.
+
+    See Also
+    --------
+    random_seeds_from_mask, iter_seeds_from_mask
+
+    """
+    mask = _seed_mask(mask)
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+
+    seed_seq = np.random.SeedSequence(random_seed)
+    voxels = np.random.default_rng(seed_seq).permutation(np.flatnonzero(mask))
+    if seed_count_per_voxel:
+        nb_seeds = seeds_count * len(voxels)
+    else:
+        nb_seeds = seeds_count if len(voxels) else 0
+
+    for chunk, start in enumerate(range(0, nb_seeds, chunk_size)):
+        index = np.arange(start, min(start + chunk_size, nb_seeds))
+        rng = np.random.default_rng(np.random.SeedSequence(
+            seed_seq.entropy, spawn_key=(chunk,)))
+        where = np.column_stack(np.unravel_index(
+            voxels[index % len(voxels)], mask.shape))
+        offsets = rng.random((len(index), 3)) - .5
+        yield _seeds_to_space(where, offsets, affine, dtype)
+
+
 def _with_initialize(generator):
     """Allow one to write a generator with initialization code.
 
@@ -1,12 +1,439 @@
+"""Executors running a function over many items in parallel.
+
+All executors share the same interface: items are grouped in chunks, each
+chunk is processed by a worker and the results are streamed back to the
+caller, e.g. straight into a preallocated output array with
+:meth:`Executor.map_into`. Large ndarray arguments are placed in shared
+memory when the workers are separate processes.
+"""
+from concurrent.futures import (CancelledError, ProcessPoolExecutor,
+                                ThreadPoolExecutor, as_completed)
+from multiprocessing import shared_memory
+import queue
+import threading
+import warnings
+
 import numpy as np
-import multiprocessing
 from tqdm.auto import tqdm
+
+from dipy.utils.multiproc import determine_num_processes
 from dipy.utils.optpkg import optional_package
 
 joblib, has_joblib, _ = optional_package('joblib')
 dask, has_dask, _ = optional_package('dask')
 ray, has_ray, _ = optional_package('ray')
 
+# ndarray arguments larger than this (in bytes) are sent to worker processes
+# through shared memory.
+SHARED_MEMORY_THRESHOLD = 2 ** 20
+
+
+class SharedArray:
+    """An ndarray stored in a shared memory block.
+
+    Pickling a ``SharedArray`` only sends the name of the block, so worker
+    processes map the same memory instead of receiving a copy.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the array.
+    dtype : data-type
+        Data type of the array.
+    name : str, optional
+        Name of an existing shared memory block to attach to. If None, a new
+        block is created and this object owns it.
+    """
+
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        if name is None:
+            size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+            shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+        # The array is set before the block so that it is released first
+        # when this object is garbage collected.
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+        self._shm = shm
+
+    @classmethod
+    def from_array(cls, arr):
+        """Copy `arr` to a new shared memory block."""
+        arr = np.asarray(arr)
+        shared = cls(arr.shape, arr.dtype)
+        shared.array[...] = arr
+        return shared
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def __reduce__(self):
+        return SharedArray, (self.shape, self.dtype, self.name)
+
+    def close(self):
+        """Release the mapping, and free the block if this object owns it."""
+        if self.array is None:
+            return
+        self.array = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _resolve(arg):
+    """Replace a SharedArray by its ndarray view"""
+    return arg.array if isinstance(arg, SharedArray) else arg
+
+
+def _run_chunk(func, start, items, func_args, func_kwargs):
+    """Apply `func` to each item of a chunk, in a worker."""
+    func_args = [_resolve(a) for a in func_args]
+    func_kwargs = {k: _resolve(v) for k, v in func_kwargs.items()}
+    return start, [func(item, *func_args, **func_kwargs) for item in items]
+
+
+class Executor:
+    """Map a function over items in chunks, streaming back the results.
+
+    Subclasses implement one engine by defining ``_run``.
+
+    Parameters
+    ----------
+    n_jobs : int, optional
+        Number of workers. See
+        :func:`dipy.utils.multiproc.determine_num_processes`. Default: -1,
+        i.e. all cores.
+    backend : str, optional
+        Engine specific backend, see the subclasses.
+    kwargs : dict, optional
+        Additional arguments passed to the underlying engine.
+    """
+
+    #: Whether the workers run in separate processes.
+    uses_processes = False
+
+    def __init__(self, n_jobs=-1, backend=None, **kwargs):
+        self.n_jobs = determine_num_processes(n_jobs)
+        self.backend = backend
+        self.kwargs = kwargs
+
+    def _run(self, tasks):
+        """Yield ``_run_chunk(*task)`` for each task, in any order."""
+        raise NotImplementedError
+
+    def _share(self, arg, shared):
+        if (self.uses_processes and isinstance(arg, np.ndarray)
+                and arg.nbytes > SHARED_MEMORY_THRESHOLD):
+            arg = SharedArray.from_array(arg)
+            shared.append(arg)
+        return arg
+
+    def map(self, func, items, func_args=None, func_kwargs=None,
+            chunk_size=None, progress=None, cancel=None):
+        """Apply `func` to every item.
+
+        Parameters
+        ----------
+        func : callable
+            Called as ``func(item, *func_args, **func_kwargs)``. It must be
+            picklable for process based engines.
+        items : sequence
+            Items to process.
+        func_args : list, optional
+            Positional arguments to `func`. Large ndarrays are sent through
+            shared memory to worker processes.
+        func_kwargs : dict, optional
+            Keyword arguments to `func`, handled like `func_args`.
+        chunk_size : int, optional
+            Number of items processed by a worker at once. Default: about four
+            chunks per worker.
+        progress : callable, optional
+            Called as ``progress(n_done, n_items)`` every time a chunk is done.
+        cancel : threading.Event, optional
+            When set, pending chunks are cancelled and
+            ``concurrent.futures.CancelledError`` is raised.
+
+        Yields
+        ------
+        index : int
+            Position of the item in `items`.
+        result : object
+            ``func(items[index], ...)``. Results are yielded in completion
+            order.
+        """
+        if not hasattr(items, '__getitem__'):
+            items = list(items)
+        n_items = len(items)
+        if chunk_size is None:
+            chunk_size = max(int(np.ceil(n_items / (4 * self.n_jobs))), 1)
+
+        shared = []
+        func_args = [self._share(a, shared) for a in func_args or []]
+        func_kwargs = {k: self._share(v, shared)
+                       for k, v in (func_kwargs or {}).items()}
+        tasks = [(func, start, items[start:start + chunk_size], func_args,
+                  func_kwargs) for start in range(0, n_items, chunk_size)]
+        n_done = 0
+        results = self._run(tasks)
+        try:
+            for start, chunk_results in results:
+                if cancel is not None and cancel.is_set():
+                    raise CancelledError()
+                for i, result in enumerate(chunk_results):
+                    yield start + i, result
+                n_done += len(chunk_results)
+                if progress is not None:
+                    progress(n_done, n_items)
+        finally:
+            results.close()
+            for arg in shared:
+                arg.close()
+
+    def map_into(self, func, items, out, **kwargs):
+        """Apply `func` to every item, storing ``out[i] = func(items[i])``.
+
+        Parameters
+        ----------
+        func : callable
+            See :meth:`map`.
+        items : sequence
+            Items to process.
+        out : ndarray
+            Preallocated output, indexed along its first axis.
+        kwargs : dict, optional
+            Arguments of :meth:`map`.
+
+        Returns
+        -------
+        out : ndarray
+        """
+        for i, result in self.map(func, items, **kwargs):
+            out[i] = result
+        return out
+
+
+class SerialExecutor(Executor):
+    """Run every chunk in the calling process. Useful for debugging."""
+
+    def __init__(self, n_jobs=1, backend=None, **kwargs):
+        Executor.__init__(self, 1, backend, **kwargs)
+
+    def _run(self, tasks):
+        for task in tasks:
+            yield _run_chunk(*task)
+
+
+class ThreadExecutor(Executor):
+    """Run the chunks in a pool of threads.
+
+    Only useful when `func` releases the GIL, e.g. most numpy and scipy
+    linear algebra.
+    """
+
+    _pool_class = ThreadPoolExecutor
+
+    def _run(self, tasks):
+        pool = self._pool_class(max_workers=self.n_jobs, **self.kwargs)
+        try:
+            futures = [pool.submit(_run_chunk, *task) for task in tasks]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+class ProcessExecutor(ThreadExecutor):
+    """Run the chunks in a pool of processes."""
+
+    uses_processes = True
+    _pool_class = ProcessPoolExecutor
+
+
+class JoblibExecutor(Executor):
+    """Run the chunks with ``joblib.Parallel``.
+
+    `backend` is the joblib backend. Default: "loky". The results are
+    streamed as the chunks complete with joblib >= 1.4, and only once all
+    the chunks are done with older versions.
+    """
+
+    def __init__(self, n_jobs=-1, backend=None, **kwargs):
+        if not has_joblib:
+            raise joblib()
+        Executor.__init__(self, n_jobs, backend or "loky", **kwargs)
+        self.uses_processes = self.backend != "threading"
+
+    def _run(self, tasks):
+        try:
+            parallel = joblib.Parallel(n_jobs=self.n_jobs,
+                                       backend=self.backend,
+                                       return_as="generator_unordered",
+                                       **self.kwargs)
+        except (TypeError, ValueError):
+            parallel = joblib.Parallel(n_jobs=self.n_jobs,
+                                       backend=self.backend, **self.kwargs)
+        delayed = joblib.delayed(_run_chunk)
+        results = parallel(delayed(*task) for task in tasks)
+        try:
+            for result in results:
+                yield result
+        finally:
+            # Closing the generator aborts the pending chunks. joblib warns
+            # about them, but here they are dropped on purpose.
+            if hasattr(results, 'close'):
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", UserWarning)
+                    results.close()
+
+
+class DaskExecutor(Executor):
+    """Run the chunks with ``dask.compute``.
+
+    `backend` is either "threading" (default) or "multiprocessing". The
+    results are streamed from the callbacks of the dask scheduler, which
+    runs in a background thread.
+    """
+
+    _schedulers = {"threading": "threads", "multiprocessing": "processes"}
+
+    def __init__(self, n_jobs=-1, backend=None, **kwargs):
+        if not has_dask:
+            raise dask()
+        backend = backend or "threading"
+        if backend not in self._schedulers:
+            raise ValueError("%s is not a backend for dask" % backend)
+        Executor.__init__(self, n_jobs, backend, **kwargs)
+        self.uses_processes = backend == "multiprocessing"
+
+    def _run(self, tasks):
+        from dask.callbacks import Callback
+
+        delayed = [dask.delayed(_run_chunk, pure=False)(*task)
+                   for task in tasks]
+        keys = {d.key for d in delayed}
+        done = queue.Queue()
+        stop = threading.Event()
+        finished = object()
+
+        def pretask(key, dsk, state):
+            # Raising in the scheduler stops it from starting other chunks
+            if stop.is_set():
+                raise CancelledError()
+
+        def posttask(key, result, dsk, state, worker_id):
+            if key in keys:
+                done.put(result)
+
+        callback = Callback(pretask=pretask, posttask=posttask)._callback
+
+        def compute():
+            try:
+                dask.compute(*delayed,
+                             scheduler=self._schedulers[self.backend],
+                             num_workers=self.n_jobs,
+                             callbacks=[callback],
+                             **self.kwargs)
+            except BaseException as e:
+                done.put(e)
+            else:
+                done.put(finished)
+
+        thread = threading.Thread(target=compute, daemon=True)
+        thread.start()
+        try:
+            while True:
+                result = done.get()
+                if result is finished:
+                    break
+                if isinstance(result, BaseException):
+                    raise result
+                yield result
+        finally:
+            stop.set()
+            thread.join()
+
+
+class RayExecutor(Executor):
+    """Run the chunks as ray tasks.
+
+    Ray workers may live on other nodes, so ndarray arguments go through the
+    ray object store rather than shared memory.
+    """
+
+    def __init__(self, n_jobs=-1, backend=None, **kwargs):
+        if not has_ray:
+            raise ray()
+        Executor.__init__(self, n_jobs, backend, **kwargs)
+
+    def _run(self, tasks):
+        remote = ray.remote(_run_chunk)
+        pending = [remote.remote(*task) for task in tasks]
+        try:
+            while pending:
+                done, pending = ray.wait(pending)
+                for ref in done:
+                    yield ray.get(ref)
+        finally:
+            for ref in pending:
+                ray.cancel(ref)
+
+
+_executors = {
+    "serial": SerialExecutor,
+    "thread": ThreadExecutor,
+    "process": ProcessExecutor,
+    "joblib": JoblibExecutor,
+    "dask": DaskExecutor,
+    "ray": RayExecutor,
+}
+
+
+def get_executor(engine="serial", n_jobs=-1, backend=None, **kwargs):
+    """Create an executor.
+
+    Parameters
+    ----------
+    engine : str
+        {"serial", "thread", "process", "joblib", "dask", "ray"}
+    n_jobs : int, optional
+        Number of workers, see
+        :func:`dipy.utils.multiproc.determine_num_processes`. Default: -1.
+    backend : str, optional
+        What joblib or dask backend to use.
+    kwargs : dict, optional
+        Additional arguments passed to the engine.
+
+    Returns
+    -------
+    executor : Executor
+    """
+    if isinstance(engine, Executor):
+        return engine
+    if engine not in _executors:
+        raise ValueError("engine must be one of %s, got %r"
+                         % (", ".join(_executors), engine))
+    return _executors[engine](n_jobs=n_jobs, backend=backend, **kwargs)
+
+
+def _tqdm_progress(total):
+    bar = tqdm(total=total)
+
+    def progress(n_done, n_items):
+        bar.update(n_done - bar.n)
+        if n_done == n_items:
+            bar.close()
+    return progress
+
 
 def paramap(func, in_list, out_shape=None, n_jobs=-1, engine="joblib",
             backend=None, func_args=None, func_kwargs=None,
@@ -27,10 +454,10 @@ def paramap(func, in_list, out_shape=None, n_jobs=-1, engine="joblib",
          The shape of the output array. If not specified, the output shape will
          be `(len(in_list),)`.
     n_jobs : integer, optional
-        The number of jobs to perform in parallel. -1 to use all but one cpu.
+        The number of jobs to perform in parallel. -1 to use all cpus.
         Default: -1.
     engine : str
-        {"dask", "joblib", "ray", "serial"}
+        {"dask", "joblib", "ray", "process", "thread", "serial"}
         The last one is useful for debugging -- runs the code without any
         parallelization. Default: "joblib"
     backend : str, optional
@@ -49,60 +476,17 @@ def paramap(func, in_list, out_shape=None, n_jobs=-1, engine="joblib",
     -------
     ndarray of identical shape to `arr`
 
-    """
-
-    func_args = func_args or []
-    func_kwargs = func_kwargs or {}
-
-    if engine == "joblib":
-        if not has_joblib:
-            raise joblib()
-        if backend is None:
-            backend = "loky"
-        pp = joblib.Parallel(
-            n_jobs=n_jobs, backend=backend,
-            **kwargs)
-        dd = joblib.delayed(func)
-        d_l = [dd(ii, *func_args, **func_kwargs) for ii in in_list]
-        results = pp(tqdm(d_l))
-
-    elif engine == "dask":
-        if not has_dask:
-            raise dask()
-        if backend is None:
-            backend = "threading"
-
-        if n_jobs == -1:
-            n_jobs = multiprocessing.cpu_count()
-            n_jobs = n_jobs - 1
-
-        def partial(func, *args, **keywords):
-            def newfunc(in_arg):
-                return func(in_arg, *args, **keywords)
-            return newfunc
-        pp = partial(func, *func_args, **func_kwargs)
-        dd = [dask.delayed(pp)(ii) for ii in in_list]
-        if backend == "multiprocessing":
-            results = dask.compute(*dd, scheduler="processes",
-                                   workers=n_jobs, **kwargs)
-        elif backend == "threading":
-            results = dask.compute(*dd, scheduler="threads",
-                                   workers=n_jobs, **kwargs)
-        else:
-            raise ValueError("%s is not a backend for dask" % backend)
+    See Also
+    --------
+    get_executor
 
-    if engine == "ray":
-        if not has_ray:
-            raise ray()
-
-        func = ray.remote(func)
-        results = ray.get([func.remote(ii, *func_args, **func_kwargs)
-                           for ii in in_list])
-
-    elif engine == "serial":
-        results = []
-        for in_element in in_list:
-            results.append(func(in_element, *func_args, **func_kwargs))
+    """
+    executor = get_executor(engine, n_jobs=n_jobs, backend=backend, **kwargs)
+    results = [None] * len(in_list)
+    for i, result in executor.map(func, in_list, func_args=func_args,
+                                  func_kwargs=func_kwargs,
+                                  progress=_tqdm_progress(len(in_list))):
+        results[i] = result
 
     if out_shape is not None:
         return np.array(results).reshape(out_shape)
@@ -1,3 +1,8 @@
+import pickle
+import threading
+import time
+from concurrent.futures import CancelledError
+
 import numpy as np
 import numpy.testing as npt
 import dipy.utils.parallel as para
@@ -34,3 +39,104 @@ def test_paramap():
                                           engine=engine,
                                           backend=backend)[0],
                              power_it(my_array[0, 0]))
+
+
+def row_dot(i, arr, vec=None):
+    return np.dot(arr[i], vec)
+
+
+def test_executors():
+    engines = ["serial", "thread", "process"]
+    if para.has_dask:
+        engines.append("dask")
+    if para.has_joblib:
+        engines.append("joblib")
+
+    # Large enough to go through shared memory with process based engines
+    arr = np.arange(300000, dtype=float).reshape((1000, 300))
+    vec = np.ones(300)
+    expected = arr.sum(-1)
+    for engine in engines:
+        executor = para.get_executor(engine, n_jobs=2)
+        out = np.zeros(1000)
+        calls = []
+        executor.map_into(row_dot, range(1000), out, func_args=[arr],
+                          func_kwargs={'vec': vec}, chunk_size=64,
+                          progress=lambda n, total: calls.append((n, total)))
+        npt.assert_array_equal(out, expected)
+        npt.assert_equal(len(calls), 16)
+        npt.assert_equal(calls[-1], (1000, 1000))
+
+        indices = [i for i, _ in executor.map(power_it, [1, 2, 3])]
+        npt.assert_equal(sorted(indices), [0, 1, 2])
+
+    npt.assert_raises(ValueError, para.get_executor, "gpu")
+    executor = para.get_executor("serial")
+    npt.assert_(para.get_executor(executor) is executor)
+
+
+def test_executor_cancel():
+    cancel = threading.Event()
+
+    def progress(n_done, n_items):
+        cancel.set()
+
+    executor = para.get_executor("serial")
+    out = np.zeros(10)
+    with npt.assert_raises(CancelledError):
+        executor.map_into(power_it, range(10), out, chunk_size=2,
+                          progress=progress, cancel=cancel)
+    npt.assert_array_equal(out[:2], [0, 1])
+    npt.assert_array_equal(out[2:], 0)
+
+
+def test_executor_streaming():
+    engines = [("thread", None)]
+    if para.has_dask:
+        engines.append(("dask", "threading"))
+    if para.has_joblib:
+        engines.append(("joblib", "threading"))
+
+    for engine, backend in engines:
+        executor = para.get_executor(engine, n_jobs=2, backend=backend)
+
+        # The last item only completes once the others have been received
+        received = threading.Event()
+
+        def wait_others(i):
+            return received.wait(10) if i == 3 else i
+
+        results = {}
+        for i, result in executor.map(wait_others, range(4), chunk_size=1):
+            results[i] = result
+            if len(results) == 3:
+                received.set()
+        npt.assert_equal(results, {0: 0, 1: 1, 2: 2, 3: True})
+
+        # The pending chunks are not run once cancelled
+        cancel = threading.Event()
+        calls = []
+
+        def slow(i):
+            calls.append(i)
+            time.sleep(0.05)
+            return i
+
+        with npt.assert_raises(CancelledError):
+            for _ in executor.map(slow, range(40), chunk_size=1,
+                                  progress=lambda *args: cancel.set(),
+                                  cancel=cancel):
+                pass
+        npt.assert_(len(calls) < 40)
+
+
+def test_shared_array():
+    arr = np.arange(12.).reshape((3, 4))
+    with para.SharedArray.from_array(arr) as shared:
+        npt.assert_array_equal(shared.array, arr)
+        attached = pickle.loads(pickle.dumps(shared))
+        npt.assert_(not attached.owner)
+        attached.array[0, 0] = 100
+        npt.assert_equal(shared.array[0, 0], 100)
+        attached.close()
+    npt.assert_(shared.array is None)
@@ -9,6 +9,7 @@ from dipy.io.streamline import load_tractogram, save_tractogram
 from dipy.tracking import Streamlines
 from dipy.segment.mask import median_otsu
 from dipy.segment.bundles import RecoBundles
+from dipy.utils.omp import determine_num_threads
 from dipy.workflows.workflow import Workflow
 
 
@@ -105,6 +106,7 @@ class RecoBundlesFlow(Workflow):
             slr_matrix='small',
             refine=False, r_reduction_thr=12.,
             r_pruning_thr=6., no_r_slr=False,
+            num_workers=None,
             out_dir='',
             out_recognized_transf='recognized.trk',
             out_recognized_labels='labels.npy'):
@@ -152,6 +154,13 @@ class RecoBundlesFlow(Workflow):
         no_r_slr : bool, optional
             Don't enable Refine local Streamline-based Linear
             Registration.
+        num_workers : int, optional
+            Number of bundles recognized in parallel. If None (default) the
+            value of OMP_NUM_THREADS environment variable is used if it is
+            set, otherwise all available threads are used. If < 0 the
+            maximal number of threads minus |num_workers + 1| is used. The
+            model bundles are loaded and recognized a few per worker at a
+            time.
         out_dir : string, optional
             Output directory. (default current directory)
         out_recognized_transf : string, optional
@@ -218,72 +227,88 @@ class RecoBundlesFlow(Workflow):
         rb = RecoBundles(streamlines, greater_than=greater_than,
                          less_than=less_than)
 
-        for _, mb, out_rec, out_labels in io_it:
-            t = time()
-            logging.info(mb)
-            model_bundle = load_tractogram(mb, 'same',
-                                           bbox_valid_check=False).streamlines
-            logging.info(' Loading time %0.3f sec' % (time() - t,))
-            logging.info("model file = ")
-            logging.info(mb)
-
-            recognized_bundle, labels = \
-                rb.recognize(
-                    model_bundle,
-                    model_clust_thr=model_clust_thr,
-                    reduction_thr=reduction_thr,
-                    reduction_distance=reduction_distance,
-                    pruning_thr=pruning_thr,
-                    pruning_distance=pruning_distance,
-                    slr=slr,
-                    slr_metric=slr_metric,
-                    slr_x0=slr_transform,
-                    slr_bounds=bounds,
-                    slr_select=slr_select,
-                    slr_method='L-BFGS-B')
-
-            if refine:
-
-                if len(recognized_bundle) > 1:
-
-                    # affine
-                    x0 = np.array([0, 0, 0, 0, 0, 0, 1., 1., 1, 0, 0, 0])
-                    affine_bounds = [(-30, 30), (-30, 30), (-30, 30),
-                                     (-45, 45), (-45, 45), (-45, 45),
-                                     (0.8, 1.2), (0.8, 1.2), (0.8, 1.2),
-                                     (-10, 10), (-10, 10), (-10, 10)]
-
-                    recognized_bundle, labels = \
-                        rb.refine(
-                            model_bundle,
-                            recognized_bundle,
-                            model_clust_thr=model_clust_thr,
-                            reduction_thr=r_reduction_thr,
-                            reduction_distance=reduction_distance,
-                            pruning_thr=r_pruning_thr,
-                            pruning_distance=pruning_distance,
-                            slr=r_slr,
-                            slr_metric=slr_metric,
-                            slr_x0=x0,
-                            slr_bounds=affine_bounds,
-                            slr_select=slr_select,
-                            slr_method='L-BFGS-B')
-
-            if len(labels) > 0:
-                ba, bmd = rb.evaluate_results(
-                    model_bundle, recognized_bundle,
-                    slr_select)
-
-                logging.info("Bundle adjacency Metric {0}".format(ba))
-                logging.info("Bundle Min Distance Metric {0}".format(bmd))
-
-            new_tractogram = StatefulTractogram(recognized_bundle,
-                                                streamline_files, Space.RASMM)
-            save_tractogram(new_tractogram, out_rec, bbox_valid_check=False)
-            logging.info('Saving output files ...')
-            np.save(out_labels, np.array(labels))
-            logging.info(out_rec)
-            logging.info(out_labels)
+        io_files = list(io_it)
+        num_workers = determine_num_threads(num_workers)
+        # The model bundles are recognized in chunks, so that only the
+        # models and results of a chunk are held in memory
+        chunk_size = 4 * num_workers
+        for start in range(0, len(io_files), chunk_size):
+            chunk = io_files[start:start + chunk_size]
+            model_bundles = []
+            for _, mb, _, _ in chunk:
+                t = time()
+                logging.info(mb)
+                model_bundles.append(load_tractogram(
+                    mb, 'same', bbox_valid_check=False).streamlines)
+                logging.info(' Loading time %0.3f sec' % (time() - t,))
+
+            # The whole-brain centroids and the reduction distances are
+            # shared by the model bundles of the chunk
+            recognized = rb.recognize_bundles(
+                model_bundles,
+                model_clust_thr=model_clust_thr,
+                reduction_thr=reduction_thr,
+                reduction_distance=reduction_distance,
+                pruning_thr=pruning_thr,
+                pruning_distance=pruning_distance,
+                slr=slr,
+                slr_metric=slr_metric,
+                slr_x0=slr_transform,
+                slr_bounds=bounds,
+                slr_select=slr_select,
+                slr_method='L-BFGS-B',
+                num_workers=num_workers)
+
+            for (_, mb, out_rec, out_labels), model_bundle, \
+                    (recognized_bundle, labels) in zip(chunk, model_bundles,
+                                                       recognized):
+                logging.info("model file = ")
+                logging.info(mb)
+
+                if refine:
+
+                    if len(recognized_bundle) > 1:
+
+                        # affine
+                        x0 = np.array([0, 0, 0, 0, 0, 0, 1., 1., 1, 0, 0, 0])
+                        affine_bounds = [(-30, 30), (-30, 30), (-30, 30),
+                                         (-45, 45), (-45, 45), (-45, 45),
+                                         (0.8, 1.2), (0.8, 1.2), (0.8, 1.2),
+                                         (-10, 10), (-10, 10), (-10, 10)]
+
+                        recognized_bundle, labels = \
+                            rb.refine(
+                                model_bundle,
+                                recognized_bundle,
+                                model_clust_thr=model_clust_thr,
+                                reduction_thr=r_reduction_thr,
+                                reduction_distance=reduction_distance,
+                                pruning_thr=r_pruning_thr,
+                                pruning_distance=pruning_distance,
+                                slr=r_slr,
+                                slr_metric=slr_metric,
+                                slr_x0=x0,
+                                slr_bounds=affine_bounds,
+                                slr_select=slr_select,
+                                slr_method='L-BFGS-B')
+
+                if len(labels) > 0:
+                    ba, bmd = rb.evaluate_results(
+                        model_bundle, recognized_bundle,
+                        slr_select)
+
+                    logging.info("Bundle adjacency Metric {0}".format(ba))
+                    logging.info("Bundle Min Distance Metric {0}".format(bmd))
+
+                new_tractogram = StatefulTractogram(recognized_bundle,
+                                                    streamline_files,
+                                                    Space.RASMM)
+                save_tractogram(new_tractogram, out_rec,
+                                bbox_valid_check=False)
+                logging.info('Saving output files ...')
+                np.save(out_labels, np.array(labels))
+                logging.info(out_rec)
+                logging.info(out_labels)
 
 
 class LabelsBundlesFlow(Workflow):
@@ -76,7 +76,8 @@ def test_recobundles_flow():
 
         rb_flow = RecoBundlesFlow(force=True)
         rb_flow.run(f1_path, f2_path, greater_than=0, clust_thr=10,
-                    model_clust_thr=5., reduction_thr=10, out_dir=out_dir)
+                    model_clust_thr=5., reduction_thr=10, num_workers=1,
+                    out_dir=out_dir)
 
         labels = rb_flow.last_generated_outputs['out_recognized_labels']
         recog_trk = rb_flow.last_generated_outputs['out_recognized_transf']
@@ -86,7 +87,7 @@ def test_recobundles_flow():
         npt.assert_equal(len(rec_bundle) == len(f2), True)
 
         label_flow = LabelsBundlesFlow(force=True)
-        label_flow.run(f1_path, labels)
+        label_flow.run(f1_path, labels, out_dir=out_dir)
 
         recog_bundle = label_flow.last_generated_outputs['out_bundle']
         rec_bundle_org = load_tractogram(recog_bundle, 'same',
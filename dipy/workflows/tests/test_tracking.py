@@ -1,9 +1,11 @@
+import os
 from os.path import join
 from tempfile import TemporaryDirectory
 import warnings
 
 import nibabel as nib
 import numpy as np
+import numpy.testing as npt
 from numpy.testing import assert_equal
 from dipy.testing import assert_false, assert_true
 
@@ -96,7 +98,8 @@ def test_particle_filtering_tracking_workflows():
             warnings.filterwarnings(
                 "ignore", message=descoteaux07_legacy_msg,
                 category=PendingDeprecationWarning)
-            pf_track_pam.run(pam_path, wm_path, gm_path, csf_path, seeds_path)
+            pf_track_pam.run(pam_path, wm_path, gm_path, csf_path, seeds_path,
+                             out_dir=out_dir)
         tractogram_path = \
             pf_track_pam.last_generated_outputs['out_tractogram']
         assert_false(is_tractogram_empty(tractogram_path))
@@ -113,12 +116,32 @@ def test_particle_filtering_tracking_workflows():
                              gm_path,
                              csf_path,
                              seeds_path,
-                             save_seeds=True)
+                             save_seeds=True,
+                             out_dir=out_dir)
         tractogram_path = \
             pf_track_pam.last_generated_outputs['out_tractogram']
         assert_true(tractogram_has_seeds(tractogram_path))
         assert_true(seeds_are_same_space_as_streamlines(tractogram_path))
 
+        # Test that sharded tracking gives the same tractogram
+        tractograms = []
+        for num_shards in [1, 3]:
+            pf_track_pam = PFTrackingPAMFlow()
+            pf_track_pam._force_overwrite = True
+            with warnings.catch_warnings():
+                warnings.filterwarnings(
+                    "ignore", message=descoteaux07_legacy_msg,
+                    category=PendingDeprecationWarning)
+                pf_track_pam.run(pam_path, wm_path, gm_path, csf_path,
+                                 seeds_path, save_seeds=True, random_seed=1,
+                                 num_shards=num_shards, engine='serial',
+                                 out_dir=out_dir,
+                                 out_tractogram='pft_{0}.trk'.format(
+                                     num_shards))
+            tractograms.append(
+                pf_track_pam.last_generated_outputs['out_tractogram'])
+        assert_tractograms_equal(*tractograms)
+
 
 def test_local_fiber_tracking_workflow():
     with TemporaryDirectory() as out_dir:
@@ -152,7 +175,7 @@ def test_local_fiber_tracking_workflow():
         lf_track_pam = LocalFiberTrackingPAMFlow()
         lf_track_pam._force_overwrite = True
         assert_equal(lf_track_pam.get_short_name(), 'track_local')
-        lf_track_pam.run(pam_path, gfa_path, seeds_path)
+        lf_track_pam.run(pam_path, gfa_path, seeds_path, out_dir=out_dir)
         tractogram_path = \
             lf_track_pam.last_generated_outputs['out_tractogram']
         assert_false(is_tractogram_empty(tractogram_path))
@@ -161,7 +184,7 @@ def test_local_fiber_tracking_workflow():
         lf_track_pam = LocalFiberTrackingPAMFlow()
         lf_track_pam._force_overwrite = True
         lf_track_pam.run(pam_path, mask_path, seeds_path,
-                         use_binary_mask=True)
+                         use_binary_mask=True, out_dir=out_dir)
 
         tractogram_path = \
             lf_track_pam.last_generated_outputs['out_tractogram']
@@ -171,7 +194,7 @@ def test_local_fiber_tracking_workflow():
         lf_track_pam = LocalFiberTrackingPAMFlow()
         lf_track_pam._force_overwrite = True
         lf_track_pam.run(pam_path, gfa_path, seeds_path,
-                         tracking_method="eudx")
+                         tracking_method="eudx", out_dir=out_dir)
         tractogram_path = \
             lf_track_pam.last_generated_outputs['out_tractogram']
         assert_false(is_tractogram_empty(tractogram_path))
@@ -184,7 +207,7 @@ def test_local_fiber_tracking_workflow():
                 "ignore", message=descoteaux07_legacy_msg,
                 category=PendingDeprecationWarning)
             lf_track_pam.run(pam_path, gfa_path, seeds_path,
-                             tracking_method="deterministic")
+                             tracking_method="deterministic", out_dir=out_dir)
         tractogram_path = \
             lf_track_pam.last_generated_outputs['out_tractogram']
         assert_false(is_tractogram_empty(tractogram_path))
@@ -197,7 +220,7 @@ def test_local_fiber_tracking_workflow():
                 "ignore", message=descoteaux07_legacy_msg,
                 category=PendingDeprecationWarning)
             lf_track_pam.run(pam_path, gfa_path, seeds_path,
-                             tracking_method="probabilistic")
+                             tracking_method="probabilistic", out_dir=out_dir)
         tractogram_path = \
             lf_track_pam.last_generated_outputs['out_tractogram']
         assert_false(is_tractogram_empty(tractogram_path))
@@ -210,7 +233,7 @@ def test_local_fiber_tracking_workflow():
                 "ignore", message=descoteaux07_legacy_msg,
                 category=PendingDeprecationWarning)
             lf_track_pam.run(pam_path, gfa_path, seeds_path,
-                             tracking_method="closestpeaks")
+                             tracking_method="closestpeaks", out_dir=out_dir)
         tractogram_path = \
             lf_track_pam.last_generated_outputs['out_tractogram']
         assert_false(is_tractogram_empty(tractogram_path))
@@ -224,12 +247,50 @@ def test_local_fiber_tracking_workflow():
                 category=PendingDeprecationWarning)
             lf_track_pam.run(pam_path, gfa_path, seeds_path,
                              tracking_method="deterministic",
-                             save_seeds=True)
+                             save_seeds=True, out_dir=out_dir)
         tractogram_path = \
             lf_track_pam.last_generated_outputs['out_tractogram']
         assert_true(tractogram_has_seeds(tractogram_path))
         assert_true(seeds_are_same_space_as_streamlines(tractogram_path))
 
+        # Test that sharded tracking gives the same tractogram, whatever
+        # the number of shards and the executor
+        tractograms = []
+        for num_shards, engine in [(1, 'serial'), (2, 'process'),
+                                   (5, 'serial')]:
+            lf_track_pam = LocalFiberTrackingPAMFlow()
+            lf_track_pam._force_overwrite = True
+            with warnings.catch_warnings():
+                warnings.filterwarnings(
+                    "ignore", message=descoteaux07_legacy_msg,
+                    category=PendingDeprecationWarning)
+                lf_track_pam.run(pam_path, gfa_path, seeds_path,
+                                 tracking_method="probabilistic",
+                                 save_seeds=True, random_seed=0,
+                                 num_shards=num_shards, engine=engine,
+                                 num_processes=2, out_dir=out_dir,
+                                 out_tractogram='local_{0}.trk'.format(
+                                     num_shards))
+            tractograms.append(
+                lf_track_pam.last_generated_outputs['out_tractogram'])
+        assert_tractograms_equal(*tractograms)
+        # The partial tractograms are removed after the merge
+        assert_equal(sorted(f for f in os.listdir(out_dir)
+                            if 'shard' in f), [])
+
+
+def assert_tractograms_equal(*tractogram_paths):
+    sfts = [load_tractogram(path, 'same', bbox_valid_check=False)
+            for path in tractogram_paths]
+    assert_true(len(sfts[0]) > 0)
+    for sft in sfts[1:]:
+        assert_equal(len(sft), len(sfts[0]))
+        for s1, s2 in zip(sft.streamlines, sfts[0].streamlines):
+            npt.assert_array_almost_equal(s1, s2, decimal=4)
+        npt.assert_array_almost_equal(sft.data_per_streamline['seeds'],
+                                      sfts[0].data_per_streamline['seeds'],
+                                      decimal=4)
+
 
 def is_tractogram_empty(tractogram_path):
     tractogram_file = \
@@ -1,30 +1,199 @@
 #!/usr/bin/env python3
 
+from functools import partial
 import logging
+import os
+
+import numpy as np
 
 from dipy.direction import (DeterministicMaximumDirectionGetter,
                             ProbabilisticDirectionGetter,
                             ClosestPeakDirectionGetter)
 from dipy.io.image import load_nifti
+from dipy.direction.peaks import PeaksAndMetrics, _pam_from_attrs
 from dipy.io.peaks import load_peaks
 from dipy.io.stateful_tractogram import Space, StatefulTractogram
-from dipy.io.streamline import save_tractogram
+from dipy.io.streamline import (StreamingTractogramWriter, load_tractogram,
+                                save_streamlines_generator, save_tractogram)
 from dipy.tracking import utils
 from dipy.tracking.local_tracking import (LocalTracking,
                                           ParticleFilteringTracking)
 from dipy.tracking.stopping_criterion import (BinaryStoppingCriterion,
                                               CmcStoppingCriterion,
                                               ThresholdStoppingCriterion)
+from dipy.tracking.streamline import Streamlines
+from dipy.utils.parallel import get_executor
 from dipy.workflows.workflow import Workflow
 
+# Attributes of a PeaksAndMetrics object, as ordered by `_pam_from_attrs`
+_PAM_ATTRS = ('peak_indices', 'peak_values', 'peak_dirs', 'gfa', 'qa',
+              'shm_coeff', 'B', 'odf')
+
+# Formats written as the streamlines are tracked
+_STREAMING_FORMATS = ('.trk', '.tck', '.trx')
+
+
+def _save_tracking(tracking_result, reference, out_tract, save_seeds):
+    """Run a tracking generator and save its streamlines to `out_tract`."""
+    if os.path.splitext(out_tract)[1] in _STREAMING_FORMATS:
+        save_streamlines_generator(tracking_result, out_tract, reference,
+                                   save_seeds=save_seeds)
+        return
+
+    if save_seeds:
+        streamlines, seeds = zip(*tracking_result)
+        seeds = {'seeds': seeds}
+    else:
+        streamlines = list(tracking_result)
+        seeds = {}
+
+    sft = StatefulTractogram(streamlines, reference, Space.RASMM,
+                             data_per_streamline=seeds)
+    save_tractogram(sft, out_tract, bbox_valid_check=False)
+
+
+def _track_shard(shard, build_tracking, sphere, seeds, reference,
+                 save_seeds, **maps):
+    """Track the seeds of one shard and save them as a partial tractogram.
+
+    Parameters
+    ----------
+    shard : tuple
+        ``(start, stop, fname)``, the range of `seeds` to track and the path
+        of the partial tractogram.
+    build_tracking : callable
+        Called as ``build_tracking(pam, seeds, **maps)`` to create the
+        tracking generator.
+    sphere : Sphere
+        Sphere of the peaks and metrics.
+    seeds : ndarray
+        All the seeds.
+    reference : str
+        Reference of the tractogram.
+    save_seeds : bool
+        Whether the seeds are saved with their streamlines.
+    maps : dict
+        The arrays of the peaks and metrics, prefixed by ``pam_``, and the
+        arrays used by `build_tracking`. They are shared between the shards.
+
+    Returns
+    -------
+    fname : str
+        Path of the partial tractogram.
+    """
+    start, stop, fname = shard
+    pam = _pam_from_attrs(PeaksAndMetrics, sphere,
+                          *[maps.pop('pam_' + attr) for attr in _PAM_ATTRS])
+    tracking_result = build_tracking(pam, seeds[start:stop], **maps)
+    _save_tracking(tracking_result, reference, fname, save_seeds)
+    return fname
+
+
+def _track_sharded(build_tracking, pam, seeds, maps, reference, out_tract,
+                   save_seeds, num_shards, engine, num_processes):
+    """Track the seeds in shards and merge the partial tractograms.
+
+    The seeds are split in `num_shards` contiguous shards, each tracked by
+    a worker of the `engine` executor and saved next to `out_tract`. The
+    partial tractograms are then concatenated in seed order, so that the
+    result does not depend on the number of shards or on the order in which
+    they complete.
+    """
+    num_shards = max(min(num_shards, len(seeds)), 1)
+    stem, ext = os.path.splitext(out_tract)
+    bounds = np.linspace(0, len(seeds), num_shards + 1).astype(int)
+    shards = [(start, stop, '{0}_shard{1}{2}'.format(stem, k, ext))
+              for k, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+    shard_kwargs = {'pam_' + attr: getattr(pam, attr) for attr in _PAM_ATTRS}
+    shard_kwargs.update(maps)
+    shard_kwargs.update(build_tracking=build_tracking, sphere=pam.sphere,
+                        seeds=seeds, reference=reference,
+                        save_seeds=save_seeds)
+    if num_processes is None:
+        num_processes = num_shards
+    executor = get_executor(engine, n_jobs=num_processes)
+    try:
+        for k, fname in executor.map(_track_shard, shards,
+                                     func_kwargs=shard_kwargs, chunk_size=1):
+            logging.info('Shard {0} saved in {1}'.format(k, fname))
+
+        partials = (load_tractogram(fname, reference, to_space=Space.RASMM,
+                                    bbox_valid_check=False)
+                    for _, _, fname in shards)
+        if ext in _STREAMING_FORMATS:
+            # Only one partial tractogram is held in memory at a time
+            with StreamingTractogramWriter(out_tract, reference) as writer:
+                for sft in partials:
+                    writer.extend(sft.streamlines, sft.data_per_streamline)
+        else:
+            streamlines = Streamlines()
+            merged_seeds = []
+            for sft in partials:
+                streamlines.extend(sft.streamlines)
+                if save_seeds:
+                    merged_seeds.append(sft.data_per_streamline['seeds'])
+            data_per_streamline = {}
+            if save_seeds:
+                data_per_streamline['seeds'] = np.concatenate(merged_seeds)
+            sft = StatefulTractogram(streamlines, reference, Space.RASMM,
+                                     data_per_streamline=data_per_streamline)
+            save_tractogram(sft, out_tract, bbox_valid_check=False)
+    finally:
+        for _, _, fname in shards:
+            if os.path.exists(fname):
+                os.remove(fname)
+
+
+def _local_tracking(pam, seeds, stop, affine, tracking_method, pmf_threshold,
+                    max_angle, use_binary_mask, stopping_thr, step_size,
+                    save_seeds, random_seed):
+    """Create the LocalTracking generator of `LocalFiberTrackingPAMFlow`."""
+    dg = LocalFiberTrackingPAMFlow._get_direction_getter(
+        tracking_method, pam, pmf_threshold=pmf_threshold,
+        max_angle=max_angle)
+    if use_binary_mask:
+        stopping_criterion = BinaryStoppingCriterion(stop > stopping_thr)
+    else:
+        stopping_criterion = ThresholdStoppingCriterion(stop, stopping_thr)
+    return LocalTracking(dg, stopping_criterion, seeds, affine,
+                         step_size=step_size, save_seeds=save_seeds,
+                         random_seed=random_seed)
+
+
+def _pft_tracking(pam, seeds, wm, gm, csf, affine, average_voxel_size,
+                  step_size, pmf_threshold, max_angle, pft_back, pft_front,
+                  pft_count, save_seeds, min_wm_pve_before_stopping,
+                  random_seed):
+    """Create the ParticleFilteringTracking generator of `PFTrackingPAMFlow`.
+    """
+    stopping_criterion = CmcStoppingCriterion.from_pve(
+        wm, gm, csf, step_size=step_size,
+        average_voxel_size=average_voxel_size)
+    direction_getter = ProbabilisticDirectionGetter.from_shcoeff(
+        pam.shm_coeff, max_angle=max_angle, sphere=pam.sphere,
+        pmf_threshold=pmf_threshold)
+    return ParticleFilteringTracking(
+        direction_getter,
+        stopping_criterion,
+        seeds, affine,
+        step_size=step_size,
+        pft_back_tracking_dist=pft_back,
+        pft_front_tracking_dist=pft_front,
+        pft_max_trial=20,
+        particle_count=pft_count,
+        save_seeds=save_seeds,
+        min_wm_pve_before_stopping=min_wm_pve_before_stopping,
+        random_seed=random_seed)
+
 
 class LocalFiberTrackingPAMFlow(Workflow):
     @classmethod
     def get_short_name(cls):
         return 'track_local'
 
-    def _get_direction_getter(self, strategy_name, pam, pmf_threshold,
-                              max_angle):
+    @staticmethod
+    def _get_direction_getter(strategy_name, pam, pmf_threshold, max_angle):
         """Get Tracking Direction Getter object.
 
         Parameters
@@ -78,15 +247,11 @@ class LocalFiberTrackingPAMFlow(Workflow):
         return dg
 
     def _core_run(self, stopping_path, use_binary_mask, stopping_thr,
-                  seeding_path, seed_density, step_size, direction_getter,
-                  out_tract, save_seeds):
+                  seeding_path, seed_density, step_size, pam, tracking_method,
+                  pmf_threshold, max_angle, out_tract, save_seeds,
+                  random_seed, num_shards, engine, num_processes):
 
         stop, affine = load_nifti(stopping_path)
-        if use_binary_mask:
-            stopping_criterion = BinaryStoppingCriterion(stop > stopping_thr)
-        else:
-            stopping_criterion = ThresholdStoppingCriterion(stop, stopping_thr)
-        logging.info('stopping criterion done')
         seed_mask, _ = load_nifti(seeding_path)
         seeds = \
             utils.seeds_from_mask(
@@ -94,25 +259,26 @@ class LocalFiberTrackingPAMFlow(Workflow):
                 density=[seed_density, seed_density, seed_density])
         logging.info('seeds done')
 
-        tracking_result = LocalTracking(direction_getter,
-                                        stopping_criterion,
-                                        seeds,
-                                        affine,
-                                        step_size=step_size,
-                                        save_seeds=save_seeds)
-
-        logging.info('LocalTracking initiated')
-
-        if save_seeds:
-            streamlines, seeds = zip(*tracking_result)
-            seeds = {'seeds': seeds}
+        build_tracking = partial(_local_tracking,
+                                 tracking_method=tracking_method,
+                                 pmf_threshold=pmf_threshold,
+                                 max_angle=max_angle,
+                                 use_binary_mask=use_binary_mask,
+                                 stopping_thr=stopping_thr,
+                                 step_size=step_size, save_seeds=save_seeds,
+                                 random_seed=random_seed)
+        maps = {'stop': stop, 'affine': affine}
+
+        if num_shards > 1:
+            logging.info('LocalTracking of {0} shards'.format(num_shards))
+            _track_sharded(build_tracking, pam, seeds, maps, seeding_path,
+                           out_tract, save_seeds, num_shards, engine,
+                           num_processes)
         else:
-            streamlines = list(tracking_result)
-            seeds = {}
-
-        sft = StatefulTractogram(streamlines, seeding_path, Space.RASMM,
-                                 data_per_streamline=seeds)
-        save_tractogram(sft, out_tract, bbox_valid_check=False)
+            tracking_result = build_tracking(pam, seeds, **maps)
+            logging.info('LocalTracking initiated')
+            _save_tracking(tracking_result, seeding_path, out_tract,
+                           save_seeds)
         logging.info('Saved {0}'.format(out_tract))
 
     def run(self, pam_files, stopping_files, seeding_files,
@@ -125,7 +291,11 @@ class LocalFiberTrackingPAMFlow(Workflow):
             max_angle=30.,
             out_dir='',
             out_tractogram='tractogram.trk',
-            save_seeds=False):
+            save_seeds=False,
+            random_seed=None,
+            num_shards=1,
+            engine='process',
+            num_processes=None):
         """Workflow for Local Fiber Tracking.
 
         This workflow use a saved peaks and metrics (PAM) file as input.
@@ -174,6 +344,23 @@ class LocalFiberTrackingPAMFlow(Workflow):
             If true, save the seeds associated to their streamline
             in the 'data_per_streamline' Tractogram dictionary using
             'seeds' as the key.
+        random_seed : int, optional
+            Seed of the random number generators, set for each seed point so
+            that the tractogram is reproducible and independent of
+            `num_shards`.
+        num_shards : int, optional
+            Number of shards the seeds are split into. Each shard is tracked
+            by its own worker and saved as a partial tractogram, and the
+            partial tractograms are merged in seed order.
+        engine : string, optional
+            Executor running the shards: "process" (default), "joblib",
+            "dask" or "ray", which can distribute the shards over the nodes
+            of a cluster, or "serial".
+        num_processes : int, optional
+            Maximum number of shards tracked at the same time. Default is
+            `num_shards`. If < 0 the maximal number of cores minus
+            ``num_processes + 1`` is used (enter -1 to use as many cores as
+            possible). 0 raises an error.
 
         References
         ----------
@@ -189,13 +376,12 @@ class LocalFiberTrackingPAMFlow(Workflow):
                          .format(pams_path))
 
             pam = load_peaks(pams_path, verbose=False)
-            dg = self._get_direction_getter(tracking_method, pam,
-                                            pmf_threshold=pmf_threshold,
-                                            max_angle=max_angle)
 
             self._core_run(stopping_path, use_binary_mask, stopping_thr,
-                           seeding_path, seed_density, step_size, dg,
-                           out_tract, save_seeds)
+                           seeding_path, seed_density, step_size, pam,
+                           tracking_method, pmf_threshold, max_angle,
+                           out_tract, save_seeds, random_seed, num_shards,
+                           engine, num_processes)
 
 
 class PFTrackingPAMFlow(Workflow):
@@ -214,7 +400,11 @@ class PFTrackingPAMFlow(Workflow):
             out_dir='',
             out_tractogram='tractogram.trk',
             save_seeds=False,
-            min_wm_pve_before_stopping=0):
+            min_wm_pve_before_stopping=0,
+            random_seed=None,
+            num_shards=1,
+            engine='process',
+            num_processes=None):
         """Workflow for Particle Filtering Tracking.
 
         This workflow use a saved peaks and metrics (PAM) file as input.
@@ -268,6 +458,23 @@ class PFTrackingPAMFlow(Workflow):
             Minimum white matter pve (1 - stopping_criterion.include_map -
             stopping_criterion.exclude_map) to reach before allowing the
             tractography to stop.
+        random_seed : int, optional
+            Seed of the random number generators, set for each seed point so
+            that the tractogram is reproducible and independent of
+            `num_shards`.
+        num_shards : int, optional
+            Number of shards the seeds are split into. Each shard is tracked
+            by its own worker and saved as a partial tractogram, and the
+            partial tractograms are merged in seed order.
+        engine : string, optional
+            Executor running the shards: "process" (default), "joblib",
+            "dask" or "ray", which can distribute the shards over the nodes
+            of a cluster, or "serial".
+        num_processes : int, optional
+            Maximum number of shards tracked at the same time. Default is
+            `num_shards`. If < 0 the maximal number of cores minus
+            ``num_processes + 1`` is used (enter -1 to use as many cores as
+            possible). 0 raises an error.
 
         References
         ----------
@@ -290,43 +497,35 @@ class PFTrackingPAMFlow(Workflow):
             gm, _ = load_nifti(gm_path)
             csf, _ = load_nifti(csf_path)
             avs = sum(voxel_size) / len(voxel_size)  # average_voxel_size
-            stopping_criterion = CmcStoppingCriterion.from_pve(
-                wm, gm, csf, step_size=step_size, average_voxel_size=avs)
-            logging.info('stopping criterion done')
             seed_mask, _ = load_nifti(seeding_path)
             seeds = utils.seeds_from_mask(seed_mask, affine,
                                           density=[seed_density, seed_density,
                                                    seed_density])
             logging.info('seeds done')
-            dg = ProbabilisticDirectionGetter
-
-            direction_getter = dg.from_shcoeff(pam.shm_coeff,
-                                               max_angle=max_angle,
-                                               sphere=pam.sphere,
-                                               pmf_threshold=pmf_threshold)
 
-            tracking_result = ParticleFilteringTracking(
-                direction_getter,
-                stopping_criterion,
-                seeds, affine,
+            build_tracking = partial(
+                _pft_tracking,
+                average_voxel_size=avs,
                 step_size=step_size,
-                pft_back_tracking_dist=pft_back,
-                pft_front_tracking_dist=pft_front,
-                pft_max_trial=20,
-                particle_count=pft_count,
+                pmf_threshold=pmf_threshold,
+                max_angle=max_angle,
+                pft_back=pft_back,
+                pft_front=pft_front,
+                pft_count=pft_count,
                 save_seeds=save_seeds,
-                min_wm_pve_before_stopping=min_wm_pve_before_stopping)
-
-            logging.info('ParticleFilteringTracking initiated')
-
-            if save_seeds:
-                streamlines, seeds = zip(*tracking_result)
-                seeds = {'seeds': seeds}
+                min_wm_pve_before_stopping=min_wm_pve_before_stopping,
+                random_seed=random_seed)
+            maps = {'wm': wm, 'gm': gm, 'csf': csf, 'affine': affine}
+
+            if num_shards > 1:
+                logging.info('ParticleFilteringTracking of {0} shards'
+                             .format(num_shards))
+                _track_sharded(build_tracking, pam, seeds, maps, seeding_path,
+                               out_tract, save_seeds, num_shards, engine,
+                               num_processes)
             else:
-                streamlines = list(tracking_result)
-                seeds = {}
-
-            sft = StatefulTractogram(streamlines, seeding_path, Space.RASMM,
-                                     data_per_streamline=seeds)
-            save_tractogram(sft, out_tract, bbox_valid_check=False)
+                tracking_result = build_tracking(pam, seeds, **maps)
+                logging.info('ParticleFilteringTracking initiated')
+                _save_tracking(tracking_result, seeding_path, out_tract,
+                               save_seeds)
             logging.info('Saved {0}'.format(out_tract))